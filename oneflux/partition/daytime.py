@@ -14,8 +14,9 @@ import os
 import sys
 import logging
 import numpy
+import collections
+import multiprocessing
 
-from statsmodels import robust
 from datetime import datetime, timedelta
 from scipy.optimize import leastsq
 from scipy import stats
@@ -27,7 +28,7 @@ from oneflux.partition.compu import compu_qcnee_filter, compu_daylight, compu_da
 from oneflux.partition.ecogeo import lloyd_taylor_dt, gpp_vpd
 from oneflux.partition.auxiliary import compare_col_to_pvwave, FLOAT_PREC, DOUBLE_PREC, NAN, NAN_TEST, nan, not_nan
 from oneflux.partition.library import QC_AUTO_DIR, METEO_PROC_DIR, NEE_PROC_DIR, DT_OUTPUT_DIR, HEADER_SEPARATOR, EXTRA_FILENAME, DT_STR
-from oneflux.partition.library import load_output, get_latitude, add_empty_vars, create_data_structures, nomi, newselif, nlinlts2, check_parameters, remove_errored_entries, jacobian, ONEFluxPartitionError
+from oneflux.partition.library import PartitioningInputStore, DiagnosticsStore, YearDigests, remove_other_years, diagnostics_store_filename, year_digests_filename, diagnostics_key, save_output, get_latitude, add_empty_vars, create_data_structures, varnum, nomi, newselif, nlinlts2, check_parameters, remove_errored_entries, add_errored_entry, jacobian, ONEFluxPartitionError
 from oneflux.utils.files import check_create_directory
 from oneflux.utils.helper_fns import islessthan
 
@@ -84,11 +85,16 @@ class ONEFluxPartitionBrokenOptError(ONEFluxPartitionError):
         super(ONEFluxPartitionBrokenOptError, self).__init__(msg)
 
 
-def partitioning_dt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare):
+def partitioning_dt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare, workers=1, input_store=None, diagnostics_store=False, incremental=False, analytic_jacobian=False):
     """
     DT partitioning wrapper function.
     Handles all "versions" (percentiles, CUT/VUT, years, etc)
 
+    Each (ustar_type, year, percentile) is run as an independent job; if a job fails
+    in an optimization step (ONEFluxPartitionBrokenOptError), the window is added to
+    the error file and only that job (and jobs for the same site-year and UStar type
+    that already ran with the previous error windows) are re-run.
+
     :param datadir: main data directory (full path)
     :type datadir: str
     :param siteid: site flux id to be processed - in format CC-SSS
@@ -101,14 +107,34 @@ def partitioning_dt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare,
     :type perc_to_compare: list (of str)
     :param years_to_compare: list of years to compare - [1996, 1997, ... , 2014]
     :type years_to_compare: list (of int)
+    :param workers: number of worker processes used to run (ustar_type, year, percentile) jobs (1 runs serially)
+    :type workers: int
+    :param input_store: input datasets shared with other partitioning methods (if None, datasets loaded for DT only)
+    :type input_store: PartitioningInputStore
+    :param diagnostics_store: if True, diagnostics outputs (e.g., _params_after_es_python, _reco_before_weights_python) are
+                              added to a single store for the site (see DiagnosticsStore) instead of one text file each
+    :type diagnostics_store: bool
+    :param incremental: if True, existing outputs are kept only for site-years with inputs unchanged since
+                        outputs were created (see YearDigests), outputs of other site-years are re-created
+                        and outputs of years not in years_to_compare are removed
+    :type incremental: bool
+    :param analytic_jacobian: if True, closed-form jacobians of models are used in optimizations and variance
+                              estimates (see oneflux.partition.library.jacobian), finite differences otherwise
+    :type analytic_jacobian: bool
     """
 
     _log.info("Started DT partitioning of {s}".format(s=siteid))
 
+    if workers is None:
+        workers = 1
+    if int(workers) < 1:
+        msg = "Invalid number of workers '{w}' for DT partitioning".format(w=workers)
+        _log.critical(msg)
+        raise ONEFluxError(msg)
+    workers = int(workers)
+
     sitedir_full = os.path.join(datadir, sitedir)
     qc_auto_dir = os.path.join(sitedir_full, QC_AUTO_DIR)
-    meteo_proc_dir = os.path.join(sitedir_full, METEO_PROC_DIR)
-    nee_proc_dir = os.path.join(sitedir_full, NEE_PROC_DIR)
     dt_output_dir = os.path.join(sitedir_full, DT_OUTPUT_DIR)
 
     # reformat percentiles to compare into data column labels
@@ -118,128 +144,456 @@ def partitioning_dt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare,
     if os.path.isdir(sitedir_full) and not os.path.isdir(dt_output_dir):
         check_create_directory(directory=dt_output_dir)
 
+    # input datasets, loaded once and shared with other partitioning methods if store provided
+    if input_store is None:
+        input_store = PartitioningInputStore(datadir=datadir, siteid=siteid, sitedir=sitedir, consumers=[DT_STR])
+
     # load meteo proc results
-    meteo_proc_f = os.path.join(meteo_proc_dir, '{s}_meteo_hh.csv'.format(s=siteid))
-    if not os.path.isfile(meteo_proc_f):
-            msg = "Meteo proc file not found '{f}'".format(f=meteo_proc_f)
-            _log.critical(msg)
-            raise ONEFluxError(msg)
-    _log.info("Will now load meteo file '{f}'".format(f=meteo_proc_f))
-    whole_dataset_meteo, headers_meteo, timestamp_list_meteo, year_list_meteo = load_output(meteo_proc_f)
+    input_store.meteo()
+
+    # digests of inputs of site-years, (ustar_type, year) of site-years with existing outputs kept
+    digests = YearDigests(filename=year_digests_filename(output_dir=dt_output_dir, siteid=siteid, part_type=DT_STR),
+                          settings={'diagnostics_store': diagnostics_store, 'analytic_jacobian': analytic_jacobian})
+    kept = set()
+
+    # list of (ustar_type, year, first_year, percentile, latitude, output_filename) jobs
+    jobs = []
 
     # iterate through UStar threshold types
     for ustar_type in prod_to_compare:
         _log.info("Started processing UStar threshold type '{u}'".format(u=ustar_type))
 
         # load nee proc results (percentiles file)
-        nee_proc_percentiles_f = os.path.join(nee_proc_dir, '{s}_NEE_percentiles_{u}_hh.csv'.format(s=siteid, u=ustar_type))
-        if not os.path.isfile(nee_proc_percentiles_f):
-            msg = "NEE proc file not found '{f}', trying '{n}'".format(f=nee_proc_percentiles_f, n='{f}')
-            nee_proc_percentiles_f = os.path.join(nee_proc_dir, '{s}_NEE_percentiles_{u}.csv'.format(s=siteid, u=ustar_type))
-            msg = msg.format(f=nee_proc_percentiles_f)
-            _log.info(msg)
-
-            if not os.path.isfile(nee_proc_percentiles_f):
-                if ustar_type == 'y':
-                    msg = "NEE proc file not found '{f}'".format(f=nee_proc_percentiles_f)
-                    _log.critical(msg)
-                    continue
-                    #raise ONEFluxError(msg) # TODO: add exception raising when both y and c missing
-                elif ustar_type == 'c':
-                    msg = "NEE proc file not found '{f}', skipping (CUT not computed?)".format(f=nee_proc_percentiles_f)
-                    _log.warning(msg)
-                    continue
-                else:
-                    msg = "Invalid USTAR type '{u}'".format(u=ustar_type)
-                    raise ONEFluxError(msg)
-        _log.info("Will now load nee percentiles file '{f}'".format(f=nee_proc_percentiles_f))
-        whole_dataset_nee, headers_nee, timestamp_list_nee, year_list_nee = load_output(nee_proc_percentiles_f)
+        whole_dataset_nee, year_list_nee = input_store.nee(ustar_type=ustar_type)
+        if whole_dataset_nee is None:
+            continue
 
         # iterate through each year
         for iteration, year in enumerate(year_list_nee):
             if year not in years_to_compare:
                 continue
-            _log.info("Started processing year '{y}'".format(y=year))
             qc_auto_nee_f = os.path.join(qc_auto_dir, '{s}_qca_nee_{y}.csv'.format(s=siteid, y=year))
             if not os.path.isfile(qc_auto_nee_f):
                 msg = "QC auto file not found '{f}'".format(f=qc_auto_nee_f)
                 _log.error(msg)
                 continue
             latitude = get_latitude(filename=qc_auto_nee_f)
+            changed = digests.changed(ustar_type=ustar_type, year=year, digest=input_store.year_digest(ustar_type=ustar_type, year=year, first_year=(iteration == 0)))
+            if incremental and changed:
+                _log.info("Inputs for UStar threshold type '{u}' and year {y} changed, outputs will be re-created".format(u=ustar_type, y=year))
 
             # iterate through UStar threshold values
             for percentile in percentiles_data_columns:
-                _log.info("Started processing percentile '{p}'".format(p=percentile))
                 percentile_print = percentile.replace(HEADER_SEPARATOR, '.')
                 output_filename = os.path.join(dt_output_dir, "nee_{t}_{p}_{s}_{y}{extra}.csv".format(t=ustar_type, p=percentile_print, s=siteid, y=year, extra=EXTRA_FILENAME))
-                temp_output_filename = os.path.join(dt_output_dir, "nee_{t}_{p}_{s}_{y}{extra}.csv".format(t=ustar_type, p=percentile_print, s=siteid, y=year, extra='{extra}'))
+                if incremental and changed and os.path.isfile(output_filename):
+                    _log.debug("Outdated output file removed: '{f}'".format(f=output_filename))
+                    os.remove(output_filename)
                 if os.path.isfile(output_filename):
+                    kept.add((ustar_type, year))
                     _log.info("Output file found, skipping: '{f}'".format(f=output_filename))
                     continue
                 else:
                     _log.debug("Output file missing, will be processed: '{f}'".format(f=output_filename))
+                jobs.append((ustar_type, year, (iteration == 0), percentile, latitude, output_filename))
 
-                # create masks for current year for both nee and meteo
-                year_mask_nee = (whole_dataset_nee['year'] == year)
-                year_mask_meteo = (whole_dataset_meteo['year'] == year)
+    _log.info("DT partitioning of {s}: {n} jobs to be processed with {w} worker(s)".format(s=siteid, n=len(jobs), w=workers))
 
-                # account for first entry being from previous year
-                if iteration == 0:
-                    _log.debug("First site-year available ({y}), removing first midnight entry from meteo only".format(y=year))
-                    first_meteo = numpy.where(year_mask_meteo == 1)[0][0]
-                    first_nee = None
-                    year_mask_meteo[first_meteo] = 0
-                else:
-                    _log.debug("Regular site-year ({y}), removing first midnight entry from meteo and nee".format(y=year))
-                    first_meteo = numpy.where(year_mask_meteo == 1)[0][0]
-                    first_nee = numpy.where(year_mask_nee == 1)[0][0]
-                    year_mask_meteo[first_meteo] = 0
-                    year_mask_nee[first_nee] = 0
+    # datasets of UStar threshold types without jobs no longer needed by this partitioning method
+    # (other types released by scheduler once all their jobs are completed)
+    for ustar_type in prod_to_compare:
+        if ustar_type not in [j[0] for j in jobs]:
+            input_store.release(consumer=DT_STR, ustar_type=ustar_type)
+
+    # diagnostics outputs of jobs added (by this process only) as jobs finish
+    store = (DiagnosticsStore(filename=diagnostics_store_filename(output_dir=dt_output_dir, siteid=siteid, part_type=DT_STR)) if diagnostics_store else None)
+
+    # outputs of years no longer to be compared (e.g., first/last years of site changed)
+    if incremental:
+        remove_other_years(output_dir=dt_output_dir, siteid=siteid, years=years_to_compare, store=store)
+
+    config = {'siteid': siteid, 'sitedir_full': sitedir_full, 'dt_output_dir': dt_output_dir, 'diagnostics_store': diagnostics_store, 'analytic_jacobian': analytic_jacobian}
+    # diagnostics outputs of finished jobs written to store even if other jobs fail
+    try:
+        if (workers == 1) or (len(jobs) <= 1):
+            _init_partition_dt_worker(config=config)
+            try:
+                _schedule_dt_jobs(jobs=jobs, siteid=siteid, sitedir_full=sitedir_full, input_store=input_store, pool=None, store=store)
+            finally:
+                _init_partition_dt_worker(config=None)
+        else:
+            # configuration is handed to workers at start up, each job receives only the
+            # year rows and columns it uses (see project_year_inputs)
+            pool = multiprocessing.Pool(processes=min(workers, len(jobs)),
+                                        initializer=_init_partition_dt_worker,
+                                        initargs=(config,))
+            try:
+                _schedule_dt_jobs(jobs=jobs, siteid=siteid, sitedir_full=sitedir_full, input_store=input_store, pool=pool, workers=workers, store=store)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    finally:
+        if store is not None:
+            store.flush()
+
+    if store is not None:
+        _log.info("DT partitioning of {s}: diagnostics outputs saved to '{f}'".format(s=siteid, f=store.filename))
+    digests.save(kept=kept, years=(years_to_compare if incremental else None))
+
+    # datasets no longer needed by this partitioning method
+    input_store.close(consumer=DT_STR)
 
-                # account for last entry being from next year
-                _log.debug("Site-year ({y}), adding first midnight entry from next year for meteo and nee".format(y=year))
-                last_meteo = numpy.where(year_mask_meteo == 1)[0][-1] + 1
-                last_nee = numpy.where(year_mask_nee == 1)[0][-1] + 1
-                year_mask_meteo[last_meteo] = 1
-                year_mask_nee[last_nee] = 1
+    _log.info("Finished DT partitioning of {s}".format(s=siteid))
 
-                _log.debug("Site-year {y}: first NEE '{tn}' and first meteo '{tm}'".format(y=year, tn=whole_dataset_nee[year_mask_nee][0]['timestamp_end'], tm=whole_dataset_meteo[year_mask_meteo][0]['timestamp_end']))
-                _log.debug("Site-year {y}:  last NEE '{tn}' and  last meteo '{tm}'".format(y=year, tn=whole_dataset_nee[year_mask_nee][-1]['timestamp_end'], tm=whole_dataset_meteo[year_mask_meteo][-1]['timestamp_end']))
 
-                if numpy.sum(year_mask_nee) != numpy.sum(year_mask_meteo):
-                    msg = "Incompatible array sizes (nee={n}, meteo={m}) for year '{y}' while processing '{f}'".format(y=year, f=output_filename, n=numpy.sum(year_mask_nee), m=numpy.sum(year_mask_meteo))
-                    _log.error(msg)
-                    raise ONEFluxError(msg)
+POLL_INTERVAL = 0.5  # seconds to wait for running jobs before checking again
+def _schedule_dt_jobs(jobs, siteid, sitedir_full, input_store, pool=None, workers=1, store=None):
+    """
+    Runs DT partitioning jobs, handling broken optimization windows per job.
+
+    Every site-year/UStar type (key) keeps a version, incremented each time a
+    window is added to the error file for that key. Jobs are run with the version
+    of their key current when they are started; a job result is only kept if
+    it was run with the current version for its key, otherwise it is re-run.
+    Outputs (and stored diagnostics) of results not kept, or of completed jobs
+    to be re-run with a new error window, are removed, so they are not found
+    as existing outputs if the run stops before the jobs are re-run.
+    Inputs for a job are created from the input store when the job is started.
+    Diagnostics outputs of valid job results are added to diagnostics store (if any),
+    also for jobs finished after another job failed (failure raised once no job is running).
+    Datasets for an UStar threshold type are released from the input store
+    once all jobs for that type are completed (no further re-runs possible).
+
+    :param jobs: list of (ustar_type, year, first_year, percentile, latitude, output_filename) jobs
+    :type jobs: list
+    :param siteid: site flux id to be processed - in format CC-SSS
+    :type siteid: str
+    :param sitedir_full: absolute path to site directory (where error file is located)
+    :type sitedir_full: str
+    :param input_store: input datasets for partitioning
+    :type input_store: PartitioningInputStore
+    :param pool: pool of worker processes (if None, jobs run serially in current process)
+    :type pool: multiprocessing.Pool
+    :param workers: maximum number of jobs running concurrently in pool
+    :type workers: int
+    :param store: diagnostics store for outputs returned by jobs (if None, jobs save text files)
+    :type store: DiagnosticsStore
+    """
+    versions = {}
+    completed = {}
+    stored_keys = {}
+
+    def job_inputs(job_id):
+        ustar_type, year, first_year, percentile = jobs[job_id][:4]
+        return input_store.year_inputs(ustar_type=ustar_type, year=year, first_year=first_year, percentile=percentile)
+    def job_version(job_id):
+        return versions.get((jobs[job_id][0], jobs[job_id][1]), 0)
+    pending = list(range(len(jobs)))
+    running = []
+
+    def release_completed():
+        for ustar_type in sorted(set(j[0] for j in jobs) - released):
+            if all((i in completed) for i, j in enumerate(jobs) if j[0] == ustar_type):
+                input_store.release(consumer=DT_STR, ustar_type=ustar_type)
+                released.add(ustar_type)
+    released = set()
+
+    def remove_outputs(job_id):
+        output_filename = jobs[job_id][5]
+        if os.path.isfile(output_filename):
+            _log.debug("Outdated output file removed: '{f}'".format(f=output_filename))
+            os.remove(output_filename)
+        if store is not None:
+            store.remove(keys=stored_keys.pop(job_id, []))
+
+    def handle(job_id, version, result):
+        line2add, diagnostics_output = result
+        ustar_type, year = jobs[job_id][0], jobs[job_id][1]
+        key = (ustar_type, year)
+        if version != versions.get(key, 0):
+            # ran with outdated error windows, result (or failure) not valid anymore
+            _log.info("DT job {u}/{y}/{p} ran with outdated error windows, will re-run".format(u=ustar_type, y=year, p=jobs[job_id][3]))
+            remove_outputs(job_id)
+            pending.append(job_id)
+            return
+        if line2add is None:
+            completed[job_id] = version
+            if store is not None:
+                store.append(arrays=diagnostics_output)
+                stored_keys[job_id] = list(diagnostics_output.keys() if diagnostics_output else [])
+            return
+        if not add_errored_entry(site=siteid, site_dir=sitedir_full, line2add=line2add):
+            msg = "DT partitioning for {s}, UStar type {u}, year {y}, percentile {p}, failed again at excluded window ({l})".format(s=siteid, u=ustar_type, y=year, p=jobs[job_id][3], l=line2add)
+            _log.critical(msg)
+            raise ONEFluxPartitionError(msg)
+        versions[key] = version + 1
+        _log.warning("Restarting DT partitioning for {s}, UStar type {u}, year {y}, percentile {p}".format(s=siteid, u=ustar_type, y=year, p=jobs[job_id][3]))
+        pending.append(job_id)
+
+        # completed jobs for same site-year/UStar type have to be re-run with new error window
+        for other_id, other_version in sorted(completed.items()):
+            if (jobs[other_id][0], jobs[other_id][1]) == key:
+                _log.info("DT job {u}/{y}/{p} affected by new error window, will re-run".format(u=ustar_type, y=year, p=jobs[other_id][3]))
+                del completed[other_id]
+                remove_outputs(other_id)
+                pending.append(other_id)
+
+    # after a failure, no further jobs are started and running jobs are waited for (not terminated)
+    # and handled, so all saved outputs have diagnostics in store; first failure raised afterwards
+    errors = []
+    while (pending and not errors) or running:
+        if pool is None:
+            job_id = pending.pop(0)
+            version = job_version(job_id)
+            handle(job_id, version, _partition_dt_job(jobs[job_id], *job_inputs(job_id)))
+            release_completed()
+            continue
+
+        try:
+            while pending and (len(running) < workers) and not errors:
+                job_id = pending.pop(0)
+                version = job_version(job_id)
+                running.append((job_id, version, pool.apply_async(_partition_dt_job, (jobs[job_id],) + job_inputs(job_id))))
+        except Exception as e:
+            _log.error("DT partitioning of {s} failed starting jobs: {e}".format(s=siteid, e=e))
+            errors.append(e)
+
+        finished = [r for r in running if r[2].ready()]
+        if running and not finished:
+            running[0][2].wait(POLL_INTERVAL)
+            continue
+        for r in finished:
+            running.remove(r)
+            try:
+                handle(r[0], r[1], r[2].get())
+            except Exception as e:
+                _log.error("DT job {u}/{y}/{p} failed: {e}".format(u=jobs[r[0]][0], y=jobs[r[0]][1], p=jobs[r[0]][3], e=e))
+                errors.append(e)
+        release_completed()
+    if errors:
+        raise errors[0]
+
+
+# configuration shared (read-only) by DT partitioning jobs within a process
+_DT_SHARED_DATA = {}
+
+
+def _init_partition_dt_worker(config):
+    """
+    Sets configuration shared by DT partitioning jobs run in the current process
 
-                #### Get a cleaned-up organized numpy version of the data
-                working_year_data = create_data_structures(ustar_type=ustar_type, whole_dataset_nee=whole_dataset_nee, whole_dataset_meteo=whole_dataset_meteo,
-                                                           percentile=percentile, year_mask_nee=year_mask_nee, year_mask_meteo=year_mask_meteo, latitude=latitude, part_type=DT_STR)
+    :param config: site configuration (siteid, sitedir_full, dt_output_dir, diagnostics_store, analytic_jacobian)
+    :type config: dict
+    """
+    _DT_SHARED_DATA['config'] = config
 
-                #### Remove entries that fall into specified error-ranges
-                working_year_data = remove_errored_entries(ustar_type=ustar_type, site=siteid, site_dir=sitedir_full, year=year, working_year_data=working_year_data)
 
-                name_out = str(siteid) + "_" + str(year) + "_" + str(ustar_type)
+def _partition_dt_job(job, year_nee, year_meteo):
+    """
+    Runs DT partitioning for a single (ustar_type, year, percentile) job
+    and saves output file; uses configuration set by _init_partition_dt_worker.
+    Returns tuple with None if successful, or line to be added to the error file
+    if optimization failed for a window, and diagnostics outputs (None if saved as text files).
+
+    :param job: tuple with (ustar_type, year, first_year, percentile, latitude, output_filename)
+    :type job: tuple
+    :param year_nee: NEE data for year, only columns used for percentile (see project_year_inputs)
+    :type year_nee: numpy.ndarray
+    :param year_meteo: meteo data for year, only columns used (see project_year_inputs)
+    :type year_meteo: numpy.ndarray
+    """
+    ustar_type, year, first_year, percentile, latitude, output_filename = job
+    siteid = _DT_SHARED_DATA['config']['siteid']
+    sitedir_full = _DT_SHARED_DATA['config']['sitedir_full']
+    dt_output_dir = _DT_SHARED_DATA['config']['dt_output_dir']
+    diagnostics_output = (collections.OrderedDict() if _DT_SHARED_DATA['config'].get('diagnostics_store', False) else None)
+    analytic_jacobian = _DT_SHARED_DATA['config'].get('analytic_jacobian', False)
 
-                name_file = "nee_" + str(ustar_type) + "_" + str(percentile) + "_" + str(siteid) + "_" + str(year)
+    _log.info("Started processing UStar threshold type '{u}', year '{y}', percentile '{p}'".format(u=ustar_type, y=year, p=percentile))
 
-                #### call flux_part_gl2010 for day time (main partitioning process)
-                result_year_data = flux_part_gl2010(data=working_year_data, name_file=name_file, name_out=name_out, dt_output_dir=dt_output_dir, site_id=siteid, ustar_type=ustar_type, percentile_num=percentile, year=year)
+    if year_nee.size != year_meteo.size:
+        msg = "Incompatible array sizes (nee={n}, meteo={m}) for year '{y}' while processing '{f}'".format(y=year, f=output_filename, n=year_nee.size, m=year_meteo.size)
+        _log.error(msg)
+        raise ONEFluxError(msg)
 
-                if result_year_data is None:
-                    _log.error("Error processing output file '{f}".format(f=output_filename))
-                else:
-                    # save output data file
-                    _log.debug("Saving output file '{f}".format(f=output_filename))
-                    numpy.savetxt(fname=output_filename, X=result_year_data, delimiter=',', fmt='%s', header=','.join(result_year_data.dtype.names), comments='')
-                    _log.debug("Saved output file '{f}".format(f=output_filename))
-
-                _log.info("Finished processing percentile '{p}'".format(p=percentile))
-            _log.info("Finished processing year '{y}'".format(y=year))
-        _log.info("Finished processing UStar threshold type '{u}'".format(u=ustar_type))
-    _log.info("Finished DT partitioning of {s}".format(s=siteid))
+    #### Get a cleaned-up organized numpy version of the data
+    working_year_data = create_data_structures(ustar_type=ustar_type, whole_dataset_nee=year_nee, whole_dataset_meteo=year_meteo,
+                                               percentile=percentile, year_slice_nee=slice(None), year_slice_meteo=slice(None), latitude=latitude, part_type=DT_STR)
+
+    #### Remove entries that fall into specified error-ranges
+    working_year_data = remove_errored_entries(ustar_type=ustar_type, site=siteid, site_dir=sitedir_full, year=year, working_year_data=working_year_data)
+
+    name_out = str(siteid) + "_" + str(year) + "_" + str(ustar_type)
+
+    name_file = "nee_" + str(ustar_type) + "_" + str(percentile) + "_" + str(siteid) + "_" + str(year)
+
+    #### call flux_part_gl2010 for day time (main partitioning process)
+    try:
+        result_year_data = flux_part_gl2010(data=working_year_data, name_file=name_file, name_out=name_out, dt_output_dir=dt_output_dir, site_id=siteid, ustar_type=ustar_type, percentile_num=percentile, year=year, diagnostics_output=diagnostics_output, analytic_jacobian=analytic_jacobian)
+    except ONEFluxPartitionBrokenOptError as e:
+        _log.warning(str(e))
+        return e.line2add, None
+
+    if result_year_data is None:
+        _log.error("Error processing output file '{f}".format(f=output_filename))
+    else:
+        # save output data file
+        _log.debug("Saving output file '{f}".format(f=output_filename))
+        save_output(filename=output_filename, data=result_year_data, delimiter=',')
+        _log.debug("Saved output file '{f}".format(f=output_filename))
+
+    _log.info("Finished processing UStar threshold type '{u}', year '{y}', percentile '{p}'".format(u=ustar_type, y=year, p=percentile))
+    return None, diagnostics_output
+
+
+DT_WORKING_COLUMNS = ['rg_f', 'tair_f', 'vpd_f', 'nee_f', 'nee_fs_unc'] # columns used in model evaluations (optimization and jacobians)
+class DTWorkingSet(object):
+    """
+    Columnar working set for daytime partitioning of one site-year:
+    contiguous double precision copies of the columns used in model
+    evaluations, built once per site-year and shared by all windows,
+    so optimization iterations do not need to convert columns again.
+
+    Subsets for windows are either index ranges (views, no copies) or
+    index arrays (copies, e.g., for records matching a condition);
+    per-window constant columns (e.g., fixed E0 or alpha) are set with fill.
+    Windows of days are located with index ranges on the (sorted) julday.
+    """
+
+    def __init__(self, columns, index, julday=None):
+        """
+        :param columns: double precision arrays for each column
+        :type columns: dict (of numpy.ndarray)
+        :param index: indices of records in site-year data structure
+        :type index: numpy.ndarray
+        :param julday: days-of-year of records, sorted (only for site-year working set)
+        :type julday: numpy.ndarray
+        """
+        self.columns = columns
+        self.index = index
+        self.julday = julday
+
+    @classmethod
+    def from_data(cls, data, columns=DT_WORKING_COLUMNS):
+        """
+        Creates working set from data structure for partitioning
+
+        :param data: data structure for partitioning
+        :type data: numpy.ndarray
+        :param columns: list of columns to be included
+        :type columns: list (of str)
+        :rtype: DTWorkingSet
+        """
+        varnum(data=data, columns=columns + ['julday'])
+        julday = numpy.ascontiguousarray(data['julday'], dtype=DOUBLE_PREC)
+        if numpy.any(julday[1:] < julday[:-1]):
+            msg = "Days-of-year (julday) not sorted, cannot create working set for daytime partitioning"
+            _log.critical(msg)
+            raise ONEFluxPartitionError(msg)
+        return cls(columns={c: numpy.ascontiguousarray(data[c], dtype=DOUBLE_PREC) for c in columns}, index=numpy.arange(data.size), julday=julday)
+
+    def __len__(self):
+        return self.index.size
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @property
+    def size(self):
+        return self.index.size
+
+    def take(self, indices):
+        """
+        Creates working set with copies of records at indices
 
+        :param indices: indices of records (relative to this working set)
+        :type indices: numpy.ndarray
+        :rtype: DTWorkingSet
+        """
+        return DTWorkingSet(columns={c: a[indices] for c, a in self.columns.items()}, index=self.index[indices])
+
+    def window(self, begin, end):
+        """
+        Creates working set with views of records in range [begin, end)
 
-def flux_part_gl2010(data, name_file, name_out, dt_output_dir, site_id, ustar_type, percentile_num, year):
+        :param begin: first index of range
+        :type begin: int
+        :param end: index after last index of range
+        :type end: int
+        :rtype: DTWorkingSet
+        """
+        return DTWorkingSet(columns={c: a[begin:end] for c, a in self.columns.items()}, index=self.index[begin:end])
+
+    def index_range(self, begin, end, include_end=False):
+        """
+        Returns range [first, last) of records with indices between begin and end,
+        same as newselif on mask (index >= begin) & (index < end) (or <= end if include_end);
+        if no records match, range with first record only is returned (as in newselif)
+
+        :param begin: lower limit for index (inclusive)
+        :type begin: float
+        :param end: upper limit for index
+        :type end: float
+        :param include_end: if True, upper limit is inclusive
+        :type include_end: bool
+        :rtype: tuple (of int)
+        """
+        first = numpy.searchsorted(self.index, begin, side='left')
+        last = numpy.searchsorted(self.index, end, side=('right' if include_end else 'left'))
+        if first >= last:
+            return 0, 1
+        return int(first), int(last)
+
+    def day_range(self, day_begin, day_end):
+        """
+        Returns range [first, last) of records with julday in (day_begin, day_end]
+
+        :param day_begin: lower limit for julday (exclusive)
+        :type day_begin: float
+        :param day_end: upper limit for julday (inclusive)
+        :type day_end: float
+        :rtype: tuple (of int)
+        """
+        first = numpy.searchsorted(self.julday, day_begin, side='right')
+        last = numpy.searchsorted(self.julday, day_end, side='right')
+        return int(first), int(max(first, last))
+
+    def select(self, first, last, mask):
+        """
+        Returns indices of records in range [first, last) where mask is True,
+        same as newselif on site-year mask restricted to range;
+        if no records match, first record of site-year is returned (as in newselif)
+
+        :param first: first index of range
+        :type first: int
+        :param last: index after last index of range
+        :type last: int
+        :param mask: site-year mask of records to be selected
+        :type mask: numpy.ndarray (dtype bool)
+        :rtype: numpy.ndarray
+        """
+        indices = numpy.flatnonzero(mask[first:last])
+        if indices.size == 0:
+            return numpy.zeros(1, dtype=indices.dtype)
+        return indices + first
+
+    def fill(self, column, value):
+        """
+        Sets (or creates) column with constant value, rounded to
+        precision of data structure for partitioning (FLOAT_PREC)
+
+        :param column: column name
+        :type column: str
+        :param value: value for all records
+        :type value: float
+        """
+        self.columns[column] = numpy.full(self.size, numpy.array(value, dtype=FLOAT_PREC), dtype=DOUBLE_PREC)
+
+
+def flux_part_gl2010(data, name_file, name_out, dt_output_dir, site_id, ustar_type, percentile_num, year, diagnostics_output=None, analytic_jacobian=False):
     """
 
     :Task:  Main flux partitioning function (for day time)
@@ -270,6 +624,10 @@ def flux_part_gl2010(data, name_file, name_out, dt_output_dir, site_id, ustar_ty
     :type percentile_num: string
     :param year: year being processed
     :type year: int
+    :param diagnostics_output: if not None, diagnostics outputs are added to it as structured arrays instead of saved as text files
+    :type diagnostics_output: dict
+    :param analytic_jacobian: if True, closed-form jacobians of models are used, finite differences otherwise
+    :type analytic_jacobian: bool
     """
     _log.info("Starting flux_part_gl2010 for daytime for nee_{u}_{p}_{s}_{y}".format(u=ustar_type, p=percentile_num, s=site_id, y=year))
 
@@ -317,9 +675,12 @@ def flux_part_gl2010(data, name_file, name_out, dt_output_dir, site_id, ustar_ty
     NEE_fqcok = (h_data['nee_f'] > -999).astype(int) * h_data['nee_fqcok']
     add_empty_vars(data=h_data, records=NEE_fqcok, column=str("nee_fqcok"))
 
+    #### Double precision columns for model evaluations, shared by all windows
+    working_set = DTWorkingSet.from_data(data=h_data)
+
     #### Calling estimate_parasets to get the best model for
     #### the NEE data
-    params, whichmodel, JTJ_inv, res_cor, p_correl_return = estimate_parasets(data=h_data, winsize=winsize, fguess=fguess, trimperc=trimperc, name_out=name_out, dt_output_dir=dt_output_dir, site_id=site_id, ustar_type=ustar_type, percentile_num=percentile_num, year=year)
+    params, whichmodel, JTJ_inv, res_cor, p_correl_return = estimate_parasets(data=h_data, working_set=working_set, winsize=winsize, fguess=fguess, trimperc=trimperc, name_out=name_out, dt_output_dir=dt_output_dir, site_id=site_id, ustar_type=ustar_type, percentile_num=percentile_num, year=year, diagnostics_output=diagnostics_output, analytic_jacobian=analytic_jacobian)
 
     paramsOK = numpy.where(params == -9999)
 
@@ -336,11 +697,11 @@ def flux_part_gl2010(data, name_file, name_out, dt_output_dir, site_id, ustar_ty
         return
 
     #### Calling compute_flux to calculate the Reco and GPP variables
-    reco_flux, gpp_flux, pf_flux1, pf_flux2 = compute_flux(data=h_data, params=params, dt_output_dir=dt_output_dir, site_id=site_id, ustar_type=ustar_type, percentile_num=percentile_num, year=year)
+    reco_flux, gpp_flux, pf_flux1, pf_flux2 = compute_flux(data=h_data, params=params, dt_output_dir=dt_output_dir, site_id=site_id, ustar_type=ustar_type, percentile_num=percentile_num, year=year, diagnostics_output=diagnostics_output)
 
     #### Calling compute_var to get the predicted variable by specifying
     #### the model we used in estimate_params
-    varGPP = compute_var(data=h_data, params=params, whichmodel=whichmodel, JTJ_inv=JTJ_inv, res_cor=res_cor)
+    varGPP = compute_var(data=h_data, working_set=working_set, params=params, whichmodel=whichmodel, JTJ_inv=JTJ_inv, res_cor=res_cor, analytic_jacobian=analytic_jacobian)
 
     #print("flux")
     #print(flux)
@@ -388,7 +749,7 @@ def flux_part_gl2010(data, name_file, name_out, dt_output_dir, site_id, ustar_ty
     return h_data
 
 
-def compute_flux(data, params, dt_output_dir, site_id, ustar_type, percentile_num, year):
+def compute_flux(data, params, dt_output_dir, site_id, ustar_type, percentile_num, year, diagnostics_output=None):
     """
     :Task:  This function is responsible to calculate the Reco and GPP values
 
@@ -440,6 +801,8 @@ def compute_flux(data, params, dt_output_dir, site_id, ustar_type, percentile_nu
     :type percentile_num: string
     :param year: year being processed
     :type year: int
+    :param diagnostics_output: if not None, Reco and GPP values before weights are added to it instead of saved as text file
+    :type diagnostics_output: dict
     """
     _log.info("Starting compute_flux of daytime for nee_{u}_{p}_{s}_{y}".format(u=ustar_type, p=percentile_num, s=site_id, y=year))
     filename_range = 'nee_' + ustar_type + '_' + str(percentile_num) + '_' + site_id + '_' + str(year) + '_params_after_es_python.csv'
@@ -662,7 +1025,14 @@ def compute_flux(data, params, dt_output_dir, site_id, ustar_type, percentile_nu
     var_names_reco_gpp = "j,year,month,day,hr,julday,reco_first,reco_second,gpp_first,gpp_second"
 
     filename_reco = 'nee_' + ustar_type + '_' + str(percentile_num) + '_' + site_id + '_' + str(year) + '_reco_before_weights_python.csv'
-    numpy.savetxt(os.path.join(dt_output_dir, filename_reco), numpy.transpose(reco_gpp_orig), delimiter=',', fmt='%s', header=var_names_reco_gpp, comments='')
+    if diagnostics_output is None:
+        numpy.savetxt(os.path.join(dt_output_dir, filename_reco), numpy.transpose(reco_gpp_orig), delimiter=',', fmt='%s', header=var_names_reco_gpp, comments='')
+    else:
+        reco_gpp_names = var_names_reco_gpp.split(',')
+        reco_gpp_array = numpy.zeros(n_set, dtype=[(n, FLOAT_PREC) for n in reco_gpp_names])
+        for i, n in enumerate(reco_gpp_names):
+            reco_gpp_array[n] = reco_gpp_orig[i]
+        diagnostics_output[diagnostics_key(filename=filename_reco)] = reco_gpp_array
     #exit()
 
     _log.info("Finished compute_flux of daytime for nee_{u}_{p}_{s}_{y}".format(u=ustar_type, p=percentile_num, s=site_id, y=year))
@@ -670,7 +1040,7 @@ def compute_flux(data, params, dt_output_dir, site_id, ustar_type, percentile_nu
     return Reco, GPP, partition_flag1, partition_flag2
 
 
-def compute_var(data, params, whichmodel, JTJ_inv, res_cor):
+def compute_var(data, working_set, params, whichmodel, JTJ_inv, res_cor, analytic_jacobian=False):
     """
     :Task:  Get the predicted values of a variable for all windows covered in the model.
 
@@ -681,6 +1051,8 @@ def compute_var(data, params, whichmodel, JTJ_inv, res_cor):
 
     :param data: data structure for partitioning
     :type data: numpy.ndarray
+    :param working_set: double precision columns of data structure for partitioning
+    :type working_set: DTWorkingSet
     :param params: parameters to be applied to the model
     :type params: numpy.ndarray
     :param whichmodel: integer specifying the model type.
@@ -689,6 +1061,8 @@ def compute_var(data, params, whichmodel, JTJ_inv, res_cor):
     :type JTJ_inv: numpy.ndarray
     :param res_cor: 
     :type res_cor: numpy.ndarray
+    :param analytic_jacobian: if True, closed-form jacobians of models are used, finite differences otherwise
+    :type analytic_jacobian: bool
     """
     _log.info("Starting compute_var of daytime")
 
@@ -714,18 +1088,16 @@ def compute_var(data, params, whichmodel, JTJ_inv, res_cor):
         if i == 0:
             ind_begin = 0
             ind_end = params[n_params - 1, i + 1]
-            sub_mask = ((data['ind'] >= ind_begin) & (data['ind'] < ind_end))
-            sub, _, _ = newselif(data=data, condition=sub_mask, drop=True)
+            first, last = working_set.index_range(begin=ind_begin, end=ind_end)
         elif i == (n_parasets - 1):
             ind_begin = params[n_params - 1, i - 1]
             ind_end = numpy.max(data['ind'])
-            sub_mask = ((data['ind'] >= ind_begin) & (data['ind'] <= ind_end))
-            sub, _, _ = newselif(data=data, condition=sub_mask, drop=True)
+            first, last = working_set.index_range(begin=ind_begin, end=ind_end, include_end=True)
         else:
             ind_begin = params[n_params - 1, i - 1]
             ind_end = params[n_params - 1, i + 1]
-            sub_mask = ((data['ind'] >= ind_begin) & (data['ind'] < ind_end))
-            sub, _, _ = newselif(data=data, condition=sub_mask, drop=True)
+            first, last = working_set.index_range(begin=ind_begin, end=ind_end)
+        sub = working_set.window(begin=first, end=last)
 
         #print("sub['ind'].size")
         #print(sub['ind'].size)
@@ -735,29 +1107,29 @@ def compute_var(data, params, whichmodel, JTJ_inv, res_cor):
 
         #### params_filled_arr is just a replicated array filled with
         #### the value of E0 of the current window
-        params_filled_arr = numpy.empty(sub['ind'].size)
+        params_filled_arr = numpy.empty(sub.size)
         params_filled_arr.fill(params[4, i])
 
         #### params_filled_arr2 is just a replicated array filled with
         #### the value of alpha of the current window
-        params_filled_arr2 = numpy.empty(sub['ind'].size)
+        params_filled_arr2 = numpy.empty(sub.size)
         params_filled_arr2.fill(params[0, i])
 
         #### Based on the model we picked, we use it to get the predicted values.
         if whichmodel[i] == 0:
             #print("params[0:3+1, i]")
             #print(params[0:3+1, i])
-            var_GPP_mat[i, sub['ind'].astype(int)] = varpred(func="HLRC_LloydVPD", data=sub, params_filled_arr=params_filled_arr, JTJ_inv=JTJ_inv[i, :, :],
-                                                optpara=params[0:3 + 1, i], res=res_cor[i])
+            var_GPP_mat[i, first:last] = varpred(func="HLRC_LloydVPD", data=sub, params_filled_arr=params_filled_arr, JTJ_inv=JTJ_inv[i, :, :],
+                                                optpara=params[0:3 + 1, i], res=res_cor[i], analytic_jacobian=analytic_jacobian)
         elif whichmodel[i] == 1:
-            var_GPP_mat[i, sub['ind'].astype(int)] = varpred(func="HLRC_Lloyd", data=sub, params_filled_arr=params_filled_arr, JTJ_inv=JTJ_inv[i, 0:2 + 1, 0:2 + 1],
-                                                optpara=[params[0, i], params[1, i], params[3, i]], res=res_cor[i])
+            var_GPP_mat[i, first:last] = varpred(func="HLRC_Lloyd", data=sub, params_filled_arr=params_filled_arr, JTJ_inv=JTJ_inv[i, 0:2 + 1, 0:2 + 1],
+                                                optpara=[params[0, i], params[1, i], params[3, i]], res=res_cor[i], analytic_jacobian=analytic_jacobian)
         elif whichmodel[i] == 2:
-            var_GPP_mat[i, sub['ind'].astype(int)] = varpred(func="HLRC_Lloyd_afix", data=sub, params_filled_arr=params_filled_arr, params_filled_arr2=params_filled_arr2, JTJ_inv=JTJ_inv[i, 0:1 + 1, 0:1 + 1],
-                                                optpara=[params[1, i], params[3, i]], res=res_cor[i])
+            var_GPP_mat[i, first:last] = varpred(func="HLRC_Lloyd_afix", data=sub, params_filled_arr=params_filled_arr, params_filled_arr2=params_filled_arr2, JTJ_inv=JTJ_inv[i, 0:1 + 1, 0:1 + 1],
+                                                optpara=[params[1, i], params[3, i]], res=res_cor[i], analytic_jacobian=analytic_jacobian)
         elif whichmodel[i] == 3:
-            var_GPP_mat[i, sub['ind'].astype(int)] = varpred(func="HLRC_LloydVPD_afix", data=sub, params_filled_arr=params_filled_arr, params_filled_arr2=params_filled_arr2, JTJ_inv=JTJ_inv[i, 0:2 + 1, 0:2 + 1],
-                                                optpara=params[1:3 + 1, i], res=res_cor[i])
+            var_GPP_mat[i, first:last] = varpred(func="HLRC_LloydVPD_afix", data=sub, params_filled_arr=params_filled_arr, params_filled_arr2=params_filled_arr2, JTJ_inv=JTJ_inv[i, 0:2 + 1, 0:2 + 1],
+                                                optpara=params[1:3 + 1, i], res=res_cor[i], analytic_jacobian=analytic_jacobian)
         elif whichmodel[i] == 4:
             #print("var_GPP_mat.shape")
             #print(var_GPP_mat.shape)
@@ -765,8 +1137,8 @@ def compute_var(data, params, whichmodel, JTJ_inv, res_cor):
             #print(sub['ind'].shape)
             #print("var_GPP_mat[i, sub['ind'].astype(int)].shape")
             #print(var_GPP_mat[i, sub['ind'].astype(int)].shape)
-            var_GPP_mat[i, sub['ind'].astype(int)] = varpred(func="LloydT_E0fix", data=sub, params_filled_arr=params_filled_arr, JTJ_inv=JTJ_inv[i, 0, 0],
-                                                optpara=params[3, i], res=res_cor[i])
+            var_GPP_mat[i, first:last] = varpred(func="LloydT_E0fix", data=sub, params_filled_arr=params_filled_arr, JTJ_inv=JTJ_inv[i, 0, 0],
+                                                optpara=params[3, i], res=res_cor[i], analytic_jacobian=analytic_jacobian)
             #if i == 2:
             #    exit()
 
@@ -795,7 +1167,7 @@ def compute_var(data, params, whichmodel, JTJ_inv, res_cor):
     return var_GPP
 
 
-def varpred(func, data, JTJ_inv, optpara, res, params_filled_arr, params_filled_arr2=None):
+def varpred(func, data, JTJ_inv, optpara, res, params_filled_arr, params_filled_arr2=None, analytic_jacobian=False):
     """
     :Task:  Get the predicted values of a variable.
 
@@ -817,11 +1189,13 @@ def varpred(func, data, JTJ_inv, optpara, res, params_filled_arr, params_filled_
     :type params_filled_arr: numpy.ndarray
     :param params_filled_arr2: Array of replicated alpha values
     :type params_filled_arr2: numpy.ndarray
+    :param analytic_jacobian: if True, closed-form jacobian of model is used, finite differences otherwise
+    :type analytic_jacobian: bool
     """
     #_log.info("Starting varpred of daytime")
 
     #### Calculate the jacobian matrix
-    jac = jacobian(func=func, data=data, params_filled_arr=params_filled_arr, params_filled_arr2=params_filled_arr2, params=optpara)
+    jac = jacobian(func=func, data=data, params_filled_arr=params_filled_arr, params_filled_arr2=params_filled_arr2, params=optpara, analytic=analytic_jacobian)
 
     '''
     print("jac.shape")
@@ -868,7 +1242,7 @@ def varpred(func, data, JTJ_inv, optpara, res, params_filled_arr, params_filled_
     return varY
 
 
-def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir, site_id, ustar_type, percentile_num, year):
+def estimate_parasets(data, working_set, winsize, fguess, trimperc, name_out, dt_output_dir, site_id, ustar_type, percentile_num, year, diagnostics_output=None, analytic_jacobian=False):
     """
     :Task:  This function is responsible to find the best parameters to 
             represent the model that will fit the data the most.
@@ -893,12 +1267,18 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
 
     :param data: data structure for partitioning
     :type data: numpy.ndarray
+    :param working_set: double precision columns of data structure for partitioning
+    :type working_set: DTWorkingSet
     :param winsize: window size to get best parameters within each window
     :type winsize: int
     :param fguess: the initial guesses for the optimization function to start with
     :type fguess: array of floats
     :param trimperc: percentage to trim
     :type trimperc: float
+    :param diagnostics_output: if not None, parameters for ranges are added to it instead of saved as text file
+    :type diagnostics_output: dict
+    :param analytic_jacobian: if True, closed-form jacobians of models are used in optimizations, finite differences otherwise
+    :type analytic_jacobian: bool
     """
 
     _log.info("Starting estimate_parasets of daytime for nee_{u}_{p}_{s}_{y}".format(u=ustar_type, p=percentile_num, s=site_id, y=year))
@@ -982,6 +1362,12 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
     #numpy.savetxt(fname='../dt_set_before_es_2013_y_python.csv', X=data, delimiter=',', fmt='%s', header=','.join(data.dtype.names), comments='')
     #exit()
 
+    #### Masks for the year of records that fit the conditions for
+    #### processing: all (sub), nighttime (subn), and daytime (subd)
+    qcok_mask = (data['nee_fqc'] == 0)
+    night_mask = qcok_mask & (data['rg'] <= 4)
+    day_mask = qcok_mask & (data['rg'] > 4)
+
     #### Iterate through each parameter set to create this set
     for i in range(n_parasets):
         JTJ_inv = numpy.zeros((3, len(fguess) - 1, len(fguess) - 1), dtype=DOUBLE_PREC)
@@ -1018,17 +1404,18 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
 #        print(day_end2)
 
 
-        #### Creating the masks of the data. We'll be using
-        #### these masks to select the data that fits certain
-        #### conditions for processing
-        sub_mask = ((data['julday'] > day_begin) & (data['julday'] <= day_end) & (data['nee_fqc'] == 0))
-        subn_mask = ((data['julday'] > day_begin2) & (data['julday'] <= day_end2) & (data['nee_fqc'] == 0) & (data['rg'] <= 4))
-        subd_mask = ((data['julday'] > day_begin) & (data['julday'] <= day_end) & (data['nee_fqc'] == 0) & (data['rg'] > 4))
+        #### Getting the index ranges of the windows (julday is sorted),
+        #### then the indices of the records within each range that fit
+        #### certain conditions for processing (using the masks for the year)
+        first, last = working_set.day_range(day_begin=day_begin, day_end=day_end)
+        first2, last2 = working_set.day_range(day_begin=day_begin2, day_end=day_end2)
+        sub_ind = working_set.select(first=first, last=last, mask=qcok_mask)
+        subn_ind = working_set.select(first=first2, last=last2, mask=night_mask)
+        subd_ind = working_set.select(first=first, last=last, mask=day_mask)
 
-        #### Get the data that correspond to the masks in the previous step
-        sub, _, _ = newselif(data=data, condition=sub_mask, drop=True)
-        subn, _, _ = newselif(data=data, condition=subn_mask, drop=True)
-        subd, _, _ = newselif(data=data, condition=subd_mask, drop=True)
+        #### Double precision columns of the same records, used in the optimizations
+        subn_set = working_set.take(subn_ind)
+        subd_set = working_set.take(subd_ind)
 
 
         '''
@@ -1062,11 +1449,11 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
         #    exit()
         '''
 
-        if numpy.amin(subn['nee_fs_unc']) < 0:
-            subn['nee_fs_unc'][:] = 1
+        if numpy.amin(subn_set['nee_fs_unc']) < 0:
+            subn_set.fill('nee_fs_unc', 1)
 
-        if numpy.amin(subd['nee_fs_unc']) < 0:
-            subd['nee_fs_unc'][:] = 1
+        if numpy.amin(subd_set['nee_fs_unc']) < 0:
+            subd_set.fill('nee_fs_unc', 1)
 
         '''
         if i == 173:
@@ -1077,7 +1464,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
         E0set = 0
         #### If the data in subn within the window is <= 10, then use
         #### the lloydtemp_e0 from the previous window
-        if subn['nee_f'].shape[0] <= 10 and i_ok > 0 and lloydtemp_e0 != None:
+        if subn_ind.size <= 10 and i_ok > 0 and lloydtemp_e0 != None:
             lloydtemp_e0 = params_ok[4, i_ok - 1]
             lloydtemp_e0_se = params_ok[9, i_ok - 1]
             #ind[i][0][:] = ind_ok[i_ok - 1][0]
@@ -1103,16 +1490,16 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
         '''
 
         #### Chech if the data is suitable for optimization (to find the model)
-        if (subn['nee_f'].shape[0] > 10 or E0set == 1) and subd['nee_f'].shape[0] > 10:
+        if (subn_ind.size > 10 or E0set == 1) and subd_ind.size > 10:
             #### Calling percentiles_fn to get the values of the chosen
             #### percentiles from the "nee_f" data array after sorting it
-            percs = percentiles_fn(data=sub, columns=['nee_f'], values=[0.03, 0.97])
+            percs = percentiles_fn(data={'nee_f': data['nee_f'][sub_ind]}, columns=['nee_f'], values=[0.03, 0.97])
             #### Setting initial value for beta amplitude of NEE
             beta = abs(percs[0] - percs[1])
 
             #### Setting initial value for rb to be the average
             #### of the "nee_f" data
-            rb = numpy.average(subn['nee_f'])
+            rb = numpy.average(data['nee_f'][subn_ind])
             fguess[3] = rb
 
             if E0set == 0:
@@ -1125,7 +1512,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                 #status, rref, e0, rref_se, e0_se, residuals, covariance_matrix, cor_matrix, lt_rmse, ls_status = nlinlts2(data=subn, lts_func="LloydTemp", depvar='nee_f', indepvar_arr=['tair_f'], npara=2, xguess=fguess[3:4+1], mprior=numpy.array(fguess[3:4+1], dtype=FLOAT_PREC), sigm=numpy.array([800, 1000]), sigd=subn['nee_fs_unc'])
 
                 #### Starting the optimization using the "LloyedTemp" function
-                lloyedTemp_result = nlinlts2(data=subn, lts_func="LloydTemp", depvar='nee_f', indepvar_arr=['tair_f'], npara=2, xguess=fguess[3:4 + 1], mprior=numpy.array(fguess[3:4 + 1], dtype=FLOAT_PREC), sigm=numpy.array([800, 1000]), sigd=subn['nee_fs_unc'])
+                lloyedTemp_result = nlinlts2(data=subn_set, lts_func="LloydTemp", depvar='nee_f', indepvar_arr=['tair_f'], npara=2, xguess=fguess[3:4 + 1], mprior=numpy.array(fguess[3:4 + 1], dtype=FLOAT_PREC), sigm=numpy.array([800, 1000]), sigd=subn_set['nee_fs_unc'], analytic_jacobian=analytic_jacobian)
 
                 #### Setting the returned model parameters
                 status = lloyedTemp_result['status']
@@ -1188,7 +1575,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                 #end if
             #end if
 
-            subd['e0_1_from_tair'][:] = e0
+            subd_set.fill('e0_1_from_tair', e0)
 
             #### Finding slope of three different initial guess values
             #### and choose the best of three
@@ -1213,7 +1600,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                 #numpy.savetxt(fname="dt_subd_2005_y_i_91_python.csv", X=subd, delimiter=',', fmt='%s', header=','.join(subd.dtype.names), comments='')
 
                 #### Starting the optimization using the "HLRC_LloydVPD" function
-                hlrclvpd_results = nlinlts2(data=subd, lts_func="HLRC_LloydVPD", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f'], npara=4, xguess=fguess[0:3 + 1], mprior=numpy.array(fguess[0:3 + 1], dtype=FLOAT_PREC), sigm=numpy.array([10, 600, 50, 80]), sigd=subd['nee_fs_unc'])
+                hlrclvpd_results = nlinlts2(data=subd_set, lts_func="HLRC_LloydVPD", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f'], npara=4, xguess=fguess[0:3 + 1], mprior=numpy.array(fguess[0:3 + 1], dtype=FLOAT_PREC), sigm=numpy.array([10, 600, 50, 80]), sigd=subd_set['nee_fs_unc'], analytic_jacobian=analytic_jacobian)
 
                 #print(nlinlts2(data=subd, lts_func="HLRC_LloydVPD", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f'], npara=4, xguess=fguess[0:3+1], mprior=numpy.array(fguess[0:3+1], dtype=FLOAT_PREC), sigm=numpy.array([10, 600, 50, 80]), sigd=subd['nee_fs_unc']))
                 #hlrclvpd_status, hlrclvpd_alpha, hlrclvpd_beta, hlrclvpd_k, hlrclvpd_rref, hlrclvpd_alpha_se, hlrclvpd_beta_se, hlrclvpd_k_se, hlrclvpd_rref_se, hlrclvpd_residuals, hlrclvpd_cov_matrix, hlrclvpd_cor_matrix, hlrclvpd_rmse, hlrclvpd_ls_status = nlinlts2(data=subd, lts_func="HLRC_LloydVPD", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f'], npara=4, xguess=fguess[0:3+1], mprior=numpy.array(fguess[0:3+1], dtype=FLOAT_PREC), sigm=numpy.array([10, 600, 50, 80]), sigd=subd['nee_fs_unc'])
@@ -1324,7 +1711,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                     #hlrcl_status, hlrcl_alpha, hlrcl_beta, hlrcl_rref, hlrcl_alpha_se, hlrcl_beta_se, hlrcl_rref_se, hlrcl_residuals, hlrcl_cov_matrix, hlrcl_cor_matrix, hlrcl_rmse, hlrcl_ls_status = nlinlts2(data=subd, lts_func="HLRC_Lloyd", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair'], npara=3, xguess=numpy.array([fguess[0], fguess[1], fguess[3]]), mprior=numpy.array([fguess[0], fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([10, 600, 80]), sigd=subd['nee_fs_unc'])
 
                     #### Starting the optimization using the "HLRC_Lloyd" function
-                    hlrcl_results = nlinlts2(data=subd, lts_func="HLRC_Lloyd", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair'], npara=3, xguess=numpy.array([fguess[0], fguess[1], fguess[3]]), mprior=numpy.array([fguess[0], fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([10, 600, 80]), sigd=subd['nee_fs_unc'])
+                    hlrcl_results = nlinlts2(data=subd_set, lts_func="HLRC_Lloyd", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair'], npara=3, xguess=numpy.array([fguess[0], fguess[1], fguess[3]]), mprior=numpy.array([fguess[0], fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([10, 600, 80]), sigd=subd_set['nee_fs_unc'], analytic_jacobian=analytic_jacobian)
 
                     #### Setting the returned model parameters
                     hlrcl_status = hlrcl_results['status']
@@ -1393,13 +1780,13 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                     if (params[j, 0, i] > 0.22) and i_ok > 0:
                         if params_ok[0, i_ok - 1] > 0:
                             alpha = params_ok[0, i_ok - 1]
-                            subd['alpha_1_from_tair'][:] = alpha
+                            subd_set.fill('alpha_1_from_tair', alpha)
                             ind[j, 1, i] = ind_ok[1, i_ok - 1]
 
                             #hlrcl_status_afix, hlrcl_beta_afix, hlrcl_rref_afix, hlrcl_beta_se_afix, hlrcl_rref_se_afix, hlrcl_residuals_afix, hlrcl_cov_matrix_afix, hlrcl_cor_matrix_afix, hlrcl_rmse_afix, hlrcl_ls_status_afix = nlinlts2(data=subd, lts_func="HLRC_Lloyd_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'alpha_1_from_tair'], npara=2, xguess=numpy.array([fguess[1], fguess[3]]), mprior=numpy.array([fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 80]), sigd=subd['nee_fs_unc'])
 
                             #### Starting the optimization using the "HLRC_Lloyd_afix" function
-                            hlrcl_results_afix = nlinlts2(data=subd, lts_func="HLRC_Lloyd_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'alpha_1_from_tair'], npara=2, xguess=numpy.array([fguess[1], fguess[3]]), mprior=numpy.array([fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 80]), sigd=subd['nee_fs_unc'])
+                            hlrcl_results_afix = nlinlts2(data=subd_set, lts_func="HLRC_Lloyd_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'alpha_1_from_tair'], npara=2, xguess=numpy.array([fguess[1], fguess[3]]), mprior=numpy.array([fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 80]), sigd=subd_set['nee_fs_unc'], analytic_jacobian=analytic_jacobian)
 
                             #### Setting the returned model parameters
                             hlrcl_status_afix = hlrcl_results_afix['status']
@@ -1462,7 +1849,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                 elif (params[j, 0, i] > 0.22) and (i_ok > 0):
                     if params_ok[0, i_ok - 1] > 0:
                         alpha = params_ok[0, i_ok - 1]
-                        subd['alpha_1_from_tair'][:] = alpha
+                        subd_set.fill('alpha_1_from_tair', alpha)
                         ind[j, 1, i] = ind_ok[1, i_ok - 1]
 
                         '''
@@ -1473,7 +1860,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                         #hlrclvpd_status_afix, hlrclvpd_beta_afix, hlrclvpd_k_afix, hlrclvpd_rref_afix, hlrclvpd_beta_se_afix, hlrclvpd_k_se_afix, hlrclvpd_rref_se_afix, hlrclvpd_residuals_afix, hlrclvpd_cov_matrix_afix, hlrclvpd_cor_matrix_afix, hlrclvpd_rmse_afix, hlrclvpd_ls_status_afix = nlinlts2(data=subd, lts_func="HLRC_LloydVPD_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f', 'alpha_1_from_tair'], npara=3, xguess=numpy.array([fguess[1], fguess[2], fguess[3]]), mprior=numpy.array([fguess[1], fguess[2], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 50, 80]), sigd=subd['nee_fs_unc'])
 
                         #### Starting the optimization using the "HLRC_LloydVPD_afix" function
-                        hlrclvpd_results = nlinlts2(data=subd, lts_func="HLRC_LloydVPD_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f', 'alpha_1_from_tair'], npara=3, xguess=numpy.array([fguess[1], fguess[2], fguess[3]]), mprior=numpy.array([fguess[1], fguess[2], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 50, 80]), sigd=subd['nee_fs_unc'])
+                        hlrclvpd_results = nlinlts2(data=subd_set, lts_func="HLRC_LloydVPD_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f', 'alpha_1_from_tair'], npara=3, xguess=numpy.array([fguess[1], fguess[2], fguess[3]]), mprior=numpy.array([fguess[1], fguess[2], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 50, 80]), sigd=subd_set['nee_fs_unc'], analytic_jacobian=analytic_jacobian)
 
                         #### Setting the returned model parameters
                         hlrclvpd_status_afix = hlrclvpd_results['status']
@@ -1560,7 +1947,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                             #hlrcl_status_afix, hlrcl_beta_afix, hlrcl_rref_afix, hlrcl_beta_se_afix, hlrcl_rref_se_afix, hlrcl_residuals_afix, hlrcl_cov_matrix_afix, hlrcl_cor_matrix_afix, hlrcl_rmse_afix, hlrcl_ls_status_afix = nlinlts2(data=subd, lts_func="HLRC_Lloyd_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'alpha_1_from_tair'], npara=2, xguess=numpy.array([fguess[1], fguess[3]]), mprior=numpy.array([fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 80]), sigd=subd['nee_fs_unc'])
 
                             #### Starting the optimization using the "HLRC_Lloyd_afix" function
-                            hlrcl_results_afix = nlinlts2(data=subd, lts_func="HLRC_Lloyd_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'alpha_1_from_tair'], npara=2, xguess=numpy.array([fguess[1], fguess[3]]), mprior=numpy.array([fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 80]), sigd=subd['nee_fs_unc'])
+                            hlrcl_results_afix = nlinlts2(data=subd_set, lts_func="HLRC_Lloyd_afix", depvar='nee_f', indepvar_arr=['rg_f', 'tair_f', 'e0_1_from_tair', 'alpha_1_from_tair'], npara=2, xguess=numpy.array([fguess[1], fguess[3]]), mprior=numpy.array([fguess[1], fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([600, 80]), sigd=subd_set['nee_fs_unc'], analytic_jacobian=analytic_jacobian)
 
                             #### Setting the returned model parameters
                             hlrcl_status_afix = hlrcl_results_afix['status']
@@ -1629,7 +2016,7 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
                     #lt_status_e0fix, lt_rref_e0fix, lt_rref_se_e0fix, lt_residuals_e0fix, lt_cov_matrix_e0fix, lt_cor_matrix_e0fix, lt_rmse_e0fix, lt_ls_status_e0fix = nlinlts2(data=subd, lts_func="LloydT_E0fix", depvar='nee_f', indepvar_arr=['tair_f', 'e0_1_from_tair'], npara=1, xguess=numpy.array([fguess[3]]), mprior=numpy.array([fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([80]), sigd=subd['nee_fs_unc'])
 
                     #### Starting the optimization using the "LloydT_E0fix" function
-                    lt_results_e0fix = nlinlts2(data=subd, lts_func="LloydT_E0fix", depvar='nee_f', indepvar_arr=['tair_f', 'e0_1_from_tair'], npara=1, xguess=numpy.array([fguess[3]]), mprior=numpy.array([fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([80]), sigd=subd['nee_fs_unc'])
+                    lt_results_e0fix = nlinlts2(data=subd_set, lts_func="LloydT_E0fix", depvar='nee_f', indepvar_arr=['tair_f', 'e0_1_from_tair'], npara=1, xguess=numpy.array([fguess[3]]), mprior=numpy.array([fguess[3]], dtype=FLOAT_PREC), sigm=numpy.array([80]), sigd=subd_set['nee_fs_unc'], analytic_jacobian=analytic_jacobian)
 
                     #### Setting the returned model parameters
                     lt_status_e0fix = lt_results_e0fix['status']
@@ -1887,7 +2274,10 @@ def estimate_parasets(data, winsize, fguess, trimperc, name_out, dt_output_dir,
     #numpy.savetxt('test_es_params_index_all_timestamp_python.csv', numpy.transpose(numpy.concatenate((params_all, ind_ok), axis=0)), delimiter=',', header=var_names_index, fmt='%s')
 
     filename_range = 'nee_' + ustar_type + '_' + str(percentile_num) + '_' + site_id + '_' + str(year) + '_params_after_es_python.csv'
-    numpy.savetxt(os.path.join(dt_output_dir, filename_range), params_all_for_ranges, delimiter=',', header=','.join(params_all_for_ranges.dtype.names), fmt='%s')
+    if diagnostics_output is None:
+        numpy.savetxt(os.path.join(dt_output_dir, filename_range), params_all_for_ranges, delimiter=',', header=','.join(params_all_for_ranges.dtype.names), fmt='%s')
+    else:
+        diagnostics_output[diagnostics_key(filename=filename_range)] = numpy.copy(params_all_for_ranges)
     #exit()
     # end of code
 
@@ -1955,6 +2345,175 @@ def percentiles_fn(data, columns, values=[0.0, 0.25, 0.5, 0.75, 1.0], remove_mis
 
 
 
+# tolerances for similar meteorological conditions in gap filling (uncertainty estimation)
+RG_TOLERANCE = 50.0
+TA_TOLERANCE = 2.5
+VPD_TOLERANCE = 5.0
+MAD_NORMALIZATION = stats.norm.ppf(0.75) # same normalization constant as statsmodels robust.scale.mad
+GAPFILL_BLOCK_SIZE = 2 ** 21 # maximum number of window entries (indices times window size) evaluated at once
+GAPFILL_MET = 'met'   # similar Rg, Tair and VPD
+GAPFILL_RG = 'rg'     # similar Rg only
+GAPFILL_HOUR = 'hour' # similar hour of day (average diurnal values)
+def gapfill_windows(array, t_window, nperday):
+    """
+    Windows centered on each entry of array (one row per entry, as read-only views),
+    with entries beyond limits of array clipped to first/last entries,
+    and order of entries in windows for a single index in uncert_via_gapFill,
+    i.e., index, index - 1, ..., index - half, index + 1, ..., index + half
+
+    :param array: data array
+    :type array: numpy.ndarray
+    :param t_window: window size (days)
+    :type t_window: float
+    :param nperday: number of entries per day
+    :type nperday: int
+    :rtype: tuple: windows (numpy.ndarray 2D, sorted entries), order of entries (numpy.ndarray)
+    """
+    before = numpy.arange(t_window / 2.0 * nperday).size - 1
+    after = numpy.arange(t_window / 2.0 * nperday - 1).size
+    padded = numpy.concatenate([numpy.repeat(array[:1], before), array, numpy.repeat(array[-1:], after)])
+    windows = numpy.lib.stride_tricks.as_strided(padded, shape=(array.size, before + after + 1), strides=(padded.strides[0], padded.strides[0]), writeable=False)
+    order = numpy.append(numpy.arange(before, -1, -1), numpy.arange(before + 1, before + after + 1))
+    return windows, order
+
+
+def gapfill_middle(sorted_values, count):
+    """
+    Middle value(s) of sorted rows with count entries, same as numpy.median
+
+    :param sorted_values: sorted values (one row per window)
+    :type sorted_values: numpy.ndarray (2D)
+    :param count: number of entries in each row
+    :type count: int
+    :rtype: numpy.ndarray
+    """
+    if count % 2:
+        return sorted_values[:, count // 2]
+    return (sorted_values[:, count // 2 - 1] + sorted_values[:, count // 2]) / sorted_values.dtype.type(2)
+
+
+def gapfill_row_stats(values, counts):
+    """
+    Statistics of values in each row, same as (for each row) stats.tmean,
+    size, stats.tstd, numpy.median and robust.scale.mad of selected values;
+    rows with the same number of values are computed together
+    (preserving summation order of single rows)
+
+    :param values: selected values, at beginning of each row
+    :type values: numpy.ndarray (2D)
+    :param counts: number of selected values in each row
+    :type counts: numpy.ndarray
+    :rtype: tuple (of numpy.ndarray): mean, std, median, robust std
+    """
+    rows = values.shape[0]
+    mean_value = numpy.empty(rows, dtype=values.dtype)
+    std_value = numpy.empty(rows, dtype=DOUBLE_PREC)
+    median_value = numpy.empty(rows, dtype=values.dtype)
+    srob_value = numpy.empty(rows, dtype=values.dtype)
+
+    for count in numpy.unique(counts):
+        same = numpy.where(counts == count)[0]
+        selected = values[same, :count]
+        mean_value[same] = numpy.mean(selected, axis=1)
+        std_value[same] = numpy.sqrt(selected.astype(float).var(axis=1) * count / (count - 1.))
+        median = gapfill_middle(numpy.sort(selected, axis=1), count)
+        # sign of zero median depends on order of equal entries in numpy.median
+        for z in numpy.where(median == 0)[0]:
+            median[z] = numpy.median(selected[z])
+        median_value[same] = median
+        srob_value[same] = gapfill_middle(numpy.sort(numpy.fabs(selected - median[:, None]) / MAD_NORMALIZATION, axis=1), count)
+
+    return mean_value, std_value, median_value, srob_value
+
+
+def gapfill_similar(index, t_window, nperday, condition, tofill, rg, ta, vpd, hr):
+    """
+    Statistics of valid values in windows with similar conditions for all indices,
+    same as evaluating each index separately (loops in uncert_via_gapFill);
+    indices are processed in blocks of at most GAPFILL_BLOCK_SIZE window entries
+
+    :param index: indices to be filled
+    :type index: numpy.ndarray
+    :param t_window: window size (days)
+    :type t_window: float
+    :param nperday: number of entries per day
+    :type nperday: int
+    :param condition: similarity condition (GAPFILL_MET, GAPFILL_RG, or GAPFILL_HOUR)
+    :type condition: str
+    :param tofill: original values of variable being filled
+    :type tofill: numpy.ndarray
+    :param rg: incoming radiation
+    :type rg: numpy.ndarray
+    :param ta: air temperature
+    :type ta: numpy.ndarray
+    :param vpd: vapor pressure deficit
+    :type vpd: numpy.ndarray
+    :param hr: hour of day
+    :type hr: numpy.ndarray
+    :rtype: tuple (of numpy.ndarray): filled indices, mean, count, std, median, robust std
+    """
+    if condition not in [GAPFILL_MET, GAPFILL_RG, GAPFILL_HOUR]:
+        msg = "Unknown gap filling condition: '{c}'".format(c=condition)
+        _log.critical(msg)
+        raise ONEFluxPartitionError(msg)
+
+    tofill_w, order = gapfill_windows(array=tofill, t_window=t_window, nperday=nperday)
+    rg_w, _ = gapfill_windows(array=rg, t_window=t_window, nperday=nperday)
+    ta_w, _ = gapfill_windows(array=ta, t_window=t_window, nperday=nperday)
+    vpd_w, _ = gapfill_windows(array=vpd, t_window=t_window, nperday=nperday)
+    hr_w, _ = gapfill_windows(array=hr, t_window=t_window, nperday=nperday)
+
+    block = max(1, GAPFILL_BLOCK_SIZE // order.size)
+    results = []
+    for start in range(0, index.size, block):
+        idx = index[start:start + block]
+        values = tofill_w[idx]
+        valid = (values > NAN_TEST)
+
+        enough = numpy.ones(idx.size, dtype=bool)
+        if condition == GAPFILL_MET:
+            # more than 9 valid entries needed before checking similar conditions
+            enough = (numpy.count_nonzero(valid, axis=1) > 9)
+            rg_idx = rg[idx]
+            rg_tolerance = numpy.where(rg_idx < RG_TOLERANCE, rg_idx, RG_TOLERANCE).astype(rg.dtype)
+            rg_tolerance = numpy.where(20 > rg_tolerance, 20, rg_tolerance).astype(rg.dtype)
+            rg_idx_w, ta_idx_w, vpd_idx_w = rg_w[idx], ta_w[idx], vpd_w[idx]
+            mask = valid & (abs(ta_idx_w - ta[idx][:, None]) < TA_TOLERANCE) & \
+                           (abs(rg_idx_w - rg_idx[:, None]) < rg_tolerance[:, None]) & \
+                           (abs(vpd_idx_w - vpd[idx][:, None]) < VPD_TOLERANCE) & \
+                           (rg_idx_w > NAN_TEST) & \
+                           (vpd_idx_w > NAN_TEST) & \
+                           (ta_idx_w > NAN_TEST)
+        elif condition == GAPFILL_RG:
+            rg_idx = rg[idx]
+            rg_tolerance = numpy.where(rg_idx < RG_TOLERANCE, rg_idx, RG_TOLERANCE).astype(rg.dtype)
+            rg_tolerance = numpy.where(20 > rg_tolerance, 20, rg_tolerance).astype(rg.dtype)
+            rg_idx_w = rg_w[idx]
+            mask = (abs(rg_idx_w - rg_idx[:, None]) < rg_tolerance[:, None]) & valid & (rg_idx_w > NAN_TEST)
+        else:
+            mask = (abs(hr_w[idx] - hr[idx][:, None]) < 1.1) & valid
+
+        counts = numpy.count_nonzero(mask, axis=1)
+        ok = enough & (counts > 9)
+        if not numpy.any(ok):
+            continue
+
+        # selected values moved to beginning of rows, in order of window entries
+        counts = counts[ok]
+        row_ind, col_ind = numpy.nonzero(mask[ok][:, order])
+        position = numpy.arange(row_ind.size) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        selected = numpy.zeros((counts.size, numpy.max(counts)), dtype=tofill.dtype)
+        selected[row_ind, position] = values[ok][row_ind, order[col_ind]]
+
+        mean_value, std_value, median_value, srob_value = gapfill_row_stats(values=selected, counts=counts)
+        results.append((idx[ok], mean_value, counts, std_value, median_value, srob_value))
+
+    if not results:
+        empty = numpy.zeros(0)
+        return numpy.zeros(0, dtype=int), empty, empty, empty, empty, empty
+    return tuple(numpy.concatenate(r) for r in zip(*results))
+
+
 def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0, longestMarginalgap=60):
     """
     :Task: fill gaps of the chosen varname or column (for day time)
@@ -1970,10 +2529,6 @@ def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0,
     """
     _log.debug("Starting uncert_gap_fill of daytime")
 
-    # Setting defaults for Rg, Ta and VPD
-    RG_TOLERANCE = 50.0
-    TA_TOLERANCE = 2.5
-    VPD_TOLERANCE = 5.0
     # window size
     t_window_orig = 14
     t_window = t_window_orig
@@ -2089,62 +2644,22 @@ def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0,
                 finalize_results()
                 return
 
-            #### Iterate through each index that needs to be filled
-            for index in ko:
-                #### w: Window of gaps to be covered
-                w = numpy.append(index - numpy.arange(t_window / 2.0 * nperday), index + numpy.arange(t_window / 2.0 * nperday - 1) + 1)
-                #### Clip all the indices in the window to be confined to the limits
-                numpy.clip(w, 0, n - 1, out=w)
-                w = w.astype(int)
-
-                #### Get all the indices of the non gapped values for averaging
-                ok4avg = numpy.where(tofill_orig[w] > NAN_TEST)[0]
-                count = len(ok4avg)
-
-                #### We need more than 9 non gapped values to be able to continue
-                #### this process of averaging
-                if count > 9:
-                    #### Get all the non gapped values only
-                    w = w[ok4avg]
-                    #### Get all the indices of the non gapped values that
-                    #### fit a certain condition or limits (e.g TA_TOLERANCE, etc)
-                    ok4avg = numpy.where((abs(ta[w] - ta[index]) < TA_TOLERANCE) &
-                                        (abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                                        (abs(vpd[w] - vpd[index]) < VPD_TOLERANCE) &
-                                        (rg[w] > NAN_TEST) &
-                                        (vpd[w] > NAN_TEST) &
-                                        (ta[w] > NAN_TEST))[0]
-                    count2 = len(ok4avg)
-
-
-                    # ok4avg = numpy.where((abs(ta[w] - ta[index]) < TA_TOLERANCE) &
-                    #                     (~numpy.isclose(abs(ta[w] - ta[index]), TA_TOLERANCE, rtol=1e-07, atol=0.0)) &
-                    #                     (abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                    #                     (~numpy.isclose(abs(rg[w] - rg[index]), max(min(RG_TOLERANCE, rg[index]), 20), rtol=1e-07, atol=0.0)) &
-                    #                     (abs(vpd[w] - vpd[index]) < VPD_TOLERANCE) &
-                    #                     (~numpy.isclose(abs(vpd[w] - vpd[index]), VPD_TOLERANCE, rtol=1e-07, atol=0.0)) &
-                    #                     (rg[w] > NAN_TEST) &
-                    #                     (vpd[w] > NAN_TEST) &
-                    #                     (ta[w] > NAN_TEST))[0]
-
-                    #### Still checking if we have more than 9 non gapped values
-                    if count2 > 9:
-                        #### Get all the stats related to those non gapped values
-                        mean_value = stats.tmean(tofill_orig[w[ok4avg]])
-                        counts_value = tofill_orig[w[ok4avg]].size
-                        std_value = stats.tstd(tofill_orig[w[ok4avg]])
-                        median_value = numpy.median(tofill_orig[w[ok4avg]])
-                        srob_value = robust.scale.mad(tofill_orig[w[ok4avg]])
-
-                        #### Fill the gaps with the mean of the non gapped values
-                        #### and save the other stats in new columns
-                        filled_val[index] = mean_value
-                        filled_n[index] = counts_value
-                        filled_s[index] = std_value
-                        filled_med[index] = median_value
-                        filled_srob[index] = srob_value
-                        fillMethod[index] = 1
-                        fillWindow[index] = (it_num + 1) * t_window_orig
+            #### All indices that need to be filled evaluated together:
+            #### windows of each index, with non gapped values that fit
+            #### certain conditions or limits (e.g TA_TOLERANCE, etc),
+            #### and stats of those values (more than 9 needed)
+            filled_index, mean_value, counts_value, std_value, median_value, srob_value = gapfill_similar(index=ko, t_window=t_window, nperday=nperday, condition=GAPFILL_MET,
+                                                                                                       tofill=tofill_orig, rg=rg, ta=ta, vpd=vpd, hr=hr)
+
+            #### Fill the gaps with the mean of the non gapped values
+            #### and save the other stats in new columns
+            filled_val[filled_index] = mean_value
+            filled_n[filled_index] = counts_value
+            filled_s[filled_index] = std_value
+            filled_med[filled_index] = median_value
+            filled_srob[filled_index] = srob_value
+            fillMethod[filled_index] = 1
+            fillWindow[filled_index] = (it_num + 1) * t_window_orig
 
             #### Update tofill with all the newly filled indices
             tofill[:] = filled_val
@@ -2179,47 +2694,22 @@ def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0,
                 finalize_results()
                 return
 
-            #### Iterate through each index that needs to be filled
-            for index in ko:
-                #### w: Window of gaps to be covered
-                w = numpy.append(index - numpy.arange(t_window / 2.0 * nperday), index + numpy.arange(t_window / 2.0 * nperday - 1) + 1)
-                #### Clip all the indices in the window to be confined to the limits
-                numpy.clip(w, 0, n - 1, out=w)
-                w = w.astype(int)
-
-                #### Get all the indices of the non gapped values for averaging.
-                #### Also get all the indices of the non gapped values that
-                #### fit a certain condition or limits (e.g TA_TOLERANCE, etc).
-                ok4avg = numpy.where((abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                                    (tofill_orig[w] > NAN_TEST) &
-                                    (rg[w] > NAN_TEST))[0]
-
-                '''ok4avg = numpy.where((abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                                    (~numpy.isclose(abs(rg[w] - rg[index]), max(min(RG_TOLERANCE, rg[index]), 20), rtol=1e-07, atol=0.0)) &
-                                    (tofill_orig[w] > NAN_TEST) &
-                                    (rg[w] > NAN_TEST))[0]
-                                    '''
-                count = len(ok4avg)
-
-                #### We need more than 9 non gapped values to be able to continue
-                #### this process of averaging
-                if count > 9:
-                    #### Get all the stats related to those non gapped values
-                    mean_value = stats.tmean(tofill_orig[w[ok4avg]])
-                    counts_value = tofill_orig[w[ok4avg]].size
-                    std_value = stats.tstd(tofill_orig[w[ok4avg]])
-                    median_value = numpy.median(tofill_orig[w[ok4avg]])
-                    srob_value = robust.scale.mad(tofill_orig[w[ok4avg]])
-
-                    #### Fill the gaps with the mean of the non gapped values
-                    #### and save the other stats in new columns
-                    filled_val[index] = mean_value
-                    filled_n[index] = counts_value
-                    filled_s[index] = std_value
-                    filled_med[index] = median_value
-                    filled_srob[index] = srob_value
-                    fillMethod[index] = 2
-                    fillWindow[index] = (it_num + 1) * t_window_orig
+            #### All indices that need to be filled evaluated together:
+            #### windows of each index, with non gapped values that fit
+            #### certain conditions or limits (e.g TA_TOLERANCE, etc),
+            #### and stats of those values (more than 9 needed)
+            filled_index, mean_value, counts_value, std_value, median_value, srob_value = gapfill_similar(index=ko, t_window=t_window, nperday=nperday, condition=GAPFILL_RG,
+                                                                                                       tofill=tofill_orig, rg=rg, ta=ta, vpd=vpd, hr=hr)
+
+            #### Fill the gaps with the mean of the non gapped values
+            #### and save the other stats in new columns
+            filled_val[filled_index] = mean_value
+            filled_n[filled_index] = counts_value
+            filled_s[filled_index] = std_value
+            filled_med[filled_index] = median_value
+            filled_srob[filled_index] = srob_value
+            fillMethod[filled_index] = 2
+            fillWindow[filled_index] = (it_num + 1) * t_window_orig
 
             #### Update tofill with all the newly filled indices
             tofill[:] = filled_val
@@ -2254,40 +2744,22 @@ def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0,
                 finalize_results()
                 return
 
-            #### Iterate through each index that needs to be filled
-            for index in ko:
-                #### w: Window of gaps to be covered
-                w = numpy.append(index - numpy.arange(t_window / 2.0 * nperday), index + numpy.arange(t_window / 2.0 * nperday - 1) + 1)
-                #### Clip all the indices in the window to be confined to the limits
-                numpy.clip(w, 0, n - 1, out=w)
-                w = w.astype(int)
-
-                #### Get all the indices of the non gapped values for averaging.
-                #### Also get all the indices of the non gapped values that
-                #### fit a certain condition or limits (e.g TA_TOLERANCE, etc).
-                ok4avg = numpy.where((abs(hr[w] - hr[index]) < 1.1) &
-                                    (tofill_orig[w] > NAN_TEST))[0]
-                count = len(ok4avg)
-
-                #### We need more than 9 non gapped values to be able to continue
-                #### this process of averaging
-                if count > 9:
-                    #### Get all the stats related to those non gapped values
-                    mean_value = stats.tmean(tofill_orig[w[ok4avg]])
-                    counts_value = tofill_orig[w[ok4avg]].size
-                    std_value = stats.tstd(tofill_orig[w[ok4avg]])
-                    median_value = numpy.median(tofill_orig[w[ok4avg]])
-                    srob_value = robust.scale.mad(tofill_orig[w[ok4avg]])
-
-                    #### Fill the gaps with the mean of the non gapped values
-                    #### and save the other stats in new columns
-                    filled_val[index] = mean_value
-                    filled_n[index] = counts_value
-                    filled_s[index] = std_value
-                    filled_med[index] = median_value
-                    filled_srob[index] = srob_value
-                    fillMethod[index] = 3
-                    fillWindow[index] = t_window
+            #### All indices that need to be filled evaluated together:
+            #### windows of each index, with non gapped values that fit
+            #### certain conditions or limits (e.g TA_TOLERANCE, etc),
+            #### and stats of those values (more than 9 needed)
+            filled_index, mean_value, counts_value, std_value, median_value, srob_value = gapfill_similar(index=ko, t_window=t_window, nperday=nperday, condition=GAPFILL_HOUR,
+                                                                                                       tofill=tofill_orig, rg=rg, ta=ta, vpd=vpd, hr=hr)
+
+            #### Fill the gaps with the mean of the non gapped values
+            #### and save the other stats in new columns
+            filled_val[filled_index] = mean_value
+            filled_n[filled_index] = counts_value
+            filled_s[filled_index] = std_value
+            filled_med[filled_index] = median_value
+            filled_srob[filled_index] = srob_value
+            fillMethod[filled_index] = 3
+            fillWindow[filled_index] = t_window
 
             #### Update tofill with all the newly filled indices
             tofill[:] = filled_val
@@ -2322,63 +2794,22 @@ def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0,
                 finalize_results()
                 return
 
-            #### Iterate through each index that needs to be filled
-            for index in ko:
-                #### w: Window of gaps to be covered
-                w = numpy.append(index - numpy.arange(t_window / 2.0 * nperday), index + numpy.arange(t_window / 2.0 * nperday - 1) + 1)
-                #### Clip all the indices in the window to be confined to the limits
-                numpy.clip(w, 0, n - 1, out=w)
-                w = w.astype(int)
-
-                #### Get all the indices of the non gapped values for averaging
-                ok4avg = numpy.where(tofill_orig[w] > NAN_TEST)[0]
-                count = len(ok4avg)
-
-                #### We need more than 9 non gapped values to be able to continue
-                #### this process of averaging
-                if count > 9:
-                    #### Get all the non gapped values only
-                    w = w[ok4avg]
-                    #### Get all the indices of the non gapped values that
-                    #### fit a certain condition or limits (e.g TA_TOLERANCE, etc)
-                    ok4avg = numpy.where((abs(ta[w] - ta[index]) < TA_TOLERANCE) &
-                                        (abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                                        (abs(vpd[w] - vpd[index]) < VPD_TOLERANCE) &
-                                        (rg[w] > NAN_TEST) &
-                                        (vpd[w] > NAN_TEST) &
-                                        (ta[w] > NAN_TEST))[0]
-
-                    '''ok4avg = numpy.where((abs(ta[w] - ta[index]) < TA_TOLERANCE) &
-                                        (~numpy.isclose(abs(ta[w] - ta[index]), TA_TOLERANCE, rtol=1e-07, atol=0.0)) &
-                                        (abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                                        (~numpy.isclose(abs(rg[w] - rg[index]), max(min(RG_TOLERANCE, rg[index]), 20), rtol=1e-07, atol=0.0)) &
-                                        (abs(vpd[w] - vpd[index]) < VPD_TOLERANCE) &
-                                        (~numpy.isclose(abs(vpd[w] - vpd[index]), VPD_TOLERANCE, rtol=1e-07, atol=0.0)) &
-                                        (rg[w] > NAN_TEST) &
-                                        (vpd[w] > NAN_TEST) &
-                                        (ta[w] > NAN_TEST))[0]
-                                        '''
-
-                    count2 = len(ok4avg)
-
-                    #### Still checking if we have more than 9 non gapped values
-                    if count2 > 9:
-                        #### Get all the stats related to those non gapped values
-                        mean_value = stats.tmean(tofill_orig[w[ok4avg]])
-                        counts_value = tofill_orig[w[ok4avg]].size
-                        std_value = stats.tstd(tofill_orig[w[ok4avg]])
-                        median_value = numpy.median(tofill_orig[w[ok4avg]])
-                        srob_value = robust.scale.mad(tofill_orig[w[ok4avg]])
-
-                        #### Fill the gaps with the mean of the non gapped values
-                        #### and save the other stats in new columns
-                        filled_val[index] = mean_value
-                        filled_n[index] = counts_value
-                        filled_s[index] = std_value
-                        filled_med[index] = median_value
-                        filled_srob[index] = srob_value
-                        fillMethod[index] = 1
-                        fillWindow[index] = (it_num + 1) * t_window_orig
+            #### All indices that need to be filled evaluated together:
+            #### windows of each index, with non gapped values that fit
+            #### certain conditions or limits (e.g TA_TOLERANCE, etc),
+            #### and stats of those values (more than 9 needed)
+            filled_index, mean_value, counts_value, std_value, median_value, srob_value = gapfill_similar(index=ko, t_window=t_window, nperday=nperday, condition=GAPFILL_MET,
+                                                                                                       tofill=tofill_orig, rg=rg, ta=ta, vpd=vpd, hr=hr)
+
+            #### Fill the gaps with the mean of the non gapped values
+            #### and save the other stats in new columns
+            filled_val[filled_index] = mean_value
+            filled_n[filled_index] = counts_value
+            filled_s[filled_index] = std_value
+            filled_med[filled_index] = median_value
+            filled_srob[filled_index] = srob_value
+            fillMethod[filled_index] = 1
+            fillWindow[filled_index] = (it_num + 1) * t_window_orig
 
             #### Update tofill with all the newly filled indices
             tofill[:] = filled_val
@@ -2412,46 +2843,22 @@ def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0,
                 finalize_results()
                 return
 
-            #### Iterate through each index that needs to be filled
-            for index in ko:
-                #### w: Window of gaps to be covered
-                w = numpy.append(index - numpy.arange(t_window / 2.0 * nperday), index + numpy.arange(t_window / 2.0 * nperday - 1) + 1)
-                #### Clip all the indices in the window to be confined to the limits
-                numpy.clip(w, 0, n - 1, out=w)
-                w = w.astype(int)
-
-                #### Get all the indices of the non gapped values for averaging.
-                #### Also get all the indices of the non gapped values that
-                #### fit a certain condition or limits (e.g TA_TOLERANCE, etc).
-                ok4avg = numpy.where((abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                                    (tofill_orig[w] > NAN_TEST) &
-                                    (rg[w] > NAN_TEST))[0]
-
-                '''ok4avg = numpy.where((abs(rg[w] - rg[index]) < max(min(RG_TOLERANCE, rg[index]), 20)) &
-                                    (~numpy.isclose(abs(rg[w] - rg[index]), max(min(RG_TOLERANCE, rg[index]), 20), rtol=1e-07, atol=0.0)) &
-                                    (tofill_orig[w] > NAN_TEST) &
-                                    (rg[w] > NAN_TEST))[0]'''
-                count = len(ok4avg)
-
-                #### We need more than 9 non gapped values to be able to continue
-                #### this process of averaging
-                if count > 9:
-                    #### Get all the stats related to those non gapped values
-                    mean_value = stats.tmean(tofill_orig[w[ok4avg]])
-                    counts_value = tofill_orig[w[ok4avg]].size
-                    std_value = stats.tstd(tofill_orig[w[ok4avg]])
-                    median_value = numpy.median(tofill_orig[w[ok4avg]])
-                    srob_value = robust.scale.mad(tofill_orig[w[ok4avg]])
-
-                    #### Fill the gaps with the mean of the non gapped values
-                    #### and save the other stats in new columns
-                    filled_val[index] = mean_value
-                    filled_n[index] = counts_value
-                    filled_s[index] = std_value
-                    filled_med[index] = median_value
-                    filled_srob[index] = srob_value
-                    fillMethod[index] = 2
-                    fillWindow[index] = (it_num + 1) * t_window_orig
+            #### All indices that need to be filled evaluated together:
+            #### windows of each index, with non gapped values that fit
+            #### certain conditions or limits (e.g TA_TOLERANCE, etc),
+            #### and stats of those values (more than 9 needed)
+            filled_index, mean_value, counts_value, std_value, median_value, srob_value = gapfill_similar(index=ko, t_window=t_window, nperday=nperday, condition=GAPFILL_RG,
+                                                                                                       tofill=tofill_orig, rg=rg, ta=ta, vpd=vpd, hr=hr)
+
+            #### Fill the gaps with the mean of the non gapped values
+            #### and save the other stats in new columns
+            filled_val[filled_index] = mean_value
+            filled_n[filled_index] = counts_value
+            filled_s[filled_index] = std_value
+            filled_med[filled_index] = median_value
+            filled_srob[filled_index] = srob_value
+            fillMethod[filled_index] = 2
+            fillWindow[filled_index] = (it_num + 1) * t_window_orig
 
             #### Update tofill with all the newly filled indices
             tofill[:] = filled_val
@@ -2487,40 +2894,22 @@ def uncert_via_gapFill(data, var, del_flag=False , nomsg=False, maxMissFrac=1.0,
                 finalize_results()
                 return
 
-            #### Iterate through each index that needs to be filled
-            for index in ko:
-                #### w: Window of gaps to be covered
-                w = numpy.append(index - numpy.arange(t_window / 2.0 * nperday), index + numpy.arange(t_window / 2.0 * nperday - 1) + 1)
-                #### Clip all the indices in the window to be confined to the limits
-                numpy.clip(w, 0, n - 1, out=w)
-                w = w.astype(int)
-
-                #### Get all the indices of the non gapped values for averaging.
-                #### Also get all the indices of the non gapped values that
-                #### fit a certain condition or limits (e.g TA_TOLERANCE, etc).
-                ok4avg = numpy.where((abs(hr[w] - hr[index]) < 1.1) &
-                                    (tofill_orig[w] > NAN_TEST))[0]
-                count = len(ok4avg)
-
-                #### We need more than 9 non gapped values to be able to continue
-                #### this process of averaging
-                if count > 9:
-                    #### Get all the stats related to those non gapped values
-                    mean_value = stats.tmean(tofill_orig[w[ok4avg]])
-                    counts_value = tofill_orig[w[ok4avg]].size
-                    std_value = stats.tstd(tofill_orig[w[ok4avg]])
-                    median_value = numpy.median(tofill_orig[w[ok4avg]])
-                    srob_value = robust.scale.mad(tofill_orig[w[ok4avg]])
-
-                    #### Fill the gaps with the mean of the non gapped values
-                    #### and save the other stats in new columns
-                    filled_val[index] = mean_value
-                    filled_n[index] = counts_value
-                    filled_s[index] = std_value
-                    filled_med[index] = median_value
-                    filled_srob[index] = srob_value
-                    fillMethod[index] = 3
-                    fillWindow[index] = t_window
+            #### All indices that need to be filled evaluated together:
+            #### windows of each index, with non gapped values that fit
+            #### certain conditions or limits (e.g TA_TOLERANCE, etc),
+            #### and stats of those values (more than 9 needed)
+            filled_index, mean_value, counts_value, std_value, median_value, srob_value = gapfill_similar(index=ko, t_window=t_window, nperday=nperday, condition=GAPFILL_HOUR,
+                                                                                                       tofill=tofill_orig, rg=rg, ta=ta, vpd=vpd, hr=hr)
+
+            #### Fill the gaps with the mean of the non gapped values
+            #### and save the other stats in new columns
+            filled_val[filled_index] = mean_value
+            filled_n[filled_index] = counts_value
+            filled_s[filled_index] = std_value
+            filled_med[filled_index] = median_value
+            filled_srob[filled_index] = srob_value
+            fillMethod[filled_index] = 3
+            fillWindow[filled_index] = t_window
 
             #### Update tofill with all the newly filled indices
             tofill[:] = filled_val
@@ -56,6 +56,28 @@ def lloyd_taylor(ta, rref, e0, tref=TREF, t0=T0):
     return rref * numpy.exp(e0 * ((1 / (tref - t0)) - (1 / (ta - t0))))
 
 
+def lloyd_taylor_jacobian(ta, rref, e0, tref=TREF, t0=T0):
+    """
+    Partial derivatives of lloyd_taylor with respect to its parameters (rref, e0)
+
+    :param ta: degC, air temperature, obtained from data
+    :type ta: float
+    :param rref: umolC m-2 -s, base respiration at reference temperature (tref)
+    :type rref: float
+    :param e0: degC, temperature sensitivity
+    :type e0: float
+    :param tref: degC, reference temperature (usually: 10 or 15 degC)
+    :type tref: float
+    :param t0: degC, regression parameter (usually: -46.02 degC)
+    :type t0: float
+    :rtype: 2-tuple (d/drref, d/de0)
+    """
+    temp_factor = (1 / (tref - t0)) - (1 / (ta - t0))
+    d_rref = numpy.exp(e0 * temp_factor)
+    d_e0 = rref * d_rref * temp_factor
+    return d_rref, d_e0
+
+
 
 def sunrs(doy, lat):
     """
@@ -121,6 +143,24 @@ def lloyd_taylor_dt(ta_f, parameter, tref=TREF, t0=T0):
     return rd15 * numpy.exp(e0 * ((1 / (tref - t0)) - (1 / (ta_f - t0))))
 
 
+def lloyd_taylor_dt_jacobian(ta_f, parameter, tref=TREF, t0=T0):
+    """
+    Partial derivatives of lloyd_taylor_dt with respect to its parameters (rd15, e0)
+
+    :param ta_f: degC, air temperature, obtained from data
+    :type ta_f: numpy.ndarray
+    :param parameter: parameters (rd15, e0)
+    :type parameter: numpy.ndarray
+    :param tref: degC, reference temperature (usually: 10 or 15 degC)
+    :type tref: float
+    :param t0: degC, regression parameter (usually: -46.02 degC)
+    :type t0: float
+    :rtype: numpy.ndarray (parameters x entries)
+    """
+    d_rd15, d_e0 = lloyd_taylor_jacobian(ta=ta_f, rref=parameter[0], e0=parameter[1], tref=tref, t0=t0)
+    return numpy.array([d_rd15, d_e0])
+
+
 def hlrc_lloyd(rg_f, ta_f, e0, parameter, tref=TREF, t0=T0):
     """
     Respiration as related to temperature.
@@ -157,6 +197,35 @@ def hlrc_lloyd(rg_f, ta_f, e0, parameter, tref=TREF, t0=T0):
     return fc
 
 
+def hlrc_lloyd_jacobian(rg_f, ta_f, e0, parameter, tref=TREF, t0=T0):
+    """
+    Partial derivatives of hlrc_lloyd with respect to its parameters (alpha, beta, rd15)
+
+    :param rg_f: W m-2, incoming shortwave radiation, obtained from data
+    :type rg_f: numpy.ndarray
+    :param ta_f: degC, air temperature, obtained from data
+    :type ta_f: numpy.ndarray
+    :param e0: degC, temperature sensitivity
+    :type e0: numpy.ndarray
+    :param parameter: parameters (alpha, beta, rd15)
+    :type parameter: numpy.ndarray
+    :param tref: degC, reference temperature (usually: 10 or 15 degC)
+    :type tref: float
+    :param t0: degC, regression parameter (usually: -46.02 degC)
+    :type t0: float
+    :rtype: numpy.ndarray (parameters x entries)
+    """
+    alpha = parameter[0]
+    beta = parameter[1]
+
+    denominator_sq = (alpha * rg_f + beta) ** 2
+    d_alpha = -1 * beta * beta * rg_f / denominator_sq
+    d_beta = -1 * alpha * alpha * rg_f * rg_f / denominator_sq
+    d_rd15 = numpy.exp(e0 * ((1 / (tref - t0)) - (1 / (ta_f - t0))))
+
+    return numpy.array([d_alpha, d_beta, d_rd15])
+
+
 def hlrc_lloydvpd(rg_f, ta_f, e0, vpd_f, parameter, tref=TREF, t0=T0):
     """
     Respiration as related to temperature.
@@ -199,6 +268,56 @@ def hlrc_lloydvpd(rg_f, ta_f, e0, vpd_f, parameter, tref=TREF, t0=T0):
     return fc
 
 
+def hlrc_lloydvpd_jacobian(rg_f, ta_f, e0, vpd_f, parameter, tref=TREF, t0=T0):
+    """
+    Partial derivatives of hlrc_lloydvpd with respect to its parameters (alpha, beta, k, rd15)
+
+    :param rg_f: W m-2, incoming shortwave radiation, obtained from data
+    :type rg_f: numpy.ndarray
+    :param ta_f: degC, air temperature, obtained from data
+    :type ta_f: numpy.ndarray
+    :param e0: degC, temperature sensitivity
+    :type e0: numpy.ndarray
+    :param vpd_f: hPa, vapor pressure deficit, obtained from data
+    :type vpd_f: numpy.ndarray
+    :param parameter: parameters (alpha, beta, k, rd15)
+    :type parameter: numpy.ndarray
+    :param tref: degC, reference temperature (usually: 10 or 15 degC)
+    :type tref: float
+    :param t0: degC, regression parameter (usually: -46.02 degC)
+    :type t0: float
+    :rtype: numpy.ndarray (parameters x entries)
+    """
+    alpha = parameter[0]
+    beta = parameter[1]
+    k = parameter[2]
+
+    d_alpha, d_beta, d_k, d_rd15 = _hlrc_vpd_partials(rg_f=rg_f, ta_f=ta_f, e0=e0, vpd_f=vpd_f, alpha=alpha, beta=beta, k=k, tref=tref, t0=t0)
+    return numpy.array([d_alpha, d_beta, d_k, d_rd15])
+
+
+def _hlrc_vpd_partials(rg_f, ta_f, e0, vpd_f, alpha, beta, k, tref=TREF, t0=T0):
+    """
+    Partial derivatives of light response with VPD limitation (hlrc_lloydvpd, hlrc_lloydvpd_afix)
+    with respect to alpha, beta, k, and rd15; derivative with respect to k is
+    zero where VPD limitation is not active (limitation factor capped at 1.0);
+    where factor is exactly 1.0 (e.g., k is zero), right-hand derivative is used,
+    so k can move away from zero (as with forward differences)
+    """
+    vpd_exp = numpy.exp(-1 * k * (vpd_f - 10.0))
+    min_arr = numpy.minimum(vpd_exp, 1.0)
+
+    denominator_sq = (alpha * rg_f + beta * min_arr) ** 2
+    d_alpha = -1 * beta * beta * min_arr * min_arr * rg_f / denominator_sq
+    d_beta = -1 * alpha * alpha * min_arr * rg_f * rg_f / denominator_sq
+    d_min_arr = -1 * alpha * alpha * beta * rg_f * rg_f / denominator_sq
+    vpd_limited = (vpd_exp < 1.0) | ((vpd_exp == 1.0) & (vpd_f > 10.0))
+    d_k = numpy.where(vpd_limited, d_min_arr * -1 * (vpd_f - 10.0) * vpd_exp, 0.0)
+    d_rd15 = numpy.exp(e0 * ((1 / (tref - t0)) - (1 / (ta_f - t0))))
+
+    return d_alpha, d_beta, d_k, d_rd15
+
+
 def hlrc_lloyd_afix(rg_f, ta_f, e0, alpha, parameter, tref=TREF, t0=T0):
     """
     Respiration as related to temperature.
@@ -234,6 +353,34 @@ def hlrc_lloyd_afix(rg_f, ta_f, e0, alpha, parameter, tref=TREF, t0=T0):
     return fc
 
 
+def hlrc_lloyd_afix_jacobian(rg_f, ta_f, e0, alpha, parameter, tref=TREF, t0=T0):
+    """
+    Partial derivatives of hlrc_lloyd_afix with respect to its parameters (beta, rd15)
+
+    :param rg_f: W m-2, incoming shortwave radiation, obtained from data
+    :type rg_f: numpy.ndarray
+    :param ta_f: degC, air temperature, obtained from data
+    :type ta_f: numpy.ndarray
+    :param e0: degC, temperature sensitivity
+    :type e0: numpy.ndarray
+    :param alpha: fixed canopy light utilization efficiency
+    :type alpha: numpy.ndarray
+    :param parameter: parameters (beta, rd15)
+    :type parameter: numpy.ndarray
+    :param tref: degC, reference temperature (usually: 10 or 15 degC)
+    :type tref: float
+    :param t0: degC, regression parameter (usually: -46.02 degC)
+    :type t0: float
+    :rtype: numpy.ndarray (parameters x entries)
+    """
+    beta = parameter[0]
+
+    d_beta = -1 * alpha * alpha * rg_f * rg_f / ((alpha * rg_f + beta) ** 2)
+    d_rd15 = numpy.exp(e0 * ((1 / (tref - t0)) - (1 / (ta_f - t0))))
+
+    return numpy.array([d_beta, d_rd15])
+
+
 def hlrc_lloydvpd_afix(rg_f, ta_f, e0, vpd_f, alpha, parameter, tref=TREF, t0=T0):
     """
     Respiration as related to temperature.
@@ -275,6 +422,35 @@ def hlrc_lloydvpd_afix(rg_f, ta_f, e0, vpd_f, alpha, parameter, tref=TREF, t0=T0
     return fc
 
 
+def hlrc_lloydvpd_afix_jacobian(rg_f, ta_f, e0, vpd_f, alpha, parameter, tref=TREF, t0=T0):
+    """
+    Partial derivatives of hlrc_lloydvpd_afix with respect to its parameters (beta, k, rd15)
+
+    :param rg_f: W m-2, incoming shortwave radiation, obtained from data
+    :type rg_f: numpy.ndarray
+    :param ta_f: degC, air temperature, obtained from data
+    :type ta_f: numpy.ndarray
+    :param e0: degC, temperature sensitivity
+    :type e0: numpy.ndarray
+    :param vpd_f: hPa, vapor pressure deficit, obtained from data
+    :type vpd_f: numpy.ndarray
+    :param alpha: fixed canopy light utilization efficiency
+    :type alpha: numpy.ndarray
+    :param parameter: parameters (beta, k, rd15)
+    :type parameter: numpy.ndarray
+    :param tref: degC, reference temperature (usually: 10 or 15 degC)
+    :type tref: float
+    :param t0: degC, regression parameter (usually: -46.02 degC)
+    :type t0: float
+    :rtype: numpy.ndarray (parameters x entries)
+    """
+    beta = parameter[0]
+    k = parameter[1]
+
+    _, d_beta, d_k, d_rd15 = _hlrc_vpd_partials(rg_f=rg_f, ta_f=ta_f, e0=e0, vpd_f=vpd_f, alpha=alpha, beta=beta, k=k, tref=tref, t0=t0)
+    return numpy.array([d_beta, d_k, d_rd15])
+
+
 def lloydt_e0fix(ta_f, e0, parameter, tref=TREF, t0=T0):
     """
     Respiration as related to temperature.
@@ -309,6 +485,25 @@ def lloydt_e0fix(ta_f, e0, parameter, tref=TREF, t0=T0):
     return rd15 * numpy.exp(e0 * ((1 / (tref - t0)) - (1 / (ta_f - t0))))
 
 
+def lloydt_e0fix_jacobian(ta_f, e0, parameter, tref=TREF, t0=T0):
+    """
+    Partial derivatives of lloydt_e0fix with respect to its parameter (rd15)
+
+    :param ta_f: degC, air temperature, obtained from data
+    :type ta_f: numpy.ndarray
+    :param e0: degC, temperature sensitivity
+    :type e0: numpy.ndarray
+    :param parameter: parameter (rd15)
+    :type parameter: numpy.ndarray
+    :param tref: degC, reference temperature (usually: 10 or 15 degC)
+    :type tref: float
+    :param t0: degC, regression parameter (usually: -46.02 degC)
+    :type t0: float
+    :rtype: numpy.ndarray (parameters x entries)
+    """
+    return numpy.array([numpy.exp(e0 * ((1 / (tref - t0)) - (1 / (ta_f - t0))))])
+
+
 def gpp_vpd(rg_f, vpd_f, parameter):
     """
     Respiration as related to temperature.
@@ -12,21 +12,29 @@ Library of optimization related functions
 '''
 
 import os
+import io
+import re
 import sys
+import json
 import logging
+import hashlib
+import zipfile
+import collections
 import numpy
 from datetime import datetime
 
 from scipy.optimize import leastsq
 from scipy.stats import rankdata
 
-from oneflux import ONEFluxError
+from oneflux import ONEFluxError, VERSION
 from oneflux.partition.ecogeo import lloyd_taylor, lloyd_taylor_dt, hlrc_lloyd, hlrc_lloydvpd
 from oneflux.partition.ecogeo import hlrc_lloyd_afix, hlrc_lloydvpd_afix, lloydt_e0fix
+from oneflux.partition.ecogeo import lloyd_taylor_dt_jacobian, hlrc_lloyd_jacobian, hlrc_lloydvpd_jacobian
+from oneflux.partition.ecogeo import hlrc_lloyd_afix_jacobian, hlrc_lloydvpd_afix_jacobian, lloydt_e0fix_jacobian
 from oneflux.partition.auxiliary import FLOAT_PREC, DOUBLE_PREC, NAN, nan, not_nan
 
 from oneflux.graph.compare import plot_comparison
-from oneflux.utils.files import file_exists_not_empty
+from oneflux.utils.files import file_exists_not_empty, block_md5
 
 _log = logging.getLogger(__name__)
 
@@ -60,15 +68,147 @@ class ONEFluxPartitionError(ONEFluxError):
     pass
 
 
-def load_output(filename, delimiter=',', skip_header=1):
+class TimestampList(collections.Sequence):
     """
-    Loads 'output' formatted file (e.g., from output of nee_proc or meteo_proc)
-    
+    Sequence of timestamps (datetime objects) from year, month, day, hour and minute
+    arrays; datetime objects are only created if an entry is accessed
+    """
+
+    def __init__(self, year, month, day, hour, minute):
+        """
+        :param year: years
+        :type year: numpy.ndarray
+        :param month: months
+        :type month: numpy.ndarray
+        :param day: days
+        :type day: numpy.ndarray
+        :param hour: hours
+        :type hour: numpy.ndarray
+        :param minute: minutes
+        :type minute: numpy.ndarray
+        """
+        self.components = (year, month, day, hour, minute)
+        self._timestamps = None
+
+    def timestamps(self):
+        """
+        Returns list of datetime objects (created at first call)
+
+        :rtype: list
+        """
+        if self._timestamps is None:
+            self._timestamps = [datetime(*i) for i in zip(*[c.tolist() for c in self.components])]
+        return self._timestamps
+
+    def __getitem__(self, index):
+        return self.timestamps()[index]
+
+    def __len__(self):
+        return self.components[0].size
+
+
+TIMESTAMP_FORMAT = "%Y%m%d%H%M"
+TIMESTAMP_WIDTH = 12 # number of characters in timestamps with TIMESTAMP_FORMAT
+DAYS_IN_MONTH = numpy.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+def parse_timestamps(timestamps):
+    """
+    Parses timestamp strings (YYYYMMDDHHMM) into year, month, day, hour and minute
+    integer arrays, slicing digits of fixed-width strings directly;
+    entries not valid in fixed-width format are parsed with datetime.strptime
+    (raising same errors for invalid timestamps)
+
+    :param timestamps: timestamps (strings)
+    :type timestamps: numpy.ndarray
+    :rtype: tuple (of numpy.ndarray): year, month, day, hour, minute
+    """
+    timestamps = numpy.char.strip(numpy.asarray(timestamps, dtype=str))
+    n = timestamps.size
+    fixed = (numpy.char.str_len(timestamps) == TIMESTAMP_WIDTH) if n > 0 else numpy.zeros(0, dtype=bool)
+    digits = numpy.frombuffer(timestamps.astype('S{w}'.format(w=TIMESTAMP_WIDTH)).tobytes(), dtype='u1').reshape(n, TIMESTAMP_WIDTH).astype('i4') - ord('0')
+    fixed &= numpy.all((digits >= 0) & (digits <= 9), axis=1)
+
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+
+    # check dates are valid (as checked by datetime.strptime)
+    month_ok = (month >= 1) & (month <= 12)
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+    days_in_month = DAYS_IN_MONTH[numpy.where(month_ok, month, 0)] + ((month == 2) & leap)
+    fixed &= (year >= 1) & month_ok & (day >= 1) & (day <= days_in_month) & (hour <= 23) & (minute <= 59)
+
+    for i in numpy.where(~fixed)[0]:
+        timestamp = datetime.strptime(str(timestamps[i]), TIMESTAMP_FORMAT)
+        year[i], month[i], day[i], hour[i], minute[i] = timestamp.year, timestamp.month, timestamp.day, timestamp.hour, timestamp.minute
+
+    return year, month, day, hour, minute
+
+
+LOAD_OUTPUT_CACHE = True # cache parsed 'output' files in binary format next to original files
+LOAD_OUTPUT_CACHE_VERSION = 1 # must be incremented if format of loaded data structures changes
+LOAD_OUTPUT_CACHE_EXT = '.npy'
+def load_output_cache_filename(filename, delimiter=',', skip_header=1):
+    """
+    Returns name of binary cache file for 'output' formatted file,
+    keyed by contents of file (md5) and loading parameters
+
     :param filename: Name of file to be loaded
     :type filename: str
+    :param delimiter: Cell delimiter character(s)
+    :type delimiter: str
+    :param skip_header: Number of lines to be skipped at beginning of file
+    :type skip_header: int
+    :rtype: str
     """
-    _log.info("Started loading '{f}'".format(f=filename))
+    key = "{v}|{m}|{d}|{s}".format(v=LOAD_OUTPUT_CACHE_VERSION, m=block_md5(filename=filename), d=delimiter, s=skip_header)
+    return "{f}.{k}{e}".format(f=filename, k=hashlib.md5(key.encode('utf-8')).hexdigest(), e=LOAD_OUTPUT_CACHE_EXT)
+
+
+def save_output_cache(data, cache_filename, filename):
+    """
+    Saves loaded 'output' data structure into binary cache file (removing stale cache files for same original file);
+    failures to save are logged but not raised, since cache is optional
 
+    :param data: Data structure loaded from 'output' file
+    :type data: numpy.ndarray
+    :param cache_filename: Name of cache file
+    :type cache_filename: str
+    :param filename: Name of original file
+    :type filename: str
+    """
+    tmp_filename = "{f}.{p}.tmp".format(f=cache_filename, p=os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as f:
+            numpy.save(f, data, allow_pickle=False)
+        dirname, basename = os.path.split(filename)
+        for stale_basename in os.listdir(dirname or os.curdir):
+            stale_filename = os.path.join(dirname, stale_basename)
+            if stale_basename.startswith(basename + '.') and stale_basename.endswith(LOAD_OUTPUT_CACHE_EXT) and stale_filename != cache_filename:
+                os.remove(stale_filename)
+        os.rename(tmp_filename, cache_filename)
+        _log.debug("Saved cache '{c}' for '{f}'".format(c=cache_filename, f=filename))
+    except (IOError, OSError) as e:
+        _log.warning("Unable to save cache '{c}' for '{f}': {e}".format(c=cache_filename, f=filename, e=e))
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+
+
+TIMESTAMP_COMPONENTS = ['year', 'month', 'day', 'hour', 'minute']
+def parse_output(filename, delimiter=',', skip_header=1):
+    """
+    Parses 'output' formatted file (e.g., from output of nee_proc or meteo_proc),
+    adding year, month, day, hour, and minute columns from timestamps
+    
+    :param filename: Name of file to be loaded
+    :type filename: str
+    :param delimiter: Cell delimiter character(s)
+    :type delimiter: str
+    :param skip_header: Number of lines to be skipped at beginning of file
+    :type skip_header: int
+    :rtype: numpy.ndarray
+    """
     _log.debug("Started loading headers")
     with open(filename, 'r') as f:
         header_line = f.readline()
@@ -81,38 +221,57 @@ def load_output(filename, delimiter=',', skip_header=1):
     data = numpy.genfromtxt(fname=filename, dtype=dtype, names=headers, delimiter=delimiter, skip_header=skip_header, missing_values='-9999,-9999.0,-6999,-6999.0, ', usemask=True)
     data = numpy.ma.filled(data, vfill)
 
-    new_dtype = dtype + [('year', FLOAT_PREC), ('month', FLOAT_PREC), ('day', FLOAT_PREC), ('hour', FLOAT_PREC), ('minute', FLOAT_PREC)]
+    new_dtype = dtype + [(i, FLOAT_PREC) for i in TIMESTAMP_COMPONENTS]
     new_data = numpy.zeros(len(data), dtype=new_dtype)
     for h in headers:
         new_data[h] = data[h]
     _log.debug("Finished loading data")
 
-    _log.debug("Started loading timestamps")
-    timestamp_list = []
+    _log.debug("Started parsing timestamps")
+    for column, array in zip(TIMESTAMP_COMPONENTS, parse_timestamps(timestamps=new_data['timestamp_end'])):
+        new_data[column][:] = array
+    _log.debug("Finished parsing timestamps")
+
+    return new_data
 
-    # TODO: the arrays below were added as a workaround for slower performance for structured arrays in numpy 1.10.1;
-    #       once fixed (1.10.2?), array_* should be removed
-    #       see bug: https://github.com/numpy/numpy/issues/6467
-    array_year = numpy.empty(len(data), dtype='i4')
-    array_month = numpy.empty(len(data), dtype='i4')
-    array_day = numpy.empty(len(data), dtype='i4')
-    array_hour = numpy.empty(len(data), dtype='i4')
-    array_minute = numpy.empty(len(data), dtype='i4')
-    it = numpy.nditer(new_data['timestamp_end'], flags=['f_index'])
-    while not it.finished:
-        timestamp = datetime.strptime(str(it.value), "%Y%m%d%H%M")
-        array_year[it.index] = timestamp.year
-        array_month[it.index] = timestamp.month
-        array_day[it.index] = timestamp.day
-        array_hour[it.index] = timestamp.hour
-        array_minute[it.index] = timestamp.minute
-        timestamp_list.append(timestamp)
-        it.iternext()
-    new_data['year'][:] = array_year
-    new_data['month'][:] = array_month
-    new_data['day'][:] = array_day
-    new_data['hour'][:] = array_hour
-    new_data['minute'][:] = array_minute
+
+def load_output(filename, delimiter=',', skip_header=1, use_cache=LOAD_OUTPUT_CACHE):
+    """
+    Loads 'output' formatted file (e.g., from output of nee_proc or meteo_proc);
+    if use_cache is True, parsed data structure is stored in binary cache file
+    next to original file (see load_output_cache_filename) and later loads of
+    unchanged file memory-map cache file instead of parsing original file
+    
+    :param filename: Name of file to be loaded
+    :type filename: str
+    :param delimiter: Cell delimiter character(s)
+    :type delimiter: str
+    :param skip_header: Number of lines to be skipped at beginning of file
+    :type skip_header: int
+    :param use_cache: if True, uses (and creates if needed) binary cache file
+    :type use_cache: bool
+    """
+    _log.info("Started loading '{f}'".format(f=filename))
+
+    new_data = None
+    if use_cache:
+        cache_filename = load_output_cache_filename(filename=filename, delimiter=delimiter, skip_header=skip_header)
+        if os.path.isfile(cache_filename):
+            try:
+                # copy-on-write mapping, changes to loaded data are not written back to cache
+                new_data = numpy.asarray(numpy.load(cache_filename, mmap_mode='c', allow_pickle=False))
+                _log.debug("Loaded cache '{c}'".format(c=cache_filename))
+            except (IOError, OSError, ValueError) as e:
+                _log.warning("Unable to load cache '{c}', loading '{f}': {e}".format(c=cache_filename, f=filename, e=e))
+    if new_data is None:
+        new_data = parse_output(filename=filename, delimiter=delimiter, skip_header=skip_header)
+        if use_cache:
+            save_output_cache(data=new_data, cache_filename=cache_filename, filename=filename)
+
+    headers = [i for i in new_data.dtype.names if i not in TIMESTAMP_COMPONENTS]
+
+    # datetime objects only created if timestamp list is used
+    timestamp_list = TimestampList(*[new_data[i].astype('i4') for i in TIMESTAMP_COMPONENTS])
     year_array = numpy.unique(ar=new_data['year'])
 
     _log.debug("Finished loading timestamps: first(END)={f}, last(END)={l}, years={y}".format(f=new_data['timestamp_end'][0], l=new_data['timestamp_end'][-1], y=list(year_array)))
@@ -124,6 +283,180 @@ def load_output(filename, delimiter=',', skip_header=1):
     return new_data, headers, timestamp_list, year_list
 
 
+# float32 values formatted by vectorized shortest round-trip digits (other values formatted by str());
+# range matches positional (non-scientific) str() formatting, up to largest range of consecutive integers
+SHORTEST_FLOAT32_MIN = 1.0e-4
+SHORTEST_FLOAT32_MAX = 2.0 ** 24
+SHORTEST_FLOAT32_DIGITS = 9     # maximum number of significant digits needed for round-trip of float32 values
+SHORTEST_FLOAT32_INTEGER = 8    # maximum number of integer digits (below SHORTEST_FLOAT32_MAX)
+SHORTEST_FLOAT32_FRACTION = 12  # maximum number of fraction digits (above SHORTEST_FLOAT32_MIN)
+FLOAT32_MANTISSA_MASK = 0x007fffff
+POWERS_OF_10 = 10 ** numpy.arange(19, dtype='i8')
+def format_float32_shortest(values):
+    """
+    Formats float32 values as shortest decimal strings that round-trip to the same values,
+    identical to str() of each value (numpy.float32 scalar), with vectorized digit generation;
+    values out of positional range (see SHORTEST_FLOAT32_MIN/MAX), powers of 2 (asymmetric
+    round-trip intervals), zeros and NAs are formatted by str()
+
+    Strings are placed in a fixed layout (sign, right aligned integer digits, point,
+    left aligned fraction digits) and returned with start and length in each row.
+
+    :param values: float32 values to be formatted
+    :type values: numpy.ndarray
+    :rtype: tuple (numpy.ndarray of characters with shape (values.size, width), numpy.ndarray of string starts, numpy.ndarray of string lengths)
+    """
+    values = numpy.ravel(values)
+    absvalues = numpy.abs(values).astype(DOUBLE_PREC)
+    with numpy.errstate(invalid='ignore'):
+        vectorized = (absvalues >= SHORTEST_FLOAT32_MIN) & (absvalues < SHORTEST_FLOAT32_MAX) & ((values.view('u4') & FLOAT32_MANTISSA_MASK) != 0)
+    idx = numpy.where(vectorized)[0]
+    target = numpy.abs(values[idx])
+    a = absvalues[idx]
+
+    # decimal exponent of first significant digit
+    exponent = numpy.floor(numpy.log10(a)).astype('i8')
+    exponent[10.0 ** exponent > a] -= 1
+    exponent[10.0 ** (exponent + 1) <= a] += 1
+
+    # binary search of smallest number of significant digits for which closest decimal round-trips
+    # (if it round-trips for some number of digits, it does for all larger numbers of digits)
+    low = numpy.zeros(idx.size, dtype='i8')
+    high = numpy.full(idx.size, SHORTEST_FLOAT32_DIGITS, dtype='i8')
+    def closest(digits):
+        decimals = digits - 1 - exponent
+        multiplier = POWERS_OF_10[numpy.maximum(decimals, 0)].astype(DOUBLE_PREC)
+        divisor = POWERS_OF_10[numpy.maximum(-decimals, 0)].astype(DOUBLE_PREC)
+        mantissa = numpy.round(a * multiplier / divisor)
+        return mantissa, decimals, (mantissa / multiplier * divisor).astype(FLOAT_PREC) == target
+    while numpy.any(high - low > 1):
+        middle = (low + high) // 2
+        roundtrip = closest(digits=middle)[2]
+        high = numpy.where(roundtrip, middle, high)
+        low = numpy.where(roundtrip, low, middle)
+    mantissa, decimals, _ = closest(digits=high)
+    mantissa = mantissa.astype('i8')
+
+    # closest decimals rounded up to next power of 10 (e.g., 0.010 for 0.0099999998) have trailing zeros
+    while True:
+        trailing = (decimals > 0) & (mantissa % 10 == 0)
+        if not numpy.any(trailing):
+            break
+        mantissa[trailing] //= 10
+        decimals[trailing] -= 1
+
+    # integer and fraction parts, at least one fraction digit ('2005.0')
+    integer = numpy.where(decimals > 0, mantissa // POWERS_OF_10[numpy.maximum(decimals, 0)], mantissa * POWERS_OF_10[numpy.maximum(-decimals, 0)])
+    fraction = numpy.where(decimals > 0, mantissa % POWERS_OF_10[numpy.maximum(decimals, 0)], 0)
+    fraction_width = numpy.maximum(decimals, 1)
+    integer_width = numpy.ones(idx.size, dtype='i8')
+    for power in range(1, SHORTEST_FLOAT32_INTEGER):
+        integer_width += (integer >= POWERS_OF_10[power])
+    sign_width = (values[idx] < 0).astype('i8')
+
+    # fixed layout: sign slot, right aligned integer digits, point, left aligned fraction digits
+    width = 1 + SHORTEST_FLOAT32_INTEGER + 1 + SHORTEST_FLOAT32_FRACTION
+    point = 1 + SHORTEST_FLOAT32_INTEGER
+    fixed = numpy.zeros((idx.size, width), dtype='u1')
+    for i in range(numpy.max(integer_width) if idx.size else 0):
+        integer, digit = numpy.divmod(integer, 10)
+        fixed[:, point - 1 - i] = digit + ord('0')
+    fixed[:, point] = ord('.')
+    fraction = fraction * POWERS_OF_10[SHORTEST_FLOAT32_FRACTION - fraction_width]
+    for i in range(SHORTEST_FLOAT32_FRACTION):
+        fraction, digit = numpy.divmod(fraction, 10)
+        fixed[:, width - 1 - i] = digit + ord('0')
+    fixed_starts = point - integer_width - sign_width
+    negative = numpy.where(sign_width == 1)[0]
+    fixed[negative, fixed_starts[negative]] = ord('-')
+
+    chars = numpy.zeros((values.size, width), dtype='u1')
+    starts = numpy.zeros(values.size, dtype='i8')
+    lengths = numpy.zeros(values.size, dtype='i8')
+    chars[idx], starts[idx], lengths[idx] = fixed, fixed_starts, sign_width + integer_width + 1 + fraction_width
+    others = numpy.where(~vectorized)[0]
+    if others.size:
+        other_chars, _, other_lengths = format_strings(values=values[others])
+        chars[others, :other_chars.shape[1]] = other_chars
+        lengths[others] = other_lengths
+    return chars, starts, lengths
+
+
+def format_strings(values):
+    """
+    Formats values as str() of each value, strings left aligned in rows
+
+    :param values: values to be formatted
+    :type values: numpy.ndarray
+    :rtype: tuple (numpy.ndarray of characters with shape (values.size, width), numpy.ndarray of string starts, numpy.ndarray of string lengths)
+    """
+    strings = numpy.array([str(v) for v in values], dtype='S')
+    chars = strings.view('u1').reshape(values.size, max(strings.itemsize, 1))
+    return chars, numpy.zeros(values.size, dtype='i8'), numpy.char.str_len(strings).astype('i8')
+
+
+def format_column(values):
+    """
+    Formats values of column as str() of each value (as numpy.savetxt with fmt='%s'),
+    each distinct value formatted once, float32 columns with vectorized formatting
+    (see format_float32_shortest)
+
+    :param values: column values to be formatted
+    :type values: numpy.ndarray
+    :rtype: tuple (numpy.ndarray of characters with shape (values.size, width), numpy.ndarray of string starts, numpy.ndarray of string lengths)
+    """
+    # distinct floats by bit pattern (e.g., 0.0 and -0.0 formatted differently)
+    keys = (values.view('u{s}'.format(s=values.dtype.itemsize)) if (values.dtype.kind == 'f' and values.dtype.itemsize in (4, 8)) else values)
+    _, index, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+    if values.dtype == numpy.float32:
+        chars, starts, lengths = format_float32_shortest(values=values[index])
+    else:
+        chars, starts, lengths = format_strings(values=values[index])
+    return chars[inverse], starts[inverse], lengths[inverse]
+
+
+def save_output(filename, data, delimiter=','):
+    """
+    Saves structured array as text file with header line of column names, byte-compatible with
+    numpy.savetxt(fname=filename, X=data, delimiter=delimiter, fmt='%s', header=delimiter.join(data.dtype.names), comments=''),
+    formatting whole columns at once (see format_column) instead of each value of each row;
+    written to temporary file renamed into place, so interrupted writes (e.g., terminated workers)
+    do not leave partial files found as existing outputs
+
+    :param filename: name of file to be saved
+    :type filename: str
+    :param data: data to be saved
+    :type data: numpy.ndarray
+    :param delimiter: cell delimiter character
+    :type delimiter: str
+    """
+    names = data.dtype.names
+    columns = [format_column(values=data[n]) for n in names]
+
+    # cells of all rows and columns (in row order), each followed by delimiter (or new line for last column)
+    width = max(chars.shape[1] for chars, _, _ in columns) + 1
+    cells = numpy.zeros((data.size, len(names), width), dtype='u1')
+    first = numpy.empty((data.size, len(names)), dtype='i8')
+    last = numpy.empty((data.size, len(names)), dtype='i8')
+    for i, (chars, starts, lengths) in enumerate(columns):
+        cells[:, i, :chars.shape[1]] = chars
+        cells[numpy.arange(data.size), i, starts + lengths] = ord('\n' if i == len(names) - 1 else delimiter)
+        first[:, i], last[:, i] = starts, starts + lengths
+    position = numpy.arange(width)
+    buf = cells[(position >= first[:, :, numpy.newaxis]) & (position <= last[:, :, numpy.newaxis])]
+
+    tmp_filename = "{f}.{p}.tmp".format(f=filename, p=os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(delimiter.join(names) + '\n')
+            f.write(buf.tostring())
+        os.rename(tmp_filename, filename)
+    except:
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
 def get_latitude(filename, delimiter=','):
     """
     Retrieves latitude from year 'input' formatted data file
@@ -147,6 +480,587 @@ def get_latitude(filename, delimiter=','):
     raise ONEFluxError(msg)
 
 
+def get_year_index(dataset):
+    """
+    Creates index of rows for each year in dataset (must be sorted by timestamp),
+    with start (inclusive) and stop (exclusive) row offsets of rows where year column equals year
+
+    :param dataset: Data structure loaded from 'output' file (see load_output)
+    :type dataset: numpy.ndarray
+    :rtype: dict (year: (start, stop))
+    """
+    years = dataset['year']
+    if numpy.any(years[1:] < years[:-1]):
+        msg = "Dataset not sorted by timestamp, cannot create year index"
+        _log.critical(msg)
+        raise ONEFluxPartitionError(msg)
+    unique_years, starts = numpy.unique(years, return_index=True)
+    stops = numpy.append(starts[1:], years.size)
+    return dict((int(y), (int(b), int(e))) for y, b, e in zip(unique_years, starts, stops))
+
+
+def get_year_slices(whole_dataset_nee, whole_dataset_meteo, year, first_year, year_index_nee=None, year_index_meteo=None):
+    """
+    Creates slices of NEE and meteo rows that constitute year, accounting for
+    end-of-averaging period convention (first midnight entry belongs to previous year,
+    first midnight entry from next year belongs to year)
+
+    :param whole_dataset_nee: Data structure loaded from NEE percentiles file
+    :type whole_dataset_nee: numpy.ndarray
+    :param whole_dataset_meteo: Data structure loaded from meteo_proc
+    :type whole_dataset_meteo: numpy.ndarray
+    :param year: year for slices
+    :type year: int
+    :param first_year: if True, year is first site-year available (first midnight entry kept in NEE)
+    :type first_year: bool
+    :param year_index_nee: year index for NEE dataset (see get_year_index), created if None
+    :type year_index_nee: dict
+    :param year_index_meteo: year index for meteo dataset (see get_year_index), created if None
+    :type year_index_meteo: dict
+    :rtype: tuple (of slice): NEE slice, meteo slice
+    """
+    if year_index_nee is None:
+        year_index_nee = get_year_index(dataset=whole_dataset_nee)
+    if year_index_meteo is None:
+        year_index_meteo = get_year_index(dataset=whole_dataset_meteo)
+
+    for label, dataset, year_index in [('NEE', whole_dataset_nee, year_index_nee), ('meteo', whole_dataset_meteo, year_index_meteo)]:
+        if year not in year_index:
+            msg = "Site-year {y} not found in {l} dataset".format(y=year, l=label)
+            _log.critical(msg)
+            raise ONEFluxPartitionError(msg)
+        if year_index[year][1] >= dataset.size:
+            msg = "Site-year {y} missing first midnight entry from next year in {l} dataset".format(y=year, l=label)
+            _log.critical(msg)
+            raise ONEFluxPartitionError(msg)
+
+    # account for first entry being from previous year
+    if first_year:
+        _log.debug("First site-year available ({y}), removing first midnight entry from meteo only".format(y=year))
+        first_nee = year_index_nee[year][0]
+    else:
+        _log.debug("Regular site-year ({y}), removing first midnight entry from meteo and nee".format(y=year))
+        first_nee = year_index_nee[year][0] + 1
+    first_meteo = year_index_meteo[year][0] + 1
+
+    # account for last entry being from next year
+    _log.debug("Site-year ({y}), adding first midnight entry from next year for meteo and nee".format(y=year))
+    year_slice_nee = slice(first_nee, year_index_nee[year][1] + 1)
+    year_slice_meteo = slice(first_meteo, year_index_meteo[year][1] + 1)
+
+    _log.debug("Site-year {y}: first NEE '{tn}' and first meteo '{tm}'".format(y=year, tn=whole_dataset_nee[year_slice_nee][0]['timestamp_end'], tm=whole_dataset_meteo[year_slice_meteo][0]['timestamp_end']))
+    _log.debug("Site-year {y}:  last NEE '{tn}' and  last meteo '{tm}'".format(y=year, tn=whole_dataset_nee[year_slice_nee][-1]['timestamp_end'], tm=whole_dataset_meteo[year_slice_meteo][-1]['timestamp_end']))
+
+    return year_slice_nee, year_slice_meteo
+
+
+# columns read by create_data_structures from NEE percentiles datasets ('{p}': percentile) and from meteo datasets
+NEE_INPUT_COLUMNS = TIMESTAMP_COMPONENTS + ['{p}', '{p}_qc']
+METEO_INPUT_COLUMNS = ['ta_m', 'ta_mqc', 'sw_in_m', 'sw_in_mqc', 'vpd_m']
+def project_year_inputs(whole_dataset_nee, whole_dataset_meteo, percentile, year_slice_nee, year_slice_meteo):
+    """
+    Creates compact copies of NEE and meteo rows that constitute year, with only the columns
+    used by create_data_structures for a single percentile (NEE_INPUT_COLUMNS and METEO_INPUT_COLUMNS)
+
+    :param whole_dataset_nee: Data structure loaded from NEE percentiles file
+    :type whole_dataset_nee: numpy.ndarray
+    :param whole_dataset_meteo: Data structure loaded from meteo_proc
+    :type whole_dataset_meteo: numpy.ndarray
+    :param percentile: UStar percentile value (data column label)
+    :type percentile: str
+    :param year_slice_nee: Slice of NEE rows that constitute year (see get_year_slices)
+    :type year_slice_nee: slice
+    :param year_slice_meteo: Slice of meteo rows that constitute year (see get_year_slices)
+    :type year_slice_meteo: slice
+    :rtype: tuple (of numpy.ndarray): NEE year data, meteo year data
+    """
+    projections = []
+    for dataset, year_slice, columns in [(whole_dataset_nee, year_slice_nee, [c.format(p=percentile) for c in NEE_INPUT_COLUMNS]),
+                                         (whole_dataset_meteo, year_slice_meteo, METEO_INPUT_COLUMNS)]:
+        rows = dataset[year_slice]
+        projection = numpy.empty(rows.size, dtype=[(c, dataset.dtype[c]) for c in columns])
+        for c in columns:
+            projection[c] = rows[c]
+        projections.append(projection)
+    return tuple(projections)
+
+
+class PartitioningInputStore(object):
+    """
+    Input datasets for partitioning of a site (meteo proc and NEE percentiles files),
+    loaded once and shared by partitioning methods (consumers, e.g., NT and DT).
+    Year indexes (see get_year_index) are created once per dataset.
+    Datasets for an UStar threshold type are released once all consumers released
+    that type; meteo dataset is released once all consumers are closed.
+    """
+
+    def __init__(self, datadir, siteid, sitedir, consumers=(NT_STR, DT_STR)):
+        """
+        :param datadir: main data directory (full path)
+        :type datadir: str
+        :param siteid: site flux id to be processed - in format CC-SSS
+        :type siteid: str
+        :param sitedir: data directory for site (relative path to datadir)
+        :type sitedir: str
+        :param consumers: labels of partitioning methods using datasets
+        :type consumers: list (of str)
+        """
+        self.siteid = siteid
+        self.sitedir_full = os.path.join(datadir, sitedir)
+        self.meteo_proc_dir = os.path.join(self.sitedir_full, METEO_PROC_DIR)
+        self.nee_proc_dir = os.path.join(self.sitedir_full, NEE_PROC_DIR)
+        self.consumers = set(consumers)
+        self._meteo = None
+        self._nee = {}
+        self._year_index = {}
+        self._year_slices = {}
+        self._released = {}
+        self._closed = set()
+
+    def meteo(self):
+        """
+        Returns meteo proc dataset (loaded at first call)
+
+        :rtype: numpy.ndarray
+        """
+        if self._meteo is None:
+            meteo_proc_f = os.path.join(self.meteo_proc_dir, '{s}_meteo_hh.csv'.format(s=self.siteid))
+            if not os.path.isfile(meteo_proc_f):
+                msg = "Meteo proc file not found '{f}'".format(f=meteo_proc_f)
+                _log.critical(msg)
+                raise ONEFluxError(msg)
+            _log.info("Will now load meteo file '{f}'".format(f=meteo_proc_f))
+            whole_dataset_meteo, headers_meteo, timestamp_list_meteo, year_list_meteo = load_output(meteo_proc_f)
+            self._meteo = whole_dataset_meteo
+        return self._meteo
+
+    def nee(self, ustar_type):
+        """
+        Returns NEE percentiles dataset and list of years for UStar threshold type
+        (loaded at first call), or (None, None) if NEE percentiles file is not available
+
+        :param ustar_type: UStar threshold type ('y' or 'c')
+        :type ustar_type: str
+        :rtype: tuple
+        """
+        if ustar_type not in self._nee:
+            nee_proc_percentiles_f = os.path.join(self.nee_proc_dir, '{s}_NEE_percentiles_{u}_hh.csv'.format(s=self.siteid, u=ustar_type))
+            if not os.path.isfile(nee_proc_percentiles_f):
+                msg = "NEE proc file not found '{f}', trying '{n}'".format(f=nee_proc_percentiles_f, n='{f}')
+                nee_proc_percentiles_f = os.path.join(self.nee_proc_dir, '{s}_NEE_percentiles_{u}.csv'.format(s=self.siteid, u=ustar_type))
+                msg = msg.format(f=nee_proc_percentiles_f)
+                _log.info(msg)
+
+                if not os.path.isfile(nee_proc_percentiles_f):
+                    if ustar_type == 'y':
+                        msg = "NEE proc file not found '{f}'".format(f=nee_proc_percentiles_f)
+                        _log.critical(msg)
+                        return None, None
+                        #raise ONEFluxError(msg) # TODO: add exception raising when both y and c missing
+                    elif ustar_type == 'c':
+                        msg = "NEE proc file not found '{f}', skipping (CUT not computed?)".format(f=nee_proc_percentiles_f)
+                        _log.warning(msg)
+                        return None, None
+                    else:
+                        msg = "Invalid USTAR type '{u}'".format(u=ustar_type)
+                        raise ONEFluxError(msg)
+            _log.info("Will now load nee percentiles file '{f}'".format(f=nee_proc_percentiles_f))
+            whole_dataset_nee, headers_nee, timestamp_list_nee, year_list_nee = load_output(nee_proc_percentiles_f)
+            self._nee[ustar_type] = (whole_dataset_nee, year_list_nee)
+        return self._nee[ustar_type]
+
+    def year_slices(self, ustar_type, year, first_year):
+        """
+        Returns slices of NEE and meteo rows that constitute year (see get_year_slices),
+        created at first call
+
+        :param ustar_type: UStar threshold type ('y' or 'c')
+        :type ustar_type: str
+        :param year: year for slices
+        :type year: int
+        :param first_year: if True, year is first site-year available
+        :type first_year: bool
+        :rtype: tuple (of slice): NEE slice, meteo slice
+        """
+        key = (ustar_type, year, first_year)
+        if key not in self._year_slices:
+            whole_dataset_nee, year_list_nee = self.nee(ustar_type=ustar_type)
+            whole_dataset_meteo = self.meteo()
+            if ustar_type not in self._year_index:
+                self._year_index[ustar_type] = get_year_index(dataset=whole_dataset_nee)
+            if None not in self._year_index:
+                self._year_index[None] = get_year_index(dataset=whole_dataset_meteo)
+            self._year_slices[key] = get_year_slices(whole_dataset_nee=whole_dataset_nee, whole_dataset_meteo=whole_dataset_meteo, year=year, first_year=first_year,
+                                                     year_index_nee=self._year_index[ustar_type], year_index_meteo=self._year_index[None])
+        return self._year_slices[key]
+
+    def year_inputs(self, ustar_type, year, first_year, percentile):
+        """
+        Returns NEE and meteo data for year, with only the columns used for a single percentile
+        (see project_year_inputs); created for each call and not kept in store
+
+        :param ustar_type: UStar threshold type ('y' or 'c')
+        :type ustar_type: str
+        :param year: year for data
+        :type year: int
+        :param first_year: if True, year is first site-year available
+        :type first_year: bool
+        :param percentile: UStar percentile value (data column label)
+        :type percentile: str
+        :rtype: tuple (of numpy.ndarray): NEE year data, meteo year data
+        """
+        year_slice_nee, year_slice_meteo = self.year_slices(ustar_type=ustar_type, year=year, first_year=first_year)
+        return project_year_inputs(whole_dataset_nee=self.nee(ustar_type=ustar_type)[0], whole_dataset_meteo=self.meteo(), percentile=percentile,
+                                   year_slice_nee=year_slice_nee, year_slice_meteo=year_slice_meteo)
+
+    def year_digest(self, ustar_type, year, first_year):
+        """
+        Returns md5sum of NEE and meteo rows (all columns) that constitute year (see get_year_slices),
+        including first midnight entry from next year, so changes to boundary entry
+        from next year also change digest of year
+
+        :param ustar_type: UStar threshold type ('y' or 'c')
+        :type ustar_type: str
+        :param year: year for digest
+        :type year: int
+        :param first_year: if True, year is first site-year available
+        :type first_year: bool
+        :rtype: str
+        """
+        year_slice_nee, year_slice_meteo = self.year_slices(ustar_type=ustar_type, year=year, first_year=first_year)
+        md5 = hashlib.md5()
+        md5.update(self.nee(ustar_type=ustar_type)[0][year_slice_nee].tobytes())
+        md5.update(self.meteo()[year_slice_meteo].tobytes())
+        return md5.hexdigest()
+
+    def release(self, consumer, ustar_type):
+        """
+        Signals consumer is done with datasets for UStar threshold type;
+        datasets are released if all consumers are done
+
+        :param consumer: label of partitioning method
+        :type consumer: str
+        :param ustar_type: UStar threshold type ('y' or 'c')
+        :type ustar_type: str
+        """
+        released = self._released.setdefault(ustar_type, set())
+        released.add(consumer)
+        # closed consumers are done with all UStar threshold types
+        if self.consumers.issubset(released.union(self._closed)):
+            if ustar_type in self._nee:
+                _log.debug("Releasing NEE percentiles dataset for UStar threshold type '{u}'".format(u=ustar_type))
+                del self._nee[ustar_type]
+            self._year_index.pop(ustar_type, None)
+            for key in [k for k in self._year_slices if k[0] == ustar_type]:
+                del self._year_slices[key]
+
+    def close(self, consumer):
+        """
+        Signals consumer is done with all datasets;
+        meteo dataset is released if all consumers are closed
+
+        :param consumer: label of partitioning method
+        :type consumer: str
+        """
+        self._closed.add(consumer)
+        for ustar_type in list(self._nee.keys()):
+            self.release(consumer=consumer, ustar_type=ustar_type)
+        if self.consumers.issubset(self._closed) and self._meteo is not None:
+            _log.debug("Releasing meteo dataset")
+            self._meteo = None
+            self._year_index.pop(None, None)
+
+
+DIAGNOSTICS_STORE_FILENAME = '{s}_{m}_diagnostics.npz'
+def diagnostics_store_filename(output_dir, siteid, part_type):
+    """
+    Filename of diagnostics store for site and partitioning method
+
+    :param output_dir: output directory of partitioning method
+    :type output_dir: str
+    :param siteid: site flux id - in format CC-SSS
+    :type siteid: str
+    :param part_type: partitioning method label (NT_STR or DT_STR)
+    :type part_type: str
+    :rtype: str
+    """
+    return os.path.join(output_dir, DIAGNOSTICS_STORE_FILENAME.format(s=siteid, m=part_type.lower()))
+
+
+def diagnostics_key(filename):
+    """
+    Key of diagnostics array in store, from name of (text) file it replaces,
+    e.g., 'nee_y_50_US-Syn_2005__nlr_status_PY' for '.../nee_y_50_US-Syn_2005__nlr_status_PY.csv'
+
+    :param filename: name of diagnostics file
+    :type filename: str
+    :rtype: str
+    """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+DIAGNOSTICS_STORE_PENDING_BYTES = 64 * 1024 * 1024 # size of arrays added to store kept in memory before store file is written
+class DiagnosticsStore(object):
+    """
+    Store of diagnostics (intermediate) outputs of a partitioning method for a site,
+    as structured arrays in a single .npz (zip) container, instead of one small
+    text file per array and (ustar_type, year, percentile).
+    Arrays are added with keys from names of files they replace (see diagnostics_key);
+    if a key is added again (e.g., re-runs), its array is replaced.
+    Added arrays are kept in memory until flush (or until they exceed DIAGNOSTICS_STORE_PENDING_BYTES),
+    which writes a new container to a temporary file and renames it to the store file,
+    so store file is never left partially written.
+    Only one process should add arrays to a store at a time.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: name of store file (see diagnostics_store_filename), created on first flush
+        :type filename: str
+        """
+        self.filename = filename
+        self._pending = collections.OrderedDict()
+        self._pending_bytes = 0
+        self._reader = None
+        self._reader_signature = None
+        self._reader_keys = set()
+        self._removed = set()
+
+    def append(self, arrays):
+        """
+        Adds arrays to store, replacing arrays with same keys
+
+        :param arrays: arrays to be added, by key (added in iteration order)
+        :type arrays: dict
+        """
+        if not arrays:
+            return
+        for key, array in arrays.items():
+            buf = io.BytesIO()
+            numpy.lib.format.write_array(buf, numpy.asanyarray(array), allow_pickle=False)
+            self._pending_bytes -= len(self._pending.pop(key, b''))
+            self._pending[key] = buf.getvalue()
+            self._removed.discard(key)
+            self._pending_bytes += len(self._pending[key])
+        _log.debug("Added {n} diagnostics arrays for '{f}'".format(n=len(arrays), f=self.filename))
+        if self._pending_bytes >= DIAGNOSTICS_STORE_PENDING_BYTES:
+            self.flush()
+
+    def remove(self, keys):
+        """
+        Removes arrays from store (from store file at next flush)
+
+        :param keys: keys of arrays to be removed
+        :type keys: list
+        """
+        for key in keys:
+            self._pending_bytes -= len(self._pending.pop(key, b''))
+            self._removed.add(key)
+        if keys:
+            _log.debug("Removed {n} diagnostics arrays from '{f}'".format(n=len(keys), f=self.filename))
+
+    def flush(self):
+        """
+        Writes added arrays to store file, with arrays already in store file
+        not replaced by added arrays (nor removed)
+        """
+        if not (self._pending or self._removed):
+            return
+        self.close()
+        tmp_filename = "{f}.{p}.tmp".format(f=self.filename, p=os.getpid())
+        try:
+            with zipfile.ZipFile(tmp_filename, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as container:
+                if os.path.isfile(self.filename):
+                    with zipfile.ZipFile(self.filename, mode='r') as previous:
+                        # latest member kept for keys added more than once (stores from previous versions)
+                        members = collections.OrderedDict((i.filename, i) for i in previous.infolist())
+                        for name, info in members.items():
+                            key = os.path.splitext(name)[0]
+                            if (key not in self._pending) and (key not in self._removed):
+                                container.writestr(info, previous.read(info))
+                for key, contents in self._pending.items():
+                    container.writestr(key + '.npy', contents)
+            os.rename(tmp_filename, self.filename)
+        except:
+            if os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        _log.debug("Saved {n} diagnostics arrays to '{f}'".format(n=len(self._pending), f=self.filename))
+        self._pending = collections.OrderedDict()
+        self._pending_bytes = 0
+        self._removed = set()
+
+    def close(self):
+        """
+        Closes store file (if opened by keys or load); added arrays not yet flushed are kept
+        """
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = None
+        self._reader_signature = None
+        self._reader_keys = set()
+
+    def _container(self):
+        """
+        Returns store file opened for reading (None if not created yet);
+        kept open (with index of members) until store file changes
+
+        :rtype: zipfile.ZipFile
+        """
+        if not os.path.isfile(self.filename):
+            self.close()
+            return None
+        stat = os.stat(self.filename)
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime)
+        if signature != self._reader_signature:
+            self.close()
+            self._reader = zipfile.ZipFile(self.filename, mode='r')
+            self._reader_signature = signature
+            self._reader_keys = set(os.path.splitext(n)[0] for n in self._reader.namelist())
+        return self._reader
+
+    def keys(self):
+        """
+        Keys of arrays in store (sorted, no duplicates)
+
+        :rtype: list
+        """
+        self._container()
+        return sorted(self._reader_keys.difference(self._removed).union(self._pending.keys()))
+
+    def __contains__(self, key):
+        if key in self._pending:
+            return True
+        self._container()
+        return (key in self._reader_keys) and (key not in self._removed)
+
+    def load(self, key):
+        """
+        Loads latest array added with key
+
+        :param key: key of array (see diagnostics_key)
+        :type key: str
+        :rtype: numpy.ndarray
+        """
+        if key not in self:
+            msg = "Diagnostics '{k}' not found in store '{f}'".format(k=key, f=self.filename)
+            _log.critical(msg)
+            raise ONEFluxPartitionError(msg)
+        contents = (self._pending[key] if key in self._pending else self._container().read(key + '.npy'))
+        return numpy.lib.format.read_array(io.BytesIO(contents), allow_pickle=False)
+
+
+def remove_other_years(output_dir, siteid, years, store=None):
+    """
+    Removes outputs of partitioning method (output and diagnostics files, and diagnostics arrays
+    in store if provided) of site-years not in years, e.g., years no longer within first and last years of site
+
+    :param output_dir: output directory of partitioning method
+    :type output_dir: str
+    :param siteid: site flux id - in format CC-SSS
+    :type siteid: str
+    :param years: site-years with outputs to be kept
+    :type years: list
+    :param store: diagnostics store of partitioning method (see DiagnosticsStore)
+    :type store: DiagnosticsStore
+    :rtype: list (of int)
+    """
+    output_year = re.compile(r'^nee_[a-z]_.+_{s}_([0-9]{{4}})'.format(s=re.escape(siteid)))
+    removed = set()
+    for name in (sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []):
+        match = output_year.match(name)
+        if match and (int(match.group(1)) not in years) and os.path.isfile(os.path.join(output_dir, name)):
+            _log.debug("Output file of year outside of years to compare removed: '{f}'".format(f=name))
+            os.remove(os.path.join(output_dir, name))
+            removed.add(int(match.group(1)))
+    if store is not None:
+        keys = [k for k in store.keys() if output_year.match(k) and (int(output_year.match(k).group(1)) not in years)]
+        store.remove(keys=keys)
+        removed.update([int(output_year.match(k).group(1)) for k in keys])
+    if removed:
+        _log.info("Outputs of years outside of years to compare removed: {y}".format(y=', '.join([str(y) for y in sorted(removed)])))
+    return sorted(removed)
+
+
+YEAR_DIGESTS_FILENAME = '{s}_{m}_year_digests.json'
+def year_digests_filename(output_dir, siteid, part_type):
+    """
+    Returns name of file with digests of inputs of site-years for partitioning method (see YearDigests)
+
+    :param output_dir: output directory of partitioning method
+    :type output_dir: str
+    :param siteid: site flux id - in format CC-SSS
+    :type siteid: str
+    :param part_type: partitioning method (NT_STR or DT_STR)
+    :type part_type: str
+    :rtype: str
+    """
+    return os.path.join(output_dir, YEAR_DIGESTS_FILENAME.format(s=siteid, m=part_type.lower()))
+
+
+class YearDigests(object):
+    """
+    Digests of inputs (see PartitioningInputStore.year_digest) of each site-year and UStar
+    threshold type with outputs of a partitioning method, saved with settings of method
+    and ONEFlux version (digests from runs with other settings or version are discarded).
+    Used by incremental runs to keep outputs of site-years with inputs unchanged since saved.
+    """
+
+    def __init__(self, filename, settings):
+        """
+        :param filename: name of digests file (see year_digests_filename)
+        :type filename: str
+        :param settings: settings of partitioning method affecting outputs (JSON serializable)
+        :type settings: dict
+        """
+        self.filename = filename
+        self.settings = json.loads(json.dumps(dict(settings, version=VERSION)))
+        self.saved = {}
+        self.current = {}
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'r') as f:
+                contents = json.load(f)
+            if contents.get('settings') == self.settings:
+                self.saved = contents.get('digests', {})
+            else:
+                _log.info("Settings of saved site-year digests changed, discarding '{f}'".format(f=self.filename))
+
+    def changed(self, ustar_type, year, digest):
+        """
+        Records current digest for site-year and UStar threshold type,
+        returns True if it differs from saved digest (or no digest saved)
+
+        :param ustar_type: UStar threshold type ('y' or 'c')
+        :type ustar_type: str
+        :param year: site-year
+        :type year: int
+        :param digest: digest of inputs (see PartitioningInputStore.year_digest)
+        :type digest: str
+        :rtype: bool
+        """
+        key = '{u}_{y}'.format(u=ustar_type, y=year)
+        self.current[key] = digest
+        return self.saved.get(key) != digest
+
+    def save(self, kept=(), years=None):
+        """
+        Saves current digests; for site-years with previously existing outputs kept,
+        saved digests are not replaced (digests of inputs used for those outputs)
+
+        :param kept: (ustar_type, year) tuples of site-years with outputs kept
+        :type kept: set
+        :param years: if not None, only digests of these years are saved (e.g., outputs of other years removed)
+        :type years: list
+        """
+        kept = set(['{u}_{y}'.format(u=u, y=y) for u, y in kept])
+        digests = dict(self.saved)
+        digests.update(dict([(k, d) for k, d in self.current.items() if k not in kept]))
+        if years is not None:
+            digests = dict([(k, d) for k, d in digests.items() if int(k.split('_')[-1]) in years])
+        with open(self.filename, 'w') as f:
+            json.dump({'settings': self.settings, 'digests': digests}, f, indent=1, sort_keys=True)
+
+
 def add_empty_vars(data, records, column, unit='-'):
     """
     Checks 'column' is a valid column name and assigns records to that column
@@ -271,9 +1185,67 @@ def nomi(data, columns):
     return data[nonnan_mask], nonnan_mask, nan_mask
 
 
-def jacobian(func, data, params_filled_arr, params_filled_arr2, params):
+def jacobian(func, data, params_filled_arr, params_filled_arr2, params, analytic=False):
+    '''
+    :Task:  Calculate the jacobian matrix, using closed-form derivatives
+            of models (see oneflux.partition.ecogeo)
+
+    :param func: function model to use
+    :type func: str
+    :param data: data structure for partitioning
+    :type data: numpy.ndarray
+    :param params_filled_arr: Array of replicated E0 values
+    :type params_filled_arr: numpy.ndarray
+    :param params_filled_arr2: Array of replicated alpha values
+    :type params_filled_arr2: numpy.ndarray
+    :param params: optimized parameters to be applied to the model
+    :type params: numpy.ndarray
+    :param analytic: if False (default), finite differences are used (see jacobian_numerical)
+    :type analytic: bool
+    '''
+
+    if not analytic:
+        return jacobian_numerical(func=func, data=data, params_filled_arr=params_filled_arr, params_filled_arr2=params_filled_arr2, params=params)
+
+    if isinstance(params, numpy.float32) or isinstance(params, numpy.float64) \
+        or isinstance(params, numpy.int32) or isinstance(params, numpy.int64):
+        params = [params]
+
+    # no copies if already double precision (e.g., oneflux.partition.daytime.DTWorkingSet)
+    rg_f, vpd_f, alpha = None, None, None
+    ta_f = numpy.asarray(data['tair_f'], dtype=DOUBLE_PREC)
+    e0 = numpy.asarray(params_filled_arr, dtype=DOUBLE_PREC)
+    if func != "LloydT_E0fix":
+        rg_f = numpy.asarray(data['rg_f'], dtype=DOUBLE_PREC)
+    if func in ["HLRC_LloydVPD", "HLRC_LloydVPD_afix"]:
+        vpd_f = numpy.asarray(data['vpd_f'], dtype=DOUBLE_PREC)
+    if func in ["HLRC_Lloyd_afix", "HLRC_LloydVPD_afix"]:
+        alpha = numpy.asarray(params_filled_arr2, dtype=DOUBLE_PREC)
+
+    j = None
+    if func == "HLRC_Lloyd":
+        j = hlrc_lloyd_jacobian(rg_f=rg_f, ta_f=ta_f, e0=e0, parameter=params)
+    if func == "HLRC_LloydVPD":
+        j = hlrc_lloydvpd_jacobian(rg_f=rg_f, ta_f=ta_f, e0=e0, vpd_f=vpd_f, parameter=params)
+    if func == "HLRC_Lloyd_afix":
+        j = hlrc_lloyd_afix_jacobian(rg_f=rg_f, ta_f=ta_f, e0=e0, alpha=alpha, parameter=params)
+    if func == "HLRC_LloydVPD_afix":
+        j = hlrc_lloydvpd_afix_jacobian(rg_f=rg_f, ta_f=ta_f, e0=e0, vpd_f=vpd_f, alpha=alpha, parameter=params)
+    if func == "LloydT_E0fix":
+        j = lloydt_e0fix_jacobian(ta_f=ta_f, e0=e0, parameter=params)
+
+    if j is None:
+        msg = "Unknown model function for jacobian: '{f}'".format(f=func)
+        _log.critical(msg)
+        raise ONEFluxError(msg)
+
+    return j.astype(FLOAT_PREC)
+
+
+def jacobian_numerical(func, data, params_filled_arr, params_filled_arr2, params):
     '''
-    :Task:  Calculate the jacobian matrix
+    :Task:  Calculate the jacobian matrix using central finite differences
+            (original implementation, kept as reference for jacobian)
 
     :param func: function model to use
     :type func: str
@@ -352,11 +1324,11 @@ def jacobian(func, data, params_filled_arr, params_filled_arr2, params):
 WINDOW_SIZE = 4      # number of days to include in window
 BR_PERC = 0.0
 def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
-                mprior, sigm, sigd, window_size=WINDOW_SIZE, trim_perc=BR_PERC):
+                mprior, sigm, sigd, window_size=WINDOW_SIZE, trim_perc=BR_PERC, analytic_jacobian=False):
     """
     Main non-linear least-squares driver function
     
-    :param data: data structure for partitioning
+    :param data: data structure for partitioning (or double precision columns, e.g., oneflux.partition.daytime.DTWorkingSet)
     :type data: numpy.ndarray
     :param func: function to be optimized
     :type func: function
@@ -370,6 +1342,8 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
     :type xguess: list
     :param trim_perc: precentage to trim from residual values
     :type trim_perc: float
+    :param analytic_jacobian: if True, closed-form jacobian of models used in optimization (only if no trimming)
+    :type analytic_jacobian: bool
     """
     if len(xguess) != npara:
         msg = "Incompatible number of parameters '{n}' and length of initial guess '{i}'".format(n=npara, i=len(xguess))
@@ -377,11 +1351,14 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
         raise ONEFluxError(msg)
 
     status = 0 # status of execution; 0 optimization executed successfully, -1 problem with execution of optimization
-    first_ts, last_ts = get_first_last_ts(data=data)
-#    _log.debug("Starting optimization step for period '{ts1}' - '{ts2}'".format(ts1=first_ts.strftime('%Y-%m-%d %H:%M'), ts2=last_ts.strftime('%Y-%m-%d %H:%M')))
+
+    # independent variables cast only once, not at each evaluation (no copies if already double precision)
+    indep_arrays = [numpy.asarray(data[i], dtype=DOUBLE_PREC) for i in indepvar_arr]
 
     # check number of entries for independent variable
-    _, nonnan_indep_mask, _ = nomi(data, indepvar_arr)
+    nonnan_indep_mask = numpy.ones(len(data[depvar]), dtype=bool)
+    for indep_array in indep_arrays:
+        nonnan_indep_mask &= not_nan(indep_array)
 
     '''
     print("numpy.sum(nonnan_indep_mask)")
@@ -449,8 +1426,9 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
         return result_dict
 
     # "clean" dependent variable so not to use NAs from independent variable
-    clean_dep = data[depvar].copy()
+    clean_dep = numpy.array(data[depvar], dtype=DOUBLE_PREC)
     clean_dep[~nonnan_indep_mask] = NAN
+    nonnan_nee_mask = not_nan(clean_dep)
 
     leastsq_count = [1]
 
@@ -479,7 +1457,7 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
         #print(leastsq_count)
 
         if lts_func == "LloydTemp":
-            prediction = lloyd_taylor_dt(ta_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), parameter=par)
+            prediction = lloyd_taylor_dt(ta_f=indep_arrays[0], parameter=par)
             '''
             print("par")
             print(par)
@@ -497,11 +1475,11 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
             #print(prediction)
             '''
         if lts_func == "HLRC_Lloyd":
-            prediction = hlrc_lloyd(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), parameter=par)
+            prediction = hlrc_lloyd(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], parameter=par)
         if lts_func == "HLRC_LloydVPD":
             #if leastsq_count[0] == 6:
             #    par = numpy.array([-0.020768575, 1.9603746, 0.0, 0.40222415], dtype=DOUBLE_PREC)
-            prediction = hlrc_lloydvpd(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), vpd_f=data[indepvar_arr[3]].astype(DOUBLE_PREC), parameter=par)
+            prediction = hlrc_lloydvpd(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], vpd_f=indep_arrays[3], parameter=par)
             #print("par")
             #print(par)
             #if leastsq_count[0] == 1:
@@ -518,15 +1496,14 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
             #print("prediction")
             #print(prediction)
         if lts_func == "HLRC_Lloyd_afix":
-            prediction = hlrc_lloyd_afix(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), alpha=data[indepvar_arr[3]].astype(DOUBLE_PREC), parameter=par)
+            prediction = hlrc_lloyd_afix(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], alpha=indep_arrays[3], parameter=par)
         if lts_func == "HLRC_LloydVPD_afix":
-            prediction = hlrc_lloydvpd_afix(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), vpd_f=data[indepvar_arr[3]].astype(DOUBLE_PREC), alpha=data[indepvar_arr[4]].astype(DOUBLE_PREC), parameter=par)
+            prediction = hlrc_lloydvpd_afix(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], vpd_f=indep_arrays[3], alpha=indep_arrays[4], parameter=par)
         if lts_func == "LloydT_E0fix":
-            prediction = lloydt_e0fix(ta_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), e0=data[indepvar_arr[1]].astype(DOUBLE_PREC), parameter=par)
+            prediction = lloydt_e0fix(ta_f=indep_arrays[0], e0=indep_arrays[1], parameter=par)
 
 
         residuals = (nee - prediction) / sigd
-        nonnan_nee_mask = not_nan(nee)
         residuals[~nonnan_nee_mask] = 0.0
 
         pres = (par - mprior) / sigm
@@ -581,12 +1558,48 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
 
         return numpy.append(residuals, pres)
 
+    # define inner function with jacobian of residuals (used by optimization)
+    def bayes_res_jacobian(par, nee=clean_dep):
+        """
+        (inner) Jacobian of trimmed_bayes_res (without trimming) from
+        closed-form derivatives of models, with one row per residual
+        (NAs have zero derivatives) and one column per parameter
+
+        :param nee: array with (non-cleaned) nee values (dependent variable)
+        :type nee: numpy.ndarray
+        """
+        model_jacobian = None
+        if lts_func == "LloydTemp":
+            model_jacobian = lloyd_taylor_dt_jacobian(ta_f=indep_arrays[0], parameter=par)
+        if lts_func == "HLRC_Lloyd":
+            model_jacobian = hlrc_lloyd_jacobian(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], parameter=par)
+        if lts_func == "HLRC_LloydVPD":
+            model_jacobian = hlrc_lloydvpd_jacobian(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], vpd_f=indep_arrays[3], parameter=par)
+        if lts_func == "HLRC_Lloyd_afix":
+            model_jacobian = hlrc_lloyd_afix_jacobian(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], alpha=indep_arrays[3], parameter=par)
+        if lts_func == "HLRC_LloydVPD_afix":
+            model_jacobian = hlrc_lloydvpd_afix_jacobian(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], vpd_f=indep_arrays[3], alpha=indep_arrays[4], parameter=par)
+        if lts_func == "LloydT_E0fix":
+            model_jacobian = lloydt_e0fix_jacobian(ta_f=indep_arrays[0], e0=indep_arrays[1], parameter=par)
+
+        res_jacobian = prior_jacobian.copy()
+        res_jacobian[:len(nee), :] = numpy.transpose(model_jacobian * res_factor)
+        return res_jacobian
+
+    # parts of jacobian not depending on parameters: derivative factor for residuals (zero for NAs), and prior terms
+    # (double precision regardless of precision of sigd, so data structure and working set windows give same jacobians)
+    res_factor = numpy.where(nonnan_nee_mask, -1.0 / numpy.asarray(sigd, dtype=DOUBLE_PREC), 0.0)
+    prior_jacobian = numpy.zeros((len(clean_dep) + npara, npara), dtype=DOUBLE_PREC)
+    prior_jacobian[len(clean_dep):, :] = numpy.diag(1.0 / numpy.asarray(sigm, dtype=DOUBLE_PREC))
+
     #print("starting least_squares")
+    # closed-form jacobian only if residuals are not trimmed (trimming not differentiable)
     parameters, std_devs, ls_status, residuals, covariance_matrix, cor_matrix = least_squares(func=trimmed_bayes_res,
                                                                                   initial_guess=xguess,
                                                                                   entries=len(clean_dep),
                                                                                   iterations=1000 * (len(clean_dep) + 1),
-                                                                                  return_residuals_cov_mat=True)
+                                                                                  return_residuals_cov_mat=True,
+                                                                                  dfunc=(bayes_res_jacobian if (analytic_jacobian and trim_perc == 0.0) else None))
     '''
     print("ending least_squares")
     print("ls_status")
@@ -621,7 +1634,7 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
     if lts_func == "LloydTemp":
         est_rref, est_e0 = parameters
         est_rref_std, est_e0_std = std_devs
-        prediction = lloyd_taylor_dt(ta_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), parameter=parameters)
+        prediction = lloyd_taylor_dt(ta_f=indep_arrays[0], parameter=parameters)
 
         est_rmse = root_mean_sq_error(nee, prediction, trim_perc)
 
@@ -649,7 +1662,7 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
     if lts_func == "HLRC_Lloyd":
         est_alpha, est_beta, est_rref = parameters
         est_alpha_std, est_beta_std, est_rref_std = std_devs
-        prediction = hlrc_lloyd(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), parameter=parameters)
+        prediction = hlrc_lloyd(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], parameter=parameters)
 
         est_rmse = root_mean_sq_error(nee, prediction, trim_perc)
 
@@ -677,7 +1690,7 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
     if lts_func == "HLRC_LloydVPD":
         est_alpha, est_beta, est_k, est_rref = parameters
         est_alpha_std, est_beta_std, est_k_std, est_rref_std = std_devs
-        prediction = hlrc_lloydvpd(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), vpd_f=data[indepvar_arr[3]].astype(DOUBLE_PREC), parameter=parameters)
+        prediction = hlrc_lloydvpd(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], vpd_f=indep_arrays[3], parameter=parameters)
 
         est_rmse = root_mean_sq_error(nee, prediction, trim_perc)
 
@@ -741,7 +1754,7 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
     if lts_func == "HLRC_Lloyd_afix":
         est_beta, est_rref = parameters
         est_beta_std, est_rref_std = std_devs
-        prediction = hlrc_lloyd_afix(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), alpha=data[indepvar_arr[3]].astype(DOUBLE_PREC), parameter=parameters)
+        prediction = hlrc_lloyd_afix(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], alpha=indep_arrays[3], parameter=parameters)
 
         est_rmse = root_mean_sq_error(nee, prediction, trim_perc)
 
@@ -769,7 +1782,7 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
     if lts_func == "HLRC_LloydVPD_afix":
         est_beta, est_k, est_rref = parameters
         est_beta_std, est_k_std, est_rref_std = std_devs
-        prediction = hlrc_lloydvpd_afix(rg_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), ta_f=data[indepvar_arr[1]].astype(DOUBLE_PREC), e0=data[indepvar_arr[2]].astype(DOUBLE_PREC), vpd_f=data[indepvar_arr[3]].astype(DOUBLE_PREC), alpha=data[indepvar_arr[4]].astype(DOUBLE_PREC), parameter=parameters)
+        prediction = hlrc_lloydvpd_afix(rg_f=indep_arrays[0], ta_f=indep_arrays[1], e0=indep_arrays[2], vpd_f=indep_arrays[3], alpha=indep_arrays[4], parameter=parameters)
 
         est_rmse = root_mean_sq_error(nee, prediction, trim_perc)
 
@@ -797,7 +1810,7 @@ def nlinlts2(data, lts_func, depvar, indepvar_arr, npara, xguess,
     if lts_func == "LloydT_E0fix":
         est_rref = parameters[0]
         est_rref_std = std_devs[0]
-        prediction = lloydt_e0fix(ta_f=data[indepvar_arr[0]].astype(DOUBLE_PREC), e0=data[indepvar_arr[1]].astype(DOUBLE_PREC), parameter=parameters)
+        prediction = lloydt_e0fix(ta_f=indep_arrays[0], e0=indep_arrays[1], parameter=parameters)
 
         est_rmse = root_mean_sq_error(nee, prediction, trim_perc)
 
@@ -830,6 +1843,47 @@ def pct(array, percent):
     """
     Calculates "percent" percentile of array -- not really a percentile,
     but similar intention. Following implementation in original code.
+    Uses selection (numpy.partition) instead of full ranking, with results
+    identical to ordinal rank based implementation (see pct_ranked)
+    
+    :param array: 1-d array to be used in calculation
+    :type array: numpy.ndarray
+    :param percent: target percent value for percentile
+    :type percent: float
+    """
+
+    nonnan_mask = not_nan(array)
+    if numpy.sum(nonnan_mask) > 1:
+        nonnan_array = array[nonnan_mask]
+    else:
+        msg = "No non-NA value in percentile calculation"
+        _log.critical(msg)
+        raise ONEFluxError(msg)
+
+    entries = len(nonnan_array)
+    critical_rank = entries * percent / 100.
+
+    # if no rank over critical rank, return max values
+    if critical_rank >= entries:
+        return numpy.max(nonnan_array)
+
+    ### smallest rank that is greater than critical rank (or SM-RK-GT-CR), zero-based position in sorted array
+    critical_position = int(numpy.floor(critical_rank))
+
+    # average with rank immediately before (SM-RK-GT-CR) only if critical rank is integer
+    # and entry with rank immediately before is not first entry of array (as in ordinal rank implementation;
+    # ordinal rank of first entry is number of entries smaller than it plus one, ties ranked in order of occurrence)
+    if critical_rank.is_integer() and (critical_position >= 1) and (numpy.sum(nonnan_array < nonnan_array[0]) + 1 != critical_position):
+        partitioned_array = numpy.partition(nonnan_array, [critical_position - 1, critical_position])
+        return numpy.average([partitioned_array[critical_position:critical_position + 1], partitioned_array[critical_position - 1:critical_position]])
+    else:
+        return numpy.partition(nonnan_array, critical_position)[critical_position]
+
+
+def pct_ranked(array, percent):
+    """
+    Calculates "percent" percentile of array (see pct), based on
+    ordinal ranks of all entries. Original implementation, kept as reference for pct
     
     :param array: 1-d array to be used in calculation
     :type array: numpy.ndarray
@@ -868,7 +1922,7 @@ def pct(array, percent):
 
 STEP_BOUND_FACTOR = 0.25    # factor to restrict initial step  (default in scipy is 100.0, but PV-Wave seems to be closer to 0.1)
 NO_CONVERGENCE_RETRY = 20  # multiplicative factor to increase number of iterations allowed for retrying optimization that did not converge
-def least_squares(func, initial_guess, entries, iterations=None, stop=False, return_residuals_cov_mat=False):
+def least_squares(func, initial_guess, entries, iterations=None, stop=False, return_residuals_cov_mat=False, dfunc=None):
     """
     Wrapper for least squares paramater optimization
     
@@ -891,19 +1945,21 @@ def least_squares(func, initial_guess, entries, iterations=None, stop=False, ret
     :type stop: bool
     :param return_residuals_cov_mat: returns residuals and covariance matrix if True
     :type return_residuals_cov_mat: bool
+    :param dfunc: function computing jacobian of func (one row per residual), finite differences used if None
+    :type dfunc: function
     :rtype: 4-tuple (of tuple estimated parameters and corresponding std_devs), or 6-tuple
     """
     if iterations is None:
         iterations = 1000 * (len(entries) + 1)
 
     # call to scipy.optimize.leastsq (implementation of the Levenberg-Marquardt algorithm)
-    pars, cov_x, info, msg, success = leastsq(func=func, x0=initial_guess, full_output=True, maxfev=iterations, factor=STEP_BOUND_FACTOR) #ftol=1.11e-16
+    pars, cov_x, info, msg, success = leastsq(func=func, x0=initial_guess, Dfun=dfunc, full_output=True, maxfev=iterations, factor=STEP_BOUND_FACTOR) #ftol=1.11e-16
 
     if success != 1:# and (info['nfev'] == iterations):
         if info['nfev'] >= iterations:
             if not stop:
                 _log.warning("No convergence (code '{p}'), retrying ({r}-fold limit increase). Least squares message: [[{m}]]".format(p=success, r=NO_CONVERGENCE_RETRY, m=msg.replace('\r', '').replace('\n', ' ')))
-                return least_squares(func=func, initial_guess=initial_guess, entries=entries, iterations=iterations * NO_CONVERGENCE_RETRY, stop=True, return_residuals_cov_mat=return_residuals_cov_mat)
+                return least_squares(func=func, initial_guess=initial_guess, entries=entries, iterations=iterations * NO_CONVERGENCE_RETRY, stop=True, return_residuals_cov_mat=return_residuals_cov_mat, dfunc=dfunc)
             else:
                 _log.warning("No convergence (code '{p}'), stopping. Least squares message: [[{m}]]".format(p=success, m=msg.replace('\r', '').replace('\n', ' ')))
         else:
@@ -1084,7 +2140,40 @@ def remove_errored_entries(ustar_type, site, site_dir, year, working_year_data):
 
     return working_year_data
 
-def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, percentile, year_mask_nee, year_mask_meteo, latitude, part_type=NT_STR):
+def add_errored_entry(site, site_dir, line2add):
+    """
+    :Task:  Add entry with error-range to partitioning DT error file.
+
+    :Explanation:   Appends line (in the site_year_nee_des,begin,end format, see
+                    ONEFluxPartitionBrokenOptError.line2add) to the error file read by
+                    remove_errored_entries, creating file with header if needed.
+                    Returns False if line was already present in the file.
+
+
+    :param site: Site ID
+    :type site: str
+    :param site_dir: Absolute path to site dir
+    :type site_dir: str
+    :param line2add: Line to be appended to error file
+    :type line2add: str
+    """
+    filename = os.path.join(site_dir, PARTITIONING_DT_ERROR_FILE.format(s=site))
+
+    lines2append = ''
+    if not os.path.isfile(filename):
+        lines2append += 'site_year_nee_des,begin,end\n'
+    else:
+        with open(filename, 'r') as f:
+            if line2add in [l.strip() for l in f]:
+                _log.warning('Line "{line}" already in error file "{f}"'.format(line=line2add, f=filename))
+                return False
+    lines2append += line2add + '\n'
+    with open(filename, 'a') as f:
+        f.write(lines2append)
+    _log.warning('Added line "{line}" to error file "{f}"'.format(line=line2add, f=filename))
+    return True
+
+def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, percentile, year_slice_nee, year_slice_meteo, latitude, part_type=NT_STR):
     """
     :Task:  Creates data structure needed for partitioning; return working copy of populated input data array
     
@@ -1097,16 +2186,16 @@ def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, p
 
     :param ustar_type: Type of UStar for current file/percentile ['c'|'y']
     :type ustar_type: str
-    :param whole_dataset_nee: Data structure loaded from NEE percentiles file
+    :param whole_dataset_nee: Data structure loaded from NEE percentiles file (or its projection, see project_year_inputs)
     :type whole_dataset_nee: numpy.ndarray
-    :param whole_dataset_meteo: Data structure loaded from meteo_proc
+    :param whole_dataset_meteo: Data structure loaded from meteo_proc (or its projection, see project_year_inputs)
     :type whole_dataset_meteo: numpy.ndarray
     :param percentile: UStar percentile value that is currently being processed
     :type percentile: str
-    :param year_mask_nee: Mask of NEE rows that constitute current year
-    :type year_mask_nee: numpy.ndarray
-    :param year_mask_meteo: Mask of meteo rows that constitute current year
-    :type year_mask_meteo: numpy.ndarray
+    :param year_slice_nee: Slice of NEE rows that constitute current year (see get_year_slices)
+    :type year_slice_nee: slice
+    :param year_slice_meteo: Slice of meteo rows that constitute current year (see get_year_slices)
+    :type year_slice_meteo: slice
     :param latitude: Lattitude for site (current year)
     :type latitude: float
     :param part_type: Partitioning Type (Day time or Night time)
@@ -1151,7 +2240,7 @@ def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, p
             _log.critical(msg)
             raise ONEFluxError(msg)
 
-    working_year_data = numpy.zeros(numpy.sum(year_mask_nee), dtype=[(i, FLOAT_PREC) for i in working_headers])
+    working_year_data = numpy.zeros(len(whole_dataset_nee[year_slice_nee]), dtype=[(i, FLOAT_PREC) for i in working_headers])
     working_year_data[:] = NAN
 
     # Lat
@@ -1163,11 +2252,11 @@ def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, p
     #             ...
     #            '91__25', '91__25_qc', '93__75', '93__75_qc', '96__25', '96__25_qc', '98__75', '98__75_qc',
     #            '50', '50_qc']
-    working_year_data['year'][:] = whole_dataset_nee['year'][year_mask_nee]
-    working_year_data['month'][:] = whole_dataset_nee['month'][year_mask_nee]
-    working_year_data['day'][:] = whole_dataset_nee['day'][year_mask_nee]
-    working_year_data['hour'][:] = whole_dataset_nee['hour'][year_mask_nee]
-    working_year_data['minute'][:] = whole_dataset_nee['minute'][year_mask_nee]
+    working_year_data['year'][:] = whole_dataset_nee['year'][year_slice_nee]
+    working_year_data['month'][:] = whole_dataset_nee['month'][year_slice_nee]
+    working_year_data['day'][:] = whole_dataset_nee['day'][year_slice_nee]
+    working_year_data['hour'][:] = whole_dataset_nee['hour'][year_slice_nee]
+    working_year_data['minute'][:] = whole_dataset_nee['minute'][year_slice_nee]
 
     # compute julday
     _log.debug("Computing days-of-year (julday)")
@@ -1181,15 +2270,15 @@ def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, p
         working_year_data['julday'][-1] = 367
 
     # computr Hr
-    hour_mask = (whole_dataset_nee['minute'][year_mask_nee] == 0.)
-    halfhour_mask = (whole_dataset_nee['minute'][year_mask_nee] == 30.)
-    working_year_data['hr'][hour_mask] = whole_dataset_nee['hour'][year_mask_nee][hour_mask]
-    working_year_data['hr'][halfhour_mask] = whole_dataset_nee['hour'][year_mask_nee][halfhour_mask] + 0.5
+    hour_mask = (whole_dataset_nee['minute'][year_slice_nee] == 0.)
+    halfhour_mask = (whole_dataset_nee['minute'][year_slice_nee] == 30.)
+    working_year_data['hr'][hour_mask] = whole_dataset_nee['hour'][year_slice_nee][hour_mask]
+    working_year_data['hr'][halfhour_mask] = whole_dataset_nee['hour'][year_slice_nee][halfhour_mask] + 0.5
 
 
     # NEE, removing non-measured values using percentile_qc (0: measured)
-    working_year_data['nee'][:] = whole_dataset_nee[percentile][year_mask_nee]
-    measured_nee_mask = (whole_dataset_nee[percentile + '_qc'][year_mask_nee] == 0)
+    working_year_data['nee'][:] = whole_dataset_nee[percentile][year_slice_nee]
+    measured_nee_mask = (whole_dataset_nee[percentile + '_qc'][year_slice_nee] == 0)
     working_year_data['nee'][~measured_nee_mask] = NAN
 
     # qcNEE (1: missing, 0: present)
@@ -1198,7 +2287,7 @@ def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, p
     working_year_data['qcnee'][missing_mask] = 1.0
 
     # NEE_f (gapfilled)
-    working_year_data['nee_f'][:] = whole_dataset_nee[percentile][year_mask_nee]
+    working_year_data['nee_f'][:] = whole_dataset_nee[percentile][year_slice_nee]
 
     # NEE_fqc (quality of gapfilling, 0:measured, 1:high, 2:medium, 3:low)
     # NOTE: original didn't use flags from nee_proc, just 0 if measured or 1 if missing...
@@ -1221,12 +2310,12 @@ def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, p
     #  'co2_f', 'co2_fqc', 'ts_1_f', 'ts_1_fqc', 'swc_1_f', 'swc_1_fqc']
 
     # Tair, removing non-measured values using Ta_mqc (0: measured)
-    working_year_data['tair'][:] = whole_dataset_meteo['ta_m'][year_mask_meteo]
-    measured_tair_mask = (whole_dataset_meteo['ta_mqc'][year_mask_meteo] == 0)
+    working_year_data['tair'][:] = whole_dataset_meteo['ta_m'][year_slice_meteo]
+    measured_tair_mask = (whole_dataset_meteo['ta_mqc'][year_slice_meteo] == 0)
     working_year_data['tair'][~measured_tair_mask] = NAN
 
     # Tair_f
-    working_year_data['tair_f'][:] = whole_dataset_meteo['ta_m'][year_mask_meteo]
+    working_year_data['tair_f'][:] = whole_dataset_meteo['ta_m'][year_slice_meteo]
 
     # Tsoil
     working_year_data['tsoil'][:] = NAN
@@ -1235,16 +2324,16 @@ def create_data_structures(ustar_type, whole_dataset_nee, whole_dataset_meteo, p
     working_year_data['tsoil_f'][:] = NAN
 
     # Rg (SW_IN), removing non-measured values using SWin_mqc (0: measured)
-    working_year_data['rg'][:] = whole_dataset_meteo['sw_in_m'][year_mask_meteo]
-    measured_swin_mask = (whole_dataset_meteo['sw_in_mqc'][year_mask_meteo] == 0)
+    working_year_data['rg'][:] = whole_dataset_meteo['sw_in_m'][year_slice_meteo]
+    measured_swin_mask = (whole_dataset_meteo['sw_in_mqc'][year_slice_meteo] == 0)
     working_year_data['rg'][~measured_swin_mask] = NAN
 
     # Rg_f (SW_IN)
-    working_year_data['rg_f'][:] = whole_dataset_meteo['sw_in_m'][year_mask_meteo]
+    working_year_data['rg_f'][:] = whole_dataset_meteo['sw_in_m'][year_slice_meteo]
 
     # VPD
     # NOTE: removing non-measured values using VPD_mqc (0: measured) NOT DONE (commented out) in original code
-    working_year_data['vpd'][:] = whole_dataset_meteo['vpd_m'][year_mask_meteo]
+    working_year_data['vpd'][:] = whole_dataset_meteo['vpd_m'][year_slice_meteo]
 
     _log.debug("Finished creating working data set. Headers: {h}".format(h=working_year_data.dtype.names))
     first_ts = datetime(int(working_year_data['year'][0]), int(working_year_data['month'][0]), int(working_year_data['day'][0]), int(working_year_data['hour'][0]), int(working_year_data['minute'][0]))
@@ -14,25 +14,37 @@ import os
 import sys
 import logging
 import numpy
+import collections
+import multiprocessing
 
 from datetime import datetime
 from scipy.optimize import leastsq
-from scipy.stats import rankdata, ttest_ind, f_oneway
+from scipy.stats import ttest_ind
 from scipy.interpolate import splev, splrep, interp1d, LSQUnivariateSpline
 
 from oneflux import ONEFluxError
 
 from oneflux.partition.compu import compu_qcnee_filter, compu_daylight, compu_daylight_zero, compu_sunrise, compu_sunset, compu_nee_night
-from oneflux.partition.ecogeo import lloyd_taylor
-from oneflux.partition.auxiliary import compare_col_to_pvwave, FLOAT_PREC, NAN, NAN_TEST, nan, not_nan
+from oneflux.partition.ecogeo import lloyd_taylor, lloyd_taylor_jacobian, TREF
+from oneflux.partition.auxiliary import compare_col_to_pvwave, FLOAT_PREC, DOUBLE_PREC, NAN, NAN_TEST, nan, not_nan
 from oneflux.partition.library import QC_AUTO_DIR, METEO_PROC_DIR, NEE_PROC_DIR, NT_OUTPUT_DIR, HEADER_SEPARATOR, EXTRA_FILENAME, NT_STR
-from oneflux.partition.library import load_output, get_latitude, var, varnum, add_empty_vars, create_data_structures, nomi, newselif, ONEFluxPartitionError
+from oneflux.partition.library import PartitioningInputStore, DiagnosticsStore, YearDigests, remove_other_years, diagnostics_store_filename, year_digests_filename, diagnostics_key, save_output, get_latitude, var, varnum, add_empty_vars, create_data_structures, nomi, newselif, pct, ONEFluxPartitionError
 from oneflux.utils.files import check_create_directory
 
 _log = logging.getLogger(__name__)
 
 
-def partitioning_nt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare):
+# levels of statistics computed for window optimizations (__nlr_status_PY output and pvalue, nee_std, ta_std columns):
+# none (no statistics), summary (std devs of NEE and temperature), full (also p-value of predicted vs measured NEE)
+DIAGNOSTICS_NONE = 'none'
+DIAGNOSTICS_SUMMARY = 'summary'
+DIAGNOSTICS_FULL = 'full'
+DIAGNOSTICS_LEVELS = [DIAGNOSTICS_NONE, DIAGNOSTICS_SUMMARY, DIAGNOSTICS_FULL]
+
+
+QUEUED_JOBS_PER_WORKER = 2 # jobs submitted to pool per worker, including running jobs
+POLL_INTERVAL = 0.5  # seconds to wait for submitted jobs before checking again
+def partitioning_nt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare, workers=1, input_store=None, warm_start=False, diagnostics=DIAGNOSTICS_FULL, diagnostics_store=False, incremental=False):
     """
     NT partitioning wrapper function.
     Handles all "versions" (percentiles, CUT/VUT, years, etc)
@@ -49,14 +61,43 @@ def partitioning_nt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare,
     :type perc_to_compare: list (of str)
     :param years_to_compare: list of years to compare - [1996, 1997, ... , 2014]
     :type years_to_compare: list (of int)
+    :param workers: number of worker processes used to run (ustar_type, year, percentile) jobs (1 runs serially)
+    :type workers: int
+    :param input_store: input datasets shared with other partitioning methods (if None, datasets loaded for NT only)
+    :type input_store: PartitioningInputStore
+    :param warm_start: if True, percentiles of each (ustar_type, year) are run in order as a single job, with optimizations
+                       started from results of the same window at the previous (neighboring) percentile (see flux_partition);
+                       results differ from default (cold start) runs, site should be checked first (see
+                       oneflux.tools.partition_nt.validate_warm_start)
+    :type warm_start: bool
+    :param diagnostics: level of statistics computed for window optimizations (none, summary, full)
+    :type diagnostics: str
+    :param diagnostics_store: if True, diagnostics outputs (e.g., __nlr_status_PY, __e0_all_val_PY) are added to
+                              a single store for the site (see DiagnosticsStore) instead of one text file each
+    :type diagnostics_store: bool
+    :param incremental: if True, existing outputs are kept only for site-years with inputs unchanged since
+                        outputs were created (see YearDigests), outputs of other site-years are re-created
+                        and outputs of years not in years_to_compare are removed
+    :type incremental: bool
     """
 
     _log.info("Started NT partitioning of {s}".format(s=siteid))
 
+    if diagnostics not in DIAGNOSTICS_LEVELS:
+        msg = "Invalid diagnostics level '{d}' for NT partitioning (valid: {v})".format(d=diagnostics, v=', '.join(DIAGNOSTICS_LEVELS))
+        _log.critical(msg)
+        raise ONEFluxError(msg)
+
+    if workers is None:
+        workers = 1
+    if int(workers) < 1:
+        msg = "Invalid number of workers '{w}' for NT partitioning".format(w=workers)
+        _log.critical(msg)
+        raise ONEFluxError(msg)
+    workers = int(workers)
+
     sitedir_full = os.path.join(datadir, sitedir)
     qc_auto_dir = os.path.join(sitedir_full, QC_AUTO_DIR)
-    meteo_proc_dir = os.path.join(sitedir_full, METEO_PROC_DIR)
-    nee_proc_dir = os.path.join(sitedir_full, NEE_PROC_DIR)
     nt_output_dir = os.path.join(sitedir_full, NT_OUTPUT_DIR)
 
     # reformat percentiles to compare into data column labels
@@ -66,130 +107,328 @@ def partitioning_nt(datadir, siteid, sitedir, prod_to_compare, perc_to_compare,
     if os.path.isdir(sitedir_full) and not os.path.isdir(nt_output_dir):
         check_create_directory(directory=nt_output_dir)
 
+    # input datasets, loaded once and shared with other partitioning methods if store provided
+    if input_store is None:
+        input_store = PartitioningInputStore(datadir=datadir, siteid=siteid, sitedir=sitedir, consumers=[NT_STR])
+
+    # diagnostics outputs of jobs added (by this process only) as jobs finish
+    store = (DiagnosticsStore(filename=diagnostics_store_filename(output_dir=nt_output_dir, siteid=siteid, part_type=NT_STR)) if diagnostics_store else None)
+
     # load meteo proc results
-    meteo_proc_f = os.path.join(meteo_proc_dir, '{s}_meteo_hh.csv'.format(s=siteid))
-    if not os.path.isfile(meteo_proc_f):
-            msg = "Meteo proc file not found '{f}'".format(f=meteo_proc_f)
-            _log.critical(msg)
-            raise ONEFluxError(msg)
-    _log.info("Will now load meteo file '{f}'".format(f=meteo_proc_f))
-    whole_dataset_meteo, headers_meteo, timestamp_list_meteo, year_list_meteo = load_output(meteo_proc_f)
+    input_store.meteo()
+
+    # digests of inputs of site-years, (ustar_type, year) of site-years with existing outputs kept
+    digests = YearDigests(filename=year_digests_filename(output_dir=nt_output_dir, siteid=siteid, part_type=NT_STR),
+                          settings={'warm_start': warm_start, 'diagnostics': diagnostics, 'diagnostics_store': diagnostics_store})
+    kept = set()
+
+    # list of (ustar_type, year, first_year, percentile, latitude, output_filename, temp_output_filename, diagnostics) jobs
+    jobs = []
 
     # iterate through UStar threshold types
     for ustar_type in prod_to_compare:
         _log.info("Started processing UStar threshold type '{u}'".format(u=ustar_type))
 
         # load nee proc results (percentiles file)
-        nee_proc_percentiles_f = os.path.join(nee_proc_dir, '{s}_NEE_percentiles_{u}_hh.csv'.format(s=siteid, u=ustar_type))
-        if not os.path.isfile(nee_proc_percentiles_f):
-            msg = "NEE proc file not found '{f}', trying '{n}'".format(f=nee_proc_percentiles_f, n='{f}')
-            nee_proc_percentiles_f = os.path.join(nee_proc_dir, '{s}_NEE_percentiles_{u}.csv'.format(s=siteid, u=ustar_type))
-            msg = msg.format(f=nee_proc_percentiles_f)
-            _log.info(msg)
-
-            if not os.path.isfile(nee_proc_percentiles_f):
-                if ustar_type == 'y':
-                    msg = "NEE proc file not found '{f}'".format(f=nee_proc_percentiles_f)
-                    _log.critical(msg)
-                    continue
-                    #raise ONEFluxError(msg) # TODO: add exception raising when both y and c missing
-                elif ustar_type == 'c':
-                    msg = "NEE proc file not found '{f}', skipping (CUT not computed?)".format(f=nee_proc_percentiles_f)
-                    _log.warning(msg)
-                    continue
-                else:
-                    msg = "Invalid USTAR type '{u}'".format(u=ustar_type)
-                    raise ONEFluxError(msg)
-        _log.info("Will now load nee percentiles file '{f}'".format(f=nee_proc_percentiles_f))
-        whole_dataset_nee, headers_nee, timestamp_list_nee, year_list_nee = load_output(nee_proc_percentiles_f)
+        whole_dataset_nee, year_list_nee = input_store.nee(ustar_type=ustar_type)
+        if whole_dataset_nee is None:
+            continue
 
         # iterate through each year
         for iteration, year in enumerate(year_list_nee):
             if year not in years_to_compare:
                 continue
-            _log.info("Started processing year '{y}'".format(y=year))
             qc_auto_nee_f = os.path.join(qc_auto_dir, '{s}_qca_nee_{y}.csv'.format(s=siteid, y=year))
             if not os.path.isfile(qc_auto_nee_f):
                 msg = "QC auto file not found '{f}'".format(f=qc_auto_nee_f)
                 _log.error(msg)
                 continue
             latitude = get_latitude(filename=qc_auto_nee_f)
+            changed = digests.changed(ustar_type=ustar_type, year=year, digest=input_store.year_digest(ustar_type=ustar_type, year=year, first_year=(iteration == 0)))
+            if incremental and changed:
+                _log.info("Inputs for UStar threshold type '{u}' and year {y} changed, outputs will be re-created".format(u=ustar_type, y=year))
 
             # iterate through UStar threshold values
             for percentile in percentiles_data_columns:
-                _log.info("Started processing percentile '{p}'".format(p=percentile))
                 percentile_print = percentile.replace(HEADER_SEPARATOR, '.')
                 output_filename = os.path.join(nt_output_dir, "nee_{t}_{p}_{s}_{y}{extra}.csv".format(t=ustar_type, p=percentile_print, s=siteid, y=year, extra=EXTRA_FILENAME))
                 temp_output_filename = os.path.join(nt_output_dir, "nee_{t}_{p}_{s}_{y}{extra}.csv".format(t=ustar_type, p=percentile_print, s=siteid, y=year, extra='{extra}'))
+                if incremental and changed and os.path.isfile(output_filename):
+                    _log.debug("Outdated output file removed: '{f}'".format(f=output_filename))
+                    os.remove(output_filename)
                 if os.path.isfile(output_filename):
+                    kept.add((ustar_type, year))
                     _log.info("Output file found, skipping: '{f}'".format(f=output_filename))
                     continue
                 else:
                     _log.debug("Output file missing, will be processed: '{f}'".format(f=output_filename))
+                jobs.append((ustar_type, year, (iteration == 0), percentile, latitude, output_filename, temp_output_filename, diagnostics))
+
+    # outputs of years no longer to be compared (e.g., first/last years of site changed)
+    if incremental:
+        remove_other_years(output_dir=nt_output_dir, siteid=siteid, years=years_to_compare, store=store)
+
+    # sequences of jobs run in order (same worker), percentiles of a (ustar_type, year) in increasing order if warm start
+    if warm_start:
+        chains = []
+        for job in jobs:
+            if chains and (chains[-1][0][:2] == job[:2]):
+                chains[-1].append(job)
+            else:
+                chains.append([job])
+        chains = [sorted(c, key=lambda j: float(j[3].replace(HEADER_SEPARATOR, '.'))) for c in chains]
+    else:
+        chains = [[job] for job in jobs]
 
-                # create masks for current year for both nee and meteo
-                year_mask_nee = (whole_dataset_nee['year'] == year)
-                year_mask_meteo = (whole_dataset_meteo['year'] == year)
+    _log.info("NT partitioning of {s}: {n} jobs ({c} sequences, {m} start) to be processed with {w} worker(s)".format(s=siteid, n=len(jobs), c=len(chains), m=('warm' if warm_start else 'cold'), w=workers))
+
+    # each job receives only the year rows and columns it uses (see project_year_inputs),
+    # created when job is submitted; datasets for an UStar threshold type are released
+    # once inputs for all its jobs are created (types without jobs released before any submission)
+    remaining = collections.Counter(c[0][0] for c in chains)
+    for ustar_type in prod_to_compare:
+        if remaining[ustar_type] == 0:
+            input_store.release(consumer=NT_STR, ustar_type=ustar_type)
+    def chain_inputs(chain):
+        inputs = [input_store.year_inputs(ustar_type=j[0], year=j[1], first_year=j[2], percentile=j[3]) for j in chain]
+        remaining[chain[0][0]] -= 1
+        if remaining[chain[0][0]] == 0:
+            input_store.release(consumer=NT_STR, ustar_type=chain[0][0])
+        return inputs
+
+    evaluations = []
+    def handle(result):
+        chain_evaluations, diagnostics_output = result
+        evaluations.append(chain_evaluations)
+        if store is not None:
+            store.append(arrays=diagnostics_output)
+
+    # diagnostics outputs of finished jobs written to store even if other jobs fail
+    try:
+        if (workers == 1) or (len(chains) <= 1):
+            for chain in chains:
+                handle(partition_nt_chain(chain, chain_inputs(chain), warm_start, diagnostics_store))
+        else:
+            # chains handled as they finish; after a failure, no further chains are submitted and running
+            # chains are waited for (not terminated) and handled, so all saved outputs have diagnostics in store
+            running, errors = [], []
+            def collect(wait=False):
+                for chain, result in [r for r in running if (wait or r[1].ready())]:
+                    running.remove((chain, result))
+                    try:
+                        handle(result.get())
+                    except Exception as e:
+                        _log.error("NT partitioning of {s} failed for UStar threshold type '{u}', year '{y}': {e}".format(s=siteid, u=chain[0][0], y=chain[0][1], e=e))
+                        errors.append(e)
+
+            pool = multiprocessing.Pool(processes=min(workers, len(chains)))
+            try:
+                try:
+                    for chain in chains:
+                        # bound number of submitted jobs (and their inputs) not yet finished
+                        collect()
+                        while (len(running) >= workers * QUEUED_JOBS_PER_WORKER) and not errors:
+                            running[0][1].wait(POLL_INTERVAL)
+                            collect()
+                        if errors:
+                            break
+                        running.append((chain, pool.apply_async(partition_nt_chain, (chain, chain_inputs(chain), warm_start, diagnostics_store))))
+                except Exception as e:
+                    _log.error("NT partitioning of {s} failed submitting jobs: {e}".format(s=siteid, e=e))
+                    errors.append(e)
+                pool.close()
+                collect(wait=True)
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+            if errors:
+                raise errors[0]
+    finally:
+        if store is not None:
+            store.flush()
+
+    _log.info("NT partitioning of {s}: {e} optimization function evaluations ({m} start)".format(s=siteid, e=sum(evaluations), m=('warm' if warm_start else 'cold')))
+    if store is not None:
+        _log.info("NT partitioning of {s}: diagnostics outputs saved to '{f}'".format(s=siteid, f=store.filename))
+    digests.save(kept=kept, years=(years_to_compare if incremental else None))
+
+    # datasets no longer needed by this partitioning method
+    input_store.close(consumer=NT_STR)
 
-                # account for first entry being from previous year
-                if iteration == 0:
-                    _log.debug("First site-year available ({y}), removing first midnight entry from meteo only".format(y=year))
-                    first_meteo = numpy.where(year_mask_meteo == 1)[0][0]
-                    first_nee = None
-                    year_mask_meteo[first_meteo] = 0
-                else:
-                    _log.debug("Regular site-year ({y}), removing first midnight entry from meteo and nee".format(y=year))
-                    first_meteo = numpy.where(year_mask_meteo == 1)[0][0]
-                    first_nee = numpy.where(year_mask_nee == 1)[0][0]
-                    year_mask_meteo[first_meteo] = 0
-                    year_mask_nee[first_nee] = 0
-
-                # account for last entry being from next year
-                _log.debug("Site-year ({y}), adding first midnight entry from next year for meteo and nee".format(y=year))
-                last_meteo = numpy.where(year_mask_meteo == 1)[0][-1] + 1
-                last_nee = numpy.where(year_mask_nee == 1)[0][-1] + 1
-                year_mask_meteo[last_meteo] = 1
-                year_mask_nee[last_nee] = 1
-
-                _log.debug("Site-year {y}: first NEE '{tn}' and first meteo '{tm}'".format(y=year, tn=whole_dataset_nee[year_mask_nee][0]['timestamp_end'], tm=whole_dataset_meteo[year_mask_meteo][0]['timestamp_end']))
-                _log.debug("Site-year {y}:  last NEE '{tn}' and  last meteo '{tm}'".format(y=year, tn=whole_dataset_nee[year_mask_nee][-1]['timestamp_end'], tm=whole_dataset_meteo[year_mask_meteo][-1]['timestamp_end']))
-
-                if numpy.sum(year_mask_nee) != numpy.sum(year_mask_meteo):
-                    msg = "Incompatible array sizes (nee={n}, meteo={m}) for year '{y}' while processing '{f}'".format(y=year, f=output_filename, n=numpy.sum(year_mask_nee), m=numpy.sum(year_mask_meteo))
-                    _log.error(msg)
-                    raise ONEFluxError(msg)
-
-                working_year_data = create_data_structures(ustar_type=ustar_type, whole_dataset_nee=whole_dataset_nee, whole_dataset_meteo=whole_dataset_meteo,
-                                                           percentile=percentile, year_mask_nee=year_mask_nee, year_mask_meteo=year_mask_meteo, latitude=latitude, part_type=NT_STR)
-
-                # corresponds to partitnioning_nt.pro, line:  compu, set, "QCNEE=0"   # NOTE: removes all information of missing data records!
-                compu(data=working_year_data, func=compu_qcnee_filter, columns=['qcnee']) # equivalent to: working_year_data['qcnee'][:] = 0
-
-                # get latitude from data structure
-                lat = var(working_year_data, 'lat')
-
-                # call flux_partition
-                result_year_data = flux_partition(data=working_year_data, lat=lat[0], tempvar='tair', temp_output_filename=temp_output_filename)
-
-                # save output data file
-                _log.debug("Saving output file '{f}".format(f=output_filename))
-                numpy.savetxt(fname=output_filename, X=result_year_data, delimiter=',', fmt='%s', header=','.join(result_year_data.dtype.names), comments='')
-                _log.debug("Saved output file '{f}".format(f=output_filename))
-
-                _log.info("Finished processing percentile '{p}'".format(p=percentile))
-#                sys.exit('EXIT') # TODO: testing only, remove
-            _log.info("Finished processing year '{y}'".format(y=year))
-        _log.info("Finished processing UStar threshold type '{u}'".format(u=ustar_type))
     _log.info("Finished NT partitioning of {s}".format(s=siteid))
 
 
+def partition_nt_chain(chain, inputs, warm_start=False, diagnostics_store=False):
+    """
+    Runs sequence of NT partitioning jobs in order, optionally passing
+    optimization results of each job as starting guesses to the next one;
+    returns number of optimization function evaluations and diagnostics outputs.
+    Warm start does not reproduce cold start results (trimmed objective has
+    several equally converged minima), so it is opt-in (see partitioning_nt)
+    and should be checked for a site first (see oneflux.tools.partition_nt.validate_warm_start)
+
+    :param chain: list of job tuples (see _partition_nt_job)
+    :type chain: list
+    :param inputs: list of (year_nee, year_meteo) tuples, one for each job (see _partition_nt_job)
+    :type inputs: list
+    :param warm_start: if True, optimizations started from results of previous job
+    :type warm_start: bool
+    :param diagnostics_store: if True, diagnostics outputs are returned (to be added to store) instead of saved as text files
+    :type diagnostics_store: bool
+    :rtype: tuple (int, collections.OrderedDict or None)
+    """
+    seeds = ({} if warm_start else None)
+    diagnostics_output = (collections.OrderedDict() if diagnostics_store else None)
+    evaluations = 0
+    for job, (year_nee, year_meteo) in zip(chain, inputs):
+        evaluations += _partition_nt_job(job, year_nee, year_meteo, warm_start=seeds, diagnostics_output=diagnostics_output)
+    return evaluations, diagnostics_output
+
+
+def _partition_nt_job(job, year_nee, year_meteo, warm_start=None, diagnostics_output=None):
+    """
+    Runs NT partitioning for a single (ustar_type, year, percentile) job
+    and saves output file; returns number of optimization function evaluations
+
+    :param job: tuple with (ustar_type, year, first_year, percentile, latitude, output_filename, temp_output_filename, diagnostics)
+    :type job: tuple
+    :param year_nee: NEE data for year, only columns used for percentile (see project_year_inputs)
+    :type year_nee: numpy.ndarray
+    :param year_meteo: meteo data for year, only columns used (see project_year_inputs)
+    :type year_meteo: numpy.ndarray
+    :param warm_start: starting guesses for optimizations, updated in place (see flux_partition)
+    :type warm_start: dict
+    :param diagnostics_output: if not None, diagnostics outputs are added to it instead of saved (see flux_partition)
+    :type diagnostics_output: dict
+    :rtype: int
+    """
+    ustar_type, year, first_year, percentile, latitude, output_filename, temp_output_filename, diagnostics = job
+
+    _log.info("Started processing UStar threshold type '{u}', year '{y}', percentile '{p}'".format(u=ustar_type, y=year, p=percentile))
+
+    if year_nee.size != year_meteo.size:
+        msg = "Incompatible array sizes (nee={n}, meteo={m}) for year '{y}' while processing '{f}'".format(y=year, f=output_filename, n=year_nee.size, m=year_meteo.size)
+        _log.error(msg)
+        raise ONEFluxError(msg)
+
+    working_year_data = create_data_structures(ustar_type=ustar_type, whole_dataset_nee=year_nee, whole_dataset_meteo=year_meteo,
+                                               percentile=percentile, year_slice_nee=slice(None), year_slice_meteo=slice(None), latitude=latitude, part_type=NT_STR)
+
+    # corresponds to partitnioning_nt.pro, line:  compu, set, "QCNEE=0"   # NOTE: removes all information of missing data records!
+    compu(data=working_year_data, func=compu_qcnee_filter, columns=['qcnee']) # equivalent to: working_year_data['qcnee'][:] = 0
+
+    # get latitude from data structure
+    lat = var(working_year_data, 'lat')
+
+    # call flux_partition
+    evaluations = []
+    result_year_data = flux_partition(data=working_year_data, lat=lat[0], tempvar='tair', temp_output_filename=temp_output_filename,
+                                      warm_start=warm_start, evaluations=evaluations, diagnostics=diagnostics, diagnostics_output=diagnostics_output)
+
+    # save output data file
+    _log.debug("Saving output file '{f}".format(f=output_filename))
+    save_output(filename=output_filename, data=result_year_data, delimiter=',')
+    _log.debug("Saved output file '{f}".format(f=output_filename))
+
+    _log.info("Finished processing UStar threshold type '{u}', year '{y}', percentile '{p}' ({n} optimizations, {e} function evaluations)".format(u=ustar_type, y=year, p=percentile, n=len(evaluations), e=sum(evaluations)))
+    return sum(evaluations)
+
+
+def save_diagnostics(filename, columns, names, diagnostics_output=None):
+    """
+    Saves diagnostics columns as comma separated rows (no header) to text file or,
+    if diagnostics_output is not None, adds them to diagnostics_output as a structured
+    array with fields names, using key based on filename (see diagnostics_key)
+
+    :param filename: name of diagnostics text file
+    :type filename: str
+    :param columns: sequences of values, one for each column
+    :type columns: list
+    :param names: names of columns
+    :type names: list
+    :param diagnostics_output: diagnostics arrays by key (see DiagnosticsStore)
+    :type diagnostics_output: dict
+    """
+    if diagnostics_output is None:
+        with open(filename, 'w') as g:
+            g.writelines([','.join([str(j) for j in i]) + '\n' for i in zip(*columns)])
+    else:
+        columns = [numpy.asarray(c) for c in columns]
+        array = numpy.zeros(len(columns[0]), dtype=[(n, c.dtype) for n, c in zip(names, columns)])
+        for n, c in zip(names, columns):
+            array[n] = c
+        diagnostics_output[diagnostics_key(filename=filename)] = array
+    _log.debug("Saved diagnostics output '{f}'".format(f=diagnostics_key(filename=filename)))
+
+
+def window_offsets(juldays, window_starts, window_size):
+    """
+    Computes start/stop offsets of windows from (sorted) days-of-year array,
+    so entries for window starting at day window_starts[i] are in
+    juldays[starts[i]:stops[i]], i.e., (juldays >= day) & (juldays < day + window_size)
+
+    :param juldays: sorted (non-decreasing) array of days-of-year
+    :type juldays: numpy.ndarray
+    :param window_starts: first day-of-year for each window
+    :type window_starts: list (of int)
+    :param window_size: number of days to include in window
+    :type window_size: int
+    :rtype: 2-tuple of numpy.ndarray (starts, stops)
+    """
+    if numpy.any(numpy.diff(juldays) < 0):
+        msg = "Days-of-year (julday) not sorted, cannot compute window offsets"
+        _log.critical(msg)
+        raise ONEFluxPartitionError(msg)
+    window_starts = numpy.asarray(window_starts)
+    starts = numpy.searchsorted(juldays, window_starts, side='left')
+    stops = numpy.searchsorted(juldays, window_starts + window_size, side='left')
+    return starts, stops
+
 
 STEP_SIZE = 5         # number of days to slide window by
 WINDOW_SIZE = 14      # number of days to include in window
 MIN_ENTRIES = 6       # minimum number of entries needed for optimization step
 MIN_TRANGE = 5.0      # minimum temperature range (degC) needed for optimization step
 DAY_MIN_SW_IN = 10.0  # minimum shortwave radiation (W m-2) to be considered daytime
-def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=''):
+def nt_windows(data, tempvar='tair'):
+    """
+    Determines windows (WINDOW_SIZE days, every STEP_SIZE days) for
+    windowed/short term parameter optimization
+
+    :param data: data structure for partitioning (with neenight computed)
+    :type data: numpy.ndarray
+    :param tempvar: temperature variable to be used (e.g., tair or tsoil)
+    :type tempvar: str
+    :rtype: 7-tuple (window_steps, valid_idx, w_starts, w_stops, valid_fcn, valid_tair, fit_windows),
+            windows as offsets into usable (non-NA) entries valid_idx/valid_fcn/valid_tair,
+            and fit_windows the list of windows with enough entries and temperature range for optimization
+    """
+    juldays = data['julday']                                   ### array of days-of-year
+    tair = data[tempvar]                                       ### array of temperatures
+    fcn = data['neenight']                                     ### array of nighttime NEE
+    julmin, julmax = int(juldays[0]), int(numpy.max(juldays))  ### first/last day of year
+
+    window_steps = range(julmin, julmax + 1, STEP_SIZE)
+
+    # indices of usable entries (non-NA NEE and temperature), and start/stop offsets (into usable entries) for each window
+    valid_idx = numpy.where(not_nan(fcn) & not_nan(tair))[0]
+    w_starts, w_stops = window_offsets(juldays=juldays[valid_idx], window_starts=window_steps, window_size=WINDOW_SIZE)
+    valid_fcn, valid_tair = fcn[valid_idx], tair[valid_idx]
+
+    fit_windows = []
+    for w_idx, (w_start, w_stop) in enumerate(zip(w_starts, w_stops)):
+        if (w_stop - w_start) > MIN_ENTRIES:
+            w_tair = valid_tair[w_start:w_stop]
+            if (numpy.max(w_tair) - numpy.min(w_tair)) >= MIN_TRANGE:
+                fit_windows.append(w_idx)
+
+    return window_steps, valid_idx, w_starts, w_stops, valid_fcn, valid_tair, fit_windows
+
+
+XGUESS = [2.0, 200.0] # default (cold start) initial guesses for (rref, e0) optimizations
+def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename='', warm_start=None, evaluations=None, diagnostics=DIAGNOSTICS_FULL, diagnostics_output=None):
     """
     Main flux partitioning function (for a single dataset)
     
@@ -201,6 +440,16 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
     :type tempvar: str
     :param nomsg: hide messages flag (not used in this implementation) 
     :type nomsg: boolean
+    :param warm_start: if not None, (rref, e0) starting guesses, for full year (key None) and windows (key jday),
+                       from the neighboring percentile; updated in place with successful optimizations of this run
+    :type warm_start: dict
+    :param evaluations: if not None, number of function evaluations of each optimization is appended to this list
+    :type evaluations: list
+    :param diagnostics: level of statistics computed for window optimizations (none, summary, full)
+    :type diagnostics: str
+    :param diagnostics_output: if not None, diagnostics outputs (e.g., __nlr_status_PY) are added to it
+                               as structured arrays instead of saved as text files (see save_diagnostics)
+    :type diagnostics_output: dict
     """
     _log.debug('Started NT flux partition main function')
 
@@ -228,7 +477,10 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
     ### FIRST OPTIMIZATION FOR FULL YEAR ##########################################################
     # estimate parameters using optimization on full year of data
     _log.debug('Starting full year/long term paramater optimization')
-    _, rref, e0, _, _, _, _, _, _, _, _, _ = nlinlts1(data=data)
+    xguess = (XGUESS if warm_start is None else warm_start.get(None, XGUESS))
+    status, rref, e0, _, _, _, _, _, _, _, _, _ = nlinlts1(data=data, xguess=xguess, evaluations=evaluations, diagnostics=DIAGNOSTICS_NONE)
+    if (warm_start is not None) and (status == 0):
+        warm_start[None] = [rref, e0]
     add_empty_vars(data=data, records=rref, column='rref_1_from_tair', unit='umolm-2s-1')
     bounded_e0 = (0.0 if e0 < 0.0 else (450.0 if e0 > 450.0 else e0))
     add_empty_vars(data=data, records=bounded_e0, column='e0_1_from_tair', unit='umolm-2s-1')
@@ -241,13 +493,10 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
     ###############################################################################################
     #### SECOND OPTIMIZATION FOR 5 DAY STEPS, 14 DAY WINDOWS ######################################
     _log.debug('Starting windowed/short term paramater optimization')
-    juldays = data['julday']                                   ### array of days-of-year
-    tair = data[tempvar]                                       ### array of temperatures
-    fcn = data['neenight']                                     ### array of nighttime NEE
-    julmin, julmax = int(juldays[0]), int(numpy.max(juldays))  ### first/last day of year
     n_regr = 0                                                 ### counter of number of regressions/optimizations
 
-    window_steps = range(julmin, julmax + 1, STEP_SIZE)
+    # windows and indices of usable entries (non-NA NEE and temperature) with start/stop offsets (into usable entries) for each window
+    window_steps, valid_idx, w_starts, w_stops, valid_fcn, valid_tair, fit_windows = nt_windows(data=data, tempvar=tempvar)
 
     # TODO: (potential) add e0_1_list, e0_2_list, e0_3_list, and corresponding se and idx to track individual
 
@@ -257,21 +506,21 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
     # lists of entry indices for each step/window with successful execution
     indices_half_list, indices_first_list, indices_last_list, indices_len_list = [], [], [], []
 
-    for jday in window_steps:
+    for w_idx, (jday, w_start, w_stop) in enumerate(zip(window_steps, w_starts, w_stops)):
 #        print                                  # TODO: remove
 #        print '--- jday start: ', jday, ' ---' # TODO: remove
         jday_all_list.append(jday)
         pvalue, nee_std, ta_std, ls_status, ls_msg = 'nan', 'nan', 'nan', -10, '' # selected non-execution status flag and message
-        # window (days interval) and non-NA mask to be used in current step
-        w_mask = (juldays >= jday) & (juldays < jday + WINDOW_SIZE) & not_nan(fcn) & not_nan(tair) #*****************************
-        w_where = numpy.where(w_mask)[0]
-        w_len = numpy.sum(w_mask)
+        # window (days interval) of non-NA entries to be used in current step
+        w_where = valid_idx[w_start:w_stop]
+        w_len = w_stop - w_start
 
         if w_len > MIN_ENTRIES:
-            subdata = data[w_mask]
-            temp_range = numpy.max(tair[w_mask]) - numpy.min(tair[w_mask])
-            if temp_range >= MIN_TRANGE:
-                status, rref, e0, rref_se, e0_se, residuals, covariance_matrix, ls_status, ls_msg, pvalue, nee_std, ta_std = nlinlts1(data=subdata)
+            if w_idx in fit_windows:
+                xguess = (XGUESS if warm_start is None else warm_start.get(jday, XGUESS))
+                status, rref, e0, rref_se, e0_se, residuals, covariance_matrix, ls_status, ls_msg, pvalue, nee_std, ta_std = nlinlts1_arrays(dep=valid_fcn[w_start:w_stop], indep=valid_tair[w_start:w_stop], xguess=xguess, evaluations=evaluations, diagnostics=diagnostics)
+                if (warm_start is not None) and (status == 0):
+                    warm_start[jday] = [rref, e0]
 
 #                if jday == 301: sys.exit('DEBUG FINISH') # TODO: remove
 
@@ -283,7 +532,7 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
                     est_e0_se_list.append(e0_se)
                     est_residuals_list.append(residuals)
                     est_covariance_matrices_list.append(covariance_matrix)
-                    indices_half_list.append(w_where[w_len / 2])
+                    indices_half_list.append(w_where[w_len // 2])
                     indices_first_list.append(w_where[0])
                     indices_last_list.append(w_where[-1])
                     indices_len_list.append(w_len)
@@ -304,20 +553,19 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
                                                ('indices_half', 'i8'), ('indices_first', 'i8'), ('indices_last', 'i8'), ('indices_len', 'i8'), ])
 
     # write pvalues, std devs for nee and ta, and optimization status (all jday windows)
-    ls_status_output = [','.join([str(j) for j in i]) + '\n' for i in zip(jday_all_list, pvalue_list, nee_std_list, ta_std_list, ls_status_list, ls_msg_list)]
-    with open(temp_output_filename.format(extra='__nlr_status_PY'), 'w') as g:
-        g.writelines(ls_status_output)
-    _log.debug("Wrote NLR status per window output: {f}".format(f=ls_status_output))
+    if diagnostics_output is None:
+        ls_status_columns = [jday_all_list, pvalue_list, nee_std_list, ta_std_list, ls_status_list, ls_msg_list]
+    else:
+        # statistics not computed are 'nan' strings
+        ls_status_columns = [jday_all_list, numpy.array(pvalue_list, dtype=DOUBLE_PREC), numpy.array(nee_std_list, dtype=FLOAT_PREC), numpy.array(ta_std_list, dtype=FLOAT_PREC), ls_status_list, ls_msg_list]
+    save_diagnostics(filename=temp_output_filename.format(extra='__nlr_status_PY'), columns=ls_status_columns,
+                     names=['jday', 'pvalue', 'nee_std', 'ta_std', 'ls_status', 'ls_msg'], diagnostics_output=diagnostics_output)
 
     # write e0 estimates (only computed windows)
-    stats_e0_output = [','.join([str(j) for j in i]) + '\n' for i in zip(jday_list, est_e0_list)]
-    with open(temp_output_filename.format(extra='__e0_all_val_PY'), 'w') as g:
-        g.writelines(stats_e0_output)
+    save_diagnostics(filename=temp_output_filename.format(extra='__e0_all_val_PY'), columns=[jday_list, est_e0_list], names=['jday', 'e0_all_val'], diagnostics_output=diagnostics_output)
 
     # write e0_se estimates (only computed windows)
-    stats_e0_se_output = [','.join([str(j) for j in i]) + '\n' for i in zip(jday_list, est_e0_se_list)]
-    with open(temp_output_filename.format(extra='__e0_all_se_PY'), 'w') as g:
-        g.writelines(stats_e0_se_output)
+    save_diagnostics(filename=temp_output_filename.format(extra='__e0_all_se_PY'), columns=[jday_list, est_e0_se_list], names=['jday', 'e0_all_se'], diagnostics_output=diagnostics_output)
 
 
 #    # plots of comparisons to pv_wave
@@ -372,17 +620,15 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
 
         # write e0_selected estimates, SE, and IDX
         jday_list_selected = list(stats['jday'][e0_selected_idx])
-        e0_selected_val_output = [','.join([str(j) for j in i]) + '\n' for i in zip(jday_list_selected, stats[e0_selected_idx]['e0'])]
-        with open(temp_output_filename.format(extra='__e0_selected_val_PY'), 'w') as g:
-            g.writelines(e0_selected_val_output)
+        save_diagnostics(filename=temp_output_filename.format(extra='__e0_selected_val_PY'), columns=[jday_list_selected, stats[e0_selected_idx]['e0']],
+                         names=['jday', 'e0_selected_val'], diagnostics_output=diagnostics_output)
 
-        e0_selected_se_output = [','.join([str(j) for j in i]) + '\n' for i in zip(jday_list_selected, stats[e0_selected_idx]['e0_se'])]
-        with open(temp_output_filename.format(extra='__e0_selected_se_PY'), 'w') as g:
-            g.writelines(e0_selected_se_output)
+        save_diagnostics(filename=temp_output_filename.format(extra='__e0_selected_se_PY'), columns=[jday_list_selected, stats[e0_selected_idx]['e0_se']],
+                         names=['jday', 'e0_selected_se'], diagnostics_output=diagnostics_output)
 
-        e0_selected_idx_output = [','.join([str(j) for j in i]) + '\n' for i in zip(jday_list_selected, e0_selected_idx)] # not full array idx, just window idx
-        with open(temp_output_filename.format(extra='__e0_selected_idx_PY'), 'w') as g:
-            g.writelines(e0_selected_idx_output)
+        # not full array idx, just window idx
+        save_diagnostics(filename=temp_output_filename.format(extra='__e0_selected_idx_PY'), columns=[jday_list_selected, e0_selected_idx],
+                         names=['jday', 'e0_selected_idx'], diagnostics_output=diagnostics_output)
 
 
         best_rref = numpy.mean(stats[e0_selected_idx]['rref'])
@@ -494,7 +740,9 @@ def flux_partition(data, lat, tempvar='tair', nomsg=False, temp_output_filename=
 def reanalyse_rref(data, e0, tempvar='tair', step=4, moving_window=8):
     """
     Estimates reference respiration (rref) values based on fixed
-    temperature sensitivity value (e0)  
+    temperature sensitivity value (e0), with two single-parameter
+    least_squares fits (ordinary and trimmed) for each moving window;
+    windows located with index ranges on entries with valid data
 
     :param data: data structure for partitioning
     :type data: numpy.ndarray
@@ -519,38 +767,37 @@ def reanalyse_rref(data, e0, tempvar='tair', step=4, moving_window=8):
     data['rrefopttrim'] = NAN
     data['rrefopttrim_se'] = NAN
 
-    # compute and iterate over integer day-of-year
+    # compute integer day-of-year, restricted to entries with valid temperature and nighttime NEE
     julday_int = (julday + 0.5).astype('i8')
-    for j in range(1, int(julday[-1]), step):
-        mask = (julday_int >= j) & (julday_int < (j + moving_window)) & (data[tempvar] > -1000.) & (data['neenight'] > -1000.)
-        idx = numpy.where(mask)[0]
-        count = numpy.sum(mask)
-
-        if count > 2:
-            mask2 = (julday_int >= j) & (julday_int < (j + moving_window))
-            idx2 = numpy.where(mask2)[0]
-            count2 = numpy.sum(mask2)
-            #mid = idx2[count2 / 2] # unused step (?)
-            mid = int(numpy.average(idx))
-            e0_average = numpy.average(e0_array[mask])
-            tair_average = numpy.average(data[tempvar][mask])
-            reco_average = numpy.average(data['neenight'][mask])
-            lloyd_fac = lloyd_taylor(ta=data[tempvar][mask], rref=1.0, e0=e0_average)
-
-            parameters, std_devs, ls_status, ls_msg, residuals, covariance_matrix = least_squares(func=lambda b: ((b * lloyd_fac - data['neenight'][mask]) ** 2).sum(),
-                                                                                                  initial_guess=(0.1,),
-                                                                                                  entries=len(data['neenight'][mask]),
-                                                                                                  iterations=1000 * (len(data['neenight'][mask]) + 1),
-                                                                                                  return_residuals_cov_mat=True)
+    valid_idx = numpy.where((data[tempvar] > -1000.) & (data['neenight'] > -1000.))[0]
+    valid_julday_int = julday_int[valid_idx]
+    valid_temp = data[tempvar][valid_idx]
+    valid_nee = data['neenight'][valid_idx]
+    valid_e0 = e0_array[valid_idx]
+
+    # windows [j, j + moving_window) located with index ranges on valid entries (integer day-of-year sorted)
+    window_starts = numpy.arange(1, int(julday[-1]), step)
+    firsts = numpy.searchsorted(valid_julday_int, window_starts, side='left')
+    lasts = numpy.searchsorted(valid_julday_int, window_starts + moving_window, side='left')
+    for first, last in zip(firsts, lasts):
+        if (last - first) > 2:
+            mid = int(numpy.average(valid_idx[first:last]))
+            e0_average = numpy.average(valid_e0[first:last])
+            nee = valid_nee[first:last]
+            reco_average = numpy.average(nee)
+            lloyd_fac = lloyd_taylor(ta=valid_temp[first:last], rref=1.0, e0=e0_average)
+
+            parameters, std_devs = least_squares(func=lambda b: ((b * lloyd_fac - nee) ** 2).sum(),
+                                                 initial_guess=(0.1,),
+                                                 entries=len(nee),
+                                                 iterations=1000 * (len(nee) + 1))
 
             # oktrim = where(abs(NEENight(ok) - recoAvg) LT pct(abs(NEENight(ok) - recoAvg), 95.) )
-            mask_trim = numpy.absolute(data['neenight'][mask] - reco_average) < pct(array=numpy.absolute(data['neenight'][mask] - reco_average), percent=95.0)
-            idx_trim = numpy.where(mask_trim)[0]
-            parameters_trim, std_devs_trim, ls_status_trim, ls_msg_trim, residuals_trim, covariance_matrix_trim = least_squares(func=lambda b: ((b * lloyd_fac[mask_trim] - data['neenight'][mask][mask_trim]) ** 2).sum(),
-                                                                                                                                initial_guess=(0.1,),
-                                                                                                                                entries=len(data['neenight'][mask][mask_trim]),
-                                                                                                                                iterations=1000 * (len(data['neenight'][mask][mask_trim]) + 1),
-                                                                                                                                return_residuals_cov_mat=True)
+            mask_trim = numpy.absolute(nee - reco_average) < pct(array=numpy.absolute(nee - reco_average), percent=95.0)
+            parameters_trim, std_devs_trim = least_squares(func=lambda b: ((b * lloyd_fac[mask_trim] - nee[mask_trim]) ** 2).sum(),
+                                                           initial_guess=(0.1,),
+                                                           entries=len(nee[mask_trim]),
+                                                           iterations=1000 * (len(nee[mask_trim]) + 1))
 
             # assign calculated rref and rref se, non-trimmed and trimmed, to mid point timestamp
             # also replaces assign_empty_vars calls
@@ -608,11 +855,67 @@ def ipolmiss(data, variable):
     if (count > 1) and ((count < data.size) or (method == 'LSQ')):
         idx = numpy.where(mask)[0]
         julday = data['julday'] + (data['hr'] / 24.0)
-        duration = [i - julday[mask][0] for i in julday[mask]]
+        duration = julday[mask] - julday[mask][0]
 
         if count < 6:
             _log.error("ipolmiss ({v}) too few elements: {c}".format(v=variable, c=count))
 
+        # apply linear interpolation to full extent of dataset
+        duration_full = julday - julday[mask][0]
+        data[variable][:] = interpolate_linear(x=duration, y=data[variable][mask], x_new=duration_full)
+
+        # set beginning/end gaps into first/last valid value
+        data[variable][:idx[0]] = data[variable][idx[0]]
+        data[variable][idx[-1] + 1:] = data[variable][idx[-1]]
+
+
+def interpolate_linear(x, y, x_new):
+    """
+    Linear interpolation with same operations (and results) as
+    scipy.interpolate.interp1d(x, y, kind='linear', bounds_error=False, fill_value=numpy.NaN)(x_new),
+    without building interpolation object (numpy.interp computes in double precision
+    and returns node values exactly, so results differ for single precision data)
+
+    :param x: coordinates of values to be interpolated
+    :type x: numpy.ndarray
+    :param y: values to be interpolated
+    :type y: numpy.ndarray
+    :param x_new: coordinates for interpolated values
+    :type x_new: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    order = numpy.argsort(x)
+    x, y = x[order], y[order]
+
+    # segment for each new coordinate (first segment also used for values at first coordinate)
+    hi = numpy.searchsorted(x, x_new).clip(1, len(x) - 1)
+    lo = hi - 1
+    slope = (y[hi] - y[lo]) / (x[hi] - x[lo])
+    y_new = slope * (x_new - x[lo]) + y[lo]
+
+    # out of bounds
+    y_new[(x_new < x[0]) | (x_new > x[-1])] = numpy.NaN
+    return y_new
+
+
+def ipolmiss_interp1d(data, variable):
+    """
+    Reference implementation of ipolmiss using scipy.interpolate.interp1d,
+    used for benchmarking and testing (see ipolmiss)
+
+    :param data: data structure for partitioning
+    :type data: numpy.ndarray
+    :param variable: variable to be interpolated
+    :type variable: str
+    """
+    mask = not_nan(data[variable])
+    count = numpy.sum(mask)
+
+    if (count > 1) and (count < data.size):
+        idx = numpy.where(mask)[0]
+        julday = data['julday'] + (data['hr'] / 24.0)
+        duration = [i - julday[mask][0] for i in julday[mask]]
+
         # create interpolation function
         sp_interp_function = interp1d(duration, data[variable][mask], kind='linear', bounds_error=False, fill_value=numpy.NaN)
 
@@ -673,7 +976,7 @@ def ipolmiss_vector(array, order, exact=True):
 
 
 BR_PERC = 10.0
-def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=2, xguess=[2.0, 200.0], trim_perc=BR_PERC):
+def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=2, xguess=[2.0, 200.0], trim_perc=BR_PERC, evaluations=None, diagnostics=DIAGNOSTICS_FULL):
     """
     Main non-linear least-squares driver function
     
@@ -691,6 +994,35 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
     :type xguess: list
     :param trim_perc: precentage to trim from residual values
     :type trim_perc: float
+    :param evaluations: if not None, number of function evaluations of optimization is appended to this list
+    :type evaluations: list
+    :param diagnostics: level of statistics computed for optimization (none, summary, full)
+    :type diagnostics: str
+    """
+    return nlinlts1_arrays(dep=data[depvar], indep=data[indepvar], func=func, npara=npara, xguess=xguess, trim_perc=trim_perc, evaluations=evaluations, diagnostics=diagnostics)
+
+
+def nlinlts1_arrays(dep, indep, func=lloyd_taylor, npara=2, xguess=[2.0, 200.0], trim_perc=BR_PERC, evaluations=None, diagnostics=DIAGNOSTICS_FULL):
+    """
+    Main non-linear least-squares driver function, on 1-d arrays
+    for dependent and independent variables (see nlinlts1)
+
+    :param dep: dependent variable (computed by function), e.g., nighttime NEE
+    :type dep: numpy.ndarray
+    :param indep: independent variable (parameter to function), e.g., temperature
+    :type indep: numpy.ndarray
+    :param func: function to be optimized
+    :type func: function
+    :param npara: number of parameters to be optimized
+    :type npara: int
+    :param xguess: list with initial/starting guesses for variables to be optimized
+    :type xguess: list
+    :param trim_perc: precentage to trim from residual values
+    :type trim_perc: float
+    :param evaluations: if not None, number of function evaluations of optimization is appended to this list
+    :type evaluations: list
+    :param diagnostics: level of statistics computed for optimization (none, summary, full)
+    :type diagnostics: str
     """
     if len(xguess) != npara:
         msg = "Incompatible number of parameters '{n}' and length of initial guess '{i}'".format(n=npara, i=len(xguess))
@@ -698,18 +1030,16 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
         raise ONEFluxError(msg)
 
     status = 0 # status of execution; 0 optimization executed successfully, -1 problem with execution of optimization
-    first_ts, last_ts = get_first_last_ts(data=data)
-#    _log.debug("Starting optimization step for period '{ts1}' - '{ts2}'".format(ts1=first_ts.strftime('%Y-%m-%d %H:%M'), ts2=last_ts.strftime('%Y-%m-%d %H:%M')))
 
     # check number of entries for independent variable
-    nonnan_indep_mask = not_nan(data[indepvar])
+    nonnan_indep_mask = not_nan(indep)
     if numpy.sum(nonnan_indep_mask) < (npara * 3):
         _log.warning("Not enough data points (independent variable filtered) for optimization: {n}".format(n=numpy.sum(nonnan_indep_mask)))
         status = -1
         return status, -9999.0, -9999.0, -9999.0, -9999.0, None, None, None, None, None, None, None
 
     # check number of entries for dependent AND independent variable
-    nonnan_dep_mask = not_nan(data[depvar])
+    nonnan_dep_mask = not_nan(dep)
     nonnan_combined_mask = nonnan_indep_mask & nonnan_dep_mask
     if numpy.sum(nonnan_combined_mask) < (npara * 3):
         _log.warning("Not enough data points (dependent and independent variable filtered) for optimization: {n}".format(n=numpy.sum(nonnan_combined_mask)))
@@ -717,7 +1047,7 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
         return status, -9999.0, -9999.0, -9999.0, -9999.0, None, None, None, None, None, None, None
 
     # "clean" dependent variable so not to use NAs from independent variable
-    clean_dep = data[depvar].copy()
+    clean_dep = dep.copy()
     clean_dep[~nonnan_indep_mask] = NAN
 
 #    print
@@ -725,12 +1055,15 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
 #    print clean_dep
 #    print
 #    print 'TA:'
-#    print data[indepvar]
+#    print indep
 #    print
 #    # TODO: remove
 
+    # number of evaluations of inner function (including retries of least_squares)
+    n_evaluations = [0]
+
     # define inner function to be used for optimization
-    def trimmed_residuals(par, nee=clean_dep, temp=data[indepvar], trim_perc=trim_perc):
+    def trimmed_residuals(par, nee=clean_dep, temp=indep, trim_perc=trim_perc):
         """
         (inner) Function to be evaluated at each iteration,
         taking care of handling NAs and trimming residuals.
@@ -748,6 +1081,7 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
         :param trim_perc: percentiled to be trimmed off
         :type trim_perc: float
         """
+        n_evaluations[0] += 1
         rref, e0 = par
         prediction = lloyd_taylor(ta=temp, rref=rref, e0=e0)
         residuals = nee - prediction
@@ -773,12 +1107,46 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
                                                                                           entries=len(clean_dep),
                                                                                           iterations=1000 * (len(clean_dep) + 1),
                                                                                           return_residuals_cov_mat=True)
+    if evaluations is not None:
+        evaluations.append(n_evaluations[0])
+    return nlinlts1_results(clean_dep=clean_dep, indep=indep, parameters=parameters, std_devs=std_devs, ls_status=ls_status, ls_msg=ls_msg, residuals=residuals, covariance_matrix=covariance_matrix, status=status, diagnostics=diagnostics)
+
+
+def nlinlts1_results(clean_dep, indep, parameters, std_devs, ls_status, ls_msg, residuals, covariance_matrix, status=0, diagnostics=DIAGNOSTICS_FULL):
+    """
+    Assembles results for non-linear least-squares optimization (nlinlts1, nlinlts1_batch),
+    computing statistics for estimated parameters (NaN if not computed for diagnostics level)
+
+    :param clean_dep: dependent variable, NA where independent variable is NA
+    :type clean_dep: numpy.ndarray
+    :param indep: independent variable
+    :type indep: numpy.ndarray
+    :param parameters: estimated parameters (rref, e0)
+    :type parameters: list
+    :param std_devs: standard deviations of estimated parameters
+    :type std_devs: list
+    :param ls_status: optimization status code
+    :type ls_status: int
+    :param ls_msg: optimization status message
+    :type ls_msg: str
+    :param residuals: (trimmed) residuals for estimated parameters
+    :type residuals: numpy.ndarray
+    :param covariance_matrix: covariance matrix for estimated parameters
+    :type covariance_matrix: numpy.ndarray
+    :param status: status of execution
+    :type status: int
+    :param diagnostics: level of statistics computed (none: no statistics, summary: std devs of NEE and temperature, full: also p-value and padded residuals)
+    :type diagnostics: str
+    :rtype: 12-tuple (status, rref, e0, rref_se, e0_se, residuals, covariance_matrix, ls_status, ls_msg, pvalue, nee_std, ta_std)
+    """
     est_rref, est_e0 = parameters
     est_rref_std, est_e0_std = std_devs
 
-    tvalue, pvalue = ttest_ind(clean_dep, lloyd_taylor(ta=data[indepvar], rref=est_rref, e0=est_e0))
-    fvalue, f_pvalue = f_oneway(clean_dep, lloyd_taylor(ta=data[indepvar], rref=est_rref, e0=est_e0))
-    nee_std, ta_std = numpy.nanstd(clean_dep), numpy.nanstd(data[indepvar])
+    pvalue, nee_std, ta_std = numpy.nan, numpy.nan, numpy.nan
+    if diagnostics != DIAGNOSTICS_NONE:
+        nee_std, ta_std = numpy.nanstd(clean_dep), numpy.nanstd(indep)
+    if diagnostics == DIAGNOSTICS_FULL:
+        tvalue, pvalue = ttest_ind(clean_dep, lloyd_taylor(ta=indep, rref=est_rref, e0=est_e0))
 
 #    print "rref:", est_rref
 #    print "rref_se:", est_rref_std
@@ -798,7 +1166,7 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
 
     # add zeros to residuals, if lenght of residuals less than maximum number of entries for window
     # done to match original code, purpose unclear
-    if len(residuals) < 48 * WINDOW_SIZE:
+    if (diagnostics == DIAGNOSTICS_FULL) and (len(residuals) < 48 * WINDOW_SIZE):
         new_residuals = numpy.zeros(48 * WINDOW_SIZE, dtype=FLOAT_PREC)
         new_residuals[:len(residuals)] = residuals
     else:
@@ -809,44 +1177,220 @@ def nlinlts1(data, func=lloyd_taylor, depvar='neenight', indepvar='tair', npara=
 
 
 
-def pct(array, percent):
+BATCH_MAX_ITERATIONS = 1000  # maximum number of Levenberg-Marquardt iterations for batched optimization
+BATCH_FTOL = 1.49012e-08     # relative reduction in sum of squares for convergence (same as scipy leastsq default)
+BATCH_XTOL = 1.49012e-08     # relative change in parameters for convergence (same as scipy leastsq default)
+BATCH_LAMBDA_INIT = 1.0e-3   # initial damping factor for Levenberg-Marquardt iterations
+BATCH_LAMBDA_MAX = 1.0e16    # damping factor after which no further reduction in sum of squares is considered possible
+BATCH_LS_MESSAGES = {
+    1: "Both actual and predicted relative reductions in the sum of squares are at most {f:f}".format(f=BATCH_FTOL),
+    2: "The relative error between two consecutive iterates is at most {x:f}".format(x=BATCH_XTOL),
+    3: "Both actual and predicted relative reductions in the sum of squares are at most {f:f} and the relative error between two consecutive iterates is at most {x:f}".format(f=BATCH_FTOL, x=BATCH_XTOL),
+    5: "Number of iterations has reached maximum = {m}.".format(m=BATCH_MAX_ITERATIONS),
+    6: "No further reduction in the sum of squares is possible (damping factor reached maximum = {d:g}).".format(d=BATCH_LAMBDA_MAX),
+}
+def nlinlts1_batch(deps, indeps, xguess=[2.0, 200.0], trim_perc=BR_PERC, max_iterations=BATCH_MAX_ITERATIONS, diagnostics=DIAGNOSTICS_FULL):
     """
-    Calculates "percent" percentile of array -- not really a percentile,
-    but similar intention. Following implementation in original code.
-    
-    :param array: 1-d array to be used in calculation
-    :type array: numpy.ndarray
-    :param percent: target percent value for percentile
-    :type percent: float
+    Batched version of nlinlts1_arrays for the Lloyd-Taylor model: runs trimmed
+    Levenberg-Marquardt iterations for all windows at once, on padded arrays and
+    using the analytic Jacobian (ecogeo.lloyd_taylor_jacobian).
+    Returns list with one result per window, in the same format as nlinlts1_arrays;
+    optimization status codes follow scipy leastsq codes (1, 2, 3: converged, 5: maximum iterations,
+    6: no further reduction in sum of squares possible, not converged).
+    Without trimming, parameters and standard errors match nlinlts1_arrays (see NLINLTS1BatchTest);
+    with trimming (default), the objective function is not smooth and optimizations can stop at
+    different minima than nlinlts1_arrays, with parameters differing by large fractions, so not used
+    for partitioning outputs, only for comparisons (see oneflux.tools.partition_nt.validate_batch_windows)
+
+    :param deps: list of arrays with dependent variable for each window (e.g., nighttime NEE)
+    :type deps: list (of numpy.ndarray)
+    :param indeps: list of arrays with independent variable for each window (e.g., temperature)
+    :type indeps: list (of numpy.ndarray)
+    :param xguess: list with initial/starting guesses for variables to be optimized (rref, e0)
+    :type xguess: list
+    :param trim_perc: precentage to trim from residual values
+    :type trim_perc: float
+    :param max_iterations: maximum number of iterations
+    :type max_iterations: int
+    :param diagnostics: level of statistics computed for optimizations (none, summary, full)
+    :type diagnostics: str
     """
-
-    nonnan_mask = not_nan(array)
-    if numpy.sum(nonnan_mask) > 1:
-        nonnan_array = array[nonnan_mask]
-    else:
-        msg = "No non-NA value in percentile calculation"
+    npara = 2
+    if len(xguess) != npara:
+        msg = "Incompatible number of parameters '{n}' and length of initial guess '{i}'".format(n=npara, i=len(xguess))
         _log.critical(msg)
         raise ONEFluxError(msg)
 
-    # indices of ascending ranking of entries in array
-    rank_idx_array = rankdata(nonnan_array, method='ordinal')
-    critical_rank = len(nonnan_array) * percent / 100.
-    over_critical_rank_mask = (rank_idx_array > critical_rank)
-
-    # if no index over critical rank, return max values
-    if numpy.sum(over_critical_rank_mask) == 0.0:
-        return numpy.max(nonnan_array)
+    results = [None] * len(deps)
+
+    # windows without enough data points are handled by nlinlts1_arrays
+    fit_idx, clean_deps = [], []
+    for i, (dep, indep) in enumerate(zip(deps, indeps)):
+        nonnan_indep_mask = not_nan(indep)
+        if (numpy.sum(nonnan_indep_mask) < (npara * 3)) or (numpy.sum(nonnan_indep_mask & not_nan(dep)) < (npara * 3)):
+            results[i] = nlinlts1_arrays(dep=dep, indep=indep, npara=npara, xguess=xguess, trim_perc=trim_perc, diagnostics=diagnostics)
+            continue
+        clean_dep = dep.copy()
+        clean_dep[~nonnan_indep_mask] = NAN
+        fit_idx.append(i)
+        clean_deps.append(clean_dep)
+    if not fit_idx:
+        return results
+
+    # padded arrays (windows x entries)
+    lengths = numpy.array([len(i) for i in clean_deps])
+    n_windows, n_entries = len(fit_idx), numpy.max(lengths)
+    nee = numpy.zeros((n_windows, n_entries), dtype=DOUBLE_PREC)
+    temp = numpy.empty((n_windows, n_entries), dtype=DOUBLE_PREC)
+    temp[:] = TREF
+    nonnan_nee_mask = numpy.zeros((n_windows, n_entries), dtype=bool)
+    for k, (i, clean_dep) in enumerate(zip(fit_idx, clean_deps)):
+        nee[k, :lengths[k]] = clean_dep
+        temp[k, :lengths[k]] = indeps[i]
+        nonnan_nee_mask[k, :lengths[k]] = not_nan(clean_dep)
+
+    def trimmed_residuals(par, rows):
+        """
+        (inner) Function computing trimmed residuals for selected windows (rows),
+        following nlinlts1_arrays; returns residuals and mask of entries used (not NA, not trimmed)
+        """
+        prediction = lloyd_taylor(ta=temp[rows], rref=par[:, 0:1], e0=par[:, 1:2])
+        residuals = nee[rows] - prediction
+        used_mask = nonnan_nee_mask[rows].copy()
+        residuals[~used_mask] = 0.0
+        if trim_perc != 0.0:
+            absolute_residuals = numpy.abs(residuals)
+            pct_calc = pct_batch(arrays=absolute_residuals, lengths=lengths[rows], percent=100.0 - trim_perc)
+            trim_mask = (absolute_residuals > pct_calc[:, numpy.newaxis])
+            residuals[trim_mask] = 0.0
+            used_mask &= ~trim_mask
+        return residuals, used_mask
+
+    def jacobian(par, rows, used_mask):
+        """
+        (inner) Function computing Jacobian (of model) for selected windows (rows),
+        zero for entries not used (NA or trimmed)
+        """
+        d_rref, d_e0 = lloyd_taylor_jacobian(ta=temp[rows], rref=par[:, 0:1], e0=par[:, 1:2])
+        d_rref[~used_mask] = 0.0
+        d_e0[~used_mask] = 0.0
+        return d_rref, d_e0
+
+    with numpy.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        all_rows = numpy.arange(n_windows)
+        parameters = numpy.empty((n_windows, npara), dtype=DOUBLE_PREC)
+        parameters[:] = xguess
+        residuals, used_mask = trimmed_residuals(par=parameters, rows=all_rows)
+        cost = numpy.sum(residuals ** 2, axis=1)
+        damping = numpy.empty(n_windows, dtype=DOUBLE_PREC)
+        damping[:] = BATCH_LAMBDA_INIT
+        ls_status = numpy.zeros(n_windows, dtype='i4')
+        active = numpy.ones(n_windows, dtype=bool)
+
+        for _ in range(max_iterations):
+            rows = numpy.where(active)[0]
+            if len(rows) == 0:
+                break
+
+            # damped normal equations (Jacobian of residuals is minus Jacobian of model)
+            d_rref, d_e0 = jacobian(par=parameters[rows], rows=rows, used_mask=used_mask[rows])
+            a00, a01, a11 = numpy.sum(d_rref * d_rref, axis=1), numpy.sum(d_rref * d_e0, axis=1), numpy.sum(d_e0 * d_e0, axis=1)
+            g0, g1 = numpy.sum(d_rref * residuals[rows], axis=1), numpy.sum(d_e0 * residuals[rows], axis=1)
+            b00, b11 = a00 * (1.0 + damping[rows]), a11 * (1.0 + damping[rows])
+            det = b00 * b11 - a01 * a01
+            solvable = (det > 0.0)
+            step = numpy.zeros((len(rows), npara), dtype=DOUBLE_PREC)
+            step[solvable, 0] = (b11[solvable] * g0[solvable] - a01[solvable] * g1[solvable]) / det[solvable]
+            step[solvable, 1] = (b00[solvable] * g1[solvable] - a01[solvable] * g0[solvable]) / det[solvable]
+
+            new_parameters = parameters[rows] + step
+            new_residuals, new_used_mask = trimmed_residuals(par=new_parameters, rows=rows)
+            new_cost = numpy.sum(new_residuals ** 2, axis=1)
+            improved = solvable & (new_cost < cost[rows])
+
+            # convergence tests (only for steps reducing sum of squares, not dominated by damping); as in leastsq,
+            # both actual and predicted (linearized model) relative reductions in sum of squares have to be small
+            # relative change in parameters tested for all (also rejected) steps, as leastsq tests its step bound
+            predicted_reduction = 2.0 * (step[:, 0] * g0 + step[:, 1] * g1) - (a00 * step[:, 0] ** 2 + 2.0 * a01 * step[:, 0] * step[:, 1] + a11 * step[:, 1] ** 2)
+            converging = improved & (damping[rows] <= BATCH_LAMBDA_INIT)
+            ftol_ok = converging & ((cost[rows] - new_cost) <= BATCH_FTOL * cost[rows]) & (predicted_reduction <= BATCH_FTOL * cost[rows])
+            xtol_ok = solvable & (numpy.sqrt(numpy.sum(step ** 2, axis=1)) <= BATCH_XTOL * numpy.sqrt(numpy.sum(parameters[rows] ** 2, axis=1)))
+
+            accepted = rows[improved]
+            parameters[accepted] = new_parameters[improved]
+            residuals[accepted] = new_residuals[improved]
+            used_mask[accepted] = new_used_mask[improved]
+            cost[accepted] = new_cost[improved]
+            damping[accepted] /= 10.0
+            damping[rows[~improved]] *= 10.0
+
+            code = numpy.zeros(len(rows), dtype='i4')
+            code[ftol_ok] = 1
+            code[xtol_ok] = 2
+            code[ftol_ok & xtol_ok] = 3
+            # no step reduces sum of squares even with maximum damping, not converged
+            code[(code == 0) & (~improved) & (damping[rows] > BATCH_LAMBDA_MAX)] = 6
+            ls_status[rows[code > 0]] = code[code > 0]
+            active[rows[code > 0]] = False
+        ls_status[active] = 5
+
+        # covariance matrix from (undamped) Jacobian at solution
+        d_rref, d_e0 = jacobian(par=parameters, rows=all_rows, used_mask=used_mask)
+        a00, a01, a11 = numpy.sum(d_rref * d_rref, axis=1), numpy.sum(d_rref * d_e0, axis=1), numpy.sum(d_e0 * d_e0, axis=1)
+        det = a00 * a11 - a01 * a01
+
+    for k, i in enumerate(fit_idx):
+        if det[k] > 0.0:
+            s_squared = cost[k] / (lengths[k] - npara)
+            covariance_matrix = numpy.array([[a11[k], -a01[k]], [-a01[k], a00[k]]]) / det[k] * s_squared
+            std_devs = [numpy.sqrt(covariance_matrix[0][0]), numpy.sqrt(covariance_matrix[1][1])]
+        else:
+            covariance_matrix = None
+            std_devs = [numpy.nan] * npara
+        results[i] = nlinlts1_results(clean_dep=clean_deps[k], indep=indeps[i], parameters=parameters[k], std_devs=std_devs,
+                                      ls_status=int(ls_status[k]), ls_msg=BATCH_LS_MESSAGES[ls_status[k]], residuals=residuals[k, :lengths[k]],
+                                      covariance_matrix=covariance_matrix, diagnostics=diagnostics)
+    return results
 
-    ### smallest rank that is greater than critical rank (or SM-RK-GT-CR)
-    critical_rank_idx = numpy.where(rank_idx_array == numpy.min(rank_idx_array[over_critical_rank_mask]))
 
-    ### rank immediately before (SM-RK-GT-CR)
-    critical_rank_idx_previous = numpy.where(rank_idx_array == (numpy.min(rank_idx_array[over_critical_rank_mask]) - 1))
+def pct_batch(arrays, lengths, percent):
+    """
+    Calculates "percent" percentile (see pct) for each row of 2-d array,
+    using only the first lengths[i] entries of row i (no NA values expected)
 
-    if critical_rank.is_integer() and (numpy.sum(critical_rank_idx_previous) != 0):
-        return numpy.average([nonnan_array[critical_rank_idx[0]], nonnan_array[critical_rank_idx_previous[0]]])
-    else:
-        return nonnan_array[critical_rank_idx[0]][0]
+    :param arrays: 2-d array (rows padded to same length)
+    :type arrays: numpy.ndarray
+    :param lengths: number of entries to be used for each row
+    :type lengths: numpy.ndarray
+    :param percent: target percent value for percentile
+    :type percent: float
+    """
+    n_rows, n_cols = arrays.shape
+    rows = numpy.arange(n_rows)
+    padded = arrays.copy()
+    padded[numpy.arange(n_cols)[numpy.newaxis, :] >= lengths[:, numpy.newaxis]] = numpy.inf
+
+    # stable sort, same order as ordinal ranks (ties ranked in order of occurrence)
+    order = numpy.argsort(padded, axis=1, kind='mergesort')
+    sorted_arrays = padded[rows[:, numpy.newaxis], order]
+
+    critical_rank = lengths * percent / 100.
+    # smallest (1-based) rank greater than critical rank
+    over_rank = numpy.floor(critical_rank).astype('i8') + 1
+    over_critical_rank = (over_rank > lengths)
+    over_rank[over_critical_rank] = lengths[over_critical_rank]
+    result = sorted_arrays[rows, over_rank - 1]
+
+    # average with entry immediately before, if critical rank is integer (and entry is not first entry of array, as in pct)
+    previous_rank = over_rank - 1
+    average_mask = (critical_rank == numpy.floor(critical_rank)) & (previous_rank >= 1) & (~over_critical_rank)
+    previous_idx = numpy.maximum(previous_rank - 1, 0)
+    average_mask &= (order[rows, previous_idx] != 0)
+    result[average_mask] = (result[average_mask] + sorted_arrays[rows, previous_idx][average_mask]) / 2.0
+
+    # if no rank over critical rank, max values
+    result[over_critical_rank] = sorted_arrays[rows, lengths - 1][over_critical_rank]
+    return result
 
 
 STEP_BOUND_FACTOR = 0.25    # factor to restrict initial step  (default in scipy is 100.0, but PV-Wave seems to be closer to 0.1)
@@ -909,7 +1453,6 @@ def least_squares(func, initial_guess, entries, iterations=None, stop=False, ret
         return (pars, std_devs)
 
 
-
 def compu(data, func, columns, parameters={}, skip_if_present=False, no_missing=False, new_=False):
     """
     Computes function on columns [1:] of data array, assigning result to first column [0]
@@ -12,6 +12,7 @@ Pipeline common/shared configuration parameters
 '''
 import sys
 import os
+import time
 import copy
 import collections
 import logging
@@ -21,11 +22,14 @@ import numpy
 import socket
 import shutil
 import fnmatch
+import subprocess
+import json
 
 from datetime import datetime, date, timedelta
 
 from oneflux import ONEFluxError
 from oneflux.utils.strings import is_int
+from oneflux.utils.files import block_md5
 from oneflux.pipeline.variables_codes import VARIABLE_LIST_MUST_BE_PRESENT, VARIABLE_LIST_SHOULD_BE_PRESENT, VARIABLE_LIST_COULD_BE_PRESENT
 
 log = logging.getLogger(__name__)
@@ -176,6 +180,59 @@ def run_command(cmd):
         raise ONEFluxPipelineError(msg)
 
 
+# interval (seconds) between checks for finished commands in concurrent command execution
+COMMAND_POLL_INTERVAL = 0.5
+def run_commands(cmds, workers, label='common.run_commands'):
+    """
+    Runs shell commands concurrently as subprocesses, with at most workers commands running at a time,
+    tests return value of each command, raises exception if any failed (after all commands finished).
+    Wall time (seconds) and peak resident set size (KB, including descendant processes,
+    only available for systems with os.wait4) are logged and returned for each command
+
+    :param cmds: commands to be executed
+    :type cmds: list (of str)
+    :param workers: maximum number of commands running at a time
+    :type workers: int
+    :param label: label for commands being executed
+    :type label: str
+    :rtype: list (of dict)
+    """
+    pending = list(enumerate(cmds))
+    running = {}
+    results = [None] * len(cmds)
+    while pending or running:
+        while pending and (len(running) < max(workers, 1)):
+            i, cmd = pending.pop(0)
+            log.debug("{l}: starting command '{c}'".format(l=label, c=cmd))
+            running[i] = (subprocess.Popen(cmd, shell=True), time.time())
+
+        done = []
+        for i, (sproc, ts_begin) in running.items():
+            peak_rss = None
+            if hasattr(os, 'wait4'):
+                pid, status, rusage = os.wait4(sproc.pid, os.WNOHANG)
+                if pid == 0:
+                    continue
+                sproc.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status))
+                peak_rss = (rusage.ru_maxrss / 1024 if sys.platform == 'darwin' else rusage.ru_maxrss)
+            elif sproc.poll() is None:
+                continue
+            results[i] = {'cmd': cmds[i], 'exitcode': sproc.returncode, 'wall_time': time.time() - ts_begin, 'peak_rss': peak_rss}
+            log.info("{l}: finished command '{c}', exit code {e}, wall time {t:.1f}s, peak RSS {r}KB".format(l=label, c=cmds[i], e=sproc.returncode, t=results[i]['wall_time'], r=peak_rss))
+            done.append(i)
+        for i in done:
+            running.pop(i)
+        if running and not done:
+            time.sleep(COMMAND_POLL_INTERVAL)
+
+    failed = [r['cmd'] for r in results if r['exitcode'] != 0]
+    if failed:
+        msg = "Non-clean execution of : {c}".format(c=' ; '.join(failed))
+        log.error(msg)
+        raise ONEFluxPipelineError(msg)
+    return results
+
+
 def test_dir(tdir, label, log_only=False):
     """
     Tests if directory exists, if not logs error and raises exception
@@ -453,6 +510,94 @@ def create_and_empty_dir(tdir, label, suffix=datetime.now().strftime("%Y%m%d%H%M
         return True
 
 
+# manifests of step runs (inputs, tool versions, configs, outputs), saved in first output directory of each step
+STEP_MANIFEST_FILENAME = '.{s}_manifest.json'
+STEP_MANIFEST_PATTERN = STEP_MANIFEST_FILENAME.format(s='*')
+def step_manifest_filename(tdir, step):
+    """
+    Returns name of manifest file for step with outputs in directory
+
+    :param tdir: path to (first) output directory of step
+    :type tdir: str
+    :param step: name of step
+    :type step: str
+    :rtype: str
+    """
+    return os.path.join(tdir, STEP_MANIFEST_FILENAME.format(s=step))
+
+
+def hash_dir(tdir, base_dir, hashes=None, pattern='*', exclude=[]):
+    """
+    Computes md5sums (see block_md5) of files matching pattern in directory tree, except step manifests
+    and files matching exclude patterns, keyed by paths relative to base_dir
+    (empty if directory not set or does not exist);
+    md5sums in hashes are reused for files not changed (same size and modification time)
+    since added, new md5sums are added to hashes
+
+    :param tdir: path to directory
+    :type tdir: str
+    :param base_dir: path to directory for relative paths
+    :type base_dir: str
+    :param hashes: md5sums of previously hashed files, (size, modification time, md5sum) tuples keyed by path
+    :type hashes: dict
+    :param pattern: pattern of names of files hashed
+    :type pattern: str
+    :param exclude: patterns of names of files not hashed (e.g., derived cache files)
+    :type exclude: list (of str)
+    :rtype: dict
+    """
+    result = {}
+    if (tdir is None) or (not os.path.isdir(tdir)):
+        return result
+    for root, dirnames, filenames in os.walk(tdir):
+        dirnames.sort()
+        for f in sorted(filenames):
+            if (not fnmatch.fnmatch(f, pattern)) or any([fnmatch.fnmatch(f, p) for p in [STEP_MANIFEST_PATTERN] + exclude]):
+                continue
+            filename = os.path.join(root, f)
+            stat = os.stat(filename)
+            key = (stat.st_size, stat.st_mtime)
+            if (hashes is not None) and (hashes.get(filename, (None, None))[:2] == key):
+                md5sum = hashes[filename][2]
+            else:
+                md5sum = block_md5(filename)
+                if hashes is not None:
+                    hashes[filename] = key + (md5sum,)
+            result[os.path.relpath(filename, base_dir)] = md5sum
+    return result
+
+
+def load_step_manifest(filename):
+    """
+    Loads step manifest, returns None if not found or invalid
+
+    :param filename: name of manifest file
+    :type filename: str
+    :rtype: dict
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except ValueError as e:
+        log.warning("Invalid step manifest '{f}', ignoring: {e}".format(f=filename, e=str(e)))
+        return None
+
+
+def save_step_manifest(filename, manifest):
+    """
+    Saves step manifest
+
+    :param filename: name of manifest file
+    :type filename: str
+    :param manifest: manifest entries (JSON serializable)
+    :type manifest: dict
+    """
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
 def copy_files_pattern(src_dir, tgt_dir, file_pattern='*', label='common.copy_files_pattern', simulation=False):
     """
     Copy all files matching pattern inside src_dir into tgt_dir (non-recursive)
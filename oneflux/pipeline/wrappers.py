@@ -12,7 +12,10 @@ Pipeline execution controller wrappers
 '''
 import sys
 import os
+import time
+import json
 import logging
+import multiprocessing
 import re
 import numpy
 import socket
@@ -25,7 +28,7 @@ from oneflux.pipeline import CMD_SEP, COPY, DELETE, DELETE_DIR, HOMEDIR, DATA_DI
 from oneflux.pipeline.site_data_product import run_site, get_headers_qc, _load_data, update_names_qc, save_csv_txt
 from oneflux.pipeline.variables_codes import QC_FULL_DIRECT_D
 from oneflux.pipeline.common import CSVMANIFEST_HEADER, ZIPMANIFEST_HEADER, ONEFluxPipelineError, \
-                                     run_command, test_dir, test_file, test_file_list, test_file_list_or, \
+                                     run_command, run_commands, step_manifest_filename, hash_dir, load_step_manifest, save_step_manifest, test_dir, test_file, test_file_list, test_file_list_or, \
                                      test_create_dir, create_replace_dir, create_and_empty_dir, test_pattern, \
                                      check_headers_fluxnet, get_empty_array_year, copy_files_pattern,\
                                      PRODFILE_TEMPLATE_F, PRODFILE_AUX_TEMPLATE_F, PRODFILE_YEARS_TEMPLATE_F, \
@@ -35,18 +38,37 @@ from oneflux.pipeline.common import CSVMANIFEST_HEADER, ZIPMANIFEST_HEADER, ONEF
                                      HOSTNAME, NOW_TS, \
                                      ERA_FIRST_YEAR, ERA_LAST_YEAR, ERA_FIRST_TIMESTAMP_START, ERA_LAST_TIMESTAMP_START, \
                                      MODE_ISSUER, MODE_PRODUCT, MODE_ERA, ERA_SOURCE_DIRECTORY
-from oneflux.partition.library import PARTITIONING_DT_ERROR_FILE, EXTRA_FILENAME
+from oneflux.partition.library import EXTRA_FILENAME, NT_STR, DT_STR, LOAD_OUTPUT_CACHE_EXT, PartitioningInputStore
+from oneflux.utils.files import block_md5
 from oneflux.downscaling.rundownscaling import run as run_downscaling
 from oneflux.partition.auxiliary import nan, nan_ext, NAN, NAN_TEST
-from oneflux.partition.daytime import ONEFluxPartitionBrokenOptError
 from oneflux.pipeline.site_plots import gen_site_plots
-from oneflux.tools.partition_nt import run_partition_nt, PROD_TO_COMPARE, PERC_TO_COMPARE
+from oneflux.tools.partition_nt import run_partition_nt, PROD_TO_COMPARE, PERC_TO_COMPARE, DIAGNOSTICS_FULL
 from oneflux.tools.partition_dt import run_partition_dt
 
 DEFAULT_LOGGING_FILENAME = 'report_{s}_{h}_{t}.log'.format(h=HOSTNAME, t=NOW_TS, s='{s}')
 
 log = logging.getLogger(__name__)
 
+# interval (seconds) between checks for finished steps in concurrent step execution (see Pipeline.run_steps)
+STEP_POLL_INTERVAL = 1.0
+
+# outcomes of executed steps (see Pipeline.step_results)
+STEP_OK = 'ok'
+STEP_FAILED = 'failed'
+STEP_CACHED = 'cached'
+
+# pipeline flags set by partitioning steps on errors (see nt_skip_on_error and dt_skip_on_error),
+# and exit codes of step processes that set them (see Pipeline.run_steps)
+STEP_SKIP_EXITCODES = {'nt_skip': 3, 'dt_skip': 4}
+
+# files not included in manifests of steps (binary caches of loaded partitioning inputs, named with md5sum of original file)
+STEP_MANIFEST_EXCLUDE = ['*.' + '?' * 32 + LOAD_OUTPUT_CACHE_EXT]
+
+# pipeline configs included in manifests of all steps (see Pipeline.step_manifest)
+STEP_MANIFEST_CONFIGS = ['first_year', 'last_year', 'prod_to_compare', 'perc_to_compare', 'record_interval',
+                         'era_first_timestamp_start', 'era_last_timestamp_start', 'nt_skip', 'dt_skip']
+
 
 class Pipeline(object):
     '''
@@ -57,6 +79,9 @@ class Pipeline(object):
     SIMULATION = False
     NT_SKIP = False
     DT_SKIP = False
+    STEP_WORKERS = 1
+    STEP_CACHE = False
+    INCREMENTAL = False
 
     def __init__(self, siteid, timestamp=datetime.now().strftime("%Y%m%d%H%M%S"), *args, **kwargs):
         '''
@@ -173,6 +198,19 @@ class Pipeline(object):
         self.dt_skip = self.configs.get('dt_skip', self.DT_SKIP)
         log.debug("ONEFlux Pipeline, skip DT config: '{v}'".format(v=self.DT_SKIP))
 
+        # maximum number of steps executed concurrently (1: steps executed in order, in this process)
+        self.step_workers = self.configs.get('step_workers', self.STEP_WORKERS)
+        log.debug("ONEFlux Pipeline: using step workers '{v}'".format(v=self.step_workers))
+
+        # True: partitioning outputs of site-years with unchanged inputs are kept, only new or changed site-years
+        # are partitioned again (e.g., after adding a year to site); step cache is also enabled
+        self.incremental = self.configs.get('incremental', self.INCREMENTAL)
+        log.debug("ONEFlux Pipeline: using incremental mode '{v}'".format(v=self.incremental))
+
+        # True: steps with manifest matching current inputs, tool versions, and configs are skipped, outputs reused
+        self.step_cache = self.configs.get('step_cache', self.STEP_CACHE) or self.incremental
+        log.debug("ONEFlux Pipeline: using step cache '{v}'".format(v=self.step_cache))
+
         # ERA timestamp ranges
         log.debug("ONEFlux Pipeline: ERA First Year '{fy}'".format(fy=ERA_FIRST_YEAR))
         log.debug("ONEFlux Pipeline: ERA Last Year '{ly}'".format(ly=ERA_LAST_YEAR))
@@ -212,7 +250,7 @@ class Pipeline(object):
         self.fluxnet = FLUXNET_PRODUCT_CLASS(pipeline=self)
 
         ### validation
-        # list all steps
+        # list all steps (in order of execution, steps listed after all steps in their input_steps)
         self.drivers = [self.fp_creator,
                         self.qc_visual,
                         self.qc_auto,
@@ -232,6 +270,23 @@ class Pipeline(object):
                         self.fluxnet,
                        ]
 
+        for i, driver in enumerate(self.drivers):
+            for input_step in driver.input_steps:
+                if input_step not in self.drivers[:i]:
+                    msg = "Pipeline: step {d} listed before input step {i}".format(d=driver.__class__.__name__, i=input_step.__class__.__name__)
+                    log.critical(msg)
+                    raise ONEFluxPipelineError(msg)
+
+        # outcomes and durations (seconds) of executed steps, in order of completion
+        self.step_results = []
+
+        # steps skipped with outputs reused, md5sums of files hashed for step manifests
+        self._cached_steps = set()
+        self._file_hashes = {}
+
+        # input datasets shared by partitioning steps (created when first needed)
+        self._partitioning_inputs = None
+
         # pre-execution validation
         if self.validate_on_create:
             log.debug("ONEFlux Pipeline: running all pre-execution validation steps")
@@ -264,6 +319,254 @@ class Pipeline(object):
             if driver.execute:
                 driver.pre_validate()
 
+    def partitioning_inputs(self):
+        '''
+        Returns input datasets (meteo proc and NEE percentiles) shared by
+        NT and DT partitioning steps, loaded once per pipeline run;
+        datasets are released once all partitioning steps set to be run are done with them
+        '''
+        if self._partitioning_inputs is None:
+            consumers = [c for c, d in [(NT_STR, self.nee_partition_nt), (DT_STR, self.nee_partition_dt)] if d.execute and (d not in self._cached_steps)]
+            self._partitioning_inputs = PartitioningInputStore(datadir=self.data_dir_main, siteid=self.siteid, sitedir=self.site_dir, consumers=consumers)
+        return self._partitioning_inputs
+
+    def load_partitioning_inputs(self, driver):
+        '''
+        Loads shared partitioning inputs (see partitioning_inputs) used by partitioning step in this process,
+        so steps executed in separate processes (see run_steps) share them instead of each loading its own copy;
+        datasets that cannot be loaded are left for the step to load (and report)
+
+        :param driver: step driver object
+        :type driver: object
+        '''
+        consumer = dict([(self.nee_partition_nt, NT_STR), (self.nee_partition_dt, DT_STR)]).get(driver)
+        if (consumer is None) or self.simulation or (consumer == NT_STR and self.nt_skip) or (consumer == DT_STR and self.dt_skip):
+            return
+        try:
+            inputs = self.partitioning_inputs()
+            inputs.meteo()
+            for ustar_type in driver.prod_to_compare:
+                inputs.nee(ustar_type=ustar_type)
+        except Exception as e:
+            log.warning("{s} Pipeline: partitioning inputs not loaded before step {d}: {e}".format(s=self.siteid, d=driver.__class__.__name__, e=str(e)))
+
+    def close_partitioning_inputs(self, driver):
+        '''
+        Signals partitioning step is done with shared partitioning inputs (see partitioning_inputs)
+
+        :param driver: step driver object
+        :type driver: object
+        '''
+        for consumer, d in [(NT_STR, self.nee_partition_nt), (DT_STR, self.nee_partition_dt)]:
+            if (d is driver) and (self._partitioning_inputs is not None):
+                self._partitioning_inputs.close(consumer=consumer)
+
+    def step_manifest(self, driver):
+        '''
+        Returns manifest of step run: md5sums of files in output directories of input steps (and of
+        files matching patterns in other input directories of step, if any, see driver attribute input_dirs
+        with (directory, pattern) tuples), ONEFlux version, md5sums of step executables,
+        configs of step affecting its outputs (see driver attribute manifest_configs, with labels of configs),
+        and configs shared by all steps (see STEP_MANIFEST_CONFIGS)
+
+        :param driver: step driver object
+        :type driver: object
+        :rtype: dict
+        '''
+        inputs = {}
+        for tdir, pattern in [(d, '*') for s in driver.input_steps for d in s.output_dirs] + getattr(driver, 'input_dirs', []):
+            inputs.update(hash_dir(tdir=tdir, base_dir=self.data_dir, hashes=self._file_hashes, pattern=pattern, exclude=STEP_MANIFEST_EXCLUDE))
+        tools = {}
+        for k, v in sorted(driver.__dict__.items()):
+            if k.endswith('_ex') and isinstance(v, basestring) and os.path.isfile(v):
+                tools[os.path.basename(v)] = block_md5(v)
+        config = dict([(l, self.configs.get(l, getattr(driver.__class__, l.upper(), None))) for l in getattr(driver, 'manifest_configs', [])])
+        config.update(dict([(l, self.configs[l]) for l in STEP_MANIFEST_CONFIGS if l in self.configs]))
+        # JSON round trip, so manifest compares equal to saved manifest
+        return json.loads(json.dumps({'step': driver.__class__.__name__, 'version': VERSION, 'tools': tools, 'config': config, 'inputs': inputs}, default=str))
+
+    def run_step(self, driver):
+        '''
+        Executes step; if step cache is enabled, step is skipped (outputs reused) if its saved manifest
+        matches current manifest (see step_manifest) and its outputs did not change since saved,
+        otherwise manifest is saved (including md5sums of outputs) after step is executed
+
+        :param driver: step driver object
+        :type driver: object
+        :rtype: str (STEP_OK or STEP_CACHED)
+        '''
+        cached, manifest = self.check_step_cache(driver=driver)
+        if cached:
+            return STEP_CACHED
+        self.execute_step(driver=driver, manifest=manifest)
+        return STEP_OK
+
+    def check_step_cache(self, driver):
+        '''
+        Checks if step can be skipped with outputs reused (see run_step);
+        skipped steps are no longer consumers of shared partitioning inputs (see partitioning_inputs)
+
+        :param driver: step driver object
+        :type driver: object
+        :rtype: tuple (bool, dict) -- True if step skipped, and current manifest of step (None if step cache not used)
+        '''
+        if (not self.step_cache) or self.simulation or (not driver.output_dirs):
+            return False, None
+
+        label = driver.__class__.__name__
+        manifest = self.step_manifest(driver=driver)
+        saved = load_step_manifest(filename=step_manifest_filename(tdir=driver.output_dirs[0], step=label))
+        if saved is not None:
+            outputs = saved.pop('outputs', None)
+            if saved != manifest:
+                log.info("{s} Pipeline: step {d} manifest changed, executing step".format(s=self.siteid, d=label))
+            elif outputs != self.step_outputs(driver=driver):
+                log.info("{s} Pipeline: step {d} outputs changed, executing step".format(s=self.siteid, d=label))
+            else:
+                log.info("{s} Pipeline: step {d} manifest unchanged, reusing outputs".format(s=self.siteid, d=label))
+                self._cached_steps.add(driver)
+                self.close_partitioning_inputs(driver=driver)
+                return True, manifest
+        return False, manifest
+
+    def execute_step(self, driver, manifest=None):
+        '''
+        Executes step and saves its manifest (including md5sums of outputs), if step cache is used
+        and step did not set pipeline skip flags while running (failed outputs not reused, saved manifest removed);
+        returns pipeline skip flags set by step while running (see STEP_SKIP_EXITCODES)
+
+        :param driver: step driver object
+        :type driver: object
+        :param manifest: current manifest of step, as returned by check_step_cache (None if step cache not used)
+        :type manifest: dict
+        :rtype: list (of str)
+        '''
+        previous = dict([(f, getattr(self, f)) for f in STEP_SKIP_EXITCODES])
+        driver.run()
+        skipped = sorted([f for f in STEP_SKIP_EXITCODES if getattr(self, f) and not previous[f]])
+        if manifest is not None:
+            manifest_filename = step_manifest_filename(tdir=driver.output_dirs[0], step=driver.__class__.__name__)
+            if skipped:
+                log.info("{s} Pipeline: step {d} set {f}, manifest not saved".format(s=self.siteid, d=driver.__class__.__name__, f=', '.join(skipped)))
+                if os.path.isfile(manifest_filename):
+                    os.remove(manifest_filename)
+            else:
+                manifest['outputs'] = self.step_outputs(driver=driver)
+                save_step_manifest(filename=manifest_filename, manifest=manifest)
+        return skipped
+
+    def step_outputs(self, driver):
+        '''
+        Returns md5sums of files in output directories of step
+
+        :param driver: step driver object
+        :type driver: object
+        :rtype: dict
+        '''
+        outputs = {}
+        for tdir in driver.output_dirs:
+            outputs.update(hash_dir(tdir=tdir, base_dir=self.data_dir, hashes=self._file_hashes, exclude=STEP_MANIFEST_EXCLUDE))
+        return outputs
+
+    def add_step_result(self, driver, status, duration):
+        '''
+        Records outcome and duration of executed step
+
+        :param driver: step driver object
+        :type driver: object
+        :param status: outcome of step execution (STEP_OK, STEP_FAILED, or STEP_CACHED)
+        :type status: str
+        :param duration: duration of step execution
+        :type duration: datetime.timedelta
+        '''
+        self.step_results.append({'step': driver.__class__.__name__, 'status': status, 'duration': duration.total_seconds()})
+
+    def run_steps(self):
+        '''
+        Executes steps set to be run, each step as soon as all its input steps are finished,
+        with up to step_workers steps executed concurrently in separate processes;
+        steps not set to be run are finished as soon as their own input steps are finished.
+        Results of steps are shared through output files, and skip flags set by partitioning steps
+        on errors are sent back to this process through exit codes of steps (see STEP_SKIP_EXITCODES),
+        before steps depending on them are started (other attributes set by a step while running
+        are not seen by this process or by other steps).
+        Step cache (see run_step) is checked in this process before a step is started, so skipped steps
+        are not started; md5sums of outputs computed by a step are not kept and are computed again
+        by steps using them. Shared partitioning inputs (see partitioning_inputs) are loaded in this process
+        before partitioning steps are started and shared by them (copy-on-write); worker processes of each step
+        (driver attribute workers) are divided by step_workers, so concurrent steps do not oversubscribe CPUs
+        '''
+        pending = list(self.drivers)
+        running = {}
+        finished = set()
+        failed = []
+        while pending or running:
+            # start ready steps (in order of list of steps) until worker cap reached
+            for driver in list(pending):
+                if failed:
+                    break
+                if not all(d in finished for d in driver.input_steps):
+                    continue
+                if not driver.execute:
+                    log.debug("{s} Pipeline: step {d} not set to be run, execute flag <{f}>".format(s=self.siteid, d=driver.__class__.__name__, f=driver.execute))
+                    pending.remove(driver)
+                    finished.add(driver)
+                elif len(running) < self.step_workers:
+                    pending.remove(driver)
+                    ts_step = datetime.now()
+                    try:
+                        cached, manifest = self.check_step_cache(driver=driver)
+                    except Exception as e:
+                        log.critical("{s} an error occurred in step {d}: {e}".format(s=self.siteid, d=driver.__class__.__name__, e=str(e)))
+                        log_trace(exception=e, level=logging.CRITICAL, log=log)
+                        self.add_step_result(driver=driver, status=STEP_FAILED, duration=datetime.now() - ts_step)
+                        failed.append(driver)
+                        break
+                    if cached:
+                        self.add_step_result(driver=driver, status=STEP_CACHED, duration=datetime.now() - ts_step)
+                        finished.add(driver)
+                        continue
+                    self.load_partitioning_inputs(driver=driver)
+                    log.info("{s} Pipeline: starting step {d} ({r} running)".format(s=self.siteid, d=driver.__class__.__name__, r=len(running)))
+                    process = multiprocessing.Process(target=_run_step, args=(driver, manifest, self.step_workers), name=driver.__class__.__name__)
+                    process.start()
+                    running[driver] = (process, ts_step)
+
+            if not running:
+                if failed:
+                    break
+                if pending:
+                    msg = "{s} Pipeline: steps with input steps never finished: {d}".format(s=self.siteid, d=', '.join([d.__class__.__name__ for d in pending]))
+                    log.critical(msg)
+                    raise ONEFluxPipelineError(msg)
+                break
+
+            # wait for any running step to finish
+            done = [d for d, (p, _) in running.items() if not p.is_alive()]
+            if not done:
+                time.sleep(STEP_POLL_INTERVAL)
+                continue
+            for driver in done:
+                process, ts_begin = running.pop(driver)
+                process.join()
+                log.info("{s} Pipeline: finished step {d}, exit code {c}, run time {t}".format(s=self.siteid, d=driver.__class__.__name__, c=process.exitcode, t=datetime.now() - ts_begin))
+                status = (STEP_OK if process.exitcode in [0] + STEP_SKIP_EXITCODES.values() else STEP_FAILED)
+                for flag, exitcode in STEP_SKIP_EXITCODES.items():
+                    if process.exitcode == exitcode:
+                        log.info("{s} Pipeline: step {d} set {f}".format(s=self.siteid, d=driver.__class__.__name__, f=flag))
+                        setattr(self, flag, True)
+                self.add_step_result(driver=driver, status=status, duration=datetime.now() - ts_begin)
+                self.close_partitioning_inputs(driver=driver)
+                if status != STEP_FAILED:
+                    finished.add(driver)
+                else:
+                    failed.append(driver)
+
+        if failed:
+            msg = "{s} Pipeline: failed step(s) {d}".format(s=self.siteid, d=', '.join([d.__class__.__name__ for d in failed]))
+            log.critical(msg)
+            raise ONEFluxPipelineError(msg)
+
     def run(self):
         '''
         Executes ONEFlux Pipeline steps set to be run
@@ -278,10 +581,18 @@ class Pipeline(object):
             logger_file, log_file_handler = add_file_log(filename=self.report_log_filename)
             ts_begin = datetime.now()
 
-            for driver in self.drivers:
-                log.debug("{s} Pipeline: checking step {d}, execute flag <{f}>".format(s=self.siteid, d=driver.__class__.__name__, f=driver.execute))
-                if driver.execute:
-                    driver.run()
+            if self.step_workers > 1:
+                self.run_steps()
+            else:
+                for driver in self.drivers:
+                    log.debug("{s} Pipeline: checking step {d}, execute flag <{f}>".format(s=self.siteid, d=driver.__class__.__name__, f=driver.execute))
+                    if driver.execute:
+                        ts_step = datetime.now()
+                        status = STEP_FAILED
+                        try:
+                            status = self.run_step(driver=driver)
+                        finally:
+                            self.add_step_result(driver=driver, status=status, duration=datetime.now() - ts_step)
             self.post_validate()
 
         except Exception as e:
@@ -302,6 +613,31 @@ class Pipeline(object):
         log.info("{s} Pipeline: execution finished".format(s=self.siteid))
 
 
+def _run_step(driver, manifest, step_workers):
+    '''
+    Executes step in separate process (see Pipeline.run_steps), exits with non-zero code on errors
+    (or with code of pipeline skip flag set by step, see STEP_SKIP_EXITCODES);
+    worker processes of step (driver attribute workers, if any) are divided by number of concurrent steps
+
+    :param driver: step driver object
+    :type driver: object
+    :param manifest: current manifest of step, as returned by Pipeline.check_step_cache (None if step cache not used)
+    :type manifest: dict
+    :param step_workers: maximum number of steps executed concurrently
+    :type step_workers: int
+    '''
+    try:
+        if getattr(driver, 'workers', None) is not None:
+            driver.workers = max(1, int(driver.workers) // step_workers)
+        skipped = driver.pipeline.execute_step(driver=driver, manifest=manifest)
+    except Exception as e:
+        log.critical("{s} an error occurred in step {d}: {e}".format(s=driver.pipeline.siteid, d=driver.__class__.__name__, e=str(e)))
+        log_trace(exception=e, level=logging.CRITICAL, log=log)
+        sys.exit(1)
+    if skipped:
+        sys.exit(STEP_SKIP_EXITCODES[skipped[0]])
+
+
 class PipelineFPCreator(object):
     '''
     Class to control execution of fp_creator step
@@ -322,6 +658,8 @@ class PipelineFPCreator(object):
         self.execute = self.FP_CREATOR_EXECUTE # TODO: remove when method implemented
         self.original_dataset_dir = self.pipeline.configs.get('original_dataset_dir', os.path.join(self.pipeline.data_dir, self.ORIGINAL_DATASET_DIR))
         self.fp_dataset_dir = self.pipeline.configs.get('fp_dataset_dir', os.path.join(self.pipeline.data_dir, self.FP_DATASET_DIR))
+        self.input_steps = []
+        self.output_dirs = [self.fp_dataset_dir]
 
     def pre_validate(self):
         '''
@@ -404,6 +742,8 @@ class PipelineQCVisual(object):
         self.execute = self.QC_VISUAL_EXECUTE # TODO: remove when method implemented
         self.qc_visual_dir = self.pipeline.configs.get('qc_visual_dir', os.path.join(self.pipeline.data_dir, self.QC_VISUAL_DIR))
         self.qc_visual_dir_inner = self.pipeline.configs.get('qc_visual_files_dir', os.path.join(self.qc_visual_dir, self.QC_VISUAL_DIR_INNER))
+        self.input_steps = [self.pipeline.fp_creator]
+        self.output_dirs = [self.qc_visual_dir]
         self.output_file_pattern = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.output_file_patterns_inner = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_INNER]
 
@@ -470,6 +810,8 @@ class PipelineQCAuto(object):
         self.execute = self.pipeline.configs.get('qc_auto_execute', self.QC_AUTO_EXECUTE)
         self.qc_auto_ex = self.pipeline.configs.get('qc_auto_ex', os.path.join(self.pipeline.tool_dir, self.QC_AUTO_EX))
         self.qc_auto_dir = self.pipeline.configs.get('qc_auto_dir', os.path.join(self.pipeline.data_dir, self.QC_AUTO_DIR))
+        self.input_steps = [self.pipeline.qc_visual]
+        self.output_dirs = [self.qc_auto_dir]
         self.qc_auto_dir_fmt = self.qc_auto_dir + os.sep
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.input_qc_visual_dir = '..' + os.sep + os.path.basename(self.pipeline.qc_visual.qc_visual_dir) + os.sep + os.path.basename(self.pipeline.qc_visual.qc_visual_dir_inner) + os.sep
@@ -544,6 +886,8 @@ class PipelineQCAutoConvert(object):
         self.pipeline = pipeline
         self.execute = self.pipeline.configs.get('qc_auto_convert_execute', self.QC_AUTO_CONVERT_EXECUTE)
         self.qc_auto_convert_dir = self.pipeline.configs.get('qc_auto_convert_dir', os.path.join(self.pipeline.data_dir, self.QC_AUTO_CONVERT_DIR))
+        self.input_steps = [self.pipeline.qc_auto]
+        self.output_dirs = [self.qc_auto_convert_dir]
         self.qc_auto_convert_original = self._QC_AUTO_CONVERT_ORIGINAL
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.qc_auto_convert_files_to_convert = []
@@ -634,6 +978,8 @@ class PipelineQCVisualCross(object):
         self.execute = self.pipeline.configs.get('qc_visual_cross_execute', self.QC_VISUAL_CROSS_EXECUTE)
         self.execute = self.QC_VISUAL_CROSS_EXECUTE # TODO: remove when method implemented
         self.qc_visual_cross_dir = self.pipeline.configs.get('qc_visual_cross_dir', os.path.join(self.pipeline.data_dir, self.QC_VISUAL_CROSS_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert]
+        self.output_dirs = [self.qc_visual_cross_dir]
 
     def pre_validate(self):
         '''
@@ -688,6 +1034,8 @@ class PipelineUstarMP(object):
         self.execute = self.pipeline.configs.get('ustar_mp_execute', self.USTAR_MP_EXECUTE)
         self.ustar_mp_ex = self.pipeline.configs.get('ustar_mp_ex', os.path.join(self.pipeline.tool_dir, self.USTAR_MP_EX))
         self.ustar_mp_dir = self.pipeline.configs.get('ustar_mp_dir', os.path.join(self.pipeline.data_dir, self.USTAR_MP_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert]
+        self.output_dirs = [self.ustar_mp_dir]
         self.ustar_mp_dir_fmt = self.ustar_mp_dir + os.sep
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.input_qc_auto_dir = self.pipeline.qc_auto.qc_auto_dir + os.sep
@@ -760,6 +1108,8 @@ class PipelineUstarCP(object):
         self.execute = self.pipeline.configs.get('ustar_cp_execute', self.USTAR_CP_EXECUTE)
         self.ustar_cp_ex = self.pipeline.configs.get('ustar_cp_ex', os.path.join(self.pipeline.tool_dir, self.USTAR_CP_EX))
         self.ustar_cp_dir = self.pipeline.configs.get('ustar_cp_dir', os.path.join(self.pipeline.data_dir, self.USTAR_CP_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert]
+        self.output_dirs = [self.ustar_cp_dir]
         self.ustar_cp_dir_fmt = self.ustar_cp_dir + os.sep
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.input_qc_auto_dir = self.pipeline.qc_auto.qc_auto_dir + os.sep
@@ -908,9 +1258,12 @@ class PipelineMeteoERA(object):
         self.pipeline = pipeline
         self.execute = self.pipeline.configs.get('meteo_era_execute', self.METEO_ERA_EXECUTE)
         self.meteo_era_dir = self.pipeline.configs.get('meteo_era_dir', os.path.join(self.pipeline.data_dir, self.METEO_ERA_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert]
+        self.output_dirs = [self.meteo_era_dir]
         self.meteo_era_input_dir = self.pipeline.configs.get('era_input_dir', os.path.join(self.meteo_era_dir, self.METEO_ERA_DIR_INPUT))
         self.meteo_era_source_dir = self.pipeline.configs.get('era_source_dir', self.pipeline.era_source_dir)
         self.input_source_file_pattern = self._INPUT_SOURCE_FILE_PATTERN.format(s=self.pipeline.siteid)
+        self.input_dirs = [(self.meteo_era_source_dir, self.input_source_file_pattern)]
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.output_file_patterns_extra = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_EXTRA]
 
@@ -1069,6 +1422,7 @@ class PipelineMeteoMDS(object):
     METEO_MDS_DIR = "07a_meteo_mds"
     METEO_NARR_DIR = "07b_meteo_narr"
     METEO_MDS_EX = "meteo_mds"
+    METEO_MDS_WORKERS = 5
 
     def __init__(self, pipeline):
         '''
@@ -1082,7 +1436,10 @@ class PipelineMeteoMDS(object):
         self.execute = self.METEO_MDS_EXECUTE # TODO: remove when method implemented
         self.meteo_mds_dir = self.pipeline.configs.get('meteo_mds_dir', os.path.join(self.pipeline.data_dir, self.METEO_MDS_DIR))
         self.meteo_narr_dir = self.pipeline.configs.get('meteo_narr_dir', os.path.join(self.pipeline.data_dir, self.METEO_NARR_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert]
+        self.output_dirs = [self.meteo_mds_dir, self.meteo_narr_dir]
         self.meteo_mds_ex = self.pipeline.configs.get('meteo_mds_ex', os.path.join(self.pipeline.tool_dir, self.METEO_MDS_EX))
+        self.workers = self.pipeline.configs.get('meteo_mds_workers', self.METEO_MDS_WORKERS)
         self.cmd = "" # TODO: implement
 
     def pre_validate(self):
@@ -1113,33 +1470,39 @@ class PipelineMeteoMDS(object):
         log.info("Pipeline meteo_mds execution finished")
 
     def run_meteomds(self):
-        einput = self.qcauto + os.sep
-        eoutput = self.meteomds + os.sep
-        eoutput_log = os.path.join(self.meteomds, 'results.txt')
+        '''
+        Executes gap-filling of Ta, SWin, VPD, RH, and NEE with MDS, one concurrent
+        execution per variable (up to workers executions at a time)
+
+        :rtype: list (of dict)
+        '''
+        einput = self.pipeline.qc_auto.qc_auto_dir + os.sep
+        eoutput = self.meteo_mds_dir + os.sep
+        eoutput_log = os.path.join(self.meteo_mds_dir, 'results.txt')
 
-        for tdir in [os.path.join(self.meteomds, i) for i in ['input', 'input_nee', 'ta', 'swin', 'vpd', 'rh', 'nee']]:
-            self.test_create_dir(tdir=tdir, label='MeteoMDS')
+        for tdir in [os.path.join(self.meteo_mds_dir, i) for i in ['input', 'input_nee', 'ta', 'swin', 'vpd', 'rh', 'nee']]:
+            test_create_dir(tdir=tdir, label='meteo_mds', simulation=self.pipeline.simulation)
 
         cp_data = "{copy} {i}*_meteo_*.csv {o}".format(copy=COPY, i=einput, o=os.path.join(eoutput, 'input') + os.sep)
         cp_data_nee = "{copy} {i}*_nee_*.csv {o}".format(copy=COPY, i=einput, o=os.path.join(eoutput, 'input_nee') + os.sep)
         log.info("Data copy command '{c}'".format(c=cp_data))
         log.info("Data copy command '{c}' (NEE)".format(c=cp_data_nee))
-        if not self.simulation:
+        if not self.pipeline.simulation:
             os.system(cp_data)
             os.system(cp_data_nee)
 
-        input_filenames = [ os.path.join(i[0], j) for i in os.walk(os.path.join(self.meteomds, 'input')) for j in i[2] ]
+        input_filenames = [ os.path.join(i[0], j) for i in os.walk(os.path.join(self.meteo_mds_dir, 'input')) for j in i[2] ]
         input_filenames = ','.join([ i for i in input_filenames if '_meteo_' in i])
-        input_filenames_nee = [ os.path.join(i[0], j) for i in os.walk(os.path.join(self.meteomds, 'input_nee')) for j in i[2] ]
+        input_filenames_nee = [ os.path.join(i[0], j) for i in os.walk(os.path.join(self.meteo_mds_dir, 'input_nee')) for j in i[2] ]
         input_filenames_nee = ','.join([ i for i in input_filenames_nee if '_nee_' in i])
 
-        cp_tool = "{copy} {c} {o}".format(copy=COPY, c=self.ex_meteomds, o=eoutput)
-        cmd_ta = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=Ta > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.ex_meteomds), f=input_filenames, n=os.path.join(self.meteomds, 'ta') + os.sep, l=eoutput_log[:-4] + '_ta.txt')
-        cmd_swin = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=SWin > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.ex_meteomds), f=input_filenames, n=os.path.join(self.meteomds, 'swin') + os.sep, l=eoutput_log[:-4] + '_swin.txt')
-        cmd_vpd = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=VPD > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.ex_meteomds), f=input_filenames, n=os.path.join(self.meteomds, 'vpd') + os.sep, l=eoutput_log[:-4] + '_vpd.txt')
-        cmd_rh = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=RH > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.ex_meteomds), f=input_filenames, n=os.path.join(self.meteomds, 'rh') + os.sep, l=eoutput_log[:-4] + '_rh.txt')
-        cmd_nee = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=NEE > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.ex_meteomds), f=input_filenames_nee, n=os.path.join(self.meteomds, 'nee') + os.sep, l=eoutput_log[:-4] + '_nee.txt')
-        del_tool = "{delete} {o}{c}".format(delete=DELETE, o=eoutput, c=os.path.basename(self.ex_meteomds))
+        cp_tool = "{copy} {c} {o}".format(copy=COPY, c=self.meteo_mds_ex, o=eoutput)
+        cmd_ta = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=Ta > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.meteo_mds_ex), f=input_filenames, n=os.path.join(self.meteo_mds_dir, 'ta') + os.sep, l=eoutput_log[:-4] + '_ta.txt')
+        cmd_swin = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=SWin > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.meteo_mds_ex), f=input_filenames, n=os.path.join(self.meteo_mds_dir, 'swin') + os.sep, l=eoutput_log[:-4] + '_swin.txt')
+        cmd_vpd = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=VPD > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.meteo_mds_ex), f=input_filenames, n=os.path.join(self.meteo_mds_dir, 'vpd') + os.sep, l=eoutput_log[:-4] + '_vpd.txt')
+        cmd_rh = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=RH > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.meteo_mds_ex), f=input_filenames, n=os.path.join(self.meteo_mds_dir, 'rh') + os.sep, l=eoutput_log[:-4] + '_rh.txt')
+        cmd_nee = "cd {o} {cmd_sep} ./{c} -input={f} -output={n} -tofill=NEE > {l}".format(cmd_sep=CMD_SEP, o=eoutput, c=os.path.basename(self.meteo_mds_ex), f=input_filenames_nee, n=os.path.join(self.meteo_mds_dir, 'nee') + os.sep, l=eoutput_log[:-4] + '_nee.txt')
+        del_tool = "{delete} {o}{c}".format(delete=DELETE, o=eoutput, c=os.path.basename(self.meteo_mds_ex))
 
         log.info("Tool copy command '{c}'".format(c=cp_tool))
         log.info("Execution Ta   command '{c}'".format(c=cmd_ta))
@@ -1148,14 +1511,14 @@ class PipelineMeteoMDS(object):
         log.info("Execution RH   command '{c}'".format(c=cmd_rh))
         log.info("Execution NEE  command '{c}'".format(c=cmd_nee))
         log.info("Tool delete command '{c}'".format(c=del_tool))
-        if not self.simulation:
+        results = []
+        if not self.pipeline.simulation:
             os.system(cp_tool)
-            os.system(cmd_ta)
-            os.system(cmd_swin)
-            os.system(cmd_vpd)
-            os.system(cmd_rh)
-            os.system(cmd_nee)
-            os.system(del_tool)
+            try:
+                results = run_commands(cmds=[cmd_ta, cmd_swin, cmd_vpd, cmd_rh, cmd_nee], workers=self.workers, label='meteo_mds')
+            finally:
+                os.system(del_tool)
+        return results
 
 
 
@@ -1195,6 +1558,8 @@ class PipelineMeteoProc(object):
         self.execute = self.pipeline.configs.get('meteo_proc_execute', self.METEO_PROC_EXECUTE)
         self.meteo_proc_ex = self.pipeline.configs.get('meteo_proc_ex', os.path.join(self.pipeline.tool_dir, self.METEO_PROC_EX))
         self.meteo_proc_dir = self.pipeline.configs.get('meteo_proc_dir', os.path.join(self.pipeline.data_dir, self.METEO_PROC_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert, self.pipeline.meteo_era]
+        self.output_dirs = [self.meteo_proc_dir]
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.output_file_patterns_info = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_INFO]
         self.input_meteo_era_dir = '..' + os.sep + os.path.basename(self.pipeline.meteo_era.meteo_era_dir) + os.sep
@@ -1301,6 +1666,8 @@ class PipelineNEEProc(object):
         self.execute = self.pipeline.configs.get('nee_proc_execute', self.NEE_PROC_EXECUTE)
         self.nee_proc_ex = self.pipeline.configs.get('nee_proc_ex', os.path.join(self.pipeline.tool_dir, self.NEE_PROC_EX))
         self.nee_proc_dir = self.pipeline.configs.get('nee_proc_dir', os.path.join(self.pipeline.data_dir, self.NEE_PROC_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert, self.pipeline.ustar_mp, self.pipeline.ustar_cp, self.pipeline.meteo_proc]
+        self.output_dirs = [self.nee_proc_dir]
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.output_file_patterns_info = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_INFO]
         self.output_file_patterns_y = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_Y]
@@ -1404,6 +1771,8 @@ class PipelineEnergyProc(object):
         self.execute = self.pipeline.configs.get('energy_proc_execute', self.ENERGY_PROC_EXECUTE)
         self.energy_proc_ex = self.pipeline.configs.get('energy_proc_ex', os.path.join(self.pipeline.tool_dir, self.ENERGY_PROC_EX))
         self.energy_proc_dir = self.pipeline.configs.get('energy_proc_dir', os.path.join(self.pipeline.data_dir, self.ENERGY_PROC_DIR))
+        self.input_steps = [self.pipeline.qc_auto, self.pipeline.qc_auto_convert]
+        self.output_dirs = [self.energy_proc_dir]
         self.energy_proc_input_dir = os.path.join(self.energy_proc_dir, 'input')
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.input_qc_auto_dir = '..' + os.sep + os.path.basename(self.pipeline.qc_auto.qc_auto_dir) + os.sep
@@ -1473,6 +1842,10 @@ class PipelineNEEPartitionNT(object):
     '''
     NEE_PARTITION_NT_EXECUTE = True
     NEE_PARTITION_NT_DIR = "10_nee_partition_nt"
+    NEE_PARTITION_NT_WORKERS = 1
+    NEE_PARTITION_NT_WARM_START = False
+    NEE_PARTITION_NT_DIAGNOSTICS = DIAGNOSTICS_FULL
+    NEE_PARTITION_NT_DIAGNOSTICS_STORE = False
     _OUTPUT_FILE_PATTERNS_Y = [
         "nee_y_?.??_{s}_????{extra}.csv".format(s='{s}', extra=EXTRA_FILENAME), # 1.25, 3.75, 8.75
         "nee_y_??.??_{s}_????{extra}.csv".format(s='{s}', extra=EXTRA_FILENAME), # 11.25, ..., 98.75
@@ -1495,11 +1868,18 @@ class PipelineNEEPartitionNT(object):
         self.label = 'nee_partition_nt'
         self.execute = self.pipeline.configs.get('nee_partition_nt_execute', self.NEE_PARTITION_NT_EXECUTE)
         self.nee_partition_nt_dir = self.pipeline.configs.get('nee_partition_nt_dir', os.path.join(self.pipeline.data_dir, self.NEE_PARTITION_NT_DIR))
+        self.input_steps = [self.pipeline.meteo_proc, self.pipeline.nee_proc]
+        self.output_dirs = [self.nee_partition_nt_dir]
         self.output_file_patterns_y = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_Y]
         self.output_file_patterns_c = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_C]
         self.prod_to_compare = self.pipeline.configs.get('prod_to_compare', PROD_TO_COMPARE)
         self.perc_to_compare = self.pipeline.configs.get('perc_to_compare', PERC_TO_COMPARE)
         self.nt_skip_on_error = self.pipeline.configs.get('nt_skip_on_error', True)
+        self.workers = self.pipeline.configs.get('nee_partition_nt_workers', self.NEE_PARTITION_NT_WORKERS)
+        self.warm_start = self.pipeline.configs.get('nee_partition_nt_warm_start', self.NEE_PARTITION_NT_WARM_START)
+        self.diagnostics = self.pipeline.configs.get('nee_partition_nt_diagnostics', self.NEE_PARTITION_NT_DIAGNOSTICS)
+        self.diagnostics_store = self.pipeline.configs.get('nee_partition_nt_diagnostics_store', self.NEE_PARTITION_NT_DIAGNOSTICS_STORE)
+        self.manifest_configs = ['nee_partition_nt_warm_start', 'nee_partition_nt_diagnostics', 'nee_partition_nt_diagnostics_store']
 
     def pre_validate(self):
         '''
@@ -1531,9 +1911,12 @@ class PipelineNEEPartitionNT(object):
         # skip execution completely after pre_validation (used when partitioning is not possible)
         if self.pipeline.nt_skip:
             log.info("Pipeline {s} execution will be skipped".format(s=self.label))
+            self.pipeline.partitioning_inputs().close(consumer=NT_STR)
             return
 
-        create_replace_dir(tdir=self.nee_partition_nt_dir, label='{s}.run'.format(s=self.label), suffix=self.pipeline.run_id, simulation=self.pipeline.simulation)
+        # outputs from previous runs kept in incremental mode (only outputs of changed site-years re-created)
+        if not self.pipeline.incremental:
+            create_replace_dir(tdir=self.nee_partition_nt_dir, label='{s}.run'.format(s=self.label), suffix=self.pipeline.run_id, simulation=self.pipeline.simulation)
 
         log.info('Execution command: oneflux.tools.partition_nt.run_partition_nt()')
         if self.pipeline.simulation:
@@ -1546,7 +1929,13 @@ class PipelineNEEPartitionNT(object):
                                 years_to_compare=range(self.pipeline.first_year, self.pipeline.last_year + 1),
                                 py_remove_old=False,
                                 prod_to_compare=self.prod_to_compare,
-                                perc_to_compare=self.perc_to_compare,)
+                                perc_to_compare=self.perc_to_compare,
+                                workers=self.workers,
+                                warm_start=self.warm_start,
+                                diagnostics=self.diagnostics,
+                                diagnostics_store=self.diagnostics_store,
+                                input_store=self.pipeline.partitioning_inputs(),
+                                incremental=self.pipeline.incremental)
                 self.post_validate()
             except Exception as e:
                 msg = 'Failed NT partitioning for site {s}, will {m} execution of NT partitioning'.format(s=self.pipeline.siteid, m=('skip' if self.nt_skip_on_error else 'stop'))
@@ -1555,6 +1944,9 @@ class PipelineNEEPartitionNT(object):
                 if self.nt_skip_on_error:
                     self.pipeline.nt_skip = True
 
+        # input datasets released once no other partitioning step needs them
+        self.pipeline.partitioning_inputs().close(consumer=NT_STR)
+
         log.info("Pipeline {s} execution finished".format(s=self.label))
 
 
@@ -1564,6 +1956,9 @@ class PipelineNEEPartitionDT(object):
     '''
     NEE_PARTITION_DT_EXECUTE = True
     NEE_PARTITION_DT_DIR = "11_nee_partition_dt"
+    NEE_PARTITION_DT_WORKERS = 1
+    NEE_PARTITION_DT_DIAGNOSTICS_STORE = False
+    NEE_PARTITION_DT_ANALYTIC_JACOBIAN = False
     _OUTPUT_FILE_PATTERNS_Y = [
         "nee_y_?.??_{s}_????{extra}.csv".format(s='{s}', extra=EXTRA_FILENAME),  # 1.25, 3.75, 8.75
         "nee_y_??.??_{s}_????{extra}.csv".format(s='{s}', extra=EXTRA_FILENAME),  # 11.25, ..., 98.75
@@ -1586,11 +1981,17 @@ class PipelineNEEPartitionDT(object):
         self.label = 'nee_partition_dt'
         self.execute = self.pipeline.configs.get('nee_partition_dt_execute', self.NEE_PARTITION_DT_EXECUTE)
         self.nee_partition_dt_dir = self.pipeline.configs.get('nee_partition_dt_dir', os.path.join(self.pipeline.data_dir, self.NEE_PARTITION_DT_DIR))
+        self.input_steps = [self.pipeline.meteo_proc, self.pipeline.nee_proc]
+        self.output_dirs = [self.nee_partition_dt_dir]
         self.output_file_patterns_y = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_Y]
         self.output_file_patterns_c = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_C]
         self.prod_to_compare = self.pipeline.configs.get('prod_to_compare', PROD_TO_COMPARE)
         self.perc_to_compare = self.pipeline.configs.get('perc_to_compare', PERC_TO_COMPARE)
         self.dt_skip_on_error = self.pipeline.configs.get('dt_skip_on_error', True)
+        self.workers = self.pipeline.configs.get('nee_partition_dt_workers', self.NEE_PARTITION_DT_WORKERS)
+        self.diagnostics_store = self.pipeline.configs.get('nee_partition_dt_diagnostics_store', self.NEE_PARTITION_DT_DIAGNOSTICS_STORE)
+        self.analytic_jacobian = self.pipeline.configs.get('nee_partition_dt_analytic_jacobian', self.NEE_PARTITION_DT_ANALYTIC_JACOBIAN)
+        self.manifest_configs = ['nee_partition_dt_diagnostics_store', 'nee_partition_dt_analytic_jacobian']
 
     def pre_validate(self):
         '''
@@ -1611,7 +2012,7 @@ class PipelineNEEPartitionDT(object):
         test_file_list(file_list=self.output_file_patterns_y, tdir=self.nee_partition_dt_dir, label='{s}.post_validate'.format(s=self.label), log_only=True)
         test_file_list(file_list=self.output_file_patterns_c, tdir=self.nee_partition_dt_dir, label='{s}.post_validate'.format(s=self.label), log_only=True)
 
-    def run(self, count=0, rerun=False):
+    def run(self):
         '''
         Executes nee_partition_dt
         '''
@@ -1622,56 +2023,35 @@ class PipelineNEEPartitionDT(object):
         # skip execution completely after pre_validation (used when partitioning is not possible)
         if self.pipeline.dt_skip:
             log.info("Pipeline {s} execution will be skipped".format(s=self.label))
+            self.pipeline.partitioning_inputs().close(consumer=DT_STR)
             return
 
-        # if execution fails on optimization step, add window to exclusion and restart with count+1
-        suffix = (self.pipeline.run_id if (count == 0) else self.pipeline.run_id + '_{c}'.format(c=count))
+        # removes original intermediate files from previous runs (kept in incremental mode, only outputs of changed site-years re-created)
+        if not self.pipeline.incremental:
+            create_and_empty_dir(tdir=self.nee_partition_dt_dir, label='{s}.run'.format(s=self.label), suffix=self.pipeline.run_id, simulation=self.pipeline.simulation)
 
-        # either first execution or final execution after all windows found, so previous files can be removed
-        if not rerun:
-            # removes original intermediate files from re-runs
-            create_and_empty_dir(tdir=self.nee_partition_dt_dir, label='{s}.run'.format(s=self.label), suffix=suffix, simulation=self.pipeline.simulation)
+        # # keeping original intermediate files from previous runs
+        # create_replace_dir(tdir=self.nee_partition_dt_dir, label='{s}.run'.format(s=self.label), suffix=self.pipeline.run_id, simulation=self.pipeline.simulation)
 
-            # # keeping original intermediate files from re-runs
-            # create_replace_dir(tdir=self.nee_partition_dt_dir, label='{s}.run'.format(s=self.label), suffix=suffix, simulation=self.pipeline.simulation)
-
-        # changed to true if a call with rerun=True made in this iteration
-        rerun_call = False
-
-        # call partitioning and catches optimization fail exceptions
+        # call partitioning; optimization fails are handled per job, with failed windows
+        # added to the error file and only affected site-year/percentile versions re-run
         log.info('Execution command: oneflux.tools.partition_dt.run_partition_dt()')
         if self.pipeline.simulation:
             log.info('Simulation only, {s} execution command skipped'.format(s=self.label))
         else:
             try:
-                try:
-                    run_partition_dt(datadir=self.pipeline.data_dir_main,
-                                    siteid=self.pipeline.siteid,
-                                    sitedir=self.pipeline.site_dir,
-                                    years_to_compare=range(self.pipeline.first_year, self.pipeline.last_year + 1),
-                                    py_remove_old=False,
-                                    prod_to_compare=self.prod_to_compare,
-                                    perc_to_compare=self.perc_to_compare,)
-                except ONEFluxPartitionBrokenOptError as e:
-                    error_filename = os.path.join(self.pipeline.data_dir, PARTITIONING_DT_ERROR_FILE.format(s=self.pipeline.siteid))
-                    lines2append = ''
-                    if not os.path.isfile(error_filename):
-                        lines2append += 'site_year_nee_des,begin,end\n'
-                    lines2append += e.line2add + '\n'
-                    with open(error_filename, "a") as f:
-                        f.write(lines2append)
-                    log.warning('Added line "{line}" to error file "{f}"'.format(line=e.line2add, f=error_filename))
-
-                    # if not alredy in rerun mode, marks as rerun, when returning from next call knows rerun for all versions required
-                    if not rerun:
-                        log.warning('Will re-run all years/perc/prod for site {s} with {n} restarts'.format(s=self.pipeline.siteid, n=count + 10000))
-                        rerun_call = True
-                    log.warning('Restarting DT partitioning for site {s} with {n} restarts'.format(s=self.pipeline.siteid, n=count))
-                    self.run(count=count + 1, rerun=True)
-
-                if rerun_call:
-                    self.run(count=count + 10000, rerun=False)
-
+                run_partition_dt(datadir=self.pipeline.data_dir_main,
+                                siteid=self.pipeline.siteid,
+                                sitedir=self.pipeline.site_dir,
+                                years_to_compare=range(self.pipeline.first_year, self.pipeline.last_year + 1),
+                                py_remove_old=False,
+                                prod_to_compare=self.prod_to_compare,
+                                perc_to_compare=self.perc_to_compare,
+                                workers=self.workers,
+                                diagnostics_store=self.diagnostics_store,
+                                analytic_jacobian=self.analytic_jacobian,
+                                input_store=self.pipeline.partitioning_inputs(),
+                                incremental=self.pipeline.incremental)
                 self.post_validate()
             except Exception as e:
                 msg = 'Failed DT partitioning for site {s}, will {m} execution of DT partitioning'.format(s=self.pipeline.siteid, m=('skip' if self.dt_skip_on_error else 'stop'))
@@ -1680,6 +2060,9 @@ class PipelineNEEPartitionDT(object):
                 if self.dt_skip_on_error:
                     self.pipeline.dt_skip = True
 
+        # input datasets released once no other partitioning step needs them
+        self.pipeline.partitioning_inputs().close(consumer=DT_STR)
+
 
         log.info("Pipeline {s} execution finished".format(s=self.label))
 
@@ -1709,6 +2092,8 @@ class PipelinePrepareUREPW(object):
         self.pipeline = pipeline
         self.execute = self.pipeline.configs.get('prepare_ure_execute', self.PREPARE_URE_EXECUTE)
         self.prepare_ure_dir = self.pipeline.configs.get('prepare_ure_dir', os.path.join(self.pipeline.data_dir, self.PREPARE_URE_DIR))
+        self.input_steps = [self.pipeline.nee_partition_nt, self.pipeline.nee_partition_dt]
+        self.output_dirs = [self.prepare_ure_dir]
         self.output_file_patterns_nt_dt = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_NT_DT]
 
     def pre_validate(self):
@@ -1792,6 +2177,8 @@ class PipelinePrepareURE(object):
         self.prod = prod
         self.execute = self.pipeline.configs.get('prepare_ure_execute', self.PREPARE_URE_EXECUTE)
         self.prepare_ure_dir = self.pipeline.configs.get('prepare_ure_dir', os.path.join(self.pipeline.data_dir, self.PREPARE_URE_DIR))
+        self.input_steps = [self.pipeline.nee_partition_nt, self.pipeline.nee_partition_dt]
+        self.output_dirs = [self.prepare_ure_dir]
         self.prepare_ure_dir_fmt = self.prepare_ure_dir + os.sep
         self.output_file_patterns_nt = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_NT]
         self.output_file_patterns_dt = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_DT]
@@ -2150,6 +2537,8 @@ class PipelineURE(object):
         self.execute = self.pipeline.configs.get('ure_execute', self.URE_EXECUTE)
         self.ure_ex = self.pipeline.configs.get('ure_ex', os.path.join(self.pipeline.tool_dir, self.URE_EX))
         self.ure_dir = self.pipeline.configs.get('ure_dir', os.path.join(self.pipeline.data_dir, self.URE_DIR))
+        self.input_steps = [self.pipeline.prepare_ure]
+        self.output_dirs = [self.ure_dir]
         self.ure_dir_fmt = self.ure_dir + os.sep
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.output_file_patterns_nt = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS_NT]
@@ -2247,11 +2636,14 @@ class PipelineFLUXNET(object):
         self.pipeline = pipeline
         self.execute = self.pipeline.configs.get('fluxnet_execute', self.FLUXNET_EXECUTE)
         self.fluxnet_dir = self.pipeline.configs.get('fluxnet_dir', os.path.join(self.pipeline.data_dir, self.FLUXNET_DIR))
+        self.input_steps = [self.pipeline.qc_visual, self.pipeline.meteo_era, self.pipeline.meteo_proc, self.pipeline.nee_proc, self.pipeline.energy_proc, self.pipeline.nee_partition_nt, self.pipeline.nee_partition_dt, self.pipeline.ure]
+        self.output_dirs = [self.fluxnet_dir]
         self.fluxnet_site_plots = self.pipeline.configs.get('fluxnet_site_plots', self.FLUXNET_SITE_PLOTS)
         self.fluxnet_first = self.pipeline.configs.get('fluxnet_first', self.FLUXNET_FIRST)
         self.fluxnet_last = self.pipeline.configs.get('fluxnet_last', self.FLUXNET_LAST)
         self.fluxnet_version_processing = self.FLUXNET_VERSION_PROCESSING
         self.fluxnet_version_data = self.pipeline.configs.get('fluxnet_version_data', self.FLUXNET_VERSION_DATA)
+        self.manifest_configs = ['fluxnet_site_plots', 'fluxnet_first', 'fluxnet_last', 'fluxnet_version_processing', 'fluxnet_version_data', 'var_info_file', 'bif_other_file_list']
         self.output_file_patterns = [i.format(s=self.pipeline.siteid) for i in self._OUTPUT_FILE_PATTERNS]
         self.csv_manifest_entries = None
         self.zip_manifest_entries = None
@@ -0,0 +1,212 @@
+'''
+oneflux.tools.batch
+
+For license information:
+see LICENSE file or headers in oneflux.__init__.py
+
+Execution controller module for full pipeline runs of multiple sites
+
+@author: agent
+@contact: agent@local
+@date: 2026-10-18
+'''
+import sys
+import os
+import csv
+import logging
+import multiprocessing
+
+from Queue import Empty
+from datetime import datetime
+
+from oneflux import ONEFluxError, add_file_log
+from oneflux.pipeline.wrappers import STEP_OK, STEP_FAILED
+from oneflux.tools.pipeline import run_pipeline
+
+log = logging.getLogger(__name__)
+
+# manifest columns (one site per line): required, and optional per-site run_pipeline keyword arguments
+MANIFEST_COLUMNS = ['siteid', 'sitedir', 'firstyear', 'lastyear']
+MANIFEST_OPTIONS_STR = ['era_source_dir', 'mcr_directory', 'record_interval', 'version_data', 'version_proc', 'var_info_file']
+MANIFEST_OPTIONS_INT = ['era_first_year', 'era_last_year']
+def load_manifest(filename):
+    """
+    Loads batch manifest, CSV file with header line and one site per line,
+    columns siteid, sitedir, firstyear, lastyear and (optional) per-site options
+    (see MANIFEST_OPTIONS_STR and MANIFEST_OPTIONS_INT, empty values use defaults)
+
+    :param filename: name of manifest file
+    :type filename: str
+    :rtype: list (of dict)
+    """
+    with open(filename, 'rU') as f:
+        reader = csv.DictReader(f)
+        headers = [h.strip().lower() for h in (reader.fieldnames or [])]
+        missing = [c for c in MANIFEST_COLUMNS if c not in headers]
+        unknown = [h for h in headers if h not in MANIFEST_COLUMNS + MANIFEST_OPTIONS_STR + MANIFEST_OPTIONS_INT]
+        if missing or unknown:
+            msg = "Invalid batch manifest '{f}': missing columns {m}, unknown columns {u}".format(f=filename, m=missing, u=unknown)
+            log.critical(msg)
+            raise ONEFluxError(msg)
+
+        sites = []
+        for row in reader:
+            row = {k.strip().lower(): v.strip() for k, v in row.items()}
+            site = {'siteid': row['siteid'], 'sitedir': row['sitedir'], 'firstyear': int(row['firstyear']), 'lastyear': int(row['lastyear']), 'options': {}}
+            for option in MANIFEST_OPTIONS_STR + MANIFEST_OPTIONS_INT:
+                if row.get(option):
+                    site['options'][option] = (int(row[option]) if option in MANIFEST_OPTIONS_INT else row[option])
+            sites.append(site)
+
+    siteids = [s['siteid'] for s in sites]
+    duplicated = sorted(set([i for i in siteids if siteids.count(i) > 1]))
+    if duplicated:
+        msg = "Invalid batch manifest '{f}': duplicated sites {d}".format(f=filename, d=duplicated)
+        log.critical(msg)
+        raise ONEFluxError(msg)
+    return sites
+
+
+# summary table, one line per executed step of each site and one line for whole site run (step PIPELINE_STEP)
+SUMMARY_HEADER = ['siteid', 'step', 'status', 'duration', 'start', 'log', 'error']
+PIPELINE_STEP = 'Pipeline'
+def load_summary(filename):
+    """
+    Loads batch summary table, returns status of latest run of each site (missing file means no runs)
+
+    :param filename: name of summary file
+    :type filename: str
+    :rtype: dict
+    """
+    status = {}
+    if not os.path.isfile(filename):
+        return status
+    with open(filename, 'rU') as f:
+        for row in csv.DictReader(f):
+            if row['step'] == PIPELINE_STEP:
+                status[row['siteid']] = row['status']
+    return status
+
+
+def _run_site(site, datadir, logdir, queue, pipeline_kwargs):
+    """
+    Runs pipeline for single site in separate process (see run_batch),
+    with log file for site, puts result into queue
+
+    :param site: site entry from manifest (see load_manifest)
+    :type site: dict
+    :param datadir: absolute path to general data directory
+    :type datadir: str
+    :param logdir: directory for site log files
+    :type logdir: str
+    :param queue: queue for results of site runs
+    :type queue: multiprocessing.Queue
+    :param pipeline_kwargs: keyword arguments to run_pipeline for all sites
+    :type pipeline_kwargs: dict
+    """
+    logfile = os.path.join(logdir, '{s}.log'.format(s=site['siteid']))
+    logger_file, log_file_handler = add_file_log(filename=logfile)
+    kwargs = dict(pipeline_kwargs)
+    kwargs.update(site['options'])
+    step_results = []
+    result = {'siteid': site['siteid'], 'status': STEP_OK, 'error': '', 'log': logfile, 'steps': step_results}
+    try:
+        run_pipeline(datadir=datadir, siteid=site['siteid'], sitedir=site['sitedir'], firstyear=site['firstyear'], lastyear=site['lastyear'],
+                     logfile=logfile, step_results=step_results, **kwargs)
+    except Exception as e:
+        log.critical("Batch: site {s} failed: {e}".format(s=site['siteid'], e=str(e)))
+        result['status'], result['error'] = STEP_FAILED, str(e)
+    finally:
+        log_file_handler.flush()
+        log_file_handler.close()
+        logger_file.removeHandler(log_file_handler)
+    queue.put(result)
+
+
+# interval (seconds) between checks for finished site runs
+BATCH_POLL_INTERVAL = 1.0
+def run_batch(datadir, manifest, summary=None, logdir=None, batch_workers=1, **pipeline_kwargs):
+    """
+    Runs pipeline for all sites in manifest, up to batch_workers sites at a time, each site
+    in separate process with its own log file (failures do not affect other sites).
+    Outcomes and durations of each site and its steps are appended to summary table as each
+    site finishes; sites with successful runs already in summary table are skipped,
+    so interrupted batches resume from summary table
+
+    :param datadir: absolute path to general data directory
+    :type datadir: str
+    :param manifest: name of manifest file (see load_manifest)
+    :type manifest: str
+    :param summary: name of summary file (default: manifest name with suffix '_summary.csv')
+    :type summary: str
+    :param logdir: directory for site log files (default: general data directory)
+    :type logdir: str
+    :param batch_workers: maximum number of sites processed concurrently
+    :type batch_workers: int
+    :param pipeline_kwargs: keyword arguments to run_pipeline for all sites (overridden by per-site options)
+    :type pipeline_kwargs: dict
+    :rtype: list (of dict)
+    """
+    sites = load_manifest(filename=manifest)
+    summary = (os.path.splitext(manifest)[0] + '_summary.csv' if summary is None else summary)
+    logdir = (datadir if logdir is None else logdir)
+    if not os.path.isdir(logdir):
+        os.makedirs(logdir)
+
+    previous = load_summary(filename=summary)
+    pending = [s for s in sites if previous.get(s['siteid']) != STEP_OK]
+    log.info("Batch: {n} sites in manifest '{m}', {d} already processed, {p} to be processed".format(n=len(sites), m=manifest, d=len(sites) - len(pending), p=len(pending)))
+    if not os.path.isfile(summary):
+        with open(summary, 'w') as f:
+            f.write(','.join(SUMMARY_HEADER) + '\n')
+
+    queue = multiprocessing.Queue()
+    running = {}
+    results = []
+    while pending or running:
+        while pending and (len(running) < max(batch_workers, 1)):
+            site = pending.pop(0)
+            log.info("Batch: starting site {s} ({r} running, {p} pending)".format(s=site['siteid'], r=len(running), p=len(pending)))
+            process = multiprocessing.Process(target=_run_site, args=(site, datadir, logdir, queue, pipeline_kwargs), name=site['siteid'])
+            process.start()
+            running[site['siteid']] = (process, datetime.now())
+
+        # results are collected before processes are joined (queue fed by finishing processes);
+        # processes already ended before collection and without result failed without reaching queue
+        alive = dict([(siteid, process.is_alive()) for siteid, (process, _) in running.items()])
+        finished = {}
+        while True:
+            try:
+                result = queue.get(timeout=BATCH_POLL_INTERVAL)
+            except Empty:
+                break
+            finished[result['siteid']] = result
+        for siteid, (process, ts_begin) in running.items():
+            if (siteid not in finished) and alive[siteid]:
+                continue
+            process.join()
+            running.pop(siteid)
+            result = finished.get(siteid, {'siteid': siteid, 'status': STEP_FAILED, 'log': '', 'steps': [],
+                                           'error': "site process ended without result, exit code {c}".format(c=process.exitcode)})
+            result['start'], result['duration'] = ts_begin, (datetime.now() - ts_begin).total_seconds()
+            results.append(result)
+            log.info("Batch: finished site {s}, status {t}, run time {d:.0f}s".format(s=siteid, t=result['status'], d=result['duration']))
+
+            lines = [[siteid, step['step'], step['status'], '{d:.1f}'.format(d=step['duration']), '', '', ''] for step in result['steps']]
+            lines.append([siteid, PIPELINE_STEP, result['status'], '{d:.1f}'.format(d=result['duration']), ts_begin.strftime("%Y%m%d%H%M%S"), result['log'], result['error']])
+            with open(summary, 'a') as f:
+                csv.writer(f, lineterminator='\n').writerows(lines)
+
+    log.info("Batch summary ({f}):".format(f=summary))
+    for result in results:
+        log.info("  {s:8s} {t:8s} {d:10.0f}s  {e}".format(s=result['siteid'], t=result['status'], d=result['duration'], e=result['error']))
+        for step in result['steps']:
+            log.info("      {n:24s} {t:8s} {d:10.0f}s".format(n=step['step'], t=step['status'], d=step['duration']))
+    failed = [r['siteid'] for r in results if r['status'] != STEP_OK]
+    if failed:
+        log.error("Batch: {n} site(s) failed: {s}".format(n=len(failed), s=', '.join(failed)))
+    return results
+
+
+if __name__ == '__main__':
+    sys.exit("ERROR: cannot run independently")
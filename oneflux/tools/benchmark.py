@@ -0,0 +1,183 @@
+'''
+oneflux.tools.benchmark
+
+For license information:
+see LICENSE file or headers in oneflux.__init__.py
+
+Microbenchmarks for performance sensitive functions
+
+@author: agent
+@contact: agent@local
+@date: 2026-10-18
+'''
+import os
+import shutil
+import logging
+import tempfile
+import timeit
+import numpy
+
+from oneflux import ONEFluxError
+from oneflux.partition.auxiliary import FLOAT_PREC
+from oneflux.partition.library import pct, pct_ranked, save_output
+from oneflux.partition.nighttime import ipolmiss, ipolmiss_interp1d
+
+log = logging.getLogger(__name__)
+
+BENCHMARK_REPEAT = 5
+BENCHMARK_SEED = 1234
+
+
+def time_call(func, kwargs, number, repeat=BENCHMARK_REPEAT):
+    """
+    Times function call, returns best time per call (seconds) over repetitions
+
+    :param func: function to be timed
+    :type func: function
+    :param kwargs: keyword arguments for function call
+    :type kwargs: dict
+    :param number: number of calls in each repetition
+    :type number: int
+    :param repeat: number of repetitions
+    :type repeat: int
+    :rtype: float
+    """
+    timer = timeit.Timer(lambda: func(**kwargs))
+    return min(timer.repeat(repeat=repeat, number=number)) / float(number)
+
+
+# sizes of arrays for benchmark of pct: one NT window (14 days of half-hours) and one full year of half-hours
+PCT_BENCHMARK_SIZES = [('window_48x14', 48 * 14), ('year_48x365', 48 * 365)]
+def benchmark_pct(sizes=PCT_BENCHMARK_SIZES, percent=95.0, number=200, repeat=BENCHMARK_REPEAT, seed=BENCHMARK_SEED):
+    """
+    Microbenchmark for selection based pct against ordinal rank based pct_ranked,
+    using absolute values of random residuals (with NAs) as in trimmed optimizations
+
+    :param sizes: list of (label, number of entries) tuples for arrays to be tested
+    :type sizes: list
+    :param percent: target percent value for percentile
+    :type percent: float
+    :param number: number of calls in each repetition
+    :type number: int
+    :param repeat: number of repetitions
+    :type repeat: int
+    :param seed: seed for random number generator
+    :type seed: int
+    :rtype: list (of dict)
+    """
+    random_state = numpy.random.RandomState(seed)
+    results = []
+    for label, entries in sizes:
+        array = numpy.abs(random_state.normal(size=entries)).astype(FLOAT_PREC)
+        array[random_state.uniform(size=entries) < 0.2] = -9999.0
+
+        if pct(array=array, percent=percent) != pct_ranked(array=array, percent=percent):
+            msg = "Benchmark pct results differ for '{l}'".format(l=label)
+            log.critical(msg)
+            raise ONEFluxError(msg)
+
+        time_ranked = time_call(func=pct_ranked, kwargs={'array': array, 'percent': percent}, number=number, repeat=repeat)
+        time_selection = time_call(func=pct, kwargs={'array': array, 'percent': percent}, number=number, repeat=repeat)
+        results.append({'label': label, 'entries': entries, 'ranked': time_ranked, 'selection': time_selection, 'speedup': time_ranked / time_selection})
+        log.info("Benchmark pct {l} ({n} entries): ranked {r:.2f}us, selection {s:.2f}us, speedup {x:.2f}x".format(l=label, n=entries, r=time_ranked * 1e6, s=time_selection * 1e6, x=time_ranked / time_selection))
+    return results
+
+
+# fractions of valid entries for benchmark of ipolmiss: one value every 4 days (as in reanalyse_rref) and gaps in 30% of entries
+IPOLMISS_BENCHMARK_FRACTIONS = [('sparse_4days', 1.0 / (48 * 4)), ('gaps_30pct', 0.7)]
+def benchmark_ipolmiss(fractions=IPOLMISS_BENCHMARK_FRACTIONS, number=1, repeat=BENCHMARK_REPEAT, seed=BENCHMARK_SEED):
+    """
+    Microbenchmark for vectorized ipolmiss against interp1d based ipolmiss_interp1d,
+    for one full year of half-hours with missing values
+
+    :param fractions: list of (label, fraction of valid entries) tuples for arrays to be tested
+    :type fractions: list
+    :param number: number of calls in each repetition
+    :type number: int
+    :param repeat: number of repetitions
+    :type repeat: int
+    :param seed: seed for random number generator
+    :type seed: int
+    :rtype: list (of dict)
+    """
+    random_state = numpy.random.RandomState(seed)
+    entries = 48 * 365
+    results = []
+    for label, fraction in fractions:
+        data = numpy.zeros(entries, dtype=[('julday', FLOAT_PREC), ('hr', FLOAT_PREC), ('var', FLOAT_PREC)])
+        data['julday'] = numpy.arange(entries) // 48 + 1
+        data['hr'] = (numpy.arange(entries) % 48) / 2.0
+        data['var'] = random_state.normal(size=entries)
+        data['var'][random_state.uniform(size=entries) >= fraction] = numpy.NaN
+
+        expected, result = data.copy(), data.copy()
+        ipolmiss_interp1d(data=expected, variable='var')
+        ipolmiss(data=result, variable='var')
+        if expected.tobytes() != result.tobytes():
+            msg = "Benchmark ipolmiss results differ for '{l}'".format(l=label)
+            log.critical(msg)
+            raise ONEFluxError(msg)
+
+        # interpolation is in place, so each call uses a copy of data (same overhead for both)
+        time_interp1d = time_call(func=lambda d: ipolmiss_interp1d(data=d.copy(), variable='var'), kwargs={'d': data}, number=number, repeat=repeat)
+        time_vectorized = time_call(func=lambda d: ipolmiss(data=d.copy(), variable='var'), kwargs={'d': data}, number=number, repeat=repeat)
+        results.append({'label': label, 'entries': entries, 'interp1d': time_interp1d, 'vectorized': time_vectorized, 'speedup': time_interp1d / time_vectorized})
+        log.info("Benchmark ipolmiss {l} ({n} entries): interp1d {i:.2f}ms, vectorized {v:.2f}ms, speedup {x:.2f}x".format(l=label, n=entries, i=time_interp1d * 1e3, v=time_vectorized * 1e3, x=time_interp1d / time_vectorized))
+    return results
+
+
+# columns of output files for benchmark of save_output: timestamps, float32 variables and float32 flags (as in partitioning outputs)
+SAVE_OUTPUT_BENCHMARK_COLUMNS = [('timestamps', 2), ('variables', 40), ('flags', 10)]
+def benchmark_save_output(columns=SAVE_OUTPUT_BENCHMARK_COLUMNS, number=1, repeat=BENCHMARK_REPEAT, seed=BENCHMARK_SEED):
+    """
+    Microbenchmark for column based save_output against numpy.savetxt,
+    for one full year of half-hours with missing values (same bytes saved by both)
+
+    :param columns: list of (kind, number of columns) tuples for columns to be tested
+    :type columns: list
+    :param number: number of calls in each repetition
+    :type number: int
+    :param repeat: number of repetitions
+    :type repeat: int
+    :param seed: seed for random number generator
+    :type seed: int
+    :rtype: dict
+    """
+    random_state = numpy.random.RandomState(seed)
+    entries = 48 * 365
+    names = ['{k}_{i}'.format(k=kind, i=i) for kind, count in columns for i in range(count)]
+    data = numpy.zeros(entries, dtype=[(n, ('a25' if n.startswith('timestamps') else FLOAT_PREC)) for n in names])
+    for n in names:
+        if n.startswith('timestamps'):
+            data[n] = (200501010000 + numpy.arange(entries) * 30).astype('a25')
+        elif n.startswith('flags'):
+            data[n] = random_state.randint(0, 3, entries)
+        else:
+            data[n] = random_state.normal(scale=10.0, size=entries)
+            data[n][random_state.uniform(size=entries) < 0.2] = -9999.0
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename_savetxt, filename_output = os.path.join(tmpdir, 'savetxt.csv'), os.path.join(tmpdir, 'save_output.csv')
+        savetxt = lambda filename: numpy.savetxt(fname=filename, X=data, delimiter=',', fmt='%s', header=','.join(data.dtype.names), comments='')
+        savetxt(filename=filename_savetxt)
+        save_output(filename=filename_output, data=data, delimiter=',')
+        with open(filename_savetxt, 'rb') as f_savetxt, open(filename_output, 'rb') as f_output:
+            if f_savetxt.read() != f_output.read():
+                msg = "Benchmark save_output results differ from savetxt"
+                log.critical(msg)
+                raise ONEFluxError(msg)
+
+        time_savetxt = time_call(func=savetxt, kwargs={'filename': filename_savetxt}, number=number, repeat=repeat)
+        time_output = time_call(func=save_output, kwargs={'filename': filename_output, 'data': data, 'delimiter': ','}, number=number, repeat=repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+    log.info("Benchmark save_output ({n} entries, {c} columns): savetxt {t:.2f}ms, save_output {s:.2f}ms, speedup {x:.2f}x".format(n=entries, c=len(names), t=time_savetxt * 1e3, s=time_output * 1e3, x=time_savetxt / time_output))
+    return {'entries': entries, 'columns': len(names), 'savetxt': time_savetxt, 'save_output': time_output, 'speedup': time_savetxt / time_output}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    benchmark_pct()
+    benchmark_ipolmiss()
+    benchmark_save_output()
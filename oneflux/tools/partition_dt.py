@@ -64,9 +64,9 @@ def remove_previous_run(datadir, siteid, sitedir, prod_to_compare, perc_to_compa
     return
 
 
-def run_python(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare):
+def run_python(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare, workers=1, input_store=None, diagnostics_store=False, incremental=False, analytic_jacobian=False):
     log.debug("Python partitioning execution started")
-    partitioning_dt(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare)
+    partitioning_dt(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare, workers=workers, input_store=input_store, diagnostics_store=diagnostics_store, incremental=incremental, analytic_jacobian=analytic_jacobian)
     log.debug("Python partitioning execution finished")
     return
 
@@ -119,7 +119,7 @@ PERC_TO_COMPARE = ['1.25', '3.75', '6.25', '8.75', '11.25', '13.75', '16.25', '1
 def run_partition_dt(datadir, siteid, sitedir, years_to_compare,
                      dt_dir=DT_OUTPUT_DIR, filename_template=FILENAME_TEMPLATE,
                      prod_to_compare=PROD_TO_COMPARE, perc_to_compare=PERC_TO_COMPARE,
-                     py_remove_old=False):
+                     py_remove_old=False, workers=1, input_store=None, diagnostics_store=False, incremental=False, analytic_jacobian=False):
     """
     Runs daytime partitioning
 
@@ -142,9 +142,19 @@ def run_partition_dt(datadir, siteid, sitedir, years_to_compare,
     :type perc_to_compare: list
     :param py_remove_old: if True, removes old python partitioning results (after backup), file has to be missing for run
     :type py_remove_old: bool
+    :param workers: number of worker processes for partitioning jobs (1 runs serially)
+    :type workers: int
+    :param input_store: input datasets shared between partitioning methods (if None, loaded for this method only)
+    :type input_store: oneflux.partition.library.PartitioningInputStore
+    :param diagnostics_store: if True, diagnostics outputs saved to single store for site instead of text files
+    :type diagnostics_store: bool
+    :param incremental: if True, existing outputs kept only for site-years with unchanged inputs, others re-created
+    :type incremental: bool
+    :param analytic_jacobian: if True, closed-form jacobians of models used instead of finite differences
+    :type analytic_jacobian: bool
     """
     remove_previous_run(datadir=datadir, siteid=siteid, sitedir=sitedir, python=py_remove_old, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare)
-    run_python(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare)
+    run_python(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare, workers=workers, input_store=input_store, diagnostics_store=diagnostics_store, incremental=incremental, analytic_jacobian=analytic_jacobian)
 
 
 if __name__ == '__main__':
@@ -19,12 +19,15 @@ import subprocess
 import socket
 import numpy
 import calendar
+import shutil
+import tempfile
 
 from datetime import datetime
 from io import StringIO
 from oneflux import ONEFluxError
-from oneflux.partition.nighttime import partitioning_nt, STEP_SIZE
-from oneflux.partition.library import STRING_HEADERS, NT_OUTPUT_DIR, EXTRA_FILENAME
+from oneflux.partition.nighttime import partitioning_nt, nt_windows, nlinlts1_arrays, nlinlts1_batch, STEP_SIZE, DIAGNOSTICS_FULL, DIAGNOSTICS_LEVELS, partition_nt_chain
+from oneflux.partition.library import STRING_HEADERS, NT_OUTPUT_DIR, EXTRA_FILENAME, QC_AUTO_DIR, HEADER_SEPARATOR, NT_STR, PartitioningInputStore, get_latitude
+from oneflux.partition.library import TIMESTAMP_COMPONENTS, DiagnosticsStore, diagnostics_key
 from oneflux.partition.auxiliary import FLOAT_PREC, NAN, NAN_TEST, nan, not_nan
 from oneflux.graph.compare import plot_comparison, plot_e0_comparison, plot_param_diff_vs, compute_plot_e0_diffs
 from oneflux.utils.files import file_exists_not_empty, check_create_directory
@@ -67,14 +70,28 @@ def remove_previous_run(datadir, siteid, sitedir, prod_to_compare, perc_to_compa
     return
 
 
-def run_python(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare):
+def run_python(datadir, siteid, sitedir, prod_to_compare, perc_to_compare, years_to_compare, workers=1, input_store=None, warm_start=False, diagnostics=DIAGNOSTICS_FULL, diagnostics_store=False, incremental=False):
     log.debug("Python partitioning execution started")
-    partitioning_nt(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare)
+    partitioning_nt(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare, workers=workers, input_store=input_store, warm_start=warm_start, diagnostics=diagnostics, diagnostics_store=diagnostics_store, incremental=incremental)
     log.debug("Python partitioning execution finished")
     return
 
 
-def load_outputs(filename, delimiter=',', skip_header=1):
+# diagnostics stores opened by load_outputs, by filename (index of store file read once, see DiagnosticsStore)
+_DIAGNOSTICS_STORES = {}
+def load_outputs(filename, delimiter=',', skip_header=1, diagnostics_store=None):
+    # diagnostics outputs (e.g., __nlr_status_PY) saved to diagnostics store instead of text files
+    if diagnostics_store is not None:
+        log.debug("Started loading {k} from {f}".format(k=diagnostics_key(filename=filename), f=diagnostics_store))
+        store = _DIAGNOSTICS_STORES.setdefault(diagnostics_store, DiagnosticsStore(filename=diagnostics_store))
+        data = store.load(key=diagnostics_key(filename=filename))
+        headers = list(data.dtype.names)
+        timestamp_list = []
+        if all(c in headers for c in TIMESTAMP_COMPONENTS):
+            timestamp_list = [datetime(int(i['year']), int(i['month']), int(i['day']), int(i['hour']), int(i['minute'])) for i in data]
+        log.debug("Finished loading {k} from {f}".format(k=diagnostics_key(filename=filename), f=diagnostics_store))
+        return data, headers, timestamp_list
+
     log.debug("Started loading {f}".format(f=filename))
     with open(filename, 'r') as f:
         header_line = f.readline()
@@ -95,6 +112,127 @@ def load_outputs(filename, delimiter=',', skip_header=1):
     return data, headers, timestamp_list
 
 
+def validate_batch_windows(filename, tempvar='tair'):
+    """
+    Validates batched optimization of NT windows (nlinlts1_batch) against
+    per-window optimization (nlinlts1_arrays), using windows from NT output file;
+    batched optimization not used for partitioning outputs, as trimmed results can differ
+
+    :param filename: NT partitioning output file (with julday, neenight, and tempvar columns)
+    :type filename: str
+    :param tempvar: temperature variable to be used (e.g., tair or tsoil)
+    :type tempvar: str
+    :rtype: numpy.ndarray (one entry per window with per-window and batched results)
+    """
+    data, headers, timestamp_list = load_outputs(filename=filename)
+    window_steps, valid_idx, w_starts, w_stops, valid_fcn, valid_tair, fit_windows = nt_windows(data=data, tempvar=tempvar)
+    deps = [valid_fcn[w_starts[i]:w_stops[i]] for i in fit_windows]
+    indeps = [valid_tair[w_starts[i]:w_stops[i]] for i in fit_windows]
+
+    start = time.time()
+    per_window_results = [nlinlts1_arrays(dep=dep, indep=indep) for dep, indep in zip(deps, indeps)]
+    per_window_time = time.time() - start
+
+    start = time.time()
+    batch_results = nlinlts1_batch(deps=deps, indeps=indeps)
+    batch_time = time.time() - start
+
+    fields = ['rref', 'e0', 'rref_se', 'e0_se']
+    dtype = [('jday', 'i4'), ('ls_status', 'i4'), ('ls_status_batch', 'i4')]
+    dtype += [(f + suffix, 'f8') for f in fields for suffix in ['', '_batch']]
+    comparison = numpy.zeros(len(fit_windows), dtype=dtype)
+    comparison['jday'][:] = [window_steps[i] for i in fit_windows]
+    for i, (per_window, batch) in enumerate(zip(per_window_results, batch_results)):
+        comparison['ls_status'][i] = (-1 if per_window[7] is None else per_window[7])
+        comparison['ls_status_batch'][i] = (-1 if batch[7] is None else batch[7])
+        for j, f in enumerate(fields):
+            comparison[f][i] = per_window[j + 1]
+            comparison[f + '_batch'][i] = batch[j + 1]
+
+    log.info("Batched NT windows validation for '{f}': {n} windows, per-window {t1:.3f}s, batched {t2:.3f}s".format(f=filename, n=len(fit_windows), t1=per_window_time, t2=batch_time))
+    for f in fields:
+        diff = numpy.abs(comparison[f] - comparison[f + '_batch'])
+        rel_diff = diff / numpy.maximum(numpy.abs(comparison[f]), numpy.finfo(float).tiny)
+        log.info("Batched NT windows validation, {v}: max abs diff {d}, max rel diff {r}".format(v=f, d=numpy.nanmax(diff) if len(diff) else 0.0, r=numpy.nanmax(rel_diff) if len(rel_diff) else 0.0))
+    return comparison
+
+
+# selected (full year and best windows) parameters compared by validate_warm_start, and relative tolerance
+WARM_START_COLUMNS = ['rref_1_from_tair', 'e0_1_from_tair', 'rref_2_from_tair', 'e0_2_from_tair']
+WARM_START_TOLERANCE = 0.01
+def validate_warm_start(datadir, siteid, sitedir, years_to_compare, perc_to_compare, ustar_type='y', tolerance=WARM_START_TOLERANCE):
+    """
+    Validates warm started NT partitioning (see nighttime.flux_partition) against
+    cold started partitioning, comparing selected Rref/E0 parameters for each year and percentile;
+    outputs are written to temporary directory (existing NT outputs are not changed)
+
+    :param datadir: main data directory (full path)
+    :type datadir: str
+    :param siteid: site flux id to be processed - in format CC-SSS
+    :type siteid: str
+    :param sitedir: data directory for site (relative path to datadir)
+    :type sitedir: str
+    :param years_to_compare: list of years to be compared
+    :type years_to_compare: list
+    :param perc_to_compare: list of percentiles to compare ('1.25', '3.75', ..., '50', ..., '96.25', '98.75')
+    :type perc_to_compare: list
+    :param ustar_type: UStar threshold type ('c' or 'y') - CUT/VUT
+    :type ustar_type: str
+    :param tolerance: maximum relative difference of parameters
+    :type tolerance: float
+    :rtype: numpy.ndarray (one entry per year and percentile with cold and warm start results)
+    """
+    input_store = PartitioningInputStore(datadir=datadir, siteid=siteid, sitedir=sitedir, consumers=[NT_STR])
+    whole_dataset_nee, year_list = input_store.nee(ustar_type=ustar_type)
+    if whole_dataset_nee is None:
+        msg = "NEE percentiles for UStar threshold type '{u}' not found for site '{s}'".format(u=ustar_type, s=siteid)
+        log.critical(msg)
+        raise ONEFluxError(msg)
+    input_store.meteo()
+
+    percentiles = sorted(perc_to_compare, key=float)
+    years = [y for y in year_list if y in years_to_compare]
+    dtype = [('year', 'i4'), ('percentile', 'a8')] + [(c + suffix, 'f8') for c in WARM_START_COLUMNS for suffix in ['', '_warm']] + [('within_tolerance', bool)]
+    comparison = numpy.zeros(len(years) * len(percentiles), dtype=dtype)
+    evaluations = {'cold': 0, 'warm': 0}
+    elapsed = {'cold': 0.0, 'warm': 0.0}
+
+    tempdir = tempfile.mkdtemp(prefix='oneflux_nt_warm_start_')
+    try:
+        for i, year in enumerate(years):
+            latitude = get_latitude(filename=os.path.join(datadir, sitedir, QC_AUTO_DIR, '{s}_qca_nee_{y}.csv'.format(s=siteid, y=year)))
+            for mode in ['cold', 'warm']:
+                chain = []
+                for percentile in percentiles:
+                    filename = os.path.join(tempdir, mode + '_' + FILENAME_TEMPLATE.format(prod=ustar_type, perc=percentile, s=siteid, y=year, add='{extra}', e='csv'))
+                    chain.append((ustar_type, year, (year == year_list[0]), percentile.replace('.', HEADER_SEPARATOR), latitude, filename.format(extra=EXTRA_FILENAME), filename, False, DIAGNOSTICS_FULL))
+                inputs = [input_store.year_inputs(ustar_type=j[0], year=j[1], first_year=j[2], percentile=j[3]) for j in chain]
+                start = time.time()
+                evaluations[mode] += partition_nt_chain(chain, inputs, warm_start=(mode == 'warm'))[0]
+                elapsed[mode] += time.time() - start
+
+            for j, percentile in enumerate(percentiles):
+                entry = comparison[i * len(percentiles) + j]
+                entry['year'], entry['percentile'] = year, percentile
+                for mode, suffix in [('cold', ''), ('warm', '_warm')]:
+                    data, _, _ = load_outputs(filename=os.path.join(tempdir, mode + '_' + FILENAME_TEMPLATE.format(prod=ustar_type, perc=percentile, s=siteid, y=year, add=EXTRA_FILENAME, e='csv')))
+                    for c in WARM_START_COLUMNS:
+                        entry[c + suffix] = data[c][0]
+                rel_diffs = [abs(entry[c + '_warm'] - entry[c]) / max(abs(entry[c]), numpy.finfo(float).tiny) for c in WARM_START_COLUMNS]
+                entry['within_tolerance'] = all(d <= tolerance for d in rel_diffs)
+                if not entry['within_tolerance']:
+                    log.warning("Warm start NT validation, year {y} percentile {p}: relative differences {d} above tolerance {t}".format(y=year, p=percentile, d=rel_diffs, t=tolerance))
+    finally:
+        shutil.rmtree(tempdir)
+        input_store.close(consumer=NT_STR)
+
+    log.info("Warm start NT validation for '{s}': {n} percentile/year runs, cold {ec} evaluations ({tc:.1f}s), warm {ew} evaluations ({tw:.1f}s), {k} within tolerance {t}".format(s=siteid, n=len(comparison), ec=evaluations['cold'], tc=elapsed['cold'], ew=evaluations['warm'], tw=elapsed['warm'], k=numpy.sum(comparison['within_tolerance']), t=tolerance))
+    for c in WARM_START_COLUMNS:
+        rel_diff = numpy.abs(comparison[c + '_warm'] - comparison[c]) / numpy.maximum(numpy.abs(comparison[c]), numpy.finfo(float).tiny)
+        log.info("Warm start NT validation, {v}: max rel diff {r}".format(v=c, r=numpy.max(rel_diff) if len(rel_diff) else 0.0))
+    return comparison
+
+
 FILENAME_TEMPLATE = "nee_{prod}_{perc}_{s}_{y}{add}.{e}"
 PROD_TO_COMPARE = ['c', 'y']
 PERC_TO_COMPARE = ['1.25', '3.75', '6.25', '8.75', '11.25', '13.75', '16.25', '18.75',
@@ -106,7 +244,8 @@ PERC_TO_COMPARE = ['1.25', '3.75', '6.25', '8.75', '11.25', '13.75', '16.25', '1
 def run_partition_nt(datadir, siteid, sitedir, years_to_compare,
                      nt_dir=NT_OUTPUT_DIR, filename_template=FILENAME_TEMPLATE,
                      prod_to_compare=PROD_TO_COMPARE, perc_to_compare=PERC_TO_COMPARE,
-                     py_remove_old=False):
+                     py_remove_old=False, workers=1, input_store=None, warm_start=False, diagnostics=DIAGNOSTICS_FULL,
+                     diagnostics_store=False, incremental=False):
     """
     Runs nighttime partitioning
 
@@ -129,9 +268,22 @@ def run_partition_nt(datadir, siteid, sitedir, years_to_compare,
     :type perc_to_compare: list
     :param py_remove_old: if True, removes old python partitioning results (after backup), file has to be missing for run
     :type py_remove_old: bool
+    :param workers: number of worker processes for partitioning jobs (1 runs serially)
+    :type workers: int
+    :param input_store: input datasets shared between partitioning methods (if None, loaded for this method only)
+    :type input_store: oneflux.partition.library.PartitioningInputStore
+    :param warm_start: if True, NT optimizations started from results of the same window at the neighboring percentile
+                       (results differ from default cold start, check site first with validate_warm_start)
+    :type warm_start: bool
+    :param diagnostics: level of statistics computed for NT window optimizations, one of DIAGNOSTICS_LEVELS (none, summary, full)
+    :type diagnostics: str
+    :param diagnostics_store: if True, diagnostics outputs saved to single store for site instead of text files
+    :type diagnostics_store: bool
+    :param incremental: if True, existing outputs kept only for site-years with unchanged inputs, others re-created
+    :type incremental: bool
     """
     remove_previous_run(datadir=datadir, siteid=siteid, sitedir=sitedir, python=py_remove_old, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare)
-    run_python(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare)
+    run_python(datadir=datadir, siteid=siteid, sitedir=sitedir, prod_to_compare=prod_to_compare, perc_to_compare=perc_to_compare, years_to_compare=years_to_compare, workers=workers, input_store=input_store, warm_start=warm_start, diagnostics=diagnostics, diagnostics_store=diagnostics_store, incremental=incremental)
 
 
 if __name__ == '__main__':
@@ -22,7 +22,7 @@ from oneflux.pipeline.wrappers import Pipeline
 from oneflux.pipeline.common import TOOL_DIRECTORY, MCR_DIRECTORY, ONEFluxPipelineError, \
                                     NOW_TS, ERA_FIRST_YEAR, ERA_LAST_YEAR, \
                                     ERA_FIRST_TIMESTAMP_START_TEMPLATE, ERA_LAST_TIMESTAMP_START_TEMPLATE
-from oneflux.tools.partition_nt import PROD_TO_COMPARE, PERC_TO_COMPARE
+from oneflux.tools.partition_nt import PROD_TO_COMPARE, PERC_TO_COMPARE, DIAGNOSTICS_FULL
 
 log = logging.getLogger(__name__)
 
@@ -45,7 +45,16 @@ def run_pipeline(datadir,
                  var_info_file=None,
                  bif_other_file_list=None,
                  logfile=None,
-                 steps={}):
+                 steps={},
+                 workers=1,
+                 nt_warm_start=False,
+                 nt_diagnostics=DIAGNOSTICS_FULL,
+                 diagnostics_store=False,
+                 dt_analytic_jacobian=False,
+                 step_workers=1,
+                 step_cache=False,
+                 incremental=False,
+                 step_results=None):
 
     sitedir_full = os.path.abspath(os.path.join(datadir, sitedir))
     if not sitedir or not os.path.isdir(sitedir_full):
@@ -54,6 +63,7 @@ def run_pipeline(datadir,
         raise ONEFluxError(msg)
 
     log.info("Started processing site dir {d}".format(d=sitedir))
+    pipeline = None
     try:
         pipeline = Pipeline(siteid=siteid,
                     data_dir=sitedir_full,
@@ -89,9 +99,19 @@ def run_pipeline(datadir,
                     fluxnet_site_plots=steps.get('fluxnet_site_plots', True),
                     nt_skip=steps.get('nt_skip', Pipeline.NT_SKIP),
                     dt_skip=steps.get('dt_skip', Pipeline.DT_SKIP),
+                    nee_partition_nt_workers=workers,
+                    nee_partition_dt_workers=workers,
+                    nee_partition_nt_warm_start=nt_warm_start,
+                    nee_partition_nt_diagnostics=nt_diagnostics,
+                    nee_partition_nt_diagnostics_store=diagnostics_store,
+                    nee_partition_dt_diagnostics_store=diagnostics_store,
+                    nee_partition_dt_analytic_jacobian=dt_analytic_jacobian,
                     var_info_file=var_info_file,
                     bif_other_file_list=bif_other_file_list,
                     logfile=logfile,
+                    step_workers=step_workers,
+                    step_cache=step_cache,
+                    incremental=incremental,
                     simulation=False)
         pipeline.run()
         #csv_manifest_entries, zip_manifest_entries = pipeline.fluxnet.csv_manifest_entries, pipeline.fluxnet.zip_manifest_entries
@@ -108,6 +128,10 @@ def run_pipeline(datadir,
         log.critical("UNKNOWN ERRORS processing site dir {d}".format(d=sitedir_full))
         log_trace(exception=e, level=logging.CRITICAL, log=log)
         raise
+    finally:
+        # outcomes and durations of executed steps, also available if run failed
+        if (step_results is not None) and (pipeline is not None):
+            step_results.extend(pipeline.step_results)
 
 if __name__ == '__main__':
     sys.exit("ERROR: cannot run independently")
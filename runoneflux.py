@@ -17,15 +17,16 @@ import argparse
 import traceback
 
 from oneflux import ONEFluxError, log_config, log_trace, VERSION_METADATA
-from oneflux.tools.partition_nt import run_partition_nt, PROD_TO_COMPARE, PERC_TO_COMPARE
+from oneflux.tools.partition_nt import run_partition_nt, PROD_TO_COMPARE, PERC_TO_COMPARE, DIAGNOSTICS_FULL, DIAGNOSTICS_LEVELS
 from oneflux.tools.partition_dt import run_partition_dt
 from oneflux.tools.pipeline import run_pipeline, NOW_TS
+from oneflux.tools.batch import run_batch
 from oneflux.pipeline.common import ERA_FIRST_YEAR, ERA_LAST_YEAR
 
 log = logging.getLogger(__name__)
 
 DEFAULT_LOGGING_FILENAME = 'oneflux.log'
-COMMAND_LIST = ['partition_nt', 'partition_dt', 'all']
+COMMAND_LIST = ['partition_nt', 'partition_dt', 'all', 'batch']
 
 # main function
 if __name__ == '__main__':
@@ -34,10 +35,10 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('command', metavar="COMMAND", help="ONEFlux command to be run", type=str, choices=COMMAND_LIST)
     parser.add_argument('datadir', metavar="DATA-DIR", help="Absolute path to general data directory", type=str)
-    parser.add_argument('siteid', metavar="SITE-ID", help="Site Flux ID in the form CC-XXX", type=str)
-    parser.add_argument('sitedir', metavar="SITE-DIR", help="Relative path to site data directory (within data-dir)", type=str)
-    parser.add_argument('firstyear', metavar="FIRST-YEAR", help="First year of data to be processed", type=int)
-    parser.add_argument('lastyear', metavar="LAST-YEAR", help="Last year of data to be processed", type=int)
+    parser.add_argument('siteid', metavar="SITE-ID", help="Site Flux ID in the form CC-XXX (not used by batch)", type=str, nargs='?')
+    parser.add_argument('sitedir', metavar="SITE-DIR", help="Relative path to site data directory (within data-dir) (not used by batch)", type=str, nargs='?')
+    parser.add_argument('firstyear', metavar="FIRST-YEAR", help="First year of data to be processed (not used by batch)", type=int, nargs='?')
+    parser.add_argument('lastyear', metavar="LAST-YEAR", help="Last year of data to be processed (not used by batch)", type=int, nargs='?')
     parser.add_argument('--perc', metavar="PERC", help="List of percentiles to be processed", dest='perc', type=str, choices=PERC_TO_COMPARE, action='append', nargs='*')
     parser.add_argument('--prod', metavar="PROD", help="List of products to be processed", dest='prod', type=str, choices=PROD_TO_COMPARE, action='append', nargs='*')
     parser.add_argument('-l', '--logfile', help="Logging file path", type=str, dest='logfile', default=DEFAULT_LOGGING_FILENAME)
@@ -50,8 +51,24 @@ if __name__ == '__main__':
     parser.add_argument('--era-ly', help="ERA last year of data (default {y})".format(y=ERA_LAST_YEAR), type=int, dest='eraly', default=int(ERA_LAST_YEAR))
     parser.add_argument('--era-source', help="Absolute path to directory with ERA pre-extracted, unit adjusted, data files for pixel(s)", type=str, dest='erasource', default=None)
     parser.add_argument('--var_info_file', help="Path to BIF VAR_INFO file", type=str, dest='var_info_file', default=None)
+    parser.add_argument('--workers', help="Number of worker processes for partitioning jobs (default 1, serial)", type=int, dest='workers', default=1)
+    parser.add_argument('--nt-warm-start', help="Start NT partitioning optimizations from results of the same window at the neighboring percentile (results differ from default cold start)", action='store_true', dest='ntwarmstart', default=False)
+    parser.add_argument('--nt-diagnostics', help="Statistics computed for NT partitioning window optimizations (default {d})".format(d=DIAGNOSTICS_FULL), type=str, choices=DIAGNOSTICS_LEVELS, dest='ntdiagnostics', default=DIAGNOSTICS_FULL)
+    parser.add_argument('--dt-analytic-jacobian', help="Use closed-form jacobians of models in DT partitioning optimizations instead of finite differences", action='store_true', dest='dtanalyticjacobian', default=False)
+    parser.add_argument('--diagnostics-store', help="Save partitioning diagnostics outputs to a single store per site and method instead of one text file each", action='store_true', dest='diagnosticsstore', default=False)
+    parser.add_argument('--step-workers', help="Number of pipeline steps executed concurrently, each step started once its input steps are finished (default 1, in order)", type=int, dest='stepworkers', default=1)
+    parser.add_argument('--step-cache', help="Skip pipeline steps with unchanged inputs, tool versions, and configs since their last run, reusing their outputs", action='store_true', dest='stepcache', default=False)
+    parser.add_argument('--incremental', help="Keep partitioning outputs of site-years with unchanged inputs, re-creating only new or changed site-years (enables step cache)", action='store_true', dest='incremental', default=False)
+    parser.add_argument('--manifest', help="Path to batch manifest (CSV with columns siteid, sitedir, firstyear, lastyear, and optional per-site options)", type=str, dest='manifest', default=None)
+    parser.add_argument('--summary', help="Path to batch summary table, used to resume batch (default: manifest path with suffix _summary.csv)", type=str, dest='summary', default=None)
+    parser.add_argument('--batch-workers', help="Number of sites processed concurrently in batch (default 1)", type=int, dest='batchworkers', default=1)
     parser.add_argument('--bif_other_file_list', help="List of paths to other BIF files", type=str, dest='bif_other_file_list', nargs='*', default=None)
     args = parser.parse_args()
+    if args.command == 'batch':
+        if args.manifest is None:
+            parser.error("argument --manifest is required for command batch")
+    elif None in [args.siteid, args.sitedir, args.firstyear, args.lastyear]:
+        parser.error("arguments SITE-ID, SITE-DIR, FIRST-YEAR, LAST-YEAR are required for command {c}".format(c=args.command))
 
     # setup logging file and stdout
     log_config(level=logging.DEBUG, filename=args.logfile, std=True, std_level=logging.DEBUG)
@@ -80,15 +97,27 @@ if __name__ == '__main__':
     msg += ", era-source ({i})".format(i=args.erasource)
     msg += ", var_info_file ({i})".format(i=args.var_info_file)
     msg += ", bif_other_file_list ({i})".format(i=args.bif_other_file_list)
+    msg += ", workers ({i})".format(i=args.workers)
+    msg += ", nt-warm-start ({i})".format(i=args.ntwarmstart)
+    msg += ", nt-diagnostics ({i})".format(i=args.ntdiagnostics)
+    msg += ", dt-analytic-jacobian ({i})".format(i=args.dtanalyticjacobian)
+    msg += ", diagnostics-store ({i})".format(i=args.diagnosticsstore)
+    msg += ", step-workers ({i})".format(i=args.stepworkers)
+    msg += ", step-cache ({i})".format(i=args.stepcache)
+    msg += ", incremental ({i})".format(i=args.incremental)
+    msg += ", manifest ({i})".format(i=args.manifest)
+    msg += ", summary ({i})".format(i=args.summary)
+    msg += ", batch-workers ({i})".format(i=args.batchworkers)
     log.debug(msg)
 
     # start execution
     try:
         # check arguments
-        site_dir = os.path.join(args.datadir, args.sitedir)
-        log.debug('Using site dir: {s}'.format(s=site_dir))
-        if not os.path.isdir(site_dir):
-            raise ONEFluxError("Site dir not found: {d}".format(d=args.sitedir))
+        if args.command != 'batch':
+            site_dir = os.path.join(args.datadir, args.sitedir)
+            log.debug('Using site dir: {s}'.format(s=site_dir))
+            if not os.path.isdir(site_dir):
+                raise ONEFluxError("Site dir not found: {d}".format(d=args.sitedir))
 
         # run command
         log.info("Starting execution: {c}".format(c=args.command))
@@ -98,13 +127,27 @@ if __name__ == '__main__':
                          record_interval=args.recint, version_data=args.versiond,
                          era_first_year=args.erafy, era_last_year=args.eraly, era_source_dir=args.erasource,
                          var_info_file=args.var_info_file, bif_other_file_list=args.bif_other_file_list,
-                         logfile=args.logfile)
+                         logfile=args.logfile, workers=args.workers,
+                         nt_warm_start=args.ntwarmstart, nt_diagnostics=args.ntdiagnostics, diagnostics_store=args.diagnosticsstore,
+                         dt_analytic_jacobian=args.dtanalyticjacobian, step_workers=args.stepworkers, step_cache=args.stepcache, incremental=args.incremental)
+        elif args.command == 'batch':
+            run_batch(datadir=args.datadir, manifest=args.manifest, summary=args.summary, batch_workers=args.batchworkers,
+                      prod_to_compare=prod, perc_to_compare=perc, mcr_directory=args.mcr_directory, timestamp=args.timestamp,
+                      record_interval=args.recint, version_data=args.versiond,
+                      era_first_year=args.erafy, era_last_year=args.eraly, era_source_dir=args.erasource,
+                      var_info_file=args.var_info_file, bif_other_file_list=args.bif_other_file_list,
+                      workers=args.workers,
+                      nt_warm_start=args.ntwarmstart, nt_diagnostics=args.ntdiagnostics, diagnostics_store=args.diagnosticsstore,
+                      dt_analytic_jacobian=args.dtanalyticjacobian, step_workers=args.stepworkers, step_cache=args.stepcache, incremental=args.incremental)
         elif args.command == 'partition_nt':
             run_partition_nt(datadir=args.datadir, siteid=args.siteid, sitedir=args.sitedir, years_to_compare=range(firstyear, lastyear + 1),
-                             py_remove_old=args.forcepy, prod_to_compare=prod, perc_to_compare=perc)
+                             py_remove_old=args.forcepy, prod_to_compare=prod, perc_to_compare=perc, workers=args.workers,
+                             warm_start=args.ntwarmstart, diagnostics=args.ntdiagnostics,
+                             diagnostics_store=args.diagnosticsstore)
         elif args.command == 'partition_dt':
             run_partition_dt(datadir=args.datadir, siteid=args.siteid, sitedir=args.sitedir, years_to_compare=range(firstyear, lastyear + 1),
-                             py_remove_old=args.forcepy, prod_to_compare=prod, perc_to_compare=perc)
+                             py_remove_old=args.forcepy, prod_to_compare=prod, perc_to_compare=perc, workers=args.workers,
+                             diagnostics_store=args.diagnosticsstore, analytic_jacobian=args.dtanalyticjacobian)
         else:
             raise ONEFluxError("Unknown command: {c}".format(c=args.command))
         log.info("Finished execution: {c}".format(c=args.command))
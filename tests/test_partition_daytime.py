@@ -0,0 +1,254 @@
+'''
+For license information:
+see LICENSE file or headers in oneflux.__init__.py
+
+Tests for daytime partitioning functions
+
+@author: agent
+@contact: agent@local
+@date: 2026-10-18
+'''
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import numpy
+
+from scipy import stats
+from statsmodels import robust
+
+from context import oneflux
+from oneflux import ONEFluxError
+from oneflux.partition import daytime
+from oneflux.partition.daytime import partitioning_dt, gapfill_windows, gapfill_row_stats, _schedule_dt_jobs, DTWorkingSet
+from oneflux.partition.library import PARTITIONING_DT_ERROR_FILE, DT_STR, nlinlts2, DiagnosticsStore, diagnostics_key
+from test_partition_nighttime import write_partitioning_inputs, edit_nee_input, wait_for_files
+from oneflux.partition.ecogeo import hlrc_lloydvpd
+
+class GapFillTest(unittest.TestCase):
+    def test_gapfill_windows_match_single_index(self):
+        """Test window views match windows built for single indices (order and clipping at limits)"""
+        array = numpy.arange(300, dtype='f4')
+        for t_window, nperday in [(1, 48), (3, 24), (14, 10)]:
+            windows, order = gapfill_windows(array=array, t_window=t_window, nperday=nperday)
+            for index in [0, 5, 150, 297, 299]:
+                w = numpy.append(index - numpy.arange(t_window / 2.0 * nperday), index + numpy.arange(t_window / 2.0 * nperday - 1) + 1)
+                numpy.clip(w, 0, array.size - 1, out=w)
+                self.assertTrue(numpy.array_equal(windows[index][order], array[w.astype(int)]))
+
+    def test_gapfill_row_stats_match_single_row(self):
+        """Test statistics computed for rows together are identical to statistics of single rows (including ties and zeros)"""
+        random_state = numpy.random.RandomState(0)
+        for trial in range(50):
+            rows, size = random_state.randint(1, 20), random_state.randint(10, 400)
+            values = numpy.round(random_state.normal(size=(rows, size)) * 5, trial % 3).astype('f4')
+            counts = random_state.randint(10, size + 1, rows)
+            mean_value, std_value, median_value, srob_value = gapfill_row_stats(values=values, counts=counts)
+            for i in range(rows):
+                selected = values[i, :counts[i]]
+                self.assertEqual(mean_value[i].tobytes(), stats.tmean(selected).tobytes())
+                self.assertEqual(std_value[i].tobytes(), stats.tstd(selected).tobytes())
+                self.assertEqual(median_value[i].tobytes(), numpy.median(selected).tobytes())
+                self.assertEqual(srob_value[i].tobytes(), robust.scale.mad(selected).tobytes())
+
+class DTWorkingSetTest(unittest.TestCase):
+    MODELS = [
+        ('HLRC_LloydVPD', ['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f'], [0.022, 25.0, 0.03, 3.0], [10, 600, 50, 80]),
+        ('HLRC_Lloyd', ['rg_f', 'tair_f', 'e0_1_from_tair'], [0.022, 25.0, 3.0], [10, 600, 80]),
+        ('HLRC_Lloyd_afix', ['rg_f', 'tair_f', 'e0_1_from_tair', 'alpha_1_from_tair'], [25.0, 3.0], [600, 80]),
+        ('HLRC_LloydVPD_afix', ['rg_f', 'tair_f', 'e0_1_from_tair', 'vpd_f', 'alpha_1_from_tair'], [25.0, 0.03, 3.0], [600, 50, 80]),
+        ('LloydT_E0fix', ['tair_f', 'e0_1_from_tair'], [3.0], [80]),
+        ('LloydTemp', ['tair_f'], [2.0, 100.0], [800, 1000]),
+    ]
+
+    def make_data(self, size=400):
+        random_state = numpy.random.RandomState(1)
+        names = ['julday', 'rg_f', 'tair_f', 'vpd_f', 'nee_f', 'nee_fs_unc', 'e0_1_from_tair', 'alpha_1_from_tair']
+        data = numpy.zeros(size, dtype=[(n, 'f4') for n in names])
+        data['julday'] = numpy.arange(size) // 48 + 1
+        data['rg_f'] = random_state.uniform(5.0, 900.0, size)
+        data['tair_f'] = random_state.uniform(0.0, 30.0, size)
+        data['vpd_f'] = random_state.uniform(0.0, 30.0, size)
+        params = numpy.array([0.03, 20.0, 0.05, 4.0])
+        nee = hlrc_lloydvpd(rg_f=data['rg_f'].astype('f8'), ta_f=data['tair_f'].astype('f8'), e0=numpy.full(size, 120.0), vpd_f=data['vpd_f'].astype('f8'), parameter=params)
+        data['nee_f'] = nee + random_state.normal(scale=2.0, size=size)
+        data['nee_fs_unc'] = random_state.uniform(0.5, 3.0, size)
+        data['nee_f'][random_state.uniform(size=size) < 0.1] = -9999.0
+        data['tair_f'][random_state.uniform(size=size) < 0.05] = -9999.0
+        return data
+
+    def test_working_set_matches_window_records(self):
+        """Test optimizations on working set windows are identical to optimizations on data structure windows (previous path)"""
+        data = self.make_data()
+        working_set = DTWorkingSet.from_data(data=data)
+        indices = numpy.flatnonzero(data['rg_f'] > 50.0)[10:300]
+        e0, alpha = 131.7, 0.0213
+        for analytic_jacobian in [False, True]:
+            for lts_func, indepvar_arr, xguess, sigm in self.MODELS:
+                # previous path: records of window copied from data structure for partitioning (FLOAT_PREC)
+                sub = data[indices]
+                sub['e0_1_from_tair'][:] = e0
+                sub['alpha_1_from_tair'][:] = alpha
+                # working set path: double precision columns, constants rounded to FLOAT_PREC
+                sub_set = working_set.take(indices)
+                sub_set.fill('e0_1_from_tair', e0)
+                sub_set.fill('alpha_1_from_tair', alpha)
+                results = []
+                for window in [sub, sub_set]:
+                    results.append(nlinlts2(data=window, lts_func=lts_func, depvar='nee_f', indepvar_arr=indepvar_arr, npara=len(xguess),
+                                            xguess=numpy.array(xguess), mprior=numpy.array(xguess, dtype='f4'), sigm=numpy.array(sigm),
+                                            sigd=window['nee_fs_unc'], analytic_jacobian=analytic_jacobian))
+                self.assertEqual(results[0]['status'], 0, lts_func)
+                self.assertEqual(sorted(results[0].keys()), sorted(results[1].keys()))
+                for key in results[0]:
+                    numpy.testing.assert_array_equal(results[0][key], results[1][key], err_msg='{f} {k} (analytic jacobian: {a})'.format(f=lts_func, k=key, a=analytic_jacobian))
+
+class YearInputsStub(object):
+    """Input store returning no data, used with job functions not reading inputs; releases are added to calls"""
+    def __init__(self, calls):
+        self.calls = calls
+
+    def year_inputs(self, ustar_type, year, first_year, percentile):
+        return None, None
+
+    def release(self, consumer, ustar_type):
+        self.calls.append((consumer, ustar_type))
+
+class ScheduleDTJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.calls = []
+        self.partition_dt_job = daytime._partition_dt_job
+        daytime._partition_dt_job = self.run_job
+
+    def tearDown(self):
+        daytime._partition_dt_job = self.partition_dt_job
+        shutil.rmtree(self.tmpdir)
+
+    def error_lines(self):
+        filename = os.path.join(self.tmpdir, PARTITIONING_DT_ERROR_FILE.format(s='XX-Xxx'))
+        if not os.path.isfile(filename):
+            return ''
+        with open(filename, 'r') as f:
+            return f.read()
+
+    def run_job(self, job, year_nee, year_meteo):
+        """Job fails at a window for percentile 50 until window is in error file, otherwise saves error windows it ran with"""
+        ustar_type, year, first_year, percentile, latitude, output_filename = job
+        self.calls.append(percentile)
+        line2add = 'XX-Xxx_{y}_{u},100,110'.format(y=year, u=ustar_type)
+        if (percentile == '50') and (line2add not in self.error_lines()):
+            return line2add, None
+        with open(output_filename, 'w') as f:
+            f.write(self.error_lines())
+        return None, None
+
+    def test_jobs_use_error_windows_current_at_start(self):
+        """Test jobs queued before new error window run once with it, completed jobs re-run once, datasets released after last run"""
+        percentiles = ['1__25', '3__75', '50', '98__75']
+        jobs = [('y', 2005, True, p, 40.0, os.path.join(self.tmpdir, 'nee_y_{p}_XX-Xxx_2005.csv'.format(p=p))) for p in percentiles]
+        _schedule_dt_jobs(jobs=jobs, siteid='XX-Xxx', sitedir_full=self.tmpdir, input_store=YearInputsStub(calls=self.calls))
+        self.assertEqual(self.calls, ['1__25', '3__75', '50', '98__75', '50', '1__25', '3__75', (DT_STR, 'y')])
+        for job in jobs:
+            with open(job[-1], 'r') as f:
+                self.assertEqual(f.read(), 'site_year_nee_des,begin,end\nXX-Xxx_2005_y,100,110\n')
+
+    def run_job_rerun_fails(self, job, year_nee, year_meteo):
+        """As run_job, saving output and returning diagnostics, but failing when re-run for percentiles other than 50"""
+        ustar_type, year, first_year, percentile, latitude, output_filename = job
+        if (percentile != '50') and (percentile in self.calls):
+            raise ONEFluxError("DT partitioning failed")
+        line2add, _ = self.run_job(job=job, year_nee=year_nee, year_meteo=year_meteo)
+        return line2add, (None if line2add else {diagnostics_key(filename=output_filename.replace('.csv', '_diag.csv')): numpy.zeros(1)})
+
+    def test_outputs_removed_for_new_error_window(self):
+        """Test outputs and stored diagnostics of completed jobs to be re-run with new error window are removed (not kept if re-run fails)"""
+        daytime._partition_dt_job = self.run_job_rerun_fails
+        jobs = [('y', 2005, True, p, 40.0, os.path.join(self.tmpdir, 'nee_y_{p}_XX-Xxx_2005.csv'.format(p=p))) for p in ['1__25', '50']]
+        store = DiagnosticsStore(filename=os.path.join(self.tmpdir, 'diagnostics.zip'))
+        self.assertRaises(ONEFluxError, _schedule_dt_jobs, jobs=jobs, siteid='XX-Xxx', sitedir_full=self.tmpdir, input_store=YearInputsStub(calls=self.calls), store=store)
+        self.assertEqual(self.calls, ['1__25', '50', '50'])
+        self.assertEqual(sorted(f for f in os.listdir(self.tmpdir) if f.startswith('nee_')), ['nee_y_50_XX-Xxx_2005.csv'])
+        self.assertEqual(store.keys(), ['nee_y_50_XX-Xxx_2005_diag'])
+
+    def test_datasets_released_per_ustar_type(self):
+        """Test datasets for an UStar threshold type are released once its jobs are completed"""
+        jobs = [(u, 2005, True, '1__25', 40.0, os.path.join(self.tmpdir, 'nee_{u}_1.25_XX-Xxx_2005.csv'.format(u=u))) for u in ['y', 'c']]
+        _schedule_dt_jobs(jobs=jobs, siteid='XX-Xxx', sitedir_full=self.tmpdir, input_store=YearInputsStub(calls=self.calls))
+        self.assertEqual(self.calls, ['1__25', (DT_STR, 'y'), '1__25', (DT_STR, 'c')])
+
+def failing_partition_dt_job(job, year_nee, year_meteo):
+    """Fails for percentile 1.25 right after other percentiles finished (before scheduler polls again), otherwise writes output and returns diagnostics"""
+    if job[3] == '1__25':
+        wait_for_files(filenames=[job[5].replace('1__25', p) for p in ['3__75', '50']], delay=0.1)
+        raise ONEFluxError("DT partitioning failed")
+    time.sleep(0.2)
+    with open(job[5], 'w') as f:
+        f.write('output')
+    return None, {diagnostics_key(filename=job[5].replace('.csv', '_diag.csv')): numpy.zeros(1)}
+
+class FailedJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.partition_dt_job = daytime._partition_dt_job
+        daytime._partition_dt_job = failing_partition_dt_job
+
+    def tearDown(self):
+        daytime._partition_dt_job = self.partition_dt_job
+        shutil.rmtree(self.tmpdir)
+
+    def test_finished_jobs_stored_after_failure(self):
+        """Test diagnostics of jobs finished in same poll as failed job are added to store, for all saved outputs"""
+        jobs = [('y', 2005, True, p, 40.0, os.path.join(self.tmpdir, 'nee_y_{p}_XX-Xxx_2005.csv'.format(p=p))) for p in ['1__25', '3__75', '50']]
+        store = DiagnosticsStore(filename=os.path.join(self.tmpdir, 'diagnostics.zip'))
+        pool = multiprocessing.Pool(processes=3)
+        try:
+            self.assertRaises(ONEFluxError, _schedule_dt_jobs, jobs=jobs, siteid='XX-Xxx', sitedir_full=self.tmpdir, input_store=YearInputsStub(calls=[]), pool=pool, workers=3, store=store)
+        finally:
+            pool.terminate()
+            pool.join()
+        outputs = sorted(f for f in os.listdir(self.tmpdir) if f.startswith('nee_'))
+        self.assertEqual(outputs, ['nee_y_3__75_XX-Xxx_2005.csv', 'nee_y_50_XX-Xxx_2005.csv'])
+        self.assertEqual(store.keys(), [diagnostics_key(filename=f.replace('.csv', '_diag.csv')) for f in outputs])
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmpdir, 'XX-Xxx', '11_nee_partition_dt')
+        write_partitioning_inputs(datadir=self.tmpdir, siteid='XX-Xxx', years=[2004, 2005, 2006])
+        self.schedule_dt_jobs = daytime._schedule_dt_jobs
+        daytime._schedule_dt_jobs = self.fake_schedule_dt_jobs
+
+    def tearDown(self):
+        daytime._schedule_dt_jobs = self.schedule_dt_jobs
+        shutil.rmtree(self.tmpdir)
+
+    def fake_schedule_dt_jobs(self, jobs, siteid, sitedir_full, input_store, pool=None, workers=1, store=None):
+        """Writes output files of jobs, records years of jobs"""
+        for job in jobs:
+            self.years.append(job[1])
+            with open(job[5], 'w') as f:
+                f.write('output')
+
+    def run_dt(self, years, analytic_jacobian=False):
+        """Runs incremental DT partitioning, returns years of executed jobs"""
+        self.years = []
+        partitioning_dt(datadir=self.tmpdir, siteid='XX-Xxx', sitedir='XX-Xxx', prod_to_compare=['y'], perc_to_compare=['50'], years_to_compare=years,
+                        incremental=True, analytic_jacobian=analytic_jacobian)
+        return self.years
+
+    def test_only_changed_years_recreated(self):
+        """Test only site-years with changed inputs re-created, all site-years re-created if method settings change"""
+        self.assertEqual(self.run_dt(years=[2004, 2005, 2006]), [2004, 2005, 2006])
+        self.assertEqual(self.run_dt(years=[2004, 2005, 2006]), [])
+        edit_nee_input(datadir=self.tmpdir, siteid='XX-Xxx', year=2005)
+        self.assertEqual(self.run_dt(years=[2004, 2005, 2006]), [2005])
+        self.assertEqual(self.run_dt(years=[2004, 2005, 2006], analytic_jacobian=True), [2004, 2005, 2006])
+
+        self.assertEqual(self.run_dt(years=[2005, 2006], analytic_jacobian=True), [])
+        self.assertEqual(sorted(f for f in os.listdir(self.output_dir) if f.startswith('nee_')), ['nee_y_50_XX-Xxx_2005.csv', 'nee_y_50_XX-Xxx_2006.csv'])
+
+if __name__ == '__main__':
+    unittest.main()
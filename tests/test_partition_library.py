@@ -0,0 +1,312 @@
+'''
+For license information:
+see LICENSE file or headers in oneflux.__init__.py
+
+Tests for partitioning library functions
+
+@author: agent
+@contact: agent@local
+@date: 2026-10-18
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from context import oneflux
+from datetime import datetime, timedelta
+from oneflux.partition.library import pct, pct_ranked, parse_timestamps, TimestampList, load_output, load_output_cache_filename
+from oneflux.partition.library import PartitioningInputStore, NT_STR, DT_STR, create_data_structures, project_year_inputs
+from oneflux.partition.library import DiagnosticsStore, diagnostics_store_filename, diagnostics_key, save_output, YearDigests, year_digests_filename, remove_other_years
+from oneflux.partition.library import jacobian, jacobian_numerical
+from oneflux.partition.nighttime import save_diagnostics
+from oneflux.tools.partition_nt import load_outputs
+
+class PctTest(unittest.TestCase):
+    def test_pct_matches_ranked(self):
+        """Test selection based pct returns same values as ordinal rank based pct_ranked (including ties and NAs)"""
+        random_state = numpy.random.RandomState(0)
+        for trial in range(500):
+            entries = random_state.randint(2, 50)
+            if trial % 2:
+                array = random_state.randint(0, 5, entries).astype('f4')
+            else:
+                array = numpy.abs(random_state.normal(size=entries)).astype('f4')
+            array[random_state.uniform(size=entries) < 0.1] = -9999.0
+            if numpy.sum(array > -9990.0) < 2:
+                continue
+            for percent in [0.0, 25.0, 50.0, 95.0, 97.5, 100.0]:
+                self.assertEqual(pct(array, percent), pct_ranked(array, percent))
+
+class JacobianTest(unittest.TestCase):
+    PARAMS = {
+        'HLRC_Lloyd': [0.02, 25.0, 3.0],
+        'HLRC_LloydVPD': [0.02, 25.0, 0.05, 3.0],
+        'HLRC_Lloyd_afix': [25.0, 3.0],
+        'HLRC_LloydVPD_afix': [25.0, 0.05, 3.0],
+        'LloydT_E0fix': 3.0,
+    }
+
+    def test_analytic_matches_numerical(self):
+        """Test closed-form jacobians of each model match finite differences (default method)"""
+        random_state = numpy.random.RandomState(0)
+        data = numpy.zeros(200, dtype=[('rg_f', 'f4'), ('tair_f', 'f4'), ('vpd_f', 'f4')])
+        data['rg_f'] = random_state.uniform(5.0, 1000.0, data.size)
+        data['tair_f'] = random_state.uniform(-10.0, 35.0, data.size)
+        data['vpd_f'] = random_state.uniform(0.0, 40.0, data.size)
+        e0 = numpy.full(data.size, 150.0, dtype='f4')
+        alpha = numpy.full(data.size, 0.02, dtype='f4')
+        for func, params in sorted(self.PARAMS.items()):
+            params = numpy.array(params, dtype='f8') if isinstance(params, list) else numpy.float64(params)
+            numerical = jacobian_numerical(func=func, data=data, params_filled_arr=e0, params_filled_arr2=alpha, params=params)
+            analytic = jacobian(func=func, data=data, params_filled_arr=e0, params_filled_arr2=alpha, params=params, analytic=True)
+            self.assertEqual(analytic.shape, numerical.shape, func)
+            for row in range(numerical.shape[0]):
+                scale = numpy.max(numpy.abs(numerical[row]))
+                numpy.testing.assert_allclose(analytic[row], numerical[row], rtol=1e-3, atol=1e-3 * scale, err_msg=func)
+            # default is finite differences
+            default = jacobian(func=func, data=data, params_filled_arr=e0, params_filled_arr2=alpha, params=params)
+            numpy.testing.assert_array_equal(default, numerical)
+
+class ParseTimestampsTest(unittest.TestCase):
+    def test_parse_timestamps_matches_strptime(self):
+        """Test vectorized timestamp parsing matches datetime.strptime (including leap days and lenient formats)"""
+        expected = [datetime(2003, 12, 31) + timedelta(minutes=30 * i) for i in range(48 * 800)]
+        timestamps = numpy.array([t.strftime("%Y%m%d%H%M") for t in expected] + ['20040101000', ' 200401010030'], dtype='a25')
+        expected += [datetime(2004, 1, 1, 0, 0), datetime(2004, 1, 1, 0, 30)]
+        components = parse_timestamps(timestamps=timestamps)
+        self.assertEqual(list(TimestampList(*components)), expected)
+
+    def test_parse_timestamps_invalid(self):
+        """Test invalid timestamps raise same errors as datetime.strptime"""
+        for timestamp in ['200302290000', '200413010000', '200401012400', '2004010100x0']:
+            self.assertRaises(ValueError, parse_timestamps, numpy.array([timestamp], dtype='a25'))
+
+class LoadOutputCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'XX-Xxx_meteo_hh.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_output(self, value):
+        with open(self.filename, 'w') as f:
+            f.write('TIMESTAMP_START,TIMESTAMP_END,TA_f,RG_f\n')
+            f.write('200412312330,200501010000,-9999,0.0\n')
+            f.write('200501010000,200501010030,{v},-9999\n'.format(v=value))
+            f.write('200501010030,200501010100,1.5,2.25\n')
+
+    def test_load_output_cache(self):
+        """Test cached loads match parsed loads and stale cache files are replaced"""
+        self.write_output(value=1.0)
+        expected = load_output(self.filename, use_cache=False)
+        loaded = load_output(self.filename)
+        cached = load_output(self.filename)
+        cache_filename = load_output_cache_filename(self.filename)
+        self.assertTrue(os.path.isfile(cache_filename))
+        for result in [loaded, cached]:
+            self.assertEqual(result[0].dtype, expected[0].dtype)
+            self.assertEqual(result[0].tobytes(), expected[0].tobytes())
+            self.assertEqual(result[1], expected[1])
+            self.assertEqual(list(result[2]), list(expected[2]))
+            self.assertEqual(result[3], expected[3])
+
+        self.write_output(value=3.0)
+        self.assertEqual(load_output(self.filename)[0]['ta_f'][1], 3.0)
+        self.assertFalse(os.path.isfile(cache_filename))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted([os.path.basename(self.filename), os.path.basename(load_output_cache_filename(self.filename))]))
+
+class PartitioningInputStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for subdir, filename, column in [('07_meteo_proc', 'XX-Xxx_meteo_hh.csv', 'TA_f'), ('08_nee_proc', 'XX-Xxx_NEE_percentiles_y_hh.csv', 'NEE_50')]:
+            os.makedirs(os.path.join(self.tmpdir, 'XX-Xxx', subdir))
+            with open(os.path.join(self.tmpdir, 'XX-Xxx', subdir, filename), 'w') as f:
+                f.write('TIMESTAMP_START,TIMESTAMP_END,{c}\n'.format(c=column))
+                for timestamp_start, timestamp_end in [('200412312330', '200501010000'), ('200501010000', '200501010030'), ('200512312330', '200601010000'), ('200601010000', '200601010030')]:
+                    f.write('{s},{e},1.0\n'.format(s=timestamp_start, e=timestamp_end))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_release_when_all_consumers_done(self):
+        """Test datasets are loaded once and released only after all consumers are done"""
+        store = PartitioningInputStore(datadir=self.tmpdir, siteid='XX-Xxx', sitedir='XX-Xxx', consumers=[NT_STR, DT_STR])
+        nee, year_list = store.nee(ustar_type='y')
+        self.assertEqual(year_list, [2005])
+        self.assertIs(store.nee(ustar_type='y')[0], nee)
+        self.assertEqual(store.nee(ustar_type='c'), (None, None))
+        self.assertEqual(store.year_slices(ustar_type='y', year=2005, first_year=True), (slice(0, 3), slice(1, 3)))
+        self.assertEqual(store.year_slices(ustar_type='y', year=2005, first_year=False), (slice(1, 3), slice(1, 3)))
+
+        store.close(consumer=NT_STR)
+        self.assertIs(store.nee(ustar_type='y')[0], nee)
+        self.assertIsNotNone(store._meteo)
+        store.release(consumer=DT_STR, ustar_type='y')
+        self.assertEqual(store._nee, {})
+        self.assertEqual(store._year_slices, {})
+        self.assertIsNotNone(store._meteo)
+        store.close(consumer=DT_STR)
+        self.assertIsNone(store._meteo)
+
+    def test_year_digests_detect_changed_years(self):
+        """Test site-year digest changes with boundary entry from next year, saved digests discarded if settings change"""
+        store = PartitioningInputStore(datadir=self.tmpdir, siteid='XX-Xxx', sitedir='XX-Xxx', consumers=[NT_STR])
+        digest = store.year_digest(ustar_type='y', year=2005, first_year=True)
+        filename = year_digests_filename(output_dir=self.tmpdir, siteid='XX-Xxx', part_type=NT_STR)
+        digests = YearDigests(filename=filename, settings={'warm_start': False})
+        self.assertTrue(digests.changed(ustar_type='y', year=2005, digest=digest))
+        digests.save()
+        self.assertFalse(YearDigests(filename=filename, settings={'warm_start': False}).changed(ustar_type='y', year=2005, digest=digest))
+        self.assertTrue(YearDigests(filename=filename, settings={'warm_start': True}).changed(ustar_type='y', year=2005, digest=digest))
+
+        nee_filename = os.path.join(self.tmpdir, 'XX-Xxx', '08_nee_proc', 'XX-Xxx_NEE_percentiles_y_hh.csv')
+        with open(nee_filename, 'r') as f:
+            lines = f.readlines()
+        lines[3] = lines[3].replace('1.0', '2.0')
+        with open(nee_filename, 'w') as f:
+            f.writelines(lines)
+        store = PartitioningInputStore(datadir=self.tmpdir, siteid='XX-Xxx', sitedir='XX-Xxx', consumers=[NT_STR])
+        changed_digest = store.year_digest(ustar_type='y', year=2005, first_year=True)
+        digests = YearDigests(filename=filename, settings={'warm_start': False})
+        self.assertTrue(digests.changed(ustar_type='y', year=2005, digest=changed_digest))
+        digests.save(kept=set([('y', 2005)]))
+        self.assertFalse(YearDigests(filename=filename, settings={'warm_start': False}).changed(ustar_type='y', year=2005, digest=digest))
+
+class ProjectYearInputsTest(unittest.TestCase):
+    def test_projection_matches_whole_dataset(self):
+        """Test working data created from projected year inputs matches working data created from whole datasets"""
+        random_state = numpy.random.RandomState(0)
+        timestamps = [datetime(2004, 12, 31, 23, 30) + timedelta(minutes=30 * i) for i in range(48 * 40)]
+        time_columns = [(c, 'f4') for c in ['year', 'month', 'day', 'hour', 'minute']]
+        nee = numpy.zeros(len(timestamps), dtype=[('timestamp_end', 'a25')] + [(c, 'f4') for c in ['1__25', '1__25_qc', '50', '50_qc']] + time_columns)
+        meteo = numpy.zeros(len(timestamps), dtype=[('timestamp_end', 'a25')] + [(c, 'f4') for c in ['ta_m', 'ta_mqc', 'sw_in_m', 'sw_in_mqc', 'vpd_m', 'vpd_mqc']] + time_columns)
+        for dataset in [nee, meteo]:
+            dataset['timestamp_end'] = [t.strftime("%Y%m%d%H%M") for t in timestamps]
+            for c in ['year', 'month', 'day', 'hour', 'minute']:
+                dataset[c] = [getattr(t, c) for t in timestamps]
+            for c in dataset.dtype.names[1:-5]:
+                dataset[c] = (random_state.uniform(size=dataset.size) < 0.3) if c.endswith('qc') else random_state.normal(size=dataset.size)
+        year_slice_nee, year_slice_meteo = slice(0, 48 * 20 + 1), slice(1, 48 * 20 + 2)
+        year_nee, year_meteo = project_year_inputs(whole_dataset_nee=nee, whole_dataset_meteo=meteo, percentile='50', year_slice_nee=year_slice_nee, year_slice_meteo=year_slice_meteo)
+        self.assertEqual(year_nee.dtype.names, ('year', 'month', 'day', 'hour', 'minute', '50', '50_qc'))
+        expected = create_data_structures(ustar_type='y', whole_dataset_nee=nee, whole_dataset_meteo=meteo, percentile='50',
+                                          year_slice_nee=year_slice_nee, year_slice_meteo=year_slice_meteo, latitude=40.0, part_type=NT_STR)
+        projected = create_data_structures(ustar_type='y', whole_dataset_nee=year_nee, whole_dataset_meteo=year_meteo, percentile='50',
+                                           year_slice_nee=slice(None), year_slice_meteo=slice(None), latitude=40.0, part_type=NT_STR)
+        self.assertEqual(projected.tobytes(), expected.tobytes())
+
+class DiagnosticsStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store_matches_text_files(self):
+        """Test diagnostics added to store match text files, arrays of keys added again replaced (store file not growing)"""
+        filename = os.path.join(self.tmpdir, 'nee_y_50_XX-Xxx_2005__nlr_status_PY.csv')
+        columns = [[1, 6, 11], numpy.array(['nan', 0.25, 0.5], dtype='f8'), numpy.array([1.5, 'nan', 2.25], dtype='f4'), [1, -10, 2], ['msg a', '', 'msg c']]
+        names = ['jday', 'pvalue', 'nee_std', 'ls_status', 'ls_msg']
+        save_diagnostics(filename=filename, columns=columns, names=names)
+        diagnostics_output = {}
+        save_diagnostics(filename=filename, columns=columns, names=names, diagnostics_output=diagnostics_output)
+        self.assertEqual(list(diagnostics_output.keys()), ['nee_y_50_XX-Xxx_2005__nlr_status_PY'])
+
+        store = DiagnosticsStore(filename=diagnostics_store_filename(output_dir=self.tmpdir, siteid='XX-Xxx', part_type=NT_STR))
+        store.append(arrays={'other': numpy.arange(3)})
+        store.append(arrays=diagnostics_output)
+        self.assertEqual(store.keys(), ['nee_y_50_XX-Xxx_2005__nlr_status_PY', 'other'])
+        self.assertFalse(os.path.isfile(store.filename))
+        store.flush()
+        data, headers, timestamp_list = load_outputs(filename=filename, diagnostics_store=store.filename)
+        self.assertEqual(headers, names)
+        self.assertEqual(timestamp_list, [])
+        with open(filename, 'r') as f:
+            self.assertEqual(f.readlines(), [','.join([str(row[n]) for n in names]) + '\n' for row in data])
+
+        size = os.path.getsize(store.filename)
+        for rerun in range(3):
+            diagnostics_output[diagnostics_key(filename=filename)] = data[:1]
+            store.append(arrays=diagnostics_output)
+            self.assertEqual(store.load(key=diagnostics_key(filename=filename)).tobytes(), data[:1].tobytes())
+            store.flush()
+            diagnostics_output[diagnostics_key(filename=filename)] = data
+            store.append(arrays=diagnostics_output)
+            store.flush()
+            self.assertEqual(os.path.getsize(store.filename), size)
+        reopened = DiagnosticsStore(filename=store.filename)
+        self.assertEqual(reopened.keys(), ['nee_y_50_XX-Xxx_2005__nlr_status_PY', 'other'])
+        self.assertEqual(reopened.load(key=diagnostics_key(filename=filename)).tobytes(), data.tobytes())
+        self.assertTrue(numpy.array_equal(reopened.load(key='other'), numpy.arange(3)))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted([os.path.basename(filename), os.path.basename(store.filename)]))
+        store.close()
+        reopened.close()
+
+    def test_remove_other_years(self):
+        """Test output files and diagnostics of years not compared removed from output directory and store"""
+        names = ['nee_y_50_XX-Xxx_{y}', 'nee_c_1.25_XX-Xxx_{y}', 'nee_y_98__75_XX-Xxx_{y}__nlr_status_PY']
+        for year in [2004, 2005]:
+            for name in names:
+                with open(os.path.join(self.tmpdir, name.format(y=year) + '.csv'), 'w') as f:
+                    f.write('output')
+        store = DiagnosticsStore(filename=diagnostics_store_filename(output_dir=self.tmpdir, siteid='XX-Xxx', part_type=NT_STR))
+        store.append(arrays=dict([(name.format(y=year), numpy.arange(3)) for name in names for year in [2004, 2005]]))
+        store.flush()
+        self.assertEqual(remove_other_years(output_dir=self.tmpdir, siteid='XX-Xxx', years=[2005, 2006], store=store), [2004])
+        self.assertEqual(store.keys(), sorted([name.format(y=2005) for name in names]))
+        store.flush()
+        self.assertEqual(DiagnosticsStore(filename=store.filename).keys(), sorted([name.format(y=2005) for name in names]))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted([name.format(y=2005) + '.csv' for name in names] + [os.path.basename(store.filename)]))
+        store.close()
+
+class SaveOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_output_matches_savetxt(self):
+        """Test column based saving writes same bytes as numpy.savetxt (shortest round-trip floats, special values, integers and strings)"""
+        random_state = numpy.random.RandomState(0)
+        special = [-9999.0, 0.0, -0.0, numpy.NaN, 1.0, 2.0 ** 23, 2.0 ** 24, 2.0 ** -10, 1.0e-4, 9.99999e-5, 0.1, 0.0099999998, 1.0e16, -1.5e-7, 123456.789, 16777215.0]
+        entries = 2000
+        data = numpy.zeros(entries, dtype=[('TIMESTAMP', 'a25'), ('NEE', 'f4'), ('GPP', 'f4'), ('NEE_QC', 'i4'), ('RECO', 'f8')])
+        data['TIMESTAMP'] = (200501010000 + numpy.arange(entries) * 30).astype('a25')
+        data['NEE'] = random_state.normal(scale=10.0, size=entries) * 10.0 ** random_state.randint(-8, 10, entries)
+        data['NEE'][:len(special)] = special
+        data['GPP'] = numpy.round(random_state.uniform(-5, 50, entries), random_state.randint(0, 4))
+        data['GPP'][random_state.uniform(size=entries) < 0.3] = -9999.0
+        data['NEE_QC'] = random_state.randint(-1, 3, entries)
+        data['RECO'] = random_state.normal(size=entries)
+        expected_filename, filename = os.path.join(self.tmpdir, 'savetxt.csv'), os.path.join(self.tmpdir, 'save_output.csv')
+        numpy.savetxt(fname=expected_filename, X=data, delimiter=',', fmt='%s', header=','.join(data.dtype.names), comments='')
+        save_output(filename=filename, data=data, delimiter=',')
+        with open(expected_filename, 'rb') as f_expected, open(filename, 'rb') as f:
+            self.assertEqual(f.read(), f_expected.read())
+
+    def test_save_output_interrupted(self):
+        """Test interrupted saving leaves previous file (or no file) and no temporary files"""
+        data = numpy.zeros(10, dtype=[('NEE', 'f4')])
+        filename = os.path.join(self.tmpdir, 'save_output.csv')
+        with open(filename, 'w') as f:
+            f.write('previous')
+
+        def failed_rename(src, dst):
+            raise OSError("interrupted")
+        rename = os.rename
+        os.rename = failed_rename
+        try:
+            self.assertRaises(OSError, save_output, filename=filename, data=data, delimiter=',')
+            self.assertRaises(OSError, save_output, filename=filename + '.new', data=data, delimiter=',')
+        finally:
+            os.rename = rename
+        with open(filename, 'r') as f:
+            self.assertEqual(f.read(), 'previous')
+        self.assertEqual(os.listdir(self.tmpdir), ['save_output.csv'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+'''
+For license information:
+see LICENSE file or headers in oneflux.__init__.py
+
+Tests for nighttime partitioning functions
+
+@author: agent
+@contact: agent@local
+@date: 2026-10-18
+'''
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import collections
+import numpy
+
+from context import oneflux
+from oneflux import ONEFluxError
+from oneflux.partition import nighttime
+from oneflux.partition.ecogeo import lloyd_taylor
+from oneflux.partition.auxiliary import NAN
+from oneflux.partition.library import pct, year_digests_filename, NT_STR, DiagnosticsStore, diagnostics_store_filename, diagnostics_key
+from oneflux.partition.nighttime import partitioning_nt, nlinlts1_arrays, nlinlts1_batch, least_squares, reanalyse_rref, ipolmiss, ipolmiss_interp1d
+from oneflux.partition.nighttime import DIAGNOSTICS_NONE, DIAGNOSTICS_SUMMARY, DIAGNOSTICS_FULL
+
+class WarmStartTest(unittest.TestCase):
+    def test_warm_start_from_converged_parameters(self):
+        """Test optimization started from converged parameters returns same parameters with fewer function evaluations"""
+        random_state = numpy.random.RandomState(0)
+        tair = random_state.uniform(low=-5.0, high=25.0, size=48 * 14)
+        nee = lloyd_taylor(ta=tair, rref=3.0, e0=150.0) + random_state.normal(scale=0.5, size=tair.size)
+        cold_evaluations, warm_evaluations = [], []
+        cold = nlinlts1_arrays(dep=nee, indep=tair, evaluations=cold_evaluations)
+        warm = nlinlts1_arrays(dep=nee, indep=tair, xguess=[cold[1], cold[2]], evaluations=warm_evaluations)
+        self.assertEqual((cold[0], warm[0]), (0, 0))
+        self.assertAlmostEqual(warm[1] / cold[1], 1.0, places=4)
+        self.assertAlmostEqual(warm[2] / cold[2], 1.0, places=4)
+        self.assertEqual(len(cold_evaluations), 1)
+        self.assertLess(warm_evaluations[0], cold_evaluations[0])
+
+class NLINLTS1BatchTest(unittest.TestCase):
+    def setUp(self):
+        random_state = numpy.random.RandomState(0)
+        self.deps, self.indeps = [], []
+        for window in range(100):
+            entries = random_state.randint(30, 300)
+            tair = random_state.uniform(-5.0, 25.0, entries).astype('f4')
+            nee = (lloyd_taylor(ta=tair, rref=random_state.uniform(0.5, 6.0), e0=random_state.uniform(50.0, 350.0)) + random_state.normal(scale=random_state.uniform(0.2, 2.0), size=entries)).astype('f4')
+            nee[random_state.uniform(size=entries) < 0.2] = NAN
+            tair[random_state.uniform(size=entries) < 0.05] = NAN
+            self.deps.append(nee)
+            self.indeps.append(tair)
+
+    def test_batch_matches_single_optimizations(self):
+        """Test batched optimizations without trimming match single optimizations:
+        parameters within 1% of their standard errors, standard errors within 0.1%"""
+        for result, expected in zip(nlinlts1_batch(deps=self.deps, indeps=self.indeps, trim_perc=0.0), [nlinlts1_arrays(dep=d, indep=i, trim_perc=0.0) for d, i in zip(self.deps, self.indeps)]):
+            self.assertIn(result[7], [1, 2, 3])
+            self.assertLess(abs(result[1] - expected[1]), 0.01 * expected[3])
+            self.assertLess(abs(result[2] - expected[2]), 0.01 * expected[4])
+            self.assertLess(abs(result[3] / expected[3] - 1.0), 0.001)
+            self.assertLess(abs(result[4] / expected[4] - 1.0), 0.001)
+
+    def test_batch_status_not_converged(self):
+        """Test status of batched optimizations stopped at maximum number of iterations"""
+        results = nlinlts1_batch(deps=self.deps, indeps=self.indeps, max_iterations=1)
+        self.assertEqual(set([r[7] for r in results]), set([5]))
+
+class DiagnosticsTest(unittest.TestCase):
+    def test_diagnostics_levels(self):
+        """Test diagnostics levels only change statistics computed for optimization, not estimated parameters"""
+        random_state = numpy.random.RandomState(0)
+        tair = random_state.uniform(low=-5.0, high=25.0, size=48 * 7)
+        nee = lloyd_taylor(ta=tair, rref=3.0, e0=150.0) + random_state.normal(scale=0.5, size=tair.size)
+        full = nlinlts1_arrays(dep=nee, indep=tair, diagnostics=DIAGNOSTICS_FULL)
+        summary = nlinlts1_arrays(dep=nee, indep=tair, diagnostics=DIAGNOSTICS_SUMMARY)
+        none = nlinlts1_arrays(dep=nee, indep=tair, diagnostics=DIAGNOSTICS_NONE)
+        for result in [summary, none]:
+            self.assertEqual(result[:5], full[:5])
+            self.assertEqual(result[7:9], full[7:9])
+            self.assertTrue(numpy.isnan(result[9]))
+        self.assertFalse(numpy.isnan(full[9]))
+        self.assertEqual(summary[10:], full[10:])
+        self.assertTrue(numpy.all(numpy.isnan(none[10:])))
+        self.assertEqual(len(full[5]), 48 * 14)
+        self.assertEqual(len(none[5]), tair.size)
+
+class ReanalyseRrefTest(unittest.TestCase):
+    def reanalyse_rref_masks(self, data, e0, tempvar='tair', step=4, moving_window=8):
+        """Moving-window Rref fits with full-year masks for each window (previous implementation)"""
+        julday = data['julday'] + (data['hr'] / 24.0)
+        e0_array = numpy.zeros(data.size, dtype='f4')
+        e0_array[:] = e0
+        for c in ['rrefoptord', 'rrefoptord_se', 'rrefopttrim', 'rrefopttrim_se']:
+            data[c] = NAN
+        julday_int = (julday + 0.5).astype('i8')
+        for j in range(1, int(julday[-1]), step):
+            mask = (julday_int >= j) & (julday_int < (j + moving_window)) & (data[tempvar] > -1000.) & (data['neenight'] > -1000.)
+            if numpy.sum(mask) > 2:
+                mid = int(numpy.average(numpy.where(mask)[0]))
+                lloyd_fac = lloyd_taylor(ta=data[tempvar][mask], rref=1.0, e0=numpy.average(e0_array[mask]))
+                nee = data['neenight'][mask]
+                parameters, std_devs = least_squares(func=lambda b: ((b * lloyd_fac - nee) ** 2).sum(), initial_guess=(0.1,), entries=len(nee), iterations=1000 * (len(nee) + 1))
+                mask_trim = numpy.absolute(nee - numpy.average(nee)) < pct(array=numpy.absolute(nee - numpy.average(nee)), percent=95.0)
+                parameters_trim, std_devs_trim = least_squares(func=lambda b: ((b * lloyd_fac[mask_trim] - nee[mask_trim]) ** 2).sum(), initial_guess=(0.1,), entries=len(nee[mask_trim]), iterations=1000 * (len(nee[mask_trim]) + 1))
+                data['rrefoptord'][mid] = max(parameters[0], 1e-6)
+                data['rrefoptord_se'][mid] = numpy.sqrt(std_devs[0])
+                data['rrefopttrim'][mid] = max(parameters_trim[0], 1e-6)
+                data['rrefopttrim_se'][mid] = numpy.sqrt(std_devs_trim[0])
+        for c in ['rrefoptord', 'rrefoptord_se', 'rrefopttrim', 'rrefopttrim_se']:
+            ipolmiss(data=data, variable=c)
+        data['reco_2'] = lloyd_taylor(ta=data[tempvar + '_f'], rref=data['rrefoptord'], e0=e0)
+        data['reco_2rob'] = lloyd_taylor(ta=data[tempvar + '_f'], rref=data['rrefopttrim'], e0=e0)
+
+    def test_index_ranges_match_masks(self):
+        """Test fits on windows located with index ranges are identical to fits on windows located with full-year masks"""
+        random_state = numpy.random.RandomState(0)
+        entries = 48 * 60
+        names = ['julday', 'hr', 'tair', 'tair_f', 'neenight', 'rrefoptord', 'rrefoptord_se', 'rrefopttrim', 'rrefopttrim_se', 'reco_2', 'reco_2rob']
+        data = numpy.zeros(entries, dtype=[(n, 'f4') for n in names])
+        data['julday'] = numpy.arange(entries) // 48 + 1
+        data['hr'] = (numpy.arange(entries) % 48) / 2.0
+        data['tair_f'] = random_state.uniform(-5.0, 25.0, entries)
+        data['tair'] = data['tair_f']
+        data['tair'][random_state.uniform(size=entries) < 0.1] = NAN
+        data['neenight'] = lloyd_taylor(ta=data['tair_f'], rref=2.5, e0=150.0) + random_state.normal(scale=0.8, size=entries)
+        data['neenight'][random_state.uniform(size=entries) < 0.6] = NAN
+        data['neenight'][48 * 20:48 * 30] = NAN
+        e0 = random_state.uniform(100.0, 200.0, entries).astype('f4')
+        expected, result = data.copy(), data.copy()
+        self.reanalyse_rref_masks(data=expected, e0=e0)
+        reanalyse_rref(data=result, e0=e0)
+        self.assertEqual(result.tobytes(), expected.tobytes())
+
+class IpolmissTest(unittest.TestCase):
+    def test_ipolmiss_matches_interp1d(self):
+        """Test vectorized interpolation is identical to interp1d based interpolation (including leading/trailing gaps)"""
+        random_state = numpy.random.RandomState(0)
+        entries = 48 * 30
+        for fraction in [0.005, 0.3, 0.9]:
+            data = numpy.zeros(entries, dtype=[('julday', 'f4'), ('hr', 'f4'), ('var', 'f4')])
+            data['julday'] = numpy.arange(entries) // 48 + 1
+            data['hr'] = (numpy.arange(entries) % 48) / 2.0
+            data['var'] = random_state.normal(size=entries)
+            data['var'][random_state.uniform(size=entries) >= fraction] = numpy.nan
+            data['var'][[0, -1]] = numpy.nan
+            expected, result = data.copy(), data.copy()
+            ipolmiss_interp1d(data=expected, variable='var')
+            ipolmiss(data=result, variable='var')
+            self.assertEqual(result.tobytes(), expected.tobytes())
+
+def write_partitioning_inputs(datadir, siteid, years):
+    """Writes meteo proc, NEE percentiles (percentiles 1.25 and 50, UStar type y), and QC auto files (latitude) with three records per year"""
+    sitedir = os.path.join(datadir, siteid)
+    files = [('07_meteo_proc', '{s}_meteo_hh.csv', 'DTIME,TA_M,TA_MQC,SW_IN_M,SW_IN_MQC,VPD_M,VPD_MQC', '1.0,10.0,0,0.0,0,1.0,0'),
+             ('08_nee_proc', '{s}_NEE_percentiles_y_hh.csv', '1.25,1.25_QC,50,50_QC', '1.0,0,1.0,0')]
+    for subdir, filename, header, values in files:
+        os.makedirs(os.path.join(sitedir, subdir))
+        with open(os.path.join(sitedir, subdir, filename.format(s=siteid)), 'w') as f:
+            f.write('TIMESTAMP_START,TIMESTAMP_END,{h}\n'.format(h=header))
+            for year in years:
+                for timestamp_start, timestamp_end in [('{y}01010000', '{y}01010030'), ('{y}06011200', '{y}06011230'), ('{y}12312330', '{n}01010000')]:
+                    f.write('{s},{e},{v}\n'.format(s=timestamp_start.format(y=year), e=timestamp_end.format(y=year, n=year + 1), v=values))
+    os.makedirs(os.path.join(sitedir, '02_qc_auto'))
+    for year in years:
+        with open(os.path.join(sitedir, '02_qc_auto', '{s}_qca_nee_{y}.csv'.format(s=siteid, y=year)), 'w') as f:
+            f.write('site,{s}\nyear,{y}\nlat,40.0\nlon,-100.0\nTIMESTAMP,NEE\n'.format(s=siteid, y=year))
+
+def edit_nee_input(datadir, siteid, year):
+    """Changes NEE value of mid-year record of year"""
+    filename = os.path.join(datadir, siteid, '08_nee_proc', '{s}_NEE_percentiles_y_hh.csv'.format(s=siteid))
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+    lines = [(l.replace(',1.0,', ',2.0,') if l.startswith('{y}0601'.format(y=year)) else l) for l in lines]
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmpdir, 'XX-Xxx', '10_nee_partition_nt')
+        write_partitioning_inputs(datadir=self.tmpdir, siteid='XX-Xxx', years=[2004, 2005, 2006])
+        self.partition_nt_chain = nighttime.partition_nt_chain
+        nighttime.partition_nt_chain = self.fake_partition_nt_chain
+
+    def tearDown(self):
+        nighttime.partition_nt_chain = self.partition_nt_chain
+        shutil.rmtree(self.tmpdir)
+
+    def fake_partition_nt_chain(self, chain, inputs, warm_start=False, diagnostics_store=False):
+        """Writes output and diagnostics files of jobs in chain, records years of jobs"""
+        self.chains.append([(job[1], job[3]) for job in chain])
+        for job in chain:
+            self.years.append(job[1])
+            for filename in [job[5], job[5].replace('.csv', '__nlr_status_PY.csv')]:
+                with open(filename, 'w') as f:
+                    f.write('output')
+        return 0, {}
+
+    def run_nt(self, years, perc_to_compare=['50'], warm_start=False):
+        """Runs incremental NT partitioning, returns years of executed jobs"""
+        self.years = []
+        self.chains = []
+        partitioning_nt(datadir=self.tmpdir, siteid='XX-Xxx', sitedir='XX-Xxx', prod_to_compare=['y'], perc_to_compare=perc_to_compare, years_to_compare=years,
+                        warm_start=warm_start, incremental=True)
+        return self.years
+
+    def test_warm_start_chains(self):
+        """Test percentiles of each site-year run in increasing order as single sequence only if warm start"""
+        self.run_nt(years=[2004, 2005], perc_to_compare=['50', '1.25'])
+        self.assertEqual(self.chains, [[(2004, '50')], [(2004, '1__25')], [(2005, '50')], [(2005, '1__25')]])
+        shutil.rmtree(self.output_dir)
+        self.run_nt(years=[2004, 2005], perc_to_compare=['50', '1.25'], warm_start=True)
+        self.assertEqual(self.chains, [[(2004, '1__25'), (2004, '50')], [(2005, '1__25'), (2005, '50')]])
+
+    def test_only_changed_years_recreated(self):
+        """Test only site-years with changed inputs re-created, outputs of years not compared removed"""
+        self.assertEqual(self.run_nt(years=[2004, 2005, 2006]), [2004, 2005, 2006])
+        self.assertEqual(self.run_nt(years=[2004, 2005, 2006]), [])
+        edit_nee_input(datadir=self.tmpdir, siteid='XX-Xxx', year=2005)
+        self.assertEqual(self.run_nt(years=[2004, 2005, 2006]), [2005])
+        self.assertEqual(self.run_nt(years=[2004, 2005, 2006]), [])
+
+        self.assertEqual(self.run_nt(years=[2005, 2006]), [])
+        self.assertEqual(sorted(f for f in os.listdir(self.output_dir) if f.startswith('nee_')),
+                         ['nee_y_50_XX-Xxx_2005.csv', 'nee_y_50_XX-Xxx_2005__nlr_status_PY.csv', 'nee_y_50_XX-Xxx_2006.csv', 'nee_y_50_XX-Xxx_2006__nlr_status_PY.csv'])
+        with open(year_digests_filename(output_dir=self.output_dir, siteid='XX-Xxx', part_type=NT_STR), 'r') as f:
+            self.assertNotIn('y_2004', f.read())
+
+def wait_for_files(filenames, delay=0.5, timeout=10.0):
+    """Waits until all files exist and then for delay (for their jobs to return), used to order jobs run in worker processes"""
+    start = time.time()
+    while (not all(os.path.isfile(f) for f in filenames)) and (time.time() - start < timeout):
+        time.sleep(0.01)
+    time.sleep(delay)
+
+def failing_partition_nt_chain(chain, inputs, warm_start=False, diagnostics_store=False):
+    """Fails for year 2004 once other years finished, otherwise writes outputs and returns diagnostics of jobs in chain"""
+    if chain[0][1] == 2004:
+        wait_for_files(filenames=[chain[0][5].replace('2004', str(y)) for y in [2005, 2006]])
+        raise ONEFluxError("NT partitioning failed")
+    diagnostics_output = collections.OrderedDict()
+    for job in chain:
+        with open(job[5], 'w') as f:
+            f.write('output')
+        diagnostics_output[diagnostics_key(filename=job[5].replace('.csv', '__nlr_status_PY.csv'))] = numpy.zeros(1)
+    return 0, diagnostics_output
+
+class FailedJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmpdir, 'XX-Xxx', '10_nee_partition_nt')
+        write_partitioning_inputs(datadir=self.tmpdir, siteid='XX-Xxx', years=[2004, 2005, 2006])
+        self.partition_nt_chain = nighttime.partition_nt_chain
+        nighttime.partition_nt_chain = failing_partition_nt_chain
+
+    def tearDown(self):
+        nighttime.partition_nt_chain = self.partition_nt_chain
+        shutil.rmtree(self.tmpdir)
+
+    def test_finished_jobs_stored_after_failure(self):
+        """Test diagnostics of jobs finished before failure is handled are added to store, for all saved outputs"""
+        self.assertRaises(ONEFluxError, partitioning_nt, datadir=self.tmpdir, siteid='XX-Xxx', sitedir='XX-Xxx', prod_to_compare=['y'], perc_to_compare=['50'],
+                          years_to_compare=[2004, 2005, 2006], workers=3, diagnostics_store=True)
+        outputs = sorted(f for f in os.listdir(self.output_dir) if f.startswith('nee_'))
+        self.assertEqual(outputs, ['nee_y_50_XX-Xxx_2005.csv', 'nee_y_50_XX-Xxx_2006.csv'])
+        store = DiagnosticsStore(filename=diagnostics_store_filename(output_dir=self.output_dir, siteid='XX-Xxx', part_type=NT_STR))
+        self.assertEqual(store.keys(), [diagnostics_key(filename=f.replace('.csv', '__nlr_status_PY.csv')) for f in outputs])
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+'''
+For license information:
+see LICENSE file or headers in oneflux.__init__.py
+
+Tests for pipeline execution controller
+
+@author: agent
+@contact: agent@local
+@date: 2026-10-18
+'''
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from context import oneflux
+from oneflux.pipeline.common import ONEFluxPipelineError, run_commands
+from oneflux.pipeline.wrappers import Pipeline, STEP_OK, STEP_CACHED
+
+STEP_NAMES = ['qc_auto', 'ustar_mp', 'ustar_cp', 'meteo_era', 'meteo_proc', 'nee_proc', 'energy_proc',
+              'nee_partition_nt', 'nee_partition_dt', 'prepare_ure', 'ure', 'fluxnet']
+
+class RunStepsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def record_run(self, name, fail=False):
+        """Returns step run function recording start and end times into file"""
+        def run():
+            start = time.time()
+            time.sleep(0.2)
+            with open(os.path.join(self.tmpdir, name), 'w') as f:
+                f.write('{s} {e}'.format(s=start, e=time.time()))
+            if fail:
+                raise ONEFluxPipelineError("step {n} failed".format(n=name))
+        return run
+
+    def times(self, name):
+        with open(os.path.join(self.tmpdir, name), 'r') as f:
+            return [float(v) for v in f.read().split()]
+
+    def test_steps_run_after_input_steps(self):
+        """Test steps start only after all their input steps finish (also through steps not run), independent steps run concurrently"""
+        pipeline = Pipeline(siteid='XX-Xxx', data_dir=self.tmpdir, tool_dir=self.tmpdir, step_workers=3, meteo_proc_execute=False)
+        for name in STEP_NAMES:
+            getattr(pipeline, name).run = self.record_run(name=name)
+        pipeline.run_steps()
+
+        self.assertFalse(os.path.isfile(os.path.join(self.tmpdir, 'meteo_proc')))
+        for name in STEP_NAMES:
+            if name == 'meteo_proc':
+                continue
+            for input_step in getattr(pipeline, name).input_steps:
+                input_name = [n for n in STEP_NAMES if getattr(pipeline, n) is input_step]
+                if input_name and input_step.execute:
+                    self.assertGreaterEqual(self.times(name)[0], self.times(input_name[0])[1])
+        self.assertGreaterEqual(self.times('nee_proc')[0], self.times('meteo_era')[1])
+        ustar_mp, ustar_cp = self.times('ustar_mp'), self.times('ustar_cp')
+        self.assertLess(max(ustar_mp[0], ustar_cp[0]), min(ustar_mp[1], ustar_cp[1]))
+
+    def test_failed_step_stops_dependent_steps(self):
+        """Test failed step raises error after running steps finish, steps depending on it not started"""
+        pipeline = Pipeline(siteid='XX-Xxx', data_dir=self.tmpdir, tool_dir=self.tmpdir, step_workers=2)
+        for name in STEP_NAMES:
+            getattr(pipeline, name).run = self.record_run(name=name, fail=(name == 'ustar_mp'))
+        self.assertRaises(ONEFluxPipelineError, pipeline.run_steps)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'ustar_cp')))
+        self.assertFalse(os.path.isfile(os.path.join(self.tmpdir, 'nee_proc')))
+
+    def test_cached_steps_not_started(self):
+        """Test cached steps skipped without starting step processes, workers of steps divided by step workers"""
+        def cached_run(driver, run):
+            def run_outputs():
+                run()
+                for tdir in driver.output_dirs:
+                    if not os.path.isdir(tdir):
+                        os.makedirs(tdir)
+                if getattr(driver, 'workers', None) is not None:
+                    with open(os.path.join(self.tmpdir, 'workers_' + driver.__class__.__name__), 'w') as f:
+                        f.write(str(driver.workers))
+            return run_outputs
+        for outcome in [STEP_OK, STEP_CACHED]:
+            pipeline = Pipeline(siteid='XX-Xxx', data_dir=self.tmpdir, tool_dir=self.tmpdir, step_workers=2, step_cache=True, nee_partition_nt_workers=4)
+            for name in STEP_NAMES:
+                driver = getattr(pipeline, name)
+                driver.run = cached_run(driver=driver, run=self.record_run(name=name))
+                if os.path.isfile(os.path.join(self.tmpdir, name)):
+                    os.remove(os.path.join(self.tmpdir, name))
+            pipeline.run_steps()
+            self.assertEqual(set([r['status'] for r in pipeline.step_results]), set([outcome]))
+            self.assertEqual(os.path.isfile(os.path.join(self.tmpdir, 'qc_auto')), outcome == STEP_OK)
+            self.assertEqual(pipeline.nee_partition_nt.workers, 4)
+        with open(os.path.join(self.tmpdir, 'workers_PipelineNEEPartitionNT'), 'r') as f:
+            self.assertEqual(f.read(), '2')
+
+    def test_failed_partitioning_skip_flag_seen_by_dependent_steps(self):
+        """Test NT skip flag set by failed NT partitioning step (skip on error) seen by this process and by steps started after it"""
+        pipeline = Pipeline(siteid='XX-Xxx', data_dir=os.path.join(self.tmpdir, 'XX-Xxx'), data_dir_main=self.tmpdir, site_dir='XX-Xxx',
+                            tool_dir=self.tmpdir, step_workers=2, first_year=2005, last_year=2006)
+        for name in STEP_NAMES:
+            if name != 'nee_partition_nt':
+                getattr(pipeline, name).run = self.record_run(name=name)
+        pipeline.nee_partition_nt.pre_validate = lambda: None
+        def record_skip():
+            with open(os.path.join(self.tmpdir, 'prepare_ure'), 'w') as f:
+                f.write(str(pipeline.nt_skip))
+        pipeline.prepare_ure.run = record_skip
+        pipeline.run_steps()
+        self.assertTrue(pipeline.nt_skip)
+        self.assertFalse(pipeline.dt_skip)
+        self.assertEqual([r['status'] for r in pipeline.step_results if r['step'] == 'PipelineNEEPartitionNT'], [STEP_OK])
+        with open(os.path.join(self.tmpdir, 'prepare_ure'), 'r') as f:
+            self.assertEqual(f.read(), 'True')
+
+class StepCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.runs = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_step(self, input_value):
+        """Runs energy_proc step with fake run function in new pipeline, returns step outcome"""
+        pipeline = Pipeline(siteid='XX-Xxx', data_dir=self.tmpdir, tool_dir=self.tmpdir, step_cache=True)
+        if not os.path.isdir(pipeline.qc_auto.qc_auto_dir):
+            os.makedirs(pipeline.qc_auto.qc_auto_dir)
+        with open(os.path.join(pipeline.qc_auto.qc_auto_dir, 'XX-Xxx_qca_energy.csv'), 'w') as f:
+            f.write(input_value)
+        def run():
+            self.runs += 1
+            if not os.path.isdir(pipeline.energy_proc.energy_proc_dir):
+                os.makedirs(pipeline.energy_proc.energy_proc_dir)
+            with open(os.path.join(pipeline.energy_proc.energy_proc_dir, 'XX-Xxx_output.csv'), 'w') as f:
+                f.write(input_value * 2)
+        pipeline.energy_proc.run = run
+        return pipeline.run_step(driver=pipeline.energy_proc)
+
+    def test_unchanged_step_reuses_outputs(self):
+        """Test step skipped if inputs unchanged since last run, executed again if inputs change"""
+        self.assertEqual(self.run_step(input_value='1'), STEP_OK)
+        self.assertEqual(self.run_step(input_value='1'), STEP_CACHED)
+        self.assertEqual(self.runs, 1)
+        self.assertEqual(self.run_step(input_value='2'), STEP_OK)
+        self.assertEqual(self.runs, 2)
+
+    def test_manifest_configs_affecting_outputs(self):
+        """Test step manifest changes with configs affecting outputs of step only"""
+        def manifest(**configs):
+            pipeline = Pipeline(siteid='XX-Xxx', data_dir=self.tmpdir, tool_dir=self.tmpdir, step_cache=True, **configs)
+            return pipeline.step_manifest(driver=pipeline.nee_partition_dt)
+        default = manifest()
+        self.assertEqual(manifest(nee_partition_dt_workers=4, dt_skip_on_error=False, nt_skip_on_error=False), default)
+        self.assertNotEqual(manifest(nee_partition_dt_analytic_jacobian=True), default)
+
+    def test_skipped_partitioning_not_reused(self):
+        """Test manifest not saved for partitioning step failed with skip on error, step executed again in next run"""
+        for run in range(2):
+            pipeline = Pipeline(siteid='XX-Xxx', data_dir=self.tmpdir, tool_dir=self.tmpdir, step_cache=True)
+            def run_failed():
+                self.runs += 1
+                if not os.path.isdir(pipeline.nee_partition_nt.nee_partition_nt_dir):
+                    os.makedirs(pipeline.nee_partition_nt.nee_partition_nt_dir)
+                pipeline.nt_skip = True
+            pipeline.nee_partition_nt.run = run_failed
+            self.assertEqual(pipeline.run_step(driver=pipeline.nee_partition_nt), STEP_OK)
+            self.assertEqual(os.listdir(pipeline.nee_partition_nt.nee_partition_nt_dir), [])
+        self.assertEqual(self.runs, 2)
+
+class RunCommandsTest(unittest.TestCase):
+    def test_run_commands_concurrently(self):
+        """Test commands run concurrently up to worker cap, each exit status checked and reported"""
+        start = time.time()
+        results = run_commands(cmds=['sleep 1'] * 4, workers=2)
+        self.assertLess(time.time() - start, 3.5)
+        self.assertEqual([r['exitcode'] for r in results], [0, 0, 0, 0])
+        for r in results:
+            self.assertGreaterEqual(r['wall_time'], 1.0)
+            if hasattr(os, 'wait4'):
+                self.assertGreater(r['peak_rss'], 0)
+        self.assertRaises(ONEFluxPipelineError, run_commands, ['true', 'exit 3', 'true'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+For license information:
+see LICENSE file or headers in oneflux.__init__.py
+
+Tests for multi-site batch execution controller
+
+@author: agent
+@contact: agent@local
+@date: 2026-10-18
+'''
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+from context import oneflux
+from oneflux import ONEFluxError
+from oneflux.pipeline.wrappers import STEP_OK, STEP_CACHED
+from oneflux.tools import batch
+from oneflux.tools.batch import run_batch, load_manifest, load_summary, PIPELINE_STEP, SUMMARY_HEADER
+
+def stub_run_pipeline(datadir, siteid, sitedir, firstyear, lastyear, logfile, step_results, **kwargs):
+    """Stub of run_pipeline recording step results (fails for site XX-Ccc), writes keyword arguments into file"""
+    step_results.append({'step': 'PipelineQCAuto', 'status': STEP_CACHED, 'duration': 0.0})
+    if siteid == 'XX-Ccc':
+        raise ONEFluxError("site {s} failed".format(s=siteid))
+    step_results.append({'step': 'PipelineNEEProc', 'status': STEP_OK, 'duration': 2.5})
+    with open(os.path.join(datadir, '{s}.kwargs'.format(s=siteid)), 'w') as f:
+        f.write(repr(sorted(kwargs.items())))
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.tmpdir, 'manifest.csv')
+        with open(self.manifest, 'w') as f:
+            f.write('siteid,sitedir,firstyear,lastyear,era_first_year\n')
+            f.write('XX-Aaa,XX-Aaa,2005,2006,1989\n')
+            f.write('XX-Bbb,XX-Bbb,2005,2006,\n')
+            f.write('XX-Ccc,XX-Ccc,2004,2004,\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_manifest(self):
+        """Test manifest entries include per-site options only when given, invalid columns raise errors"""
+        sites = load_manifest(filename=self.manifest)
+        self.assertEqual([s['siteid'] for s in sites], ['XX-Aaa', 'XX-Bbb', 'XX-Ccc'])
+        self.assertEqual(sites[0]['options'], {'era_first_year': 1989})
+        self.assertEqual(sites[1]['options'], {})
+        with open(self.manifest, 'a') as f:
+            f.write('XX-Aaa,XX-Aaa,2007,2007,\n')
+        self.assertRaises(ONEFluxError, load_manifest, self.manifest)
+        with open(self.manifest, 'w') as f:
+            f.write('siteid,sitedir,firstyear,lastyear,unknown\n')
+        self.assertRaises(ONEFluxError, load_manifest, self.manifest)
+
+    def test_resume_from_summary(self):
+        """Test sites already successfully processed are skipped, failed sites isolated and recorded in summary"""
+        summary = os.path.join(self.tmpdir, 'manifest_summary.csv')
+        with open(summary, 'w') as f:
+            f.write(','.join(SUMMARY_HEADER) + '\n')
+            f.write('XX-Aaa,{p},ok,10.0,20180101000000,XX-Aaa.log,\n'.format(p=PIPELINE_STEP))
+            f.write('XX-Bbb,{p},failed,10.0,20180101000000,XX-Bbb.log,error\n'.format(p=PIPELINE_STEP))
+        results = run_batch(datadir=self.tmpdir, manifest=self.manifest, batch_workers=2)
+        self.assertEqual(sorted([r['siteid'] for r in results]), ['XX-Bbb', 'XX-Ccc'])
+        self.assertEqual(load_summary(filename=summary), {'XX-Aaa': 'ok', 'XX-Bbb': 'failed', 'XX-Ccc': 'failed'})
+        for siteid in ['XX-Bbb', 'XX-Ccc']:
+            self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, '{s}.log'.format(s=siteid))))
+
+    def test_summary_steps_and_resume(self):
+        """Test step results of sites recorded in summary, only failed sites run again when batch resumed"""
+        summary = os.path.join(self.tmpdir, 'manifest_summary.csv')
+        run_pipeline = batch.run_pipeline
+        batch.run_pipeline = stub_run_pipeline
+        try:
+            results = run_batch(datadir=self.tmpdir, manifest=self.manifest, batch_workers=2, record_interval='hh')
+            self.assertEqual(dict([(r['siteid'], r['status']) for r in results]), {'XX-Aaa': 'ok', 'XX-Bbb': 'ok', 'XX-Ccc': 'failed'})
+            with open(summary, 'r') as f:
+                rows = [(r['siteid'], r['step'], r['status'], r['duration']) for r in csv.DictReader(f) if r['step'] != PIPELINE_STEP]
+            for siteid in ['XX-Aaa', 'XX-Bbb']:
+                self.assertEqual([r for r in rows if r[0] == siteid], [(siteid, 'PipelineQCAuto', 'cached', '0.0'), (siteid, 'PipelineNEEProc', 'ok', '2.5')])
+            self.assertEqual([r for r in rows if r[0] == 'XX-Ccc'], [('XX-Ccc', 'PipelineQCAuto', 'cached', '0.0')])
+            with open(os.path.join(self.tmpdir, 'XX-Aaa.kwargs'), 'r') as f:
+                self.assertEqual(f.read(), repr([('era_first_year', 1989), ('record_interval', 'hh')]))
+            with open(os.path.join(self.tmpdir, 'XX-Bbb.kwargs'), 'r') as f:
+                self.assertEqual(f.read(), repr([('record_interval', 'hh')]))
+
+            results = run_batch(datadir=self.tmpdir, manifest=self.manifest, batch_workers=2, record_interval='hh')
+            self.assertEqual([r['siteid'] for r in results], ['XX-Ccc'])
+            self.assertEqual(load_summary(filename=summary), {'XX-Aaa': 'ok', 'XX-Bbb': 'ok', 'XX-Ccc': 'failed'})
+        finally:
+            batch.run_pipeline = run_pipeline
+
+if __name__ == '__main__':
+    unittest.main()